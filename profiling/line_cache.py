@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Highlighting throughput with and without the cache of highlighting results of lines.
+
+Usage: line_cache.py FILE
+"""
+
+import sys
+import time
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+def _highlight(syntax, lines):
+    qutepart.syntax.clearLineCache()
+    startTime = time.perf_counter()
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.highlightBlock(text, contextStack)
+        contextStack = lineData[0]
+    return time.perf_counter() - startTime
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        return 1
+
+    with open(sys.argv[1], encoding='utf-8') as sourceFile:
+        lines = sourceFile.read().splitlines()
+
+    syntax = SyntaxManager(headless=True).getSyntax(sourceFilePath=sys.argv[1],
+                                                    firstLine=lines[0] if lines else None)
+    if syntax is None:
+        print('Syntax not detected')
+        return 1
+
+    print('Language: {}, {} parser'.format(syntax.name,
+                                            'C' if qutepart.syntax.loader.binaryParserAvailable else 'Python'))
+    print('{} lines, {} unique'.format(len(lines), len(set(lines))))
+
+    maxSize = qutepart.syntax.lineCacheInfo()[3]
+    qutepart.syntax.setLineCacheSize(0)
+    uncachedTime = _highlight(syntax, lines)
+    qutepart.syntax.setLineCacheSize(maxSize)
+    cachedTime = _highlight(syntax, lines)
+    hits, misses, size, maxSize = qutepart.syntax.lineCacheInfo()
+
+    print('without cache: {:8.3f} s, {:9.0f} lines/s'.format(uncachedTime, len(lines) / uncachedTime))
+    print('   with cache: {:8.3f} s, {:9.0f} lines/s, {:.2f}x'.format(cachedTime,
+                                                                    len(lines) / cachedTime,
+                                                                    uncachedTime / cachedTime))
+    print('hit rate: {:.1%} ({} hits, {} misses, {} of {} lines cached)'.format(hits / max(hits + misses, 1),
+                                                                              hits, misses, size, maxSize))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
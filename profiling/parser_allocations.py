@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Objects created by the Python parser per line.
+
+Constructor calls of qutepart.syntax.parser classes are counted with cProfile.
+Highlighted segments and text type maps, which the parser returns, are not counted.
+
+Usage: parser_allocations.py FILE
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+os.environ['QPART_CPARSER'] = 'N'
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.parser
+
+
+def _highlight(syntax, lines):
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        contextStack = lineData[0]
+
+
+def _constructorCalls(syntax, lines):
+    """Get {class name: count of constructor calls}
+    """
+    profile = cProfile.Profile()
+    profile.runcall(_highlight, syntax, lines)
+    stats = pstats.Stats(profile).stats
+
+    classForLine = {}  # line of __init__: class name
+    for name, obj in vars(qutepart.syntax.parser).items():
+        init = getattr(obj, '__init__', None)
+        if isinstance(obj, type) and \
+           getattr(init, '__code__', None) is not None and \
+           init.__code__.co_filename == qutepart.syntax.parser.__file__:
+            classForLine[init.__code__.co_firstlineno] = name
+
+    calls = {}
+    for (fileName, line, functionName), (primitiveCalls, totalCalls, tt, ct, callers) in stats.items():
+        if functionName == '__init__' and fileName == qutepart.syntax.parser.__file__ and line in classForLine:
+            calls[classForLine[line]] = totalCalls
+    return calls
+
+
+def _peakMemoryPerLine(syntax, lines):
+    """Get maximum of memory, which is allocated temporarily while a line is highlighted
+    """
+    tracemalloc.start()
+    peak = 0
+    contextStack = None
+    for text in lines:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        contextStack = lineData[0]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        return 1
+
+    with open(sys.argv[1], encoding='utf-8') as sourceFile:
+        lines = sourceFile.read().splitlines()
+
+    syntax = SyntaxManager(headless=True).getSyntax(sourceFilePath=sys.argv[1],
+                                                    firstLine=lines[0] if lines else None)
+    if syntax is None:
+        print('Syntax not detected')
+        return 1
+
+    _highlight(syntax, lines)  # warm up caches
+
+    startTime = time.perf_counter()
+    _highlight(syntax, lines)
+    highlightingTime = time.perf_counter() - startTime
+
+    print('Language: {}, {} lines'.format(syntax.name, len(lines)))
+    print('{:.1f} us per line'.format(highlightingTime * 1000000 / max(len(lines), 1)))
+    print('Constructor calls per line:')
+    for name, count in sorted(_constructorCalls(syntax, lines).items()):
+        print('{:>24}: {:8.2f}'.format(name, count / max(len(lines), 1)))
+    print('Peak temporary memory of a line: {} bytes'.format(_peakMemoryPerLine(syntax, lines)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Differential check of the C and the Python parsers, and their throughput.
+
+Both parsers highlight the same corpus: the sample files of tests/test_syntax/files and a generated text
+for every XML definition. Generated lines are made of keywords, numbers and punctuation, so many contexts
+of the definition are entered. Segments, text type maps and context stacks are compared line by line,
+the first different line of every text is printed. Adjacent segments with equal formats are merged,
+because the parsers split text differently.
+
+The parser is chosen by QPART_CPARSER when qutepart is imported, therefore every parser runs
+in a child process. The line cache is not used. A text, which is not highlighted in time
+(i.e. a regular expression backtracks catastrophically), is reported, and the child is restarted
+from the next text.
+
+Throughput is printed in lines/s and MB/s for every parser and definition. --save-budget saves it,
+--budget reports definitions, which are slower than the saved throughput by more than the tolerance.
+Budgets are only comparable on the same machine.
+
+Known differences are listed in _KNOWN_DIFFERENCES and don't fail the check.
+Exit code is 1, if the parsers differ, a text is not highlighted in time or throughput is below the budget.
+
+Usage: parser_parity.py [--lines COUNT] [--timeout SECONDS] [--budget FILE] [--save-budget FILE]
+                        [--tolerance PERCENT] [XML_FILE...]
+    XML_FILE        XML definition file names, i.e. perl.xml. Default is all definitions
+    --lines         count of generated lines per definition. Default is 200
+    --timeout       time limit of highlighting of a text by a parser. Default is 10
+    --tolerance     allowed throughput drop. Default is 30
+"""
+
+import faulthandler
+import json
+import logging
+import marshal
+import math
+import os
+import os.path
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+_TOP_LEVEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, _TOP_LEVEL_PATH)  # qutepart of the tree is imported by the script and the child processes
+_SAMPLES_PATH = os.path.join(_TOP_LEVEL_PATH, 'tests', 'test_syntax', 'files')
+_XML_PATH = os.path.join(_TOP_LEVEL_PATH, 'qutepart', 'syntax', 'data', 'xml')
+
+_PARSERS = (('c', 'Y'), ('python', 'N'))  # name, QPART_CPARSER
+
+_REPEAT_COUNT = 3
+_MIN_MEASUREMENT_TIME = 0.1  # short texts are highlighted more times, the best time is used
+_DEFAULT_LINE_COUNT = 200
+_DEFAULT_TOLERANCE = 30
+_DEFAULT_TIMEOUT = 10
+
+# Known differences, which are not fixed yet: text name: (first different line, description).
+# Left side of a description is the C parser. The parsers of qutepart before this script had been added
+# highlight these texts the same way, except where noted. A known difference is reported, but doesn't
+# fail the check, unless the first different line changes. An entry, which doesn't differ any more, is reported
+_KNOWN_DIFFERENCES = {
+    'highlight.ly': (12, 'C does not highlight a Variable, Python does'),
+    'highlight.sed': (45, 'context stacks differ'),
+    'highlight1.spec': (64, 'C highlights Keyword, Python highlights Error'),
+    'apache.xml (generated)': (14, "C keeps 'Integer Directives' at the line end, Python returns to the default context"),
+    'cpp.xml (generated)': (108, 'C highlights one Preprocessor character before Error, Python highlights Error'),
+    'email.xml (generated)': (11, "C pops the 'header' context, Python keeps it"),
+    'erlang.xml (generated)': (None, 'a string regular expression backtracks catastrophically in the Python parser'),
+    'fastq.xml (generated)': (80, "C pops the 'SeqStart' context, Python keeps it"),
+    'fstab.xml (generated)': (15, 'C highlights Comment, Python highlights Dump, Pass and Error'),
+    'gdb-bt.xml (generated)': (28, "dynamic data of the 'identifier' context differ"),
+    'grammar.xml (generated)': (50, 'C highlights String Char in a String, Python does not'),
+    'idconsole.xml (generated)': (123, 'context stacks differ'),
+    'isocpp.xml (generated)': (4, 'C highlights Preprocessor before Error, Python highlights Error'),
+    'javascript.xml (generated)': (1, "C keeps the 'Shebang' context at the line end, Python returns to the default context"),
+    'kconfig.xml (generated)': (1, "C pops the 'input' context, Python keeps it"),
+    'makefile.xml (generated)': (88, 'C highlights a 3 characters Operator and Silent, Python 2 characters and Normal'),
+    'nagios.xml (generated)': (192, 'C highlights Comment, Python does not'),
+    'oors.xml (generated)': (27, 'C highlights Preprocessor before Error, Python highlights Error'),
+    'praat.xml (generated)': (50, 'C highlights a function, Python does not'),
+    'pug.xml (generated)': (41, "C keeps the 'Element' context at the line end, Python returns to the default context"),
+    'sed.xml (generated)': (53, 'context stacks differ'),
+    'systemc.xml (generated)': (42, 'C highlights Preprocessor before Error, Python highlights Error'),
+    'toml.xml (generated)': (35, 'highlighting of a key with errors differs'),
+    'txt2tags.xml (generated)': (35, 'Strikeout length differs'),
+    'xonotic-console.xml (generated)': (117, 'Comment length differs'),
+}
+
+_PUNCTUATION = ['"', "'", '`', '/*', '*/', '//', '#', '--', ';', ':', ',', '.', '=', '<', '>', '</', '/>',
+                '<!--', '-->', '{', '}', '(', ')', '[', ']', '\\', '$', '@', '%', '&', '|', '"""', '\t']
+_NUMBERS = ['0', '42', '3.14', '0x1F', '017', '1e10', '-7']
+_IDENTIFIERS = ['foo', 'bar_1', 'Baz', 'x']
+
+
+def _generatedLines(syntax, count):
+    """Lines of random tokens. The same for every run and parser
+    """
+    generator = random.Random(syntax.xmlFileName)
+    words = sorted({word for words in syntax.parser.lists.values() for word in words})
+    tokenKinds = [_PUNCTUATION, _NUMBERS, _IDENTIFIERS]
+    if words:
+        tokenKinds.append(words)
+
+    lines = []
+    for i in range(count):
+        tokens = [generator.choice(generator.choice(tokenKinds)) \
+                    for j in range(generator.randint(0, 12))]
+        lines.append(''.join([token + generator.choice(['', ' ', ' ']) for token in tokens]))
+    return lines
+
+
+def _corpus(manager, xmlFileNames, lineCount):
+    """Get list of (text name, syntax, lines)
+    """
+    texts = []
+    for fileName in sorted(os.listdir(_SAMPLES_PATH)):
+        with open(os.path.join(_SAMPLES_PATH, fileName), encoding='utf-8', errors='replace') as sampleFile:
+            lines = sampleFile.read().splitlines()
+        syntax = manager.getSyntax(sourceFilePath=fileName, firstLine=lines[0] if lines else None)
+        if syntax is not None and syntax.xmlFileName in xmlFileNames:
+            texts.append((fileName, syntax, lines))
+
+    for xmlFileName in xmlFileNames:
+        syntax = manager.getSyntax(xmlFileName=xmlFileName)
+        if syntax is not None:
+            texts.append((xmlFileName + ' (generated)', syntax, _generatedLines(syntax, lineCount)))
+
+    return texts
+
+
+def _formatKey(format):
+    if format is None:
+        return None
+    return tuple(sorted(vars(format).items()))
+
+
+def _stackKey(parser, contextStack):
+    """The C parser returns None instead of the default stack
+    """
+    if contextStack is None:
+        return None
+    frames = contextStack.frames()
+    if list(frames) == [(parser.defaultContext, None)]:
+        return None
+    return tuple([(context.parser.syntax.xmlFileName, context.name, data) for context, data in frames])
+
+
+def _segmentsKey(highlightedSegments):
+    """Parsers split text with the same format differently. Compare highlighting, as it is shown
+    """
+    segments = []
+    for length, format in highlightedSegments:
+        formatKey = _formatKey(format)
+        if length == 0:
+            continue
+        elif segments and segments[-1][1] == formatKey:
+            segments[-1] = (segments[-1][0] + length, formatKey)
+        else:
+            segments.append((length, formatKey))
+    return segments
+
+
+def _highlight(syntax, lines):
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        contextStack = lineData[0]
+
+
+def _results(syntax, lines):
+    """List of (segments, text type map, context stack) of lines in comparable form
+    """
+    results = []
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        contextStack, textTypeMap = lineData
+        results.append((_segmentsKey(highlightedSegments),
+                        str(textTypeMap),
+                        _stackKey(syntax.parser, contextStack)))
+    return results
+
+
+def _runChild(outputPath, xmlFileNames, lineCount, firstText, timeout):
+    """Highlight the corpus from the text with index firstText with the parser of this process.
+
+    Records are appended to outputPath: binaryParserAvailable, then (text name, xmlFileName) and
+    (lines, bytes, time, results) for every text, then None.
+    The process exits, if a text is not highlighted in time
+    """
+    import qutepart.syntax
+    from qutepart.syntax import SyntaxManager
+    import qutepart.syntax.loader
+
+    logging.getLogger('qutepart').setLevel(logging.CRITICAL)  # broken definitions and deep stacks are reported
+    qutepart.syntax.setLineCacheSize(0)
+
+    corpus = _corpus(SyntaxManager(headless=True), xmlFileNames, lineCount)
+    with open(outputPath, 'ab') as outputFile:
+        marshal.dump(qutepart.syntax.loader.binaryParserAvailable, outputFile)
+        for name, syntax, lines in corpus[firstText:]:
+            marshal.dump((name, syntax.xmlFileName), outputFile)
+            outputFile.flush()
+
+            # regular expressions with catastrophic backtracking can't be interrupted
+            faulthandler.dump_traceback_later(timeout, exit=True)
+            results = _results(syntax, lines)  # also makes dispatch tables
+            times = []
+            while len(times) < _REPEAT_COUNT or sum(times) < _MIN_MEASUREMENT_TIME:
+                startTime = time.perf_counter()
+                _highlight(syntax, lines)
+                times.append(time.perf_counter() - startTime)
+            faulthandler.cancel_dump_traceback_later()
+
+            size = sum([len(text.encode('utf-8', 'surrogatepass')) + 1 for text in lines])
+            marshal.dump((len(lines), size, min(times), results), outputFile)
+            outputFile.flush()
+
+        marshal.dump(None, outputFile)
+
+
+def _runParser(cParser, xmlFileNames, lineCount, timeout):
+    """Get binaryParserAvailable and list of (text name, xmlFileName, lines, bytes, time, results).
+    Results of texts, which were not highlighted in time, are None
+    """
+    fd, outputPath = tempfile.mkstemp(suffix='.marshal')
+    os.close(fd)
+    texts = []
+    try:
+        environment = dict(os.environ, QPART_CPARSER=cParser)
+        while True:
+            open(outputPath, 'wb').close()
+            subprocess.call([sys.executable, os.path.abspath(__file__),
+                             '--child', outputPath, '--first', str(len(texts)),
+                             '--lines', str(lineCount), '--timeout', str(timeout)] + xmlFileNames,
+                            env=environment)
+            with open(outputPath, 'rb') as outputFile:
+                binaryParser = marshal.load(outputFile)
+                while True:
+                    header = marshal.load(outputFile)
+                    if header is None:
+                        return binaryParser, texts
+                    try:
+                        texts.append(header + marshal.load(outputFile))
+                    except EOFError:  # killed on timeout, continue from the next text
+                        texts.append(header + (0, 0, 0., None))
+                        break
+    finally:
+        os.remove(outputPath)
+
+
+def _firstDifference(results, otherResults):
+    """Get (line index, description) or None
+    """
+    for index, (result, otherResult) in enumerate(zip(results, otherResults)):
+        for part, value, otherValue in zip(('segments', 'text types', 'context stack'), result, otherResult):
+            if value != otherValue:
+                if part == 'segments':  # formats are long, show only their names
+                    value, otherValue = [[(length, dict(format or {}).get('attributeName')) \
+                                             for length, format in segments] \
+                                            for segments in (value, otherValue)]
+                return index, '{}: {!r} != {!r}'.format(part, value, otherValue)
+    if len(results) != len(otherResults):
+        return min(len(results), len(otherResults)), 'line count'
+    return None
+
+
+def _throughput(texts, skippedNames):
+    """Get {xmlFileName: (lines, bytes, time)}
+    """
+    throughput = {}
+    for name, xmlFileName, lineCount, size, highlightingTime, results in texts:
+        if name in skippedNames:
+            continue
+        lines, bytes_, seconds = throughput.get(xmlFileName, (0, 0, 0.))
+        throughput[xmlFileName] = (lines + lineCount, bytes_ + size, seconds + highlightingTime)
+    return throughput
+
+
+def _popOption(args, name):
+    if name not in args:
+        return None
+    index = args.index(name)
+    if index + 1 >= len(args):
+        raise ValueError(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        childOutputPath = _popOption(args, '--child')
+        firstText = int(_popOption(args, '--first') or 0)
+        timeout = float(_popOption(args, '--timeout') or _DEFAULT_TIMEOUT)
+        lineCount = int(_popOption(args, '--lines') or _DEFAULT_LINE_COUNT)
+        budgetPath = _popOption(args, '--budget')
+        saveBudgetPath = _popOption(args, '--save-budget')
+        tolerance = float(_popOption(args, '--tolerance') or _DEFAULT_TOLERANCE) / 100
+    except ValueError:
+        print(__doc__.strip())
+        return 1
+
+    if any([arg.startswith('-') for arg in args]):
+        print(__doc__.strip())
+        return 1
+
+    xmlFileNames = args or sorted([fileName for fileName in os.listdir(_XML_PATH) if fileName.endswith('.xml')])
+
+    if childOutputPath is not None:
+        _runChild(childOutputPath, xmlFileNames, lineCount, firstText, timeout)
+        return 0
+
+    outputs = {}
+    for parserName, cParser in _PARSERS:
+        binaryParser, outputs[parserName] = _runParser(cParser, xmlFileNames, lineCount, timeout)
+        if binaryParser != (parserName == 'c'):
+            print('The C parser is not available')
+            return 1
+
+    differentTexts = 0
+    knownDifferences = 0
+    notHighlightedNames = set()
+    for text, otherText in zip(outputs['c'], outputs['python']):
+        name, xmlFileName, lineCount_, size, time_, results = text
+        knownLine, knownDescription = _KNOWN_DIFFERENCES.get(name, (False, None))
+        if results is None or otherText[-1] is None:
+            notHighlightedNames.add(name)
+            line = None
+            description = 'not highlighted in {} s by the {} parser'.format(timeout, 'C' if results is None else 'Python')
+        else:
+            difference = _firstDifference(results, otherText[-1])
+            if difference is None:
+                if knownLine is not False:
+                    print('{}: known difference is fixed: {}'.format(name, knownDescription))
+                continue
+            line = difference[0] + 1
+            description = difference[1]
+
+        location = name if line is None else '{}:{}'.format(name, line)
+        if line == knownLine:
+            knownDifferences += 1
+            print('{}: known: {}'.format(location, knownDescription))
+        else:
+            differentTexts += 1
+            print('{}: {}'.format(location, description))
+
+    throughputs = {parserName: _throughput(texts, notHighlightedNames) for parserName, texts in outputs.items()}
+    linesPerSecond = {parserName: {xmlFileName: lines / seconds \
+                                       for xmlFileName, (lines, bytes_, seconds) in throughput.items()} \
+                        for parserName, throughput in throughputs.items()}
+
+    budget = {}
+    if budgetPath is not None:
+        with open(budgetPath) as budgetFile:
+            budget = json.load(budgetFile)
+
+    print('{:<28} {:>7} {:>12} {:>8} {:>12} {:>8}'.format('definition', 'lines', 'C lines/s', 'MB/s',
+                                                          'Py lines/s', 'MB/s'))
+    regressions = []
+    for xmlFileName in sorted(throughputs['c']):
+        columns = []
+        for parserName, cParser in _PARSERS:
+            lines, bytes_, seconds = throughputs[parserName][xmlFileName]
+            columns.extend([lines / seconds, bytes_ / seconds / 1e6])
+            budgetLinesPerSecond = budget.get(parserName, {}).get(xmlFileName)
+            if budgetLinesPerSecond is not None and lines / seconds < budgetLinesPerSecond * (1 - tolerance):
+                regressions.append((parserName, xmlFileName, lines / seconds, budgetLinesPerSecond))
+        print('{:<28} {:7d} {:12.0f} {:8.2f} {:12.0f} {:8.2f}'.format(xmlFileName,
+                                                                      throughputs['c'][xmlFileName][0],
+                                                                      *columns))
+
+    for parserName, xmlFileName, actual, expected in regressions:
+        print('Regression: {} parser, {}: {:.0f} lines/s, budget {:.0f} lines/s'.format(parserName, xmlFileName,
+                                                                                     actual, expected))
+
+    if budget:
+        # geometric mean is not dominated by a few definitions and shows slowdown of the whole machine
+        ratios = []
+        for parserName, cParser in _PARSERS:
+            logRatios = [math.log(linesPerSecond[parserName][xmlFileName] / budgetLinesPerSecond) \
+                            for xmlFileName, budgetLinesPerSecond in budget.get(parserName, {}).items() \
+                                if xmlFileName in linesPerSecond[parserName]]
+            if logRatios:
+                ratios.append('{} parser {:.2f}x'.format(parserName, math.exp(sum(logRatios) / len(logRatios))))
+        print('Throughput relative to the budget: {}'.format(', '.join(ratios)))
+
+    print('{} texts, {} differ, {} known differences, {} regressions'.format(len(outputs['c']), differentTexts,
+                                                                               knownDifferences, len(regressions)))
+
+    if saveBudgetPath is not None:
+        with open(saveBudgetPath, 'w') as saveFile:
+            json.dump(linesPerSecond, saveFile, indent=4, sort_keys=True)
+
+    return 1 if differentTexts or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Highlighting time of syntaxes, which use regular expressions a lot.
+
+Every file is highlighted several times by the parser, the best time is printed.
+Share of RegExpr rules in the highlighting time is measured in a separate run with profiling enabled.
+
+To see the speedup of a regular expression library, save results of one build of the C parser,
+and compare results of another build with them:
+
+    python3 setup.py build_ext --inplace --without-pcre2
+    regexp_benchmark.py --save pcre.json
+    python3 setup.py build_ext --inplace
+    regexp_benchmark.py --compare pcre.json
+
+Usage: regexp_benchmark.py [--save RESULTS] [--compare RESULTS] [FILE...]
+    FILE    source files. Default is Perl, Ruby, LaTeX and Markdown samples
+"""
+
+import json
+import os.path
+import sys
+import time
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+_TOP_LEVEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_DEFAULT_FILES = [os.path.join(_TOP_LEVEL_PATH, 'tests', 'test_syntax', 'files', 'highlight.pl'),
+                  os.path.join(_TOP_LEVEL_PATH, 'tests', 'test_syntax', 'files', 'highlight.rb'),
+                  os.path.join(_TOP_LEVEL_PATH, 'tests', 'test_syntax', 'files', 'highlight.tex'),
+                  os.path.join(_TOP_LEVEL_PATH, 'README.md')]
+
+_REPEAT_COUNT = 5
+_MIN_LINES = 10000  # short files are repeated to make the time measurable
+
+
+def _highlight(syntax, lines):
+    startTime = time.perf_counter()
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        contextStack = lineData[0]
+    return time.perf_counter() - startTime
+
+
+def _regExpShare(syntax, lines):
+    qutepart.syntax.setProfilingEnabled(True)
+    _highlight(syntax, lines)  # the Python parser remakes dispatch tables
+    qutepart.syntax.clearProfile()
+    highlightingTime = _highlight(syntax, lines)
+    qutepart.syntax.setProfilingEnabled(False)
+    contextProfiles, ruleProfiles = qutepart.syntax.profileInfo()
+    qutepart.syntax.clearProfile()
+    regExpTime = sum([ruleTime for xmlFileName, contextName, ruleId, trials, matches, ruleTime in ruleProfiles
+                          if ruleId.startswith('RegExpr(')])
+    return regExpTime / highlightingTime
+
+
+def _backend():
+    if qutepart.syntax.loader.binaryParserAvailable:
+        name, version, jit = qutepart.syntax.loader._parserModule.regExpBackend()
+        return 'C parser, {} {}{}'.format(name, version, ', JIT' if jit else '')
+    else:
+        return 'Python parser'
+
+
+def _benchmark(manager, filePath):
+    """Get (language, count of lines, highlighting time, share of RegExpr rules) or None
+    """
+    with open(filePath, encoding='utf-8') as sourceFile:
+        lines = sourceFile.read().splitlines()
+
+    syntax = manager.getSyntax(sourceFilePath=filePath,
+                               firstLine=lines[0] if lines else None)
+    if syntax is None or not lines:
+        return None
+
+    lines = lines * max(1, _MIN_LINES // len(lines))
+
+    _highlight(syntax, lines)  # contexts make dispatch tables on first use
+    highlightingTime = min([_highlight(syntax, lines) for i in range(_REPEAT_COUNT)])
+    return syntax.name, len(lines), highlightingTime, _regExpShare(syntax, lines)
+
+
+def _popOption(args, name):
+    if name not in args:
+        return None
+    index = args.index(name)
+    if index + 1 >= len(args):
+        raise ValueError(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        savePath = _popOption(args, '--save')
+        comparePath = _popOption(args, '--compare')
+    except ValueError:
+        print(__doc__.strip())
+        return 1
+
+    if any([arg.startswith('-') for arg in args]):
+        print(__doc__.strip())
+        return 1
+
+    baseline = {}
+    if comparePath is not None:
+        with open(comparePath) as compareFile:
+            baseline = json.load(compareFile)
+
+    manager = SyntaxManager(headless=True)
+
+    print(_backend())
+    print('{:<12} {:>7} {:>10} {:>9} {:>8}'.format('language', 'lines', 'time, ms', 'regexp', 'speedup'))
+
+    results = {}
+    for filePath in args or _DEFAULT_FILES:
+        result = _benchmark(manager, filePath)
+        if result is None:
+            print('{}: syntax not detected'.format(filePath))
+            continue
+
+        language, lineCount, highlightingTime, regExpShare = result
+        results[language] = highlightingTime
+
+        speedup = ''
+        if language in baseline:
+            speedup = '{:.2f}x'.format(baseline[language] / highlightingTime)
+        print('{:<12} {:7d} {:10.1f} {:9.0%} {:>8}'.format(language, lineCount,
+                                                          highlightingTime * 1000, regExpShare, speedup))
+
+    if savePath is not None:
+        with open(savePath, 'w') as saveFile:
+            json.dump(results, saveFile, indent=4, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
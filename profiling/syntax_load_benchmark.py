@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Load time of syntaxes from the XML files and from the compiled definition cache.
+See SyntaxManager cacheDir parameter.
+
+Every syntax is loaded by a new SyntaxManager, therefore time includes syntaxes it refers to.
+The best time of several loads is reported:
+    xml         the XML file is compiled, the cache is not used
+    cached      the definition is loaded from the cache
+
+Usage: syntax_load_benchmark.py [XML_FILE_NAME...]
+    XML_FILE_NAME   syntax definition, i.e. cpp.xml. Default is the slowest syntaxes and the total of all
+"""
+
+import logging
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+_XML_DIR_PATH = os.path.join(os.path.dirname(qutepart.syntax.loader.__file__), 'data', 'xml')
+
+_REPEAT_COUNT = 3
+_SLOWEST_COUNT = 15
+
+
+def _loadTime(xmlFileName, cacheDir):
+    bestTime = None
+    for i in range(_REPEAT_COUNT):
+        manager = SyntaxManager(headless=True, cacheDir=cacheDir)
+        startTime = time.perf_counter()
+        manager.getSyntax(xmlFileName=xmlFileName)
+        loadTime = time.perf_counter() - startTime
+        bestTime = loadTime if bestTime is None else min(bestTime, loadTime)
+    return bestTime
+
+
+def main():
+    if any([arg.startswith('-') for arg in sys.argv[1:]]):
+        print(__doc__.strip())
+        return 1
+
+    xmlFileNames = sys.argv[1:] or sorted(os.listdir(_XML_DIR_PATH))
+    logging.getLogger('qutepart').setLevel(logging.ERROR)  # broken definitions
+
+    cacheDir = tempfile.mkdtemp()
+    try:
+        times = []
+        for xmlFileName in xmlFileNames:
+            xmlTime = _loadTime(xmlFileName, None)
+            SyntaxManager(headless=True, cacheDir=cacheDir).getSyntax(xmlFileName=xmlFileName)  # fill the cache
+            times.append((xmlFileName, xmlTime, _loadTime(xmlFileName, cacheDir)))
+    finally:
+        shutil.rmtree(cacheDir)
+
+    print('{} parser'.format('C' if qutepart.syntax.loader.binaryParserAvailable else 'Python'))
+    print('{:<24} {:>10} {:>10} {:>8}'.format('syntax', 'xml, ms', 'cached, ms', 'speedup'))
+
+    shownTimes = times if sys.argv[1:] else sorted(times, key=lambda item: item[1], reverse=True)[:_SLOWEST_COUNT]
+    for xmlFileName, xmlTime, cachedTime in shownTimes:
+        print('{:<24} {:10.1f} {:10.1f} {:7.2f}x'.format(xmlFileName, xmlTime * 1000, cachedTime * 1000,
+                                                         xmlTime / cachedTime))
+
+    if len(times) > 1:
+        xmlTotal = sum([xmlTime for xmlFileName, xmlTime, cachedTime in times])
+        cachedTotal = sum([cachedTime for xmlFileName, xmlTime, cachedTime in times])
+        print('{:<24} {:10.1f} {:10.1f} {:7.2f}x'.format('total of %d' % len(times), xmlTotal * 1000, cachedTotal * 1000,
+                                                         xmlTotal / cachedTotal))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Rules and contexts of a syntax definition, which take most of highlighting time.
+
+Every line of the file is parsed, the line cache is not used.
+
+Usage: syntax_profile.py FILE [COUNT]
+    COUNT   count of printed rules and contexts. Default is 20
+"""
+
+import sys
+import time
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+_MAX_RULE_ID_LENGTH = 100  # fused rules and keyword lists are long
+
+
+def _highlight(syntax, lines):
+    startTime = time.perf_counter()
+    contextStack = None
+    for text in lines:
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+        contextStack = lineData[0]
+    return time.perf_counter() - startTime
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print(__doc__.strip())
+        return 1
+
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 20
+
+    with open(sys.argv[1], encoding='utf-8') as sourceFile:
+        lines = sourceFile.read().splitlines()
+
+    syntax = SyntaxManager(headless=True).getSyntax(sourceFilePath=sys.argv[1],
+                                                    firstLine=lines[0] if lines else None)
+    if syntax is None:
+        print('Syntax not detected')
+        return 1
+
+    _highlight(syntax, lines)  # contexts make dispatch tables on first use
+    highlightingTime = _highlight(syntax, lines)
+
+    qutepart.syntax.setProfilingEnabled(True)
+    _highlight(syntax, lines)  # the Python parser remakes dispatch tables
+    qutepart.syntax.clearProfile()
+    profilingTime = _highlight(syntax, lines)
+    qutepart.syntax.setProfilingEnabled(False)
+    contextProfiles, ruleProfiles = qutepart.syntax.profileInfo()
+
+    print('Language: {}, {} parser, {} lines'.format(syntax.name,
+                                                      'C' if qutepart.syntax.loader.binaryParserAvailable else 'Python',
+                                                      len(lines)))
+    print('{:.3f} s, {:.3f} s with profiling'.format(highlightingTime, profilingTime))
+
+    print()
+    print('{:>9} {:>9}  {}'.format('time, ms', 'blocks', 'context'))
+    for xmlFileName, contextName, blocks, contextTime in contextProfiles[:count]:
+        print('{:9.2f} {:9d}  {}: {}'.format(contextTime * 1000, blocks, xmlFileName, contextName))
+
+    print()
+    print('{:>9} {:>9} {:>9}  {}'.format('time, ms', 'trials', 'matches', 'rule'))
+    for xmlFileName, contextName, ruleId, trials, matches, ruleTime in ruleProfiles[:count]:
+        if len(ruleId) > _MAX_RULE_ID_LENGTH:
+            ruleId = ruleId[:_MAX_RULE_ID_LENGTH - 3] + '...'
+        print('{:9.2f} {:9d} {:9d}  {}: {}: {}'.format(ruleTime * 1000, trials, matches,
+                                                       xmlFileName, contextName, ruleId))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
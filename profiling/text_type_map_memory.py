@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Memory used by text type maps of a highlighted file.
+
+Run-length encoded maps are compared with the per-character representations,
+which were used before: a list of letters (Python parser) and a string (C parser).
+
+Usage: text_type_map_memory.py FILE
+"""
+
+import sys
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+def _textTypeMapsSize(textTypeMaps):
+    """Shared objects are counted once
+    """
+    seen = set()
+    size = 0
+    for textTypeMap in textTypeMaps:
+        for obj in (textTypeMap, textTypeMap.types, textTypeMap.ends, textTypeMap.length):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+    return size
+
+
+def _listSize(textTypeMap):
+    return sys.getsizeof(list(textTypeMap))  # letters are interned one character strings
+
+
+def _stringSize(textTypeMap):
+    return sys.getsizeof('\u0100' * len(textTypeMap))  # the C parser created UCS-2 strings
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        return 1
+
+    with open(sys.argv[1], encoding='utf-8') as sourceFile:
+        lines = sourceFile.read().splitlines()
+
+    syntax = SyntaxManager(headless=True).getSyntax(sourceFilePath=sys.argv[1],
+                                                    firstLine=lines[0] if lines else None)
+    if syntax is None:
+        print('Syntax not detected')
+        return 1
+
+    textTypeMaps = []
+    contextStack = None
+    for text in lines:
+        lineData = syntax.parseBlock(text, contextStack)
+        contextStack, textTypeMap = lineData
+        textTypeMaps.append(textTypeMap)
+
+    runs = sum([len(textTypeMap.types) for textTypeMap in textTypeMaps])
+    sizes = [('run-length encoded', _textTypeMapsSize(textTypeMaps)),
+             ('list (old Python parser)', sum([_listSize(textTypeMap) for textTypeMap in textTypeMaps])),
+             ('string (old C parser)', sum([_stringSize(textTypeMap) for textTypeMap in textTypeMaps]))]
+
+    print('Language: {}, {} parser'.format(syntax.name,
+                                            'C' if qutepart.syntax.loader.binaryParserAvailable else 'Python'))
+    print('{} lines, {} characters, {} runs'.format(len(lines), sum([len(text) for text in lines]), runs))
+    encodedSize = sizes[0][1]
+    for name, size in sizes:
+        print('{:>26}: {:10} bytes, {:6.1f} bytes per line, {:5.2f}x'.format(name,
+                                                                            size,
+                                                                            size / max(len(lines), 1),
+                                                                            size / max(encodedSize, 1)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Highlighting throughput of a thread pool. See qutepart.syntax.bulk.highlightTexts().
+
+The file is highlighted as several documents by 1, 2, 4... threads, up to THREADS.
+The C parser parses lines without the GIL, therefore throughput grows with count of threads
+up to count of CPUs. The line cache is disabled.
+
+Usage: thread_benchmark.py [FILE [THREADS]]
+    FILE        source file. Default is the Perl sample
+    THREADS     maximum count of threads. Default is count of CPUs
+"""
+
+import os
+import os.path
+import sys
+import time
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+from qutepart.syntax.bulk import highlightTexts
+import qutepart.syntax.loader
+
+
+_TOP_LEVEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+_DEFAULT_FILE = os.path.join(_TOP_LEVEL_PATH, 'tests', 'test_syntax', 'files', 'highlight.pl')
+
+_DOCUMENT_COUNT = 32
+_MIN_LINES = 20000  # in all documents
+
+
+def _highlight(syntax, texts, threads):
+    startTime = time.perf_counter()
+    for spans in highlightTexts(texts, syntax, jobs=threads):
+        pass
+    return time.perf_counter() - startTime
+
+
+def main():
+    if len(sys.argv) > 3 or any([arg.startswith('-') for arg in sys.argv[1:]]):
+        print(__doc__.strip())
+        return 1
+
+    filePath = sys.argv[1] if len(sys.argv) > 1 else _DEFAULT_FILE
+    maxThreads = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    with open(filePath, encoding='utf-8') as sourceFile:
+        text = sourceFile.read()
+
+    syntax = SyntaxManager(headless=True).getSyntax(sourceFilePath=filePath,
+                                                    firstLine=text.split('\n', 1)[0])
+    if syntax is None:
+        print('Syntax not detected')
+        return 1
+
+    lineCount = text.count('\n') + 1
+    repeatCount = max(1, _MIN_LINES // (lineCount * _DOCUMENT_COUNT))
+    texts = ['\n'.join([text] * repeatCount)] * _DOCUMENT_COUNT
+    totalLines = lineCount * repeatCount * _DOCUMENT_COUNT
+
+    qutepart.syntax.setLineCacheSize(0)
+    _highlight(syntax, texts[:1], 1)  # contexts make dispatch tables on first use
+
+    print('Language: {}, {} parser, {} CPUs, {} documents, {} lines'.format(
+              syntax.name, 'C' if qutepart.syntax.loader.binaryParserAvailable else 'Python',
+              os.cpu_count(), _DOCUMENT_COUNT, totalLines))
+    print('{:>8} {:>10} {:>12} {:>8}'.format('threads', 'time, ms', 'lines/s', 'speedup'))
+
+    singleThreadTime = None
+    threads = 1
+    while threads <= maxThreads:
+        highlightingTime = _highlight(syntax, texts, threads)
+        if singleThreadTime is None:
+            singleThreadTime = highlightingTime
+        print('{:8d} {:10.1f} {:12.0f} {:7.2f}x'.format(threads, highlightingTime * 1000,
+                                                        totalLines / highlightingTime,
+                                                        singleThreadTime / highlightingTime))
+        threads *= 2
+
+    qutepart.syntax.setLineCacheSize(qutepart.syntax._LINE_CACHE_DEFAULT_SIZE)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""On-disk cache of highlighting results.
+
+Cache file contains line data and format ranges of every line of a document.
+File name is a hash of the document text, syntax XML file name, qutepart version and parser type,
+therefore cache entries are never invalidated, only replaced.
+When total size of the files is over the limit, the least recently used files are removed.
+"""
+
+import array
+import hashlib
+import logging
+import marshal
+import os
+import os.path
+import tempfile
+import zlib
+
+import qutepart.version
+import qutepart.syntax.loader
+from qutepart.syntax.texttypemap import TextTypeMap
+
+
+_logger = logging.getLogger('qutepart')
+
+_FORMAT_VERSION = 2
+
+_FILE_SUFFIX = '.qphl'
+
+# total size of cache files in bytes. See HighlightCache maxSize parameter
+_DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# line stack index for lines without line data (too long lines) and for the default stack of the C parser
+_NO_LINE_DATA = -2
+_NO_CONTEXT_STACK = -1
+
+
+class HighlightCache:
+    """Highlighting results cache in a directory.
+
+    A line is (lineData, ranges), where ranges is a list of ranges. Range is (start, length, format),
+    where format is an item of Syntax.formats of the syntax or of syntaxes it includes
+
+    maxSize is the limit of total size of the cache files in bytes. It is checked on save
+    """
+    def __init__(self, dirPath, maxSize=_DEFAULT_MAX_SIZE):
+        self._dirPath = dirPath
+        self._maxSize = maxSize
+
+    def _filePath(self, text, syntax):
+        key = hashlib.sha1()
+        key.update(text.encode('utf-8', 'surrogatepass'))
+        key.update(('\0%s\0%s\0%s\0%d\0%d' % (syntax.xmlFileName,
+                                              '.'.join([str(n) for n in qutepart.version.VERSION]),
+                                              'c' if qutepart.syntax.loader.binaryParserAvailable else 'py',
+                                              marshal.version,
+                                              _FORMAT_VERSION)).encode('utf-8'))
+        return os.path.join(self._dirPath, key.hexdigest() + _FILE_SUFFIX)
+
+    def load(self, text, syntax, makeRange=lambda start, length, format: (start, length, format)):
+        """Get list of lines for the text. None if not cached
+
+        makeRange(start, length, format) creates objects for ranges of lines.
+        Equal ranges are the same object
+        """
+        filePath = self._filePath(text, syntax)
+        try:
+            with open(filePath, 'rb') as cacheFile:
+                content = marshal.loads(zlib.decompress(cacheFile.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError, zlib.error) as ex:
+            _logger.warning('Failed to read highlighting cache %s: %s', filePath, ex)
+            return None
+
+        try:
+            os.utime(filePath)  # recently used files are removed last
+        except OSError:
+            pass
+
+        try:
+            return self._deserialize(content, syntax, makeRange)
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError, StopIteration) as ex:
+            _logger.warning('Invalid highlighting cache %s: %s', filePath, ex)
+            return None
+
+    def save(self, text, syntax, lines):
+        """Save lines for the text. lines is an iterable of lines, but formats of ranges
+        are replaced with format ids. See Syntax.formats
+        """
+        try:
+            content = self._serialize(lines)
+        except KeyError:
+            return  # a format without id. Can't be restored
+
+        tmpFilePath = None
+        try:
+            os.makedirs(self._dirPath, exist_ok=True)
+            fd, tmpFilePath = tempfile.mkstemp(dir=self._dirPath)
+            with os.fdopen(fd, 'wb') as cacheFile:
+                cacheFile.write(zlib.compress(marshal.dumps(content), 1))
+            os.replace(tmpFilePath, self._filePath(text, syntax))
+            tmpFilePath = None
+            self._removeOldFiles()
+        except OSError as ex:
+            _logger.warning('Failed to save highlighting cache: %s', ex)
+            if tmpFilePath is not None and os.path.exists(tmpFilePath):
+                os.remove(tmpFilePath)
+
+    def _removeOldFiles(self):
+        """Remove the least recently used files, while total size of the files is over the limit
+        """
+        files = []
+        with os.scandir(self._dirPath) as entries:
+            for entry in entries:
+                if entry.name.endswith(_FILE_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        totalSize = sum([size for mtime, size, path in files])
+        for mtime, size, path in sorted(files):
+            if totalSize <= self._maxSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another editor instance
+            totalSize -= size
+
+    @staticmethod
+    def _serialize(lines):
+        formatIds = []
+        formatIndexes = {}
+        contexts = []
+        contextIndexes = {}
+        stacks = []
+        stackIndexes = {}
+
+        lineStacks = array.array('i')
+        textTypes = []  # run types of text type maps
+        textTypeRunEnds = array.array('I')
+        textTypeRunCounts = array.array('i')
+        textTypeMapLengths = array.array('i')
+        ranges = array.array('i')  # count of ranges, then (start, length, format index) for every range
+
+        for lineData, lineRanges in lines:
+            if lineData is None:
+                lineStacks.append(_NO_LINE_DATA)
+                textTypeRunCounts.append(0)
+                textTypeMapLengths.append(0)
+            else:
+                contextStack, textTypeMap = lineData
+                if contextStack is None:
+                    lineStacks.append(_NO_CONTEXT_STACK)
+                else:
+                    if contextStack not in stackIndexes:
+                        frames = []
+                        for context, data in contextStack.frames():
+                            if context not in contextIndexes:
+                                contextIndexes[context] = len(contexts)
+                                contexts.append((context.parser.syntax.xmlFileName, context.name))
+                            frames.append((contextIndexes[context], data))
+                        stackIndexes[contextStack] = len(stacks)
+                        stacks.append(tuple(frames))
+                    lineStacks.append(stackIndexes[contextStack])
+
+                textTypes.append(textTypeMap.types)
+                textTypeRunEnds.extend(textTypeMap.ends)
+                textTypeRunCounts.append(len(textTypeMap.types))
+                textTypeMapLengths.append(len(textTypeMap))
+
+            ranges.append(len(lineRanges))
+            for start, length, formatId in lineRanges:
+                if formatId is None:
+                    raise KeyError(formatId)
+                if formatId not in formatIndexes:
+                    formatIndexes[formatId] = len(formatIds)
+                    formatIds.append(formatId)
+                ranges.extend((start, length, formatIndexes[formatId]))
+
+        return {'version': _FORMAT_VERSION,
+                'formatIds': formatIds,
+                'contexts': contexts,
+                'stacks': stacks,
+                'lineStacks': lineStacks.tobytes(),
+                'textTypes': ''.join(textTypes),
+                'textTypeRunEnds': textTypeRunEnds.tobytes(),
+                'textTypeRunCounts': textTypeRunCounts.tobytes(),
+                'textTypeMapLengths': textTypeMapLengths.tobytes(),
+                'ranges': ranges.tobytes()}
+
+    @staticmethod
+    def _deserialize(content, syntax, makeRange):
+        if content['version'] != _FORMAT_VERSION:
+            raise ValueError('Unknown version')
+
+        manager = syntax.manager
+
+        formats = []
+        for formatId in content['formatIds']:
+            xmlFileName, index = formatId.rsplit(':', 1)
+            formats.append(manager.getSyntax(xmlFileName=xmlFileName).formats[int(index)])
+
+        contexts = [manager.getSyntax(xmlFileName=xmlFileName).parser.contexts[name] \
+                        for xmlFileName, name in content['contexts']]
+        stacks = [syntax.parser.makeContextStack([(contexts[contextIndex], data) \
+                                                    for contextIndex, data in frames]) \
+                    for frames in content['stacks']]
+
+        lineStacks = array.array('i')
+        lineStacks.frombytes(content['lineStacks'])
+        textTypeRunEnds = array.array('I')
+        textTypeRunEnds.frombytes(content['textTypeRunEnds'])
+        textTypeRunCounts = array.array('i')
+        textTypeRunCounts.frombytes(content['textTypeRunCounts'])
+        textTypeMapLengths = array.array('i')
+        textTypeMapLengths.frombytes(content['textTypeMapLengths'])
+        ranges = array.array('i')
+        ranges.frombytes(content['ranges'])
+        allTextTypes = content['textTypes']
+
+        rangeObjects = {}  # (start, length, format index): object from makeRange
+        rangeIter = iter(ranges)
+
+        lines = []
+        textTypesPos = 0
+        textTypeRunEndsPos = 0
+        for stackIndex, textTypeRunCount, textTypeMapLength in zip(lineStacks, textTypeRunCounts, textTypeMapLengths):
+            if stackIndex == _NO_LINE_DATA:
+                lineData = None
+            else:
+                endsCount = max(textTypeRunCount - 1, 0)  # the last end is the length
+                textTypeMap = TextTypeMap(allTextTypes[textTypesPos:textTypesPos + textTypeRunCount],
+                                          textTypeRunEnds[textTypeRunEndsPos:textTypeRunEndsPos + endsCount],
+                                          textTypeMapLength)
+                textTypesPos += textTypeRunCount
+                textTypeRunEndsPos += endsCount
+                contextStack = stacks[stackIndex] if stackIndex != _NO_CONTEXT_STACK else None
+                lineData = (contextStack, textTypeMap)
+
+            lineRanges = []
+            for i in range(next(rangeIter)):
+                key = (next(rangeIter), next(rangeIter), next(rangeIter))
+                rangeObject = rangeObjects.get(key)
+                if rangeObject is None:
+                    rangeObject = makeRange(key[0], key[1], formats[key[2]])
+                    rangeObjects[key] = rangeObject
+                lineRanges.append(rangeObject)
+
+            lines.append((lineData, lineRanges))
+
+        return lines
@@ -2,6 +2,7 @@
 """
 
 import os.path
+import collections
 import fnmatch
 import json
 import threading
@@ -23,6 +24,8 @@ class TextFormat:
         strikeOut      : Striked out font
         spellChecking  : Text will be spell checked
         textType       : 'c' for comments, 's' for strings, ' ' for other.
+        attributeName  : itemData name from the syntax definition. None for default format
+        defStyleName   : Default style name, i.e. 'dsKeyword'. None for default format
     """
     def __init__(self, color = '#000000',
                        background = '#ffffff',
@@ -42,11 +45,74 @@ class TextFormat:
         self.strikeOut = strikeOut
         self.spellChecking = spellChecking
         self.textType = ' '  # modified later
+        self.attributeName = None  # modified later
+        self.defStyleName = None  # modified later
 
     def __cmp__(self, other):
         return cmp(self.__dict__, other.__dict__)
 
 
+class _LineCache:
+    """LRU cache of highlighting results of lines. Repetitive files (logs, generated code) and undo/redo cycles
+    highlight the same lines many times.
+
+    Key is (parser, line text, context stack of the previous line), value is (lineData, highlightedSegments).
+    Context stacks are interned by the parsers, therefore equal stacks are cheap to compare.
+    Size of the cache is limited by count of lines and by total length of the texts,
+    because size of the results grows with the text. Longer lines are not cached.
+    Results of lines, which exhausted the parsing budget, are not cached, therefore a cached result
+    is the complete highlighting of the line for any budget.
+    The cache is used by the GUI thread and by background threads
+    """
+    def __init__(self, maxSize, maxChars):
+        self.maxSize = maxSize
+        self.maxChars = maxChars
+        self.hits = 0
+        self.misses = 0
+        self._chars = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def size(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return result
+
+    def put(self, key, result):
+        textLength = len(key[1])
+        if textLength > self.maxChars:
+            return
+
+        with self._lock:
+            if key in self._items:  # parsed by other thread
+                return
+            self._items[key] = result
+            self._chars += textLength
+            while len(self._items) > self.maxSize or self._chars > self.maxChars:
+                oldKey, oldResult = self._items.popitem(last=False)
+                self._chars -= len(oldKey[1])
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._chars = 0
+            self.hits = 0
+            self.misses = 0
+
+
+_LINE_CACHE_DEFAULT_SIZE = 4096
+_LINE_CACHE_DEFAULT_CHARS = 1024 * 1024
+_lineCache = _LineCache(_LINE_CACHE_DEFAULT_SIZE, _LINE_CACHE_DEFAULT_CHARS)
+
+
 class Syntax:
     """Syntax. Programming language parser definition
 
@@ -64,6 +130,10 @@ class Syntax:
         indenter        Indenter for the syntax. Possible values are
                             none, normal, cstyle, haskell, lilypond, lisp, python, ruby, xml
                         None, if not set by xml file
+        xmlFileName     Name of the XML definition file
+        formats         List of formats, which are used by the parser. QTextCharFormat, or TextFormat
+                        for headless syntaxes. QTextFormat.UserProperty of QTextCharFormat is
+                        "xmlFileName:index" string
     """
     def __init__(self, manager):
         self.manager = manager
@@ -88,21 +158,43 @@ class Syntax:
 
     def _setParser(self, parser):
         self.parser = parser
-        # performance optimization, avoid 1 function call
-        self.highlightBlock = parser.highlightBlock
-        self.parseBlock = parser.parseBlock
 
-    def highlightBlock(self, text, prevLineData):
+    def highlightBlock(self, text, prevLineData, maxSteps=0, maxTime=0):
         """Parse line of text and return
             (lineData, highlightedSegments)
         where
             lineData is data, which shall be saved and used for parsing next line
             highlightedSegments is list of touples (segmentLength, segmentFormat)
+
+        maxSteps and maxTime (seconds) limit parsing of a long or pathological line. 0 is no limit.
+        A step is a position, at which rules are tried. When the limit is reached, the rest of the line
+        gets the format of the current context, and the next line is parsed as if the line ended there.
+
+        Results are cached, see lineCacheInfo(). Returned objects are shared and must not be modified.
+        Results cut by the limits are not cached
         """
         #self.parser.parseAndPrintBlockTextualResults(text, prevLineData)
-        return self.parser.highlightBlock(text, prevLineData)
+        return self.highlightBlockLimited(text, prevLineData, maxSteps, maxTime)[:2]
 
-    def parseBlock(self, text, prevLineData):
+    def highlightBlockLimited(self, text, prevLineData, maxSteps=0, maxTime=0):
+        """Parse line of text and return
+            (lineData, highlightedSegments, exhausted)
+        exhausted is True, if maxSteps or maxTime is reached and highlighting of the line is cut.
+        See highlightBlock()
+        """
+        cache = _lineCache
+        key = (self.parser, text, prevLineData)
+        result = cache.get(key)
+        if result is not None:
+            return result + (False,)
+
+        lineData, highlightedSegments, exhausted = \
+            self.parser.highlightBlockLimited(text, prevLineData, maxSteps, maxTime)
+        if not exhausted:
+            cache.put(key, (lineData, highlightedSegments))
+        return lineData, highlightedSegments, exhausted
+
+    def parseBlock(self, text, prevLineData, maxSteps=0, maxTime=0):
         """Parse line of text and return
             lineData
         where
@@ -110,9 +202,24 @@ class Syntax:
 
         This is quicker version of highlighBlock, which doesn't return results,
         but only parsers the block and produces data, which is necessary for parsing next line.
-        Use it for invisible lines
+        Use it for invisible lines. Results are not cached. See highlightBlock() for maxSteps and maxTime
+        """
+        return self.parser.parseBlock(text, prevLineData, maxSteps, maxTime)
+
+    def highlightBlockPacked(self, text, prevLineData, buffer, maxSteps=0, maxTime=0):
+        """Parse line of text, fill buffer with highlighted segments and return
+            lineData
+
+        buffer is a bytearray, which shall be reused for lines. It is resized and filled with
+        (start, length, formatIndex) triples of native ints, use memoryview(buffer).cast('i') to read them.
+        formatIndex is an index in the parser.packedFormats list, or -1 for text without a format.
+        The list only grows, therefore indexes are stable. Formats of included syntaxes are there too.
+        The C parser doesn't make Python objects for segments, and the buffer of a line can be compared
+        with the buffer of the previous highlighting as bytes.
+
+        Results are not cached. See highlightBlock() for maxSteps and maxTime
         """
-        return self.parser.parseBlock(text, prevLineData)
+        return self.parser.highlightBlockPacked(text, prevLineData, buffer, maxSteps, maxTime)
 
     def _getTextType(self, lineData, column):
         """Get text type (letter)
@@ -151,7 +258,14 @@ class SyntaxManager:
     """SyntaxManager holds references to loaded Syntax'es and allows to find or
     load Syntax by its name or by source file name
     """
-    def __init__(self):
+    def __init__(self, headless=False, cacheDir=None):
+        """If headless is True, loaded syntaxes do not use PyQt5 and can be used
+        with highlightLines() without QApplication.
+        If cacheDir is set, compiled syntax definitions are saved to the directory
+        and later loaded from it instead of the XML files
+        """
+        self.headless = headless
+        self.cacheDir = cacheDir
         self._loadedSyntaxesLock = threading.RLock()
         self._loadedSyntaxes = {}
         syntaxDbPath = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data", "syntax_db.json")
@@ -177,7 +291,7 @@ class SyntaxManager:
                 xmlFilePath = os.path.join(os.path.dirname(__file__), "data", "xml", xmlFileName)
                 syntax = Syntax(self)
                 self._loadedSyntaxes[xmlFileName] = syntax
-                qutepart.syntax.loader.loadSyntax(syntax, xmlFilePath)
+                qutepart.syntax.loader.loadSyntax(syntax, xmlFilePath, self.headless, self.cacheDir)
 
             return self._loadedSyntaxes[xmlFileName]
 
@@ -258,3 +372,135 @@ class SyntaxManager:
                 pass
 
         return syntax
+
+
+def _stripLineEnd(line):
+    if line.endswith('\n'):
+        line = line[:-1]
+    if line.endswith('\r'):
+        line = line[:-1]
+    return line
+
+
+def highlightLines(lines, syntax, maxSteps=0, maxTime=0):
+    """Highlight lines without Qt. Generator.
+
+    lines is an iterable of strings. Trailing end of line characters are ignored,
+    therefore lines of a text file can be passed directly.
+    syntax must be loaded by SyntaxManager(headless=True)
+    maxSteps and maxTime limit parsing of every line, see Syntax.highlightBlock()
+
+    Yields a list of spans per line. Span is a tuple
+        (start, length, attributeName, defStyleName, textType)
+    Adjacent spans always differ.
+    attributeName and defStyleName are None for text without a format.
+    textType is ' ', 'c', 'b', 'h' or 's'. See Syntax.isCode() and friends.
+
+    Only the context stack of the previous line is kept, therefore memory usage
+    doesn't depend on the count of lines
+    """
+    if not syntax.manager.headless:
+        raise ValueError('highlightLines() requires a syntax loaded by SyntaxManager(headless=True)')
+
+    contextStack = None
+    for line in lines:
+        text = _stripLineEnd(line)
+        lineData, segments = syntax.highlightBlock(text, contextStack, maxSteps, maxTime)
+        if lineData is not None:
+            contextStack, textTypeMap = lineData
+        else:
+            contextStack, textTypeMap = None, ''
+
+        spans = []
+        start = 0
+        for length, format in segments:
+            textType = textTypeMap[start] if start < len(textTypeMap) else ' '
+            if format is not None:
+                style = (format.attributeName, format.defStyleName, textType)
+            else:
+                style = (None, None, textType)
+
+            if spans and spans[-1][2:] == style:  # parser splits text with the same format
+                prevStart, prevLength = spans[-1][:2]
+                spans[-1] = (prevStart, prevLength + length) + style
+            else:
+                spans.append((start, length) + style)
+            start += length
+
+        yield spans
+
+
+def dynamicRegExpCacheInfo():
+    """Get (hits, misses, size, maxSize) of the LRU cache of compiled patterns of dynamic RegExpr rules.
+    A rule searches the cache once per context stack frame. Counters are shared by all syntaxes
+    """
+    import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
+    return qutepart.syntax.loader._parserModule.dynamicRegExpCacheInfo()
+
+
+def clearDynamicRegExpCache():
+    """Clear the cache of compiled patterns of dynamic RegExpr rules and reset counters
+    """
+    import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
+    qutepart.syntax.loader._parserModule.clearDynamicRegExpCache()
+
+
+def lineCacheInfo():
+    """Get (hits, misses, size, maxSize) of the LRU cache of highlighting results of lines.
+    The cache is shared by all syntaxes
+    """
+    cache = _lineCache
+    return cache.hits, cache.misses, cache.size(), cache.maxSize
+
+
+def setLineCacheSize(maxSize, maxChars=_LINE_CACHE_DEFAULT_CHARS):
+    """Set maximum count of lines in the cache of highlighting results and maximum total length of
+    their texts. 0 disables the cache. The cache is cleared
+    """
+    global _lineCache
+    _lineCache = _LineCache(maxSize, maxChars)
+
+
+def clearLineCache():
+    """Clear the cache of highlighting results of lines and reset counters
+    """
+    _lineCache.clear()
+
+
+def setProfilingEnabled(enabled):
+    """Enable or disable profiling of syntax definitions.
+    Parsers count trials, matches and time of rules and time of contexts. Highlighting is slower while
+    profiling is enabled. Lines, found in the line cache, are not parsed. See setLineCacheSize()
+    """
+    import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
+    qutepart.syntax.loader._parserModule.setProfilingEnabled(enabled)
+
+
+def profileInfo():
+    """Get (contextProfiles, ruleProfiles) since the profile was cleared. The slowest are the first.
+
+    contextProfiles is a list of (xmlFileName, contextName, blocks, time)
+    ruleProfiles is a list of (xmlFileName, contextName, ruleId, trials, matches, time)
+    time is in seconds. contextName is the context, which contains the rule in the XML file.
+    ruleId is rule.shortId().
+
+    Time of IncludeRules, Int and Float includes time of the rules tried by them. The C parser profiles
+    these nested rules too. The Python parser profiles fused rules as one FusedRules rule
+    """
+    import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
+    contexts, rules = qutepart.syntax.loader._parserModule.profileInfo()
+
+    contextProfiles = [(context.parser.syntax.xmlFileName, context.name, blocks, time) \
+                            for context, blocks, time in contexts]
+    ruleProfiles = [(context.parser.syntax.xmlFileName, context.name, rule.shortId(), trials, matches, time) \
+                        for rule, context, trials, matches, time in rules]
+
+    return (sorted(contextProfiles, key=lambda profile: profile[-1], reverse=True),
+            sorted(ruleProfiles, key=lambda profile: profile[-1], reverse=True))
+
+
+def clearProfile():
+    """Reset counters of profiling of syntax definitions
+    """
+    import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
+    qutepart.syntax.loader._parserModule.clearProfile()
@@ -0,0 +1,231 @@
+"""Bulk highlighting of file trees in a process pool, and of texts in a thread pool.
+
+Qt is not used. Each worker process has its own headless SyntaxManager,
+therefore syntax definitions are loaded once per worker, not once per file.
+Threads share syntaxes. The C parser parses lines without the GIL, therefore threads run in parallel
+"""
+
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import os.path
+
+from qutepart.syntax import SyntaxManager, highlightLines
+import qutepart.syntax.export
+
+
+_FILES_PER_TASK = 16  # reduces interprocess communication overhead for small files
+_TASKS_PER_WORKER_IN_FLIGHT = 4  # memory usage doesn't depend on count of files
+_MAX_LINE_PARSING_TIME_SEC = 1.  # a pathological line of one file doesn't stall a worker
+
+_workerSyntaxManager = None
+
+
+def _initWorker():
+    global _workerSyntaxManager
+    _workerSyntaxManager = SyntaxManager(headless=True)
+
+
+def _splitLines(text):
+    lines = text.split('\n')
+    if lines[-1] == '':  # text after the last line end
+        lines.pop()
+    return lines
+
+
+def _errorMessage(ex):
+    return '{}: {}'.format(type(ex).__name__, ex)
+
+
+def _highlightFile(path, maxSteps, maxTime):
+    """Highlight a file in a worker process. See highlightFiles() for the result.
+    An exception is reported as the error of the file, other files of the task are highlighted
+    """
+    try:
+        with open(path, encoding='utf-8', errors='replace') as sourceFile:
+            lines = _splitLines(sourceFile.read())
+
+        syntax = _workerSyntaxManager.getSyntax(sourceFilePath=path,
+                                                firstLine=lines[0] if lines else None)
+        if syntax is None:
+            return {'path': path, 'syntax': None}
+
+        return {'path': path,
+                'syntax': syntax.name,
+                'lines': list(highlightLines(lines, syntax, maxSteps, maxTime))}
+    except Exception as ex:
+        return {'path': path, 'error': _errorMessage(ex)}
+
+
+def _exportFile(task):
+    """Export a file in a worker process. See exportFiles() for the result
+    """
+    path, outPath, outFormat = task
+    try:
+        with open(path, encoding='utf-8', errors='replace') as sourceFile:
+            firstLine = sourceFile.readline()
+            syntax = _workerSyntaxManager.getSyntax(sourceFilePath=path, firstLine=firstLine.rstrip('\r\n'))
+            if syntax is None:
+                return {'path': path, 'syntax': None}
+
+            sourceFile.seek(0)
+            os.makedirs(os.path.dirname(outPath) or '.', exist_ok=True)
+            with open(outPath, 'w', encoding='utf-8') as outFile:
+                if outFormat == 'html':
+                    qutepart.syntax.export.exportHtml(sourceFile, syntax, outFile)
+                else:
+                    qutepart.syntax.export.exportAnsi(sourceFile, syntax, outFile)
+    except Exception as ex:
+        return {'path': path, 'error': _errorMessage(ex)}
+
+    return {'path': path, 'syntax': syntax.name, 'output': outPath}
+
+
+def _exportFiles(tasks):
+    return [_exportFile(task) for task in tasks]
+
+
+def _highlightFiles(maxSteps, maxTime, paths):
+    return [_highlightFile(path, maxSteps, maxTime) for path in paths]
+
+
+def _highlightFilesAsJson(maxSteps, maxTime, paths):
+    """Serialization to JSON is done in a worker too
+    """
+    return [json.dumps(_highlightFile(path, maxSteps, maxTime)) for path in paths]
+
+
+def iterFiles(paths):
+    """Generator. Walk directories recursively and yield file paths.
+    Paths of files are yielded as is
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames.sort()
+                for fileName in sorted(fileNames):
+                    yield os.path.join(dirPath, fileName)
+        else:
+            yield path
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _highlightTexts(syntax, texts):
+    """Highlight texts in a worker thread. See highlightTexts() for the result
+    """
+    return [list(highlightLines(_splitLines(text), syntax)) for text in texts]
+
+
+def _runInPool(function, tasks, jobs, threads=False):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if threads:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        tasksPerChunk = 1  # no interprocess communication
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_initWorker)
+        tasksPerChunk = _FILES_PER_TASK
+    maxFuturesInFlight = jobs * _TASKS_PER_WORKER_IN_FLIGHT
+    futures = collections.deque()
+    try:
+        for chunk in _chunks(tasks, tasksPerChunk):
+            futures.append(executor.submit(function, chunk))
+            if len(futures) >= maxFuturesInFlight:
+                yield from futures.popleft().result()
+
+        while futures:
+            yield from futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def highlightFiles(paths, jobs=None, maxSteps=0, maxTime=_MAX_LINE_PARSING_TIME_SEC):
+    """Generator. Detect syntax and highlight files in parallel processes.
+
+    paths is an iterable of file and directory paths. Directories are walked recursively.
+    jobs is a count of worker processes. Count of CPUs by default.
+    maxSteps and maxTime limit parsing of every line, see Syntax.highlightBlock(). 0 is no limit
+
+    Yields a dict per file in the order of paths. Keys:
+        path    File path
+        syntax  Syntax name, None if not detected
+        lines   List of span lists as returned by highlightLines(). Not set if syntax is None
+        error   Error message if the file can not be read or highlighted. Other keys except path are not set
+    """
+    return _runInPool(functools.partial(_highlightFiles, maxSteps, maxTime), iterFiles(paths), jobs)
+
+
+def highlightFilesAsJsonLines(paths, jobs=None, maxSteps=0, maxTime=_MAX_LINE_PARSING_TIME_SEC):
+    """Same as highlightFiles(), but yields dicts serialized to JSON strings without line end.
+    Serialization is done in worker processes
+    """
+    return _runInPool(functools.partial(_highlightFilesAsJson, maxSteps, maxTime), iterFiles(paths), jobs)
+
+
+def highlightTexts(texts, syntax, jobs=None):
+    """Generator. Highlight texts in parallel threads.
+
+    texts is an iterable of strings: documents, or chunks of a document, which start in the default context
+    of the syntax. syntax must be loaded by SyntaxManager(headless=True). It is shared by the threads.
+    jobs is a count of threads. Count of CPUs by default.
+
+    Yields a list of span lists per text, as returned by highlightLines(), in the order of texts.
+
+    Threads run in parallel, if the C parser is used and profiling is disabled.
+    Unlike highlightFiles(), syntax definitions are loaded once and results are not sent between processes
+    """
+    if not syntax.manager.headless:
+        raise ValueError('highlightTexts() requires a syntax loaded by SyntaxManager(headless=True)')
+
+    return _runInPool(functools.partial(_highlightTexts, syntax), texts, jobs, threads=True)
+
+
+_EXPORT_EXTENSIONS = {'html': '.html', 'ansi': '.ansi'}
+
+
+def _exportTasks(paths, outDirPath, outFormat):
+    """Generator. Yield (source path, output path, format).
+    Files in directories are exported with paths relative to the directory
+    """
+    extension = _EXPORT_EXTENSIONS[outFormat]
+    for path in paths:
+        if os.path.isdir(path):
+            for filePath in iterFiles([path]):
+                yield filePath, os.path.join(outDirPath, os.path.relpath(filePath, path)) + extension, outFormat
+        else:
+            yield path, os.path.join(outDirPath, os.path.basename(path)) + extension, outFormat
+
+
+def exportFiles(paths, outDirPath, outFormat='html', jobs=None):
+    """Generator. Export files to HTML or ANSI colored text in parallel processes.
+    See qutepart.syntax.export
+
+    paths is an iterable of file and directory paths. Directories are walked recursively.
+    outFormat is 'html' or 'ansi'. Output file name is the source file name with .html or .ansi extension.
+    jobs is a count of worker processes. Count of CPUs by default.
+
+    Yields a dict per file in the order of paths. Keys:
+        path    File path
+        syntax  Syntax name, None if not detected. The file is not exported
+        output  Output file path. Not set if syntax is None
+        error   Error message if the file can not be read, highlighted or written.
+                Other keys except path are not set
+    """
+    if outFormat not in _EXPORT_EXTENSIONS:
+        raise ValueError('Unknown export format ' + outFormat)
+
+    return _runInPool(_exportFiles, _exportTasks(paths, outDirPath, outFormat), jobs)
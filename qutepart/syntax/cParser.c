@@ -19,13 +19,25 @@
 
 
 #include <stdio.h>
+#include <time.h>
 
-// Allow the PCRE's config.h to set options used by pcre.h below.
-#ifdef HAVE_PCRE_CONFIG_H
-    #include "config.h"
+#ifdef _WIN32
+    #include <windows.h>
 #endif
 
-#include <pcre.h>
+/* setup.py defines QUTEPART_PCRE2, if PCRE2 is found. Otherwise the legacy PCRE is used.
+   See "Regular expressions" section */
+#ifdef QUTEPART_PCRE2
+    #define PCRE2_CODE_UNIT_WIDTH 8
+    #include <pcre2.h>
+#else
+    // Allow the PCRE's config.h to set options used by pcre.h below.
+    #ifdef HAVE_PCRE_CONFIG_H
+        #include "config.h"
+    #endif
+
+    #include <pcre.h>
+#endif
 
 
 #define UNICODE_CHECK(OBJECT, RET) \
@@ -181,6 +193,9 @@
         {"tryMatch", (PyCFunction)AbstractRule_tryMatch, METH_VARARGS, \
          "Try to parse a fragment of text" \
         }, \
+        {"shortId", (PyCFunction)RULE_TYPE_NAME##_shortId, METH_NOARGS, \
+         "Get short ID string of the rule. Used for logs and profiling" \
+        }, \
         {NULL}  /* Sentinel */ \
     }; \
  \
@@ -195,11 +210,33 @@
 typedef long long int _StringHash;
 
 #define QUTEPART_MAX_CONTEXT_STACK_DEPTH 128
+#define QUTEPART_MAX_LINE_END_SWITCHES 128  /* lineEndContext of some definitions make a cycle */
+
+#define QUTEPART_DISPATCH_TABLE_SIZE 128  // contexts select rules by the first character, if it is ASCII
+
+/* Lines are parsed without the GIL. Structures, which are shared by threads, use atomic reference counters.
+ * See "Parser" section
+ */
+#ifdef _WIN32
+    typedef volatile LONG _AtomicCounter;
+    typedef volatile LONG _AtomicFlag;
+    #define QUTEPART_ATOMIC_INCREMENT(pCounter) InterlockedIncrement(pCounter)
+    #define QUTEPART_ATOMIC_DECREMENT(pCounter) InterlockedDecrement(pCounter)  /* returns the new value */
+    #define QUTEPART_ATOMIC_LOAD(pFlag) (*(pFlag))  /* volatile access has acquire and release semantics */
+    #define QUTEPART_ATOMIC_STORE(pFlag, value) (*(pFlag) = (value))
+#else
+    typedef unsigned int _AtomicCounter;
+    typedef int _AtomicFlag;
+    #define QUTEPART_ATOMIC_INCREMENT(pCounter) __atomic_add_fetch(pCounter, 1, __ATOMIC_SEQ_CST)
+    #define QUTEPART_ATOMIC_DECREMENT(pCounter) __atomic_sub_fetch(pCounter, 1, __ATOMIC_SEQ_CST)
+    #define QUTEPART_ATOMIC_LOAD(pFlag) __atomic_load_n(pFlag, __ATOMIC_ACQUIRE)
+    #define QUTEPART_ATOMIC_STORE(pFlag, value) __atomic_store_n(pFlag, value, __ATOMIC_RELEASE)
+#endif
 
 typedef struct {
     size_t size;
     const char** data;
-    unsigned int refCount;
+    _AtomicCounter refCount;
 } _RegExpMatchGroups;
 
 typedef struct {
@@ -220,13 +257,23 @@ typedef struct {
     bool firstNonSpace;
     bool dynamic;
     unsigned int column;
+    bool firstCharsKnown;
+    bool firstChars[QUTEPART_DISPATCH_TABLE_SIZE];  // a match might start with the character
 } AbstractRuleParams;
 
 
+/* Profiling counters of a rule or a context. See setProfilingEnabled() */
+typedef struct {
+    unsigned long count;  // trials of a rule, parsed blocks of a context
+    unsigned long matches;
+    double time;  // seconds
+} _ProfileCounters;
+
 #define AbstractRule_HEAD \
     PyObject_HEAD \
     AbstractRuleParams* abstractRuleParams; \
-    void* _tryMatch;  // _tryMatchFunctionType
+    void* _tryMatch;  /* _tryMatchFunctionType */ \
+    _ProfileCounters profile;
 
 typedef struct {
     AbstractRule_HEAD
@@ -254,6 +301,14 @@ typedef struct {
     PyObject* wholeLineUnicodeTextLower;
     PyObject* wholeLineUtf8Text;
     PyObject* wholeLineUtf8TextLower;
+    /* Buffers of the objects above. Rules use only them, because they are called without the GIL */
+    Py_UNICODE* wholeLineUnicodeBuffer;
+    Py_UNICODE* wholeLineUnicodeBufferLower;
+    const char* wholeLineUtf8Buffer;
+    const char* wholeLineUtf8BufferLower;
+    size_t wholeLineUtf8Len;
+    void* regExpMatchData;  // _RegExpMatchData*
+    bool profiling;
     Py_UNICODE* unicodeText;
     Py_UNICODE* unicodeTextLower;
     const char* utf8Text;
@@ -289,22 +344,38 @@ typedef struct {
     PyObject* rulesPython;
     AbstractRule** rulesC;
     size_t rulesSize;
+    PyObject* flatRulesPython;  // rules, IncludeRules are replaced with rules of included contexts. NULL if not made yet
+    AbstractRule** flatRulesC;
+    size_t flatRulesSize;
+    AbstractRule** dispatchRules;  // rulesForChar items point to this array
+    AbstractRule** rulesForChar[QUTEPART_DISPATCH_TABLE_SIZE];
+    size_t rulesForCharSize[QUTEPART_DISPATCH_TABLE_SIZE];
+    _AtomicFlag dispatchTableMade;  // is read without the GIL. Set when the fields above are ready
     bool dynamic;
     Py_UNICODE textType;
     PyObject* textTypePython;
+    _ProfileCounters profile;
 } Context;
 
-typedef struct {
+/* Context stack is immutable. It is a linked list of frames, therefore stacks share tails.
+ * Stacks are interned. Equal stacks are the same object
+ */
+typedef struct _ContextStack {
     PyObject_HEAD
-    Context* _contexts[QUTEPART_MAX_CONTEXT_STACK_DEPTH];
-    _RegExpMatchGroups* _data[QUTEPART_MAX_CONTEXT_STACK_DEPTH];
+    struct _ContextStack* _parent;  // stack without the top frame. NULL for the bottom frame
+    Context* _context;
+    _RegExpMatchGroups* _data;
     size_t _size;
+    size_t _hash;
+    struct _ContextStack* _nextInterned;  // next stack in the intern table bucket
 } ContextStack;
 
 #define DELIMINATOR_SET_CACHE_SIZE 128
 
 typedef struct {
     PyObject* setAsUnicodeString;
+    Py_UNICODE* characters;  // buffer of setAsUnicodeString. Is read without the GIL
+    Py_ssize_t size;
     bool cache[DELIMINATOR_SET_CACHE_SIZE];
 } DeliminatorSet;
 
@@ -319,16 +390,19 @@ typedef struct {
     Context* defaultContext;
     ContextStack* defaultContextStack;
     bool debugOutputEnabled;
+    PyObject* packedFormats;  /* list. Format table of highlightBlockPacked() */
 } Parser;
 
 
 /********************************************************************************
  *                                _RegExpMatchGroups
  ********************************************************************************/
+/* Groups are made and released while the GIL is released. Therefore the raw memory allocator is used
+ */
 static _RegExpMatchGroups*
 _RegExpMatchGroups_new(size_t size, const char** data)
 {
-    _RegExpMatchGroups* self = PyMem_Malloc(sizeof *self);
+    _RegExpMatchGroups* self = PyMem_RawMalloc(sizeof *self);
     self->refCount = 1;
     self->size = size;
     self->data = data;
@@ -342,12 +416,10 @@ _RegExpMatchGroups_release(_RegExpMatchGroups* self)
     if (NULL == self)
         return;
 
-    self->refCount--;
-
-    if (0 == self->refCount)
+    if (0 == QUTEPART_ATOMIC_DECREMENT(&self->refCount))
     {
-        pcre_free((void*)self->data);
-        PyMem_Free(self);
+        PyMem_RawFree((void*)self->data);
+        PyMem_RawFree(self);
     }
 }
 
@@ -355,7 +427,7 @@ static _RegExpMatchGroups*
 _RegExpMatchGroups_duplicate(_RegExpMatchGroups* self)
 {
     if (NULL != self)
-        self->refCount++;
+        QUTEPART_ATOMIC_INCREMENT(&self->refCount);
     return self;
 }
 
@@ -374,6 +446,46 @@ _RegExpMatchGroups_getItem(_RegExpMatchGroups* self, unsigned int index)
     return self->data[index];
 }
 
+#define QUTEPART_REG_EXP_GROUP_UNSET ((size_t)-1)
+
+/* Make match groups from byte offsets of groups in the subject.
+ * Groups, which are not set, are empty strings.
+ * Memory layout is NULL-terminated array of pointers followed by the strings
+ */
+static _RegExpMatchGroups*
+_RegExpMatchGroups_fromMatch(const char* subject, const size_t* ovector, size_t size)
+{
+    size_t bufferSize = (size + 1) * sizeof(char*);
+    const char** data;
+    char* string;
+    size_t i;
+
+    for (i = 0; i < size; i++)
+    {
+        if (QUTEPART_REG_EXP_GROUP_UNSET != ovector[i * 2])
+            bufferSize += ovector[i * 2 + 1] - ovector[i * 2];
+        bufferSize += 1;
+    }
+
+    data = (const char**)PyMem_RawMalloc(bufferSize);
+    string = (char*)(data + size + 1);
+    for (i = 0; i < size; i++)
+    {
+        size_t length = 0;
+        if (QUTEPART_REG_EXP_GROUP_UNSET != ovector[i * 2])
+        {
+            length = ovector[i * 2 + 1] - ovector[i * 2];
+            memcpy(string, subject + ovector[i * 2], length);
+        }
+        string[length] = '\0';
+        data[i] = string;
+        string += length + 1;
+    }
+    data[size] = NULL;
+
+    return _RegExpMatchGroups_new(size, data);
+}
+
 /********************************************************************************
  *                                _listToDynamicallyAllocatedArray
  ********************************************************************************/
@@ -396,15 +508,12 @@ _listToDynamicallyAllocatedArray(PyObject* list, size_t* size)
  *                                DeliminatorSet
  ********************************************************************************/
 static bool
-_isDeliminatorNoCache(Py_UNICODE character, PyObject* setAsUnicodeString)
+_isDeliminatorNoCache(Py_UNICODE character, DeliminatorSet* deliminatorSet)
 {
-    Py_ssize_t deliminatorSetLen = PyUnicode_GET_SIZE(setAsUnicodeString);
     Py_ssize_t i;
 
-    Py_UNICODE* deliminatorSetUnicode = PyUnicode_AS_UNICODE(setAsUnicodeString);
-
-    for(i = 0; i < deliminatorSetLen; i++)
-        if (deliminatorSetUnicode[i] == character)
+    for(i = 0; i < deliminatorSet->size; i++)
+        if (deliminatorSet->characters[i] == character)
             return true;
 
     return false;
@@ -416,7 +525,7 @@ _isDeliminator(Py_UNICODE character, DeliminatorSet* deliminatorSet)
     if (character < DELIMINATOR_SET_CACHE_SIZE)
         return deliminatorSet->cache[character];
     else
-        return _isDeliminatorNoCache(character, deliminatorSet->setAsUnicodeString);
+        return _isDeliminatorNoCache(character, deliminatorSet);
 }
 
 static DeliminatorSet
@@ -424,11 +533,14 @@ _MakeDeliminatorSet(PyObject* setAsUnicodeString)
 {
     DeliminatorSet deliminatorSet;
     unsigned int i;
-    for (i = 0; i < DELIMINATOR_SET_CACHE_SIZE; i++)
-        deliminatorSet.cache[i] = _isDeliminatorNoCache(i, setAsUnicodeString);
 
     deliminatorSet.setAsUnicodeString = setAsUnicodeString;
     Py_INCREF(deliminatorSet.setAsUnicodeString);
+    deliminatorSet.characters = PyUnicode_AS_UNICODE(setAsUnicodeString);
+    deliminatorSet.size = PyUnicode_GET_SIZE(setAsUnicodeString);
+
+    for (i = 0; i < DELIMINATOR_SET_CACHE_SIZE; i++)
+        deliminatorSet.cache[i] = _isDeliminatorNoCache(i, &deliminatorSet);
 
     return deliminatorSet;
 }
@@ -472,11 +584,12 @@ AbstractRuleParams_init(AbstractRuleParams *self, PyObject *args, PyObject *kwds
     PyObject* lookAhead = NULL;
     PyObject* firstNonSpace = NULL;
     PyObject* dynamic = NULL;
+    PyObject* firstChars = NULL;
 
-    if (! PyArg_ParseTuple(args, "|OOOOOOOOi",
+    if (! PyArg_ParseTuple(args, "|OOOOOOOOiO",
                            &parentContext, &format, &textType, &attribute,
                            &context, &lookAhead, &firstNonSpace, &dynamic,
-                           &self->column))
+                           &self->column, &firstChars))
         return -1;
 
     // parentContext is not checked because of cross-dependencies
@@ -500,6 +613,21 @@ AbstractRuleParams_init(AbstractRuleParams *self, PyObject *args, PyObject *kwds
     ASSIGN_BOOL_FIELD(firstNonSpace);
     ASSIGN_BOOL_FIELD(dynamic);
 
+    self->firstCharsKnown = NULL != firstChars && Py_None != firstChars;
+    if (self->firstCharsKnown)
+    {
+        Py_UNICODE* firstCharsUnicode;
+        Py_ssize_t i;
+
+        UNICODE_CHECK(firstChars, -1);
+        firstCharsUnicode = PyUnicode_AS_UNICODE(firstChars);
+        for (i = 0; i < PyUnicode_GET_SIZE(firstChars); i++)
+        {
+            if (firstCharsUnicode[i] < QUTEPART_DISPATCH_TABLE_SIZE)
+                self->firstChars[firstCharsUnicode[i]] = true;
+        }
+    }
+
     return 0;
 }
 
@@ -570,6 +698,23 @@ _utf8CharacterLengthTable_init(void)
         _utf8CharacterLengthTable[i] = _utf8TextCharacterLength(i);
 }
 
+static void* _RegExpMatchData_new(void);  // see "Regular expressions" section
+static void _RegExpMatchData_free(void* matchData);
+
+/* Reset the state, which depends on the context, before parsing a block of the line in a context.
+ * The position is kept. TextToMatchObject_internal_update() moves it forward
+ */
+static void
+TextToMatchObject_internal_reset(TextToMatchObject_internal* self, _RegExpMatchGroups* contextData)
+{
+    self->firstNonSpace = true;  // updated in the loop
+    // isWordStart, wordLength is updated in the loop
+    self->isWordStart = true;
+    self->contextData = contextData;
+}
+
+/* Make the object once per line, while the GIL is held. Then it is moved along the line without the GIL
+ */
 static TextToMatchObject_internal
 TextToMatchObject_internal_make(unsigned int column, PyObject* unicodeText, _RegExpMatchGroups* contextData)
 {
@@ -581,16 +726,19 @@ TextToMatchObject_internal_make(unsigned int column, PyObject* unicodeText, _Reg
     textToMatchObject.wholeLineUnicodeTextLower = PyObject_CallMethod(unicodeText, "lower", "");
     textToMatchObject.wholeLineUtf8Text = PyUnicode_AsUTF8String(unicodeText);
     textToMatchObject.wholeLineUtf8TextLower = PyUnicode_AsUTF8String(textToMatchObject.wholeLineUnicodeTextLower);
-    textToMatchObject.utf8Text = PyBytes_AsString(textToMatchObject.wholeLineUtf8Text);
-    textToMatchObject.utf8TextLower = PyBytes_AsString(textToMatchObject.wholeLineUtf8TextLower);
+    textToMatchObject.wholeLineUnicodeBuffer = PyUnicode_AS_UNICODE(unicodeText);
+    textToMatchObject.wholeLineUnicodeBufferLower = PyUnicode_AS_UNICODE(textToMatchObject.wholeLineUnicodeTextLower);
+    textToMatchObject.wholeLineUtf8Buffer = PyBytes_AsString(textToMatchObject.wholeLineUtf8Text);
+    textToMatchObject.wholeLineUtf8BufferLower = PyBytes_AsString(textToMatchObject.wholeLineUtf8TextLower);
+    textToMatchObject.wholeLineUtf8Len = PyBytes_GET_SIZE(textToMatchObject.wholeLineUtf8Text);
+    textToMatchObject.regExpMatchData = _RegExpMatchData_new();
+    textToMatchObject.profiling = false;
 
     // text and textLen is updated in the loop
+    textToMatchObject.utf8Text = textToMatchObject.wholeLineUtf8Buffer;
+    textToMatchObject.utf8TextLower = textToMatchObject.wholeLineUtf8BufferLower;
     textToMatchObject.textLen = textToMatchObject.wholeLineLen;
-    textToMatchObject.firstNonSpace = true;  // updated in the loop
-    // isWordStart, wordLength is updated in the loop
-    textToMatchObject.firstNonSpace = true;
-    textToMatchObject.isWordStart = true;
-    textToMatchObject.contextData = contextData;
+    TextToMatchObject_internal_reset(&textToMatchObject, contextData);
 
     return textToMatchObject;
 }
@@ -601,6 +749,7 @@ TextToMatchObject_internal_free(TextToMatchObject_internal* self)
     Py_XDECREF(self->wholeLineUnicodeTextLower);
     Py_XDECREF(self->wholeLineUtf8Text);
     Py_XDECREF(self->wholeLineUtf8TextLower);
+    _RegExpMatchData_free(self->regExpMatchData);
 }
 
 static void
@@ -611,8 +760,8 @@ TextToMatchObject_internal_update(TextToMatchObject_internal* self,
     unsigned int i;
     unsigned int prevTextLen;
     unsigned int step;
-    Py_UNICODE* wholeLineUnicodeBuffer = PyUnicode_AS_UNICODE(self->wholeLineUnicodeText);
-    Py_UNICODE* wholeLineUnicodeBufferLower = PyUnicode_AS_UNICODE(self->wholeLineUnicodeTextLower);
+    Py_UNICODE* wholeLineUnicodeBuffer = self->wholeLineUnicodeBuffer;
+    Py_UNICODE* wholeLineUnicodeBufferLower = self->wholeLineUnicodeBufferLower;
 
    // update text, textLen, column
     self->unicodeText = wholeLineUnicodeBuffer + currentColumnIndex;
@@ -763,7 +912,7 @@ TextToMatchObject_init(TextToMatchObject*self, PyObject *args, PyObject *kwds)
             memsize += PyBytes_Size(utf8String) + 1; // + null char
             Py_XDECREF(utf8String);
         }
-        data = pcre_malloc(memsize);
+        data = PyMem_RawMalloc(memsize);
 
         freeSpaceForString = data + ((size + 1) * sizeof(char*));
         charPointers = (const char**)data;
@@ -800,6 +949,141 @@ TextToMatchObject_init(TextToMatchObject*self, PyObject *args, PyObject *kwds)
 DECLARE_TYPE(TextToMatchObject, NULL, "Rule.tryMatch() input parameter");
 
 
+/********************************************************************************
+ *                                Time
+ ********************************************************************************/
+static double
+_monotonicTime(void)  // seconds
+{
+#ifdef _WIN32
+    LARGE_INTEGER frequency;
+    LARGE_INTEGER counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart / (double)frequency.QuadPart;
+#else
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+#endif
+}
+
+
+/********************************************************************************
+ *                                GIL
+ ********************************************************************************/
+/* Parser_parseBlock_internal() releases the GIL, while a line is parsed. Rules and contexts don't touch
+ * Python objects. Rare code, which needs them, acquires the GIL temporarily with these functions.
+ * threadState is NULL, if the parser holds the GIL
+ */
+static void
+_acquireGil(PyThreadState* threadState)
+{
+    if (NULL != threadState)
+        PyEval_RestoreThread(threadState);
+}
+
+static void
+_releaseGil(PyThreadState* threadState)
+{
+    if (NULL != threadState)
+        PyEval_SaveThread();  // returns threadState
+}
+
+
+/********************************************************************************
+ *                                Line budget
+ ********************************************************************************/
+/* Limit of steps and time of parsing of a line. A step is a position, at which rules of a context are tried.
+ * Time is checked every QUTEPART_BUDGET_TIME_CHECK_INTERVAL_STEPS steps
+ */
+#define QUTEPART_BUDGET_TIME_CHECK_INTERVAL_STEPS 16
+
+typedef struct {
+    unsigned long stepsLeft;  // 0 if not limited
+    double endTime;  // 0 if not limited
+    unsigned int stepsToTimeCheck;
+    bool exhausted;
+} _LineBudget;
+
+static void
+_LineBudget_init(_LineBudget* self, unsigned long maxSteps, double maxTime)
+{
+    self->stepsLeft = maxSteps;
+    self->endTime = maxTime > 0 ? _monotonicTime() + maxTime : 0;
+    self->stepsToTimeCheck = QUTEPART_BUDGET_TIME_CHECK_INTERVAL_STEPS;
+    self->exhausted = false;
+}
+
+static bool
+_LineBudget_step(_LineBudget* self)  // returns true, if the budget is exhausted
+{
+    if (self->stepsLeft > 0)
+    {
+        self->stepsLeft--;
+        if (0 == self->stepsLeft)
+            self->exhausted = true;
+    }
+
+    if (self->endTime > 0)
+    {
+        self->stepsToTimeCheck--;
+        if (0 == self->stepsToTimeCheck)
+        {
+            self->stepsToTimeCheck = QUTEPART_BUDGET_TIME_CHECK_INTERVAL_STEPS;
+            if (_monotonicTime() >= self->endTime)
+                self->exhausted = true;
+        }
+    }
+
+    return self->exhausted;
+}
+
+
+/********************************************************************************
+ *                                Profiling
+ ********************************************************************************/
+/* Rules and contexts, which have been profiled since the profile was cleared, are kept in lists.
+ * Counters are stored in the objects
+ */
+static bool _profilingEnabled = false;
+static PyObject* _profiledRules = NULL;
+static PyObject* _profiledContexts = NULL;
+
+static void
+_profileAdd(PyObject** pProfiledObjects, PyObject* object, _ProfileCounters* counters,
+            bool matched, double startTime)
+{
+    if (0 == counters->count)
+    {
+        if (NULL == *pProfiledObjects)
+            *pProfiledObjects = PyList_New(0);
+
+        if (NULL == *pProfiledObjects ||
+            0 != PyList_Append(*pProfiledObjects, object))
+        {
+            PyErr_Print();
+            return;
+        }
+    }
+
+    counters->count++;
+    if (matched)
+        counters->matches++;
+    counters->time += _monotonicTime() - startTime;
+}
+
+static PyObject*
+setProfilingEnabled(PyObject* self, PyObject* enabled)
+{
+    int isTrue = PyObject_IsTrue(enabled);
+    if (-1 == isTrue)
+        return NULL;
+
+    _profilingEnabled = isTrue;
+    Py_RETURN_NONE;
+}
+
 /********************************************************************************
  *                                Rules
  ********************************************************************************/
@@ -853,7 +1137,7 @@ RuleTryMatchResult_internal_free(RuleTryMatchResult_internal* self)
 }
 
 static RuleTryMatchResult_internal
-AbstractRule_tryMatch_internal(AbstractRule* self, TextToMatchObject_internal* textToMatchObject)
+AbstractRule_tryMatchNotProfiled(AbstractRule* self, TextToMatchObject_internal* textToMatchObject)
 {
     // Skip if column doesn't match
     if (self->abstractRuleParams->column != -1 &&
@@ -867,6 +1151,21 @@ AbstractRule_tryMatch_internal(AbstractRule* self, TextToMatchObject_internal* t
     return ((_tryMatchFunctionType)self->_tryMatch)((PyObject*)self, textToMatchObject);
 }
 
+static RuleTryMatchResult_internal
+AbstractRule_tryMatch_internal(AbstractRule* self, TextToMatchObject_internal* textToMatchObject)
+{
+    double startTime;
+    RuleTryMatchResult_internal result;
+
+    if ( ! textToMatchObject->profiling)
+        return AbstractRule_tryMatchNotProfiled(self, textToMatchObject);
+
+    startTime = _monotonicTime();
+    result = AbstractRule_tryMatchNotProfiled(self, textToMatchObject);
+    _profileAdd(&_profiledRules, (PyObject*)self, &self->profile, NULL != result.rule, startTime);
+    return result;
+}
+
 
 static Context*
 AbstractRule_parentContext(AbstractRuleParams* params)
@@ -983,6 +1282,7 @@ AbstractRule_tryMatch(AbstractRule* self, PyObject *args, PyObject *kwds)
 
     TYPE_CHECK(textToMatchObject, TextToMatchObject, NULL);
 
+    textToMatchObject->internal.profiling = _profilingEnabled;
     internalResult = AbstractRule_tryMatch_internal(self, &(textToMatchObject->internal));
 
     if (NULL == internalResult.rule)
@@ -1074,6 +1374,12 @@ DetectChar_init(DetectChar *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+DetectChar_shortId(DetectChar* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("DetectChar(%s, %u)", self->utf8Char, self->index);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(DetectChar);
 
 
@@ -1131,6 +1437,12 @@ Detect2Chars_init(Detect2Chars *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+Detect2Chars_shortId(Detect2Chars* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("Detect2Chars(%c%c)", (int)self->char_, (int)self->char1_);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(Detect2Chars);
 
 
@@ -1141,6 +1453,8 @@ typedef struct {
     AbstractRule_HEAD
     /* Type-specific fields go here. */
     PyObject* string;
+    Py_UNICODE* characters;  // buffer of string
+    Py_ssize_t size;
 } AnyChar;
 
 
@@ -1154,13 +1468,11 @@ static RuleTryMatchResult_internal
 AnyChar_tryMatch(AnyChar* self, TextToMatchObject_internal* textToMatchObject)
 {
     Py_ssize_t i;
-    Py_ssize_t size = PyUnicode_GET_SIZE(self->string);
-    Py_UNICODE* unicode = PyUnicode_AS_UNICODE(self->string);
     Py_UNICODE char_ = textToMatchObject->unicodeText[0];
 
-    for (i = 0; i < size; i++)
+    for (i = 0; i < self->size; i++)
     {
-        if (unicode[i] == char_)
+        if (self->characters[i] == char_)
             return MakeTryMatchResult(self, 1, NULL);
     }
 
@@ -1183,10 +1495,18 @@ AnyChar_init(AnyChar *self, PyObject *args, PyObject *kwds)
 
     ASSIGN_FIELD(AbstractRuleParams, abstractRuleParams);
     ASSIGN_PYOBJECT_FIELD(string);
+    self->characters = PyUnicode_AS_UNICODE(string);
+    self->size = PyUnicode_GET_SIZE(string);
 
     return 0;
 }
 
+static PyObject*
+AnyChar_shortId(AnyChar* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("AnyChar(%U)", self->string);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(AnyChar);
 
 
@@ -1259,6 +1579,12 @@ StringDetect_init(StringDetect *self, PyObject *args, PyObject *kwds)
 }
 
 
+static PyObject*
+StringDetect_shortId(StringDetect* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("StringDetect(%s)", self->utf8String);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(StringDetect);
 
 
@@ -1334,6 +1660,12 @@ WordDetect_init(WordDetect *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+WordDetect_shortId(WordDetect* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("WordDetect(%s, %d)", self->utf8Word, self->insensitive);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(WordDetect);
 
 
@@ -1469,6 +1801,7 @@ typedef struct {
     AbstractRule_HEAD
     /* Type-specific fields go here. */
     _WordTree wordTree;
+    PyObject* words;  // for shortId()
     bool insensitive;
 } keyword;
 
@@ -1477,6 +1810,7 @@ static void
 keyword_dealloc_fields(keyword* self)
 {
     _WordTree_free(&(self->wordTree));
+    Py_XDECREF(self->words);
 }
 
 static RuleTryMatchResult_internal
@@ -1516,6 +1850,7 @@ keyword_init(keyword *self, PyObject *args, PyObject *kwds)
     BOOL_CHECK(insensitive, -1);
 
     ASSIGN_FIELD(AbstractRuleParams, abstractRuleParams);
+    ASSIGN_PYOBJECT_FIELD(words);
     ASSIGN_BOOL_FIELD(insensitive);
 
     parentParser = AbstractRule_parentParser(self->abstractRuleParams);
@@ -1526,161 +1861,584 @@ keyword_init(keyword *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+keyword_shortId(keyword* self, PyObject* args)
+{
+    PyObject* separator;
+    PyObject* words;
+    PyObject* result;
+
+    separator = PyUnicode_FromString(" ");
+    if (NULL == separator)
+        return NULL;
+    words = PyUnicode_Join(separator, self->words);
+    Py_DECREF(separator);
+    if (NULL == words)
+        return NULL;
+
+    result = PyUnicode_FromFormat("keyword(%U, %d)", words, self->insensitive);
+    Py_DECREF(words);
+    return result;
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(keyword);
 
 
 /********************************************************************************
- *                                RegExpr
+ *                                Regular expressions
  ********************************************************************************/
+/* Backend of RegExpr rules. PCRE2 patterns are compiled with JIT compiler, if the platform supports it.
+ * Legacy PCRE patterns are studied, and compiled with JIT compiler if PCRE is new enough.
+ * Patterns are anchored and are matched at a byte offset of the subject.
+ * Patterns are compiled and matched without the GIL. Every parsed line has own match data
+ */
+#define QUTEPART_MAX_REG_EXP_GROUPS 10  // including the whole match
+
+#ifdef QUTEPART_PCRE2
+
 typedef struct {
-    AbstractRule_HEAD
-    /* Type-specific fields go here. */
-    char* utf8String;
-    size_t stringLen;
-    bool insensitive;
-    bool minimal;
-    bool wordStart;
-    bool lineStart;
-    pcre* regExp;
-    pcre_extra* extra;
-} RegExpr;
+    pcre2_code* code;
+    bool jit;
+} _RegExp;
 
-static void
-RegExpr_dealloc_fields(RegExpr* self)
+static void*
+_RegExpMatchData_new(void)
 {
-    PyMem_Free(self->utf8String);
+    return pcre2_match_data_create(QUTEPART_MAX_REG_EXP_GROUPS, NULL);
+}
 
-    if (NULL != self->regExp)
-        pcre_free(self->regExp);
-    if (NULL != self->extra)
-        pcre_free(self->extra);
+static void
+_RegExpMatchData_free(void* matchData)
+{
+    pcre2_match_data_free(matchData);
 }
 
-static pcre*
-_compileRegExp(const char* utf8String, bool insensitive, bool minimal, pcre_extra** pExtra)
+static _RegExp*
+_RegExp_compile(const char* utf8String, bool insensitive, bool minimal)
 {
-    const char* errptr = NULL;
-    int erroffset = 0;
-    pcre* regExp;
+    int errorCode = 0;
+    PCRE2_SIZE errorOffset = 0;
+    pcre2_code* code;
+    _RegExp* self;
 
-    int options = PCRE_ANCHORED | PCRE_UTF8 | PCRE_NO_UTF8_CHECK;
+    uint32_t options = PCRE2_ANCHORED | PCRE2_UTF | PCRE2_NO_UTF_CHECK;
     if (insensitive)
-        options |= PCRE_CASELESS;
+        options |= PCRE2_CASELESS;
 
     if (minimal)
-        options |= PCRE_UNGREEDY;  // NOTE this flag works correctly only if reg exp patterns are greedy by default
+        options |= PCRE2_UNGREEDY;  // NOTE this flag works correctly only if reg exp patterns are greedy by default
 
-    regExp = pcre_compile(utf8String,
-                          options,
-                          &errptr, &erroffset, NULL);
+    code = pcre2_compile((PCRE2_SPTR)utf8String, PCRE2_ZERO_TERMINATED, options,
+                         &errorCode, &errorOffset, NULL);
 
-    if (NULL == regExp)
+    if (NULL == code)
     {
-        if (NULL != errptr)
-            fprintf(stderr, "Failed to compile reg exp. At pos %d: %s. Pattern: '%s'\n", erroffset, errptr, utf8String);
-        else
-            fprintf(stderr, "Failed to compile reg exp. Pattern: '%s'\n", utf8String);
+        PCRE2_UCHAR message[256];
+        pcre2_get_error_message(errorCode, message, sizeof message);
+        fprintf(stderr, "Failed to compile reg exp. At pos %d: %s. Pattern: '%s'\n",
+                (int)errorOffset, (const char*)message, utf8String);
+        return NULL;
     }
 
-#if defined PCRE_STUDY_JIT_COMPILE
-    #define STUDY_OPTIONS PCRE_STUDY_JIT_COMPILE
-#else
-    #define STUDY_OPTIONS 0
-#endif
-    if (NULL != pExtra)
-        *pExtra = pcre_study(regExp, STUDY_OPTIONS, &errptr);
+    self = PyMem_RawMalloc(sizeof *self);
+    self->code = code;
+    self->jit = (0 == pcre2_jit_compile(code, PCRE2_JIT_COMPLETE));  // fails if JIT is not supported
+
+    return self;
+}
 
-    return regExp;
+static void
+_RegExp_free(_RegExp* self)
+{
+    pcre2_code_free(self->code);
+    PyMem_RawFree(self);
 }
 
+/* Match pattern at offset. Returns count of set items of ovector, 0 if not matched.
+ * ovector must have space for QUTEPART_MAX_REG_EXP_GROUPS pairs of byte offsets
+ */
 static int
-_matchRegExp(pcre* regExp, pcre_extra* extra, const char* utf8Text, size_t textLen, _RegExpMatchGroups** pGroups)
+_RegExp_match(_RegExp* self, const char* subject, size_t subjectLen, size_t offset,
+              size_t* ovector, void* matchData)
 {
-    int ovector[30];
-    int rc = pcre_exec(regExp, extra,
-                       utf8Text, textLen,
-                       0, PCRE_NOTEMPTY | PCRE_NO_UTF8_CHECK,
-                       ovector, sizeof ovector / sizeof ovector[0]);
+    int rc;
+
+    if (self->jit)
+        rc = pcre2_jit_match(self->code, (PCRE2_SPTR)subject, subjectLen, offset,
+                             PCRE2_NOTEMPTY, matchData, NULL);
+    else
+        rc = pcre2_match(self->code, (PCRE2_SPTR)subject, subjectLen, offset,
+                         PCRE2_NOTEMPTY | PCRE2_NO_UTF_CHECK, matchData, NULL);
+
+    if (0 == rc)  // more groups, than ovector can contain
+        rc = QUTEPART_MAX_REG_EXP_GROUPS;
 
     if (rc > 0)
-    {
-        if (NULL != pGroups)
-        {
-            const char** data = NULL;
-            pcre_get_substring_list(utf8Text, ovector, rc, &data);
-            *pGroups = _RegExpMatchGroups_new(rc, data);
-        }
+        memcpy(ovector, pcre2_get_ovector_pointer(matchData), rc * 2 * sizeof(size_t));
 
-        return ovector[1] - ovector[0];
-    }
-    else if (rc < 0 && rc != -1)
-    {
-        fprintf(stderr, "Failed to call pcre_exec: error %d\n", rc);
-        return 0;
-    }
-    else
+    if (rc < 0 && rc != PCRE2_ERROR_NOMATCH)
     {
+        fprintf(stderr, "Failed to match reg exp: error %d\n", rc);
         return 0;
     }
+
+    return rc > 0 ? rc : 0;
 }
 
-static RuleTryMatchResult_internal
-RegExpr_tryMatch(RegExpr* self, TextToMatchObject_internal* textToMatchObject)
+static PyObject*
+regExpBackend(PyObject* self, PyObject* args)
 {
-    size_t matchLen;
-    pcre* regExp = NULL;
-    pcre_extra* extra = NULL;
-    _RegExpMatchGroups* groups = NULL;
-
-    // Special case. if pattern starts with \b, we have to check it manually,
-    //because string is passed to .match(..) without beginning
-    if (self->wordStart &&
-        ( ! textToMatchObject->isWordStart))
-            return MakeEmptyTryMatchResult();
+    char version[64];
+    uint32_t jit = 0;
 
-    //Special case. If pattern starts with ^ - check column number manually
-    if (self->lineStart &&
-        textToMatchObject->currentColumnIndex > 0)
-        return MakeEmptyTryMatchResult();
+    pcre2_config(PCRE2_CONFIG_VERSION, version);
+    pcre2_config(PCRE2_CONFIG_JIT, &jit);
 
-    if (self->abstractRuleParams->dynamic)
-    {
-        char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
-        size_t stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
-                                                     buffer, sizeof buffer - 1,
-                                                     textToMatchObject->contextData,
-                                                     true);
-        if (stringLen <= 0)
-            return MakeEmptyTryMatchResult();
+    return Py_BuildValue("(ssO)", "PCRE2", version, jit ? Py_True : Py_False);
+}
 
-        regExp = _compileRegExp(buffer, self->insensitive, self->minimal, NULL);
-    }
-    else
-    {
-        regExp = self->regExp;
-        extra = self->extra;
-    }
+#else  // legacy PCRE
 
-    if (NULL == regExp)
-        return MakeEmptyTryMatchResult();
+typedef struct {
+    pcre* code;
+    pcre_extra* extra;
+} _RegExp;
 
-    int matchLenUtf8 = _matchRegExp(
-        regExp, extra,
-        textToMatchObject->utf8Text, textToMatchObject->textLen,
-        &groups);
+#if defined PCRE_STUDY_JIT_COMPILE
+    #define STUDY_OPTIONS PCRE_STUDY_JIT_COMPILE
+#else
+    #define STUDY_OPTIONS 0
+#endif
 
-    PyObject* unicodeText = PyUnicode_DecodeUTF8(textToMatchObject->utf8Text, matchLenUtf8, NULL);
-    if (unicodeText == NULL) {
-        return MakeEmptyTryMatchResult();
-    }
-    matchLen = PyUnicode_GET_SIZE(unicodeText);
-    Py_DECREF(unicodeText);
+static void*
+_RegExpMatchData_new(void)
+{
+    return NULL;  // pcre_exec() uses ovector on the stack
+}
 
-    if (matchLen != 0) {
-        return MakeTryMatchResult(self, matchLen, groups);
+static void
+_RegExpMatchData_free(void* matchData)
+{
+}
+
+static _RegExp*
+_RegExp_compile(const char* utf8String, bool insensitive, bool minimal)
+{
+    const char* errptr = NULL;
+    int erroffset = 0;
+    pcre* code;
+    _RegExp* self;
+
+    int options = PCRE_ANCHORED | PCRE_UTF8 | PCRE_NO_UTF8_CHECK;
+    if (insensitive)
+        options |= PCRE_CASELESS;
+
+    if (minimal)
+        options |= PCRE_UNGREEDY;  // NOTE this flag works correctly only if reg exp patterns are greedy by default
+
+    code = pcre_compile(utf8String,
+                        options,
+                        &errptr, &erroffset, NULL);
+
+    if (NULL == code)
+    {
+        if (NULL != errptr)
+            fprintf(stderr, "Failed to compile reg exp. At pos %d: %s. Pattern: '%s'\n", erroffset, errptr, utf8String);
+        else
+            fprintf(stderr, "Failed to compile reg exp. Pattern: '%s'\n", utf8String);
+        return NULL;
+    }
+
+    self = PyMem_RawMalloc(sizeof *self);
+    self->code = code;
+    self->extra = pcre_study(code, STUDY_OPTIONS, &errptr);
+
+    return self;
+}
+
+static void
+_RegExp_free(_RegExp* self)
+{
+    pcre_free(self->code);
+    if (NULL != self->extra)
+    {
+#if defined PCRE_STUDY_JIT_COMPILE
+        pcre_free_study(self->extra);
+#else
+        pcre_free(self->extra);
+#endif
+    }
+    PyMem_RawFree(self);
+}
+
+/* Match pattern at offset. Returns count of set items of ovector, 0 if not matched.
+ * ovector must have space for QUTEPART_MAX_REG_EXP_GROUPS pairs of byte offsets
+ */
+static int
+_RegExp_match(_RegExp* self, const char* subject, size_t subjectLen, size_t offset,
+              size_t* ovector, void* matchData)
+{
+    int pcreOvector[QUTEPART_MAX_REG_EXP_GROUPS * 3];  // the last third is a workspace of pcre_exec()
+    int rc;
+    int i;
+
+    rc = pcre_exec(self->code, self->extra,
+                   subject, subjectLen,
+                   offset, PCRE_NOTEMPTY | PCRE_NO_UTF8_CHECK,
+                   pcreOvector, sizeof pcreOvector / sizeof pcreOvector[0]);
+
+    if (0 == rc)  // more groups, than ovector can contain
+        rc = QUTEPART_MAX_REG_EXP_GROUPS;
+
+    for (i = 0; i < rc * 2; i++)
+        ovector[i] = pcreOvector[i] < 0 ? QUTEPART_REG_EXP_GROUP_UNSET : (size_t)pcreOvector[i];
+
+    if (rc < 0 && rc != PCRE_ERROR_NOMATCH)
+    {
+        fprintf(stderr, "Failed to call pcre_exec: error %d\n", rc);
+        return 0;
+    }
+
+    return rc > 0 ? rc : 0;
+}
+
+static PyObject*
+regExpBackend(PyObject* self, PyObject* args)
+{
+    int jit = 0;
+
+#if defined PCRE_CONFIG_JIT
+    pcre_config(PCRE_CONFIG_JIT, &jit);
+#endif
+
+    return Py_BuildValue("(ssO)", "PCRE", pcre_version(), jit ? Py_True : Py_False);
+}
+
+#endif  // QUTEPART_PCRE2
+
+
+/********************************************************************************
+ *                                RegExpr
+ ********************************************************************************/
+typedef struct {
+    AbstractRule_HEAD
+    /* Type-specific fields go here. */
+    PyObject* string;  // for shortId()
+    char* utf8String;
+    size_t stringLen;
+    bool insensitive;
+    bool minimal;
+    bool wordStart;
+    bool lineStart;
+    /* The pattern is matched at an offset in the whole line, if it doesn't look at the text before
+       the match start, or can be rewritten to not look at it. See parser._offsetMatchingPattern().
+       Otherwise it is matched against the rest of the line, like the Python parser does */
+    bool matchAtOffset;
+    _RegExp* regExp;
+    /* Dynamic rules: pattern for the context data of the last matched context stack frame.
+       Substitutions are made and the cache is searched once per frame */
+    _RegExpMatchGroups* dynamicContextData;
+    struct _DynamicRegExp* dynamicRegExp;
+} RegExpr;
+
+static void _DynamicRegExp_release(struct _DynamicRegExp* self);
+static void _DynamicRegExpCache_removeRule(RegExpr* rule);
+
+static PyObject* offsetMatchingPattern = NULL;  // qutepart.syntax.parser._offsetMatchingPattern()
+
+static void
+RegExpr_dealloc_fields(RegExpr* self)
+{
+    Py_XDECREF(self->string);
+    PyMem_Free(self->utf8String);
+
+    if (NULL != self->regExp)
+        _RegExp_free(self->regExp);
+
+    _RegExpMatchGroups_release(self->dynamicContextData);
+    _DynamicRegExp_release(self->dynamicRegExp);
+    _DynamicRegExpCache_removeRule(self);
+}
+
+/* Match the pattern at the current position of textToMatchObject. Returns length of the match in bytes
+ */
+static size_t
+_matchRegExp(_RegExp* regExp, bool matchAtOffset, TextToMatchObject_internal* textToMatchObject,
+             _RegExpMatchGroups** pGroups)
+{
+    size_t ovector[QUTEPART_MAX_REG_EXP_GROUPS * 2];
+    const char* wholeLine = textToMatchObject->wholeLineUtf8Buffer;
+    size_t wholeLineLen = textToMatchObject->wholeLineUtf8Len;
+    size_t offset = textToMatchObject->utf8Text - wholeLine;
+    const char* subject = wholeLine;
+    int count;
+
+    if ( ! matchAtOffset)
+    {
+        subject = textToMatchObject->utf8Text;
+        wholeLineLen -= offset;
+        offset = 0;
+    }
+
+    count = _RegExp_match(regExp, subject, wholeLineLen, offset, ovector, textToMatchObject->regExpMatchData);
+
+    if (0 == count)
+        return 0;
+
+    if (NULL != pGroups)
+        *pGroups = _RegExpMatchGroups_fromMatch(subject, ovector, count);
+
+    return ovector[1] - ovector[0];
+}
+
+/* LRU cache of compiled patterns of dynamic RegExpr rules. Key is (rule, pattern after substitutions).
+ * Compiled patterns are reference counted, because a rule keeps the last used pattern,
+ * and the pattern is used by _matchRegExp() while another thread might evict it.
+ * Lines are parsed without the GIL, therefore the cache and the last used patterns of rules
+ * are protected by _dynamicRegExpLock
+ */
+typedef struct _DynamicRegExp {
+    _RegExp* regExp;  // NULL if the pattern is invalid
+    _AtomicCounter refCount;
+} _DynamicRegExp;
+
+typedef struct {
+    RegExpr* rule;
+    char* pattern;
+    size_t patternLen;
+    unsigned long hash;
+    unsigned long lastUsed;
+    _DynamicRegExp* regExp;
+} _DynamicRegExpCacheEntry;
+
+#define QUTEPART_DYNAMIC_REG_EXP_CACHE_SIZE 256
+
+static _DynamicRegExpCacheEntry _dynamicRegExpCache[QUTEPART_DYNAMIC_REG_EXP_CACHE_SIZE];
+static size_t _dynamicRegExpCacheSize = 0;
+static unsigned long _dynamicRegExpCacheClock = 0;
+static unsigned long _dynamicRegExpCacheHits = 0;
+static unsigned long _dynamicRegExpCacheMisses = 0;
+static PyThread_type_lock _dynamicRegExpLock = NULL;  // allocated by PyInit_cParser()
+
+static void
+_DynamicRegExp_release(_DynamicRegExp* self)
+{
+    if (NULL == self)
+        return;
+
+    if (0 == QUTEPART_ATOMIC_DECREMENT(&self->refCount))
+    {
+        if (NULL != self->regExp)
+            _RegExp_free(self->regExp);
+        PyMem_RawFree(self);
+    }
+}
+
+static void
+_DynamicRegExpCacheEntry_free(_DynamicRegExpCacheEntry* entry)
+{
+    PyMem_RawFree(entry->pattern);
+    _DynamicRegExp_release(entry->regExp);
+}
+
+static unsigned long
+_DynamicRegExpCache_hash(const char* pattern, size_t patternLen)
+{
+    unsigned long hash = 5381;
+    size_t i;
+
+    for (i = 0; i < patternLen; i++)
+        hash = hash * 33 + (unsigned char)pattern[i];
+
+    return hash;
+}
+
+/* Get compiled pattern. Returns new reference. pattern is null-terminated.
+ * Called with _dynamicRegExpLock acquired
+ */
+static _DynamicRegExp*
+_DynamicRegExpCache_get(RegExpr* rule, const char* pattern, size_t patternLen)
+{
+    unsigned long hash = _DynamicRegExpCache_hash(pattern, patternLen);
+    _DynamicRegExpCacheEntry* entry = NULL;
+    size_t i;
+
+    for (i = 0; i < _dynamicRegExpCacheSize; i++)
+    {
+        entry = &_dynamicRegExpCache[i];
+        if (entry->rule == rule &&
+            entry->hash == hash &&
+            entry->patternLen == patternLen &&
+            0 == memcmp(entry->pattern, pattern, patternLen))
+        {
+            _dynamicRegExpCacheHits++;
+            entry->lastUsed = ++_dynamicRegExpCacheClock;
+            QUTEPART_ATOMIC_INCREMENT(&entry->regExp->refCount);
+            return entry->regExp;
+        }
+    }
+
+    _dynamicRegExpCacheMisses++;
+
+    if (_dynamicRegExpCacheSize < QUTEPART_DYNAMIC_REG_EXP_CACHE_SIZE)
+    {
+        entry = &_dynamicRegExpCache[_dynamicRegExpCacheSize++];
+    }
+    else  // evict the least recently used pattern
+    {
+        entry = &_dynamicRegExpCache[0];
+        for (i = 1; i < _dynamicRegExpCacheSize; i++)
+        {
+            if (_dynamicRegExpCache[i].lastUsed < entry->lastUsed)
+                entry = &_dynamicRegExpCache[i];
+        }
+        _DynamicRegExpCacheEntry_free(entry);
+    }
+
+    entry->rule = rule;
+    entry->pattern = PyMem_RawMalloc(patternLen + 1);
+    memcpy(entry->pattern, pattern, patternLen + 1);
+    entry->patternLen = patternLen;
+    entry->hash = hash;
+    entry->lastUsed = ++_dynamicRegExpCacheClock;
+    entry->regExp = PyMem_RawMalloc(sizeof *entry->regExp);
+    entry->regExp->regExp = _RegExp_compile(pattern, rule->insensitive, rule->minimal);
+    entry->regExp->refCount = 2;  // the cache and the caller
+
+    return entry->regExp;
+}
+
+static void
+_DynamicRegExpCache_removeRule(RegExpr* rule)
+{
+    size_t i = 0;
+
+    PyThread_acquire_lock(_dynamicRegExpLock, WAIT_LOCK);
+    while (i < _dynamicRegExpCacheSize)
+    {
+        if (_dynamicRegExpCache[i].rule == rule)
+        {
+            _DynamicRegExpCacheEntry_free(&_dynamicRegExpCache[i]);
+            _dynamicRegExpCache[i] = _dynamicRegExpCache[--_dynamicRegExpCacheSize];
+        }
+        else
+        {
+            i++;
+        }
+    }
+    PyThread_release_lock(_dynamicRegExpLock);
+}
+
+static PyObject*
+dynamicRegExpCacheInfo(PyObject* self, PyObject* args)
+{
+    PyObject* info;
+
+    PyThread_acquire_lock(_dynamicRegExpLock, WAIT_LOCK);
+    info = Py_BuildValue("(kknn)",
+                         _dynamicRegExpCacheHits, _dynamicRegExpCacheMisses,
+                         (Py_ssize_t)_dynamicRegExpCacheSize, (Py_ssize_t)QUTEPART_DYNAMIC_REG_EXP_CACHE_SIZE);
+    PyThread_release_lock(_dynamicRegExpLock);
+
+    return info;
+}
+
+static PyObject*
+clearDynamicRegExpCache(PyObject* self, PyObject* args)
+{
+    size_t i;
+
+    PyThread_acquire_lock(_dynamicRegExpLock, WAIT_LOCK);
+    for (i = 0; i < _dynamicRegExpCacheSize; i++)
+        _DynamicRegExpCacheEntry_free(&_dynamicRegExpCache[i]);
+
+    _dynamicRegExpCacheSize = 0;
+    _dynamicRegExpCacheHits = 0;
+    _dynamicRegExpCacheMisses = 0;
+    PyThread_release_lock(_dynamicRegExpLock);
+
+    Py_RETURN_NONE;
+}
+
+static RuleTryMatchResult_internal
+RegExpr_tryMatch(RegExpr* self, TextToMatchObject_internal* textToMatchObject)
+{
+    size_t matchLen;
+    size_t matchLenUtf8;
+    size_t i;
+    _RegExp* regExp = NULL;
+    _DynamicRegExp* dynamicRegExp = NULL;
+    _RegExpMatchGroups* groups = NULL;
+    RuleTryMatchResult_internal result;
+
+    // Special case. if pattern starts with \b, we have to check it manually,
+    //because string is passed to .match(..) without beginning
+    if (self->wordStart &&
+        ( ! textToMatchObject->isWordStart))
+            return MakeEmptyTryMatchResult();
+
+    //Special case. If pattern starts with ^ - check column number manually
+    if (self->lineStart &&
+        textToMatchObject->currentColumnIndex > 0)
+        return MakeEmptyTryMatchResult();
+
+    if (self->abstractRuleParams->dynamic)
+    {
+        PyThread_acquire_lock(_dynamicRegExpLock, WAIT_LOCK);
+        if (NULL == self->dynamicRegExp ||
+            self->dynamicContextData != textToMatchObject->contextData)
+        {
+            char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
+            size_t stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
+                                                         buffer, sizeof buffer - 1,
+                                                         textToMatchObject->contextData,
+                                                         true);
+            if (stringLen == 0 || stringLen == (size_t)-1)
+            {
+                PyThread_release_lock(_dynamicRegExpLock);
+                return MakeEmptyTryMatchResult();
+            }
+
+            _DynamicRegExp_release(self->dynamicRegExp);
+            _RegExpMatchGroups_release(self->dynamicContextData);
+            self->dynamicRegExp = _DynamicRegExpCache_get(self, buffer, stringLen);
+            self->dynamicContextData = _RegExpMatchGroups_duplicate(textToMatchObject->contextData);
+        }
+
+        dynamicRegExp = self->dynamicRegExp;
+        QUTEPART_ATOMIC_INCREMENT(&dynamicRegExp->refCount);  // other thread might change pattern of the rule
+        PyThread_release_lock(_dynamicRegExpLock);
+        regExp = dynamicRegExp->regExp;
     }
     else
+    {
+        regExp = self->regExp;
+    }
+
+    if (NULL == regExp)
+    {
+        _DynamicRegExp_release(dynamicRegExp);
         return MakeEmptyTryMatchResult();
+    }
+
+    matchLenUtf8 = _matchRegExp(regExp, self->matchAtOffset, textToMatchObject, &groups);
+    _DynamicRegExp_release(dynamicRegExp);
+
+    // count of characters is count of bytes, which are not continuation bytes of utf8 characters
+    matchLen = 0;
+    for (i = 0; i < matchLenUtf8; i++)
+    {
+        if ((textToMatchObject->utf8Text[i] & 0xC0) != 0x80)
+            matchLen++;
+    }
+
+    if (matchLen != 0)
+        result = MakeTryMatchResult(self, matchLen, groups);
+    else
+        result = MakeEmptyTryMatchResult();
+
+    _RegExpMatchGroups_release(groups);  // the result keeps own reference
+    return result;
 }
 
 static int
@@ -1692,6 +2450,7 @@ RegExpr_init(RegExpr *self, PyObject *args, PyObject *kwds)
     PyObject* minimal = NULL;
     PyObject* wordStart = NULL;
     PyObject* lineStart = NULL;
+    PyObject* pattern;
     PyObject* utf8String;
 
     self->_tryMatch = RegExpr_tryMatch;
@@ -1708,13 +2467,30 @@ RegExpr_init(RegExpr *self, PyObject *args, PyObject *kwds)
     BOOL_CHECK(lineStart, -1);
 
     ASSIGN_FIELD(AbstractRuleParams, abstractRuleParams);
+    ASSIGN_PYOBJECT_FIELD(string);
 
     ASSIGN_BOOL_FIELD(insensitive);
     ASSIGN_BOOL_FIELD(minimal);
     ASSIGN_BOOL_FIELD(wordStart);
     ASSIGN_BOOL_FIELD(lineStart);
 
-    utf8String = PyUnicode_AsUTF8String(string);
+    pattern = PyObject_CallFunctionObjArgs(offsetMatchingPattern, string, NULL);
+    if (NULL == pattern)
+        return -1;
+
+    self->matchAtOffset = (Py_None != pattern);
+    if ( ! self->matchAtOffset)
+    {
+        Py_DECREF(pattern);
+        pattern = string;
+        Py_INCREF(pattern);
+    }
+
+    utf8String = PyUnicode_AsUTF8String(pattern);
+    Py_DECREF(pattern);
+    if (NULL == utf8String)
+        return -1;
+
     if (self->abstractRuleParams->dynamic)
     {
         self->stringLen = PyBytes_Size(utf8String);
@@ -1723,13 +2499,19 @@ RegExpr_init(RegExpr *self, PyObject *args, PyObject *kwds)
     }
     else
     {
-        self->regExp = _compileRegExp(PyBytes_AsString(utf8String), self->insensitive, self->minimal, &(self->extra));
+        self->regExp = _RegExp_compile(PyBytes_AsString(utf8String), self->insensitive, self->minimal);
     }
     Py_DECREF(utf8String);
 
     return 0;
 }
 
+static PyObject*
+RegExpr_shortId(RegExpr* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("RegExpr( %U )", self->string);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(RegExpr);
 
 
@@ -1852,16 +2634,14 @@ AbstractNumberRule_tryMatch(AbstractRule* self,
         return MakeEmptyTryMatchResult();
 
     matchEndIndex = textToMatchObject->currentColumnIndex + index;
-    if (matchEndIndex < PyUnicode_GET_SIZE(textToMatchObject->wholeLineUnicodeText))
+    if (matchEndIndex < textToMatchObject->wholeLineLen)
     {
         size_t i;
         bool haveMatch = false;
         Parser* parentParser;
 
-        TextToMatchObject_internal newTextToMatchObject =
-                TextToMatchObject_internal_make(textToMatchObject->currentColumnIndex + index,
-                                                textToMatchObject->wholeLineUnicodeText,
-                                                textToMatchObject->contextData);
+        TextToMatchObject_internal newTextToMatchObject = *textToMatchObject;  // shares buffers of the line
+        TextToMatchObject_internal_reset(&newTextToMatchObject, textToMatchObject->contextData);
 
         parentParser = AbstractRule_parentParser(self->abstractRuleParams);
         TextToMatchObject_internal_update(&newTextToMatchObject,
@@ -1880,8 +2660,6 @@ AbstractNumberRule_tryMatch(AbstractRule* self,
             }
             // child rule context and attribute is ignored
         }
-
-        TextToMatchObject_internal_free(&newTextToMatchObject);
     }
 
     return MakeTryMatchResult(self, index, NULL);
@@ -1933,6 +2711,12 @@ Int_init(Int *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+Int_shortId(Int* self, PyObject* args)
+{
+    return PyUnicode_FromString("Int()");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(Int);
 
 
@@ -1982,6 +2766,12 @@ Float_init(Float *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+Float_shortId(Float* self, PyObject* args)
+{
+    return PyUnicode_FromString("Float()");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(Float);
 
 
@@ -2044,6 +2834,12 @@ HlCOct_init(HlCOct *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+HlCOct_shortId(HlCOct* self, PyObject* args)
+{
+    return PyUnicode_FromString("HlCOct");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(HlCOct);
 
 
@@ -2111,6 +2907,12 @@ HlCHex_init(HlCHex *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+HlCHex_shortId(HlCHex* self, PyObject* args)
+{
+    return PyUnicode_FromString("HlCHex");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(HlCHex);
 
 
@@ -2204,6 +3006,12 @@ HlCStringChar_init(HlCStringChar *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+HlCStringChar_shortId(HlCStringChar* self, PyObject* args)
+{
+    return PyUnicode_FromString("HlCStringChar");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(HlCStringChar);
 
 
@@ -2261,6 +3069,12 @@ HlCChar_init(HlCChar *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+HlCChar_shortId(HlCChar* self, PyObject* args)
+{
+    return PyUnicode_FromString("HlCChar");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(HlCChar);
 
 
@@ -2326,6 +3140,12 @@ RangeDetect_init(RangeDetect *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+RangeDetect_shortId(RangeDetect* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("RangeDetect(%c, %c)", (int)self->char_, (int)self->char1_);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(RangeDetect);
 
 
@@ -2371,9 +3191,15 @@ LineContinue_init(LineContinue *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
-DECLARE_RULE_METHODS_AND_TYPE(LineContinue);
-
-
+static PyObject*
+LineContinue_shortId(LineContinue* self, PyObject* args)
+{
+    return PyUnicode_FromString("LineContinue");
+}
+
+DECLARE_RULE_METHODS_AND_TYPE(LineContinue);
+
+
 /********************************************************************************
  *                                IncludeRules
  ********************************************************************************/
@@ -2425,6 +3251,12 @@ IncludeRules_init(IncludeRules *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+IncludeRules_shortId(IncludeRules* self, PyObject* args)
+{
+    return PyUnicode_FromFormat("IncludeRules(%U)", self->context->name);
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(IncludeRules);
 
 
@@ -2472,6 +3304,12 @@ DetectSpaces_init(DetectSpaces *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+DetectSpaces_shortId(DetectSpaces* self, PyObject* args)
+{
+    return PyUnicode_FromString("DetectSpaces()");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(DetectSpaces);
 
 
@@ -2523,36 +3361,213 @@ DetectIdentifier_init(DetectIdentifier *self, PyObject *args, PyObject *kwds)
     return 0;
 }
 
+static PyObject*
+DetectIdentifier_shortId(DetectIdentifier* self, PyObject* args)
+{
+    return PyUnicode_FromString("DetectIdentifier()");
+}
+
 DECLARE_RULE_METHODS_AND_TYPE(DetectIdentifier);
 
 
 /********************************************************************************
  *                                Context stack
  ********************************************************************************/
+/* Intern table is a hash table of all alive stacks.
+ * It contains borrowed references, a stack removes itself when deallocated
+ */
+typedef struct {
+    ContextStack** buckets;
+    size_t bucketCount;
+    size_t size;
+} _ContextStackInternTable;
+
+static _ContextStackInternTable _internedContextStacks = {NULL, 0, 0};
+
+static bool
+_RegExpMatchGroups_equal(_RegExpMatchGroups* a, _RegExpMatchGroups* b)
+{
+    size_t i;
+
+    if (a == b)
+        return true;
+    if (NULL == a || NULL == b || a->size != b->size)
+        return false;
+
+    for (i = 0; i < a->size; i++)
+    {
+        if (0 != strcmp(a->data[i], b->data[i]))
+            return false;
+    }
+
+    return true;
+}
+
+static size_t
+_ContextStack_hash(ContextStack* parent, Context* context, _RegExpMatchGroups* data)
+{
+    size_t hash = (size_t)parent * 1000003 ^ (size_t)context;
+
+    if (NULL != data)
+    {
+        size_t i;
+        for (i = 0; i < data->size; i++)
+        {
+            const char* c;
+            for (c = data->data[i]; *c != '\0'; c++)
+                hash = hash * 33 + *c;
+            hash = hash * 33 + 1;  // group separator
+        }
+    }
+
+    return hash ^ (hash >> 16);
+}
+
 static void
-ContextStack_dealloc(ContextStack* self)
+_ContextStack_internTableResize(size_t bucketCount)
 {
+    ContextStack** buckets = PyMem_Malloc(bucketCount * sizeof(ContextStack*));
     size_t i;
-    for (i = 0; i < self->_size; i++)
-        _RegExpMatchGroups_release(self->_data[i]);
+
+    for (i = 0; i < bucketCount; i++)
+        buckets[i] = NULL;
+
+    for (i = 0; i < _internedContextStacks.bucketCount; i++)
+    {
+        ContextStack* stack = _internedContextStacks.buckets[i];
+        while (NULL != stack)
+        {
+            ContextStack* next = stack->_nextInterned;
+            size_t index = stack->_hash % bucketCount;
+            stack->_nextInterned = buckets[index];
+            buckets[index] = stack;
+            stack = next;
+        }
+    }
+
+    PyMem_Free(_internedContextStacks.buckets);
+    _internedContextStacks.buckets = buckets;
+    _internedContextStacks.bucketCount = bucketCount;
+}
+
+static void
+_ContextStack_intern(ContextStack* self)
+{
+    size_t index;
+
+    if (_internedContextStacks.size >= _internedContextStacks.bucketCount)
+        _ContextStack_internTableResize(_internedContextStacks.bucketCount * 2 + 64);
+
+    index = self->_hash % _internedContextStacks.bucketCount;
+    self->_nextInterned = _internedContextStacks.buckets[index];
+    _internedContextStacks.buckets[index] = self;
+    _internedContextStacks.size++;
+}
+
+static void
+_ContextStack_unintern(ContextStack* self)
+{
+    ContextStack** pStack = &_internedContextStacks.buckets[self->_hash % _internedContextStacks.bucketCount];
+
+    while (*pStack != self)
+        pStack = &(*pStack)->_nextInterned;
+
+    *pStack = self->_nextInterned;
+    _internedContextStacks.size--;
+}
+
+static ContextStack*
+_ContextStack_findInterned(ContextStack* parent, Context* context, _RegExpMatchGroups* data, size_t hash)
+{
+    ContextStack* stack;
+
+    if (0 == _internedContextStacks.bucketCount)
+        return NULL;
+
+    for (stack = _internedContextStacks.buckets[hash % _internedContextStacks.bucketCount];
+         NULL != stack;
+         stack = stack->_nextInterned)
+    {
+        if (stack->_hash == hash &&
+            stack->_parent == parent &&
+            stack->_context == context &&
+            _RegExpMatchGroups_equal(stack->_data, data))
+            return stack;
+    }
+
+    return NULL;
+}
+
+static void
+ContextStack_dealloc(ContextStack* self)
+{
+    _ContextStack_unintern(self);
+    Py_XDECREF(self->_parent);
+    _RegExpMatchGroups_release(self->_data);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
-DECLARE_TYPE_WITHOUT_CONSTRUCTOR(ContextStack, NULL, "Context stack");
+static PyObject*
+ContextStack_frames(ContextStack* self, PyObject* args)
+{
+    PyObject* frames = PyTuple_New(self->_size);
+    ContextStack* stack;
+    Py_ssize_t index = self->_size;
+
+    for (stack = self; NULL != stack; stack = stack->_parent)
+    {
+        PyObject* data;
+
+        if (NULL == stack->_data)
+        {
+            Py_INCREF(Py_None);
+            data = Py_None;
+        }
+        else
+        {
+            size_t i;
+            data = PyTuple_New(stack->_data->size);
+            for (i = 0; i < stack->_data->size; i++)
+                PyTuple_SET_ITEM(data, i, PyUnicode_FromString(stack->_data->data[i]));
+        }
+
+        index--;
+        PyTuple_SET_ITEM(frames, index, Py_BuildValue("ON", stack->_context, data));
+    }
+
+    return frames;
+}
+
+static PyMethodDef ContextStack_methods[] = {
+    {"frames", (PyCFunction)ContextStack_frames, METH_NOARGS,
+            "Get tuple of (context, data) frames. The bottom frame is the first"},
+    {NULL}  /* Sentinel */
+};
+
+DECLARE_TYPE_WITHOUT_CONSTRUCTOR(ContextStack, ContextStack_methods, "Context stack");
 
 static ContextStack*
-ContextStack_new(Context** contexts, _RegExpMatchGroups** data, size_t size)  // not a constructor, just C function
+ContextStack_make(ContextStack* parent, Context* context, _RegExpMatchGroups* data)  // not a constructor, just C function
 {
-    size_t i;
-    ContextStack* contextStack = PyObject_New(ContextStack, &ContextStackType);
+    size_t hash = _ContextStack_hash(parent, context, data);
+    ContextStack* contextStack = _ContextStack_findInterned(parent, context, data, hash);
 
-    for (i = 0; i < size; i++)
+    if (NULL != contextStack)
     {
-        contextStack->_contexts[i] = contexts[i];
-        contextStack->_data[i] = _RegExpMatchGroups_duplicate(data[i]);
+        Py_INCREF(contextStack);
+        return contextStack;
     }
-    contextStack->_size = size;
+
+    contextStack = PyObject_New(ContextStack, &ContextStackType);
+
+    Py_XINCREF(parent);
+    contextStack->_parent = parent;
+    contextStack->_context = context;
+    contextStack->_data = _RegExpMatchGroups_duplicate(data);
+    contextStack->_size = (NULL != parent) ? parent->_size + 1 : 1;
+    contextStack->_hash = hash;
+    _ContextStack_intern(contextStack);
 
     return contextStack;
 }
@@ -2560,13 +3575,110 @@ ContextStack_new(Context** contexts, _RegExpMatchGroups** data, size_t size)  //
 static Context*
 ContextStack_currentContext(ContextStack* self)
 {
-    return self->_contexts[self->_size - 1];
+    return self->_context;
 }
 
 static _RegExpMatchGroups*
 ContextStack_currentData(ContextStack* self)
 {
-    return self->_data[self->_size - 1];
+    return self->_data;
+}
+
+/* Context stack of a line, which is being parsed. ContextStack objects can't be made without the GIL,
+ * therefore frames, which are pushed while the line is parsed, are kept in a C array on top of the part of
+ * the initial stack, which hasn't been popped. ContextStack object is made, when the line has been parsed.
+ * The stack is never deeper than QUTEPART_MAX_CONTEXT_STACK_DEPTH, see ContextSwitcher_switch()
+ */
+typedef struct {
+    Context* context;
+    _RegExpMatchGroups* data;  // owned
+} _ContextFrame;
+
+typedef struct {
+    ContextStack* base;  // borrowed. The caller keeps the initial stack alive. NULL if it has been popped
+    _ContextFrame frames[QUTEPART_MAX_CONTEXT_STACK_DEPTH];
+    size_t framesCount;
+} _LineContextStack;
+
+static void
+_LineContextStack_init(_LineContextStack* self, ContextStack* contextStack)
+{
+    self->base = contextStack;
+    self->framesCount = 0;
+}
+
+static void
+_LineContextStack_pop(_LineContextStack* self)
+{
+    if (self->framesCount > 0)
+    {
+        self->framesCount--;
+        _RegExpMatchGroups_release(self->frames[self->framesCount].data);
+    }
+    else
+    {
+        self->base = self->base->_parent;
+    }
+}
+
+static void
+_LineContextStack_free(_LineContextStack* self)
+{
+    while (self->framesCount > 0)
+        _LineContextStack_pop(self);
+}
+
+static void
+_LineContextStack_push(_LineContextStack* self, Context* context, _RegExpMatchGroups* data)
+{
+    self->frames[self->framesCount].context = context;
+    self->frames[self->framesCount].data = _RegExpMatchGroups_duplicate(data);
+    self->framesCount++;
+}
+
+static size_t
+_LineContextStack_size(_LineContextStack* self)
+{
+    return ((NULL != self->base) ? self->base->_size : 0) + self->framesCount;
+}
+
+static Context*
+_LineContextStack_currentContext(_LineContextStack* self)
+{
+    if (self->framesCount > 0)
+        return self->frames[self->framesCount - 1].context;
+    else
+        return ContextStack_currentContext(self->base);
+}
+
+static _RegExpMatchGroups*
+_LineContextStack_currentData(_LineContextStack* self)
+{
+    if (self->framesCount > 0)
+        return self->frames[self->framesCount - 1].data;
+    else
+        return ContextStack_currentData(self->base);
+}
+
+/* Make interned ContextStack. Returns new reference. Called with the GIL held
+ */
+static ContextStack*
+_LineContextStack_toContextStack(_LineContextStack* self)
+{
+    ContextStack* contextStack = self->base;
+    size_t i;
+
+    Py_XINCREF(contextStack);
+    for (i = 0; i < self->framesCount; i++)
+    {
+        ContextStack* newContextStack = ContextStack_make(contextStack,
+                                                          self->frames[i].context,
+                                                          self->frames[i].data);
+        Py_XDECREF(contextStack);
+        contextStack = newContextStack;
+    }
+
+    return contextStack;
 }
 
 /********************************************************************************
@@ -2598,56 +3710,61 @@ ContextSwitcher_init(ContextSwitcher *self, PyObject *args, PyObject *kwds)
 
 DECLARE_TYPE(ContextSwitcher, NULL, "Context switcher");
 
-static ContextStack*
-ContextSwitcher_getNextContextStack(ContextSwitcher* self, ContextStack* contextStack, _RegExpMatchGroups* data)
+/* Switch the context stack of a line. Doesn't need the GIL.
+ * Returns true if the stack has been changed. Equal stacks are not changed, like interned ContextStack objects
+ */
+static bool
+ContextSwitcher_switch(ContextSwitcher* self, _LineContextStack* contextStack, _RegExpMatchGroups* data)
 {
     bool haveContextToSwitch = Py_None != (PyObject*)self->_contextToSwitch;
-    ContextStack* newContextStack;
+    size_t popsCount = (size_t)self->_popsCount;
+    size_t size = _LineContextStack_size(contextStack);
+    Context* contextToSwitch;
+    size_t i;
 
-    if (contextStack->_size - self->_popsCount < 0 ||
-        (contextStack->_size - self->_popsCount == 0 &&
+    if (popsCount > size ||
+        (popsCount == size &&
          ( ! haveContextToSwitch)))
     {
 #if 0  // Trace disabled because happens to often. It seems like it is normal behavior.
         fprintf(stderr, "Attempt to pop the last context\n");
 #endif
-        return ContextStack_new(contextStack->_contexts,
-                                contextStack->_data,
-                                1);
+        for (i = 1; i < size; i++)
+            _LineContextStack_pop(contextStack);
+        return size > 1;
     }
 
-    newContextStack = ContextStack_new(contextStack->_contexts,
-                                       contextStack->_data,
-                                       contextStack->_size - self->_popsCount);
-
-    if (haveContextToSwitch)
+    if ( ! haveContextToSwitch)
     {
-        if (newContextStack->_size < QUTEPART_MAX_CONTEXT_STACK_DEPTH)
-        {
-            Context* contextToSwitch = (Context*)self->_contextToSwitch;
-            newContextStack->_contexts[newContextStack->_size] = contextToSwitch;
-
-            if (contextToSwitch->dynamic)
-                newContextStack->_data[newContextStack->_size] = _RegExpMatchGroups_duplicate(data);
-            else
-                newContextStack->_data[newContextStack->_size] = NULL;
+        for (i = 0; i < popsCount; i++)
+            _LineContextStack_pop(contextStack);
+        return popsCount > 0;
+    }
 
-            newContextStack->_size++;
-        }
-        else
+    if (size - popsCount >= QUTEPART_MAX_CONTEXT_STACK_DEPTH)
+    {
+        static bool messageShown = false;
+        if ( ! messageShown)
         {
-            static bool messageShown = false;
-            if ( ! messageShown)
-            {
-                fprintf(stderr, "qutepart: Max context stack depth %d reached\n", QUTEPART_MAX_CONTEXT_STACK_DEPTH);
-                messageShown = true;
-            }
-            Py_XDECREF(newContextStack);
-            return contextStack;
+            fprintf(stderr, "qutepart: Max context stack depth %d reached\n", QUTEPART_MAX_CONTEXT_STACK_DEPTH);
+            messageShown = true;
         }
+        return false;
     }
 
-    return newContextStack;
+    contextToSwitch = (Context*)self->_contextToSwitch;
+    if ( ! contextToSwitch->dynamic)
+        data = NULL;
+
+    if (1 == popsCount &&
+        _LineContextStack_currentContext(contextStack) == contextToSwitch &&
+        _RegExpMatchGroups_equal(_LineContextStack_currentData(contextStack), data))
+        return false;  // the top frame is replaced with an equal frame
+
+    for (i = 0; i < popsCount; i++)
+        _LineContextStack_pop(contextStack);
+    _LineContextStack_push(contextStack, contextToSwitch, data);
+    return true;
 }
 
 
@@ -2665,6 +3782,17 @@ static PyMemberDef Context_members[] = {
 };
 
 
+static void
+Context_freeDispatchTable(Context* self)
+{
+    QUTEPART_ATOMIC_STORE(&self->dispatchTableMade, 0);
+    Py_CLEAR(self->flatRulesPython);
+    PyMem_Free(self->flatRulesC);
+    self->flatRulesC = NULL;
+    PyMem_Free(self->dispatchRules);
+    self->dispatchRules = NULL;
+}
+
 static void
 Context_dealloc(Context* self)
 {
@@ -2680,6 +3808,7 @@ Context_dealloc(Context* self)
     Py_XDECREF(self->textTypePython);
 
     PyMem_Free(self->rulesC);
+    Context_freeDispatchTable(self);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
@@ -2757,11 +3886,124 @@ Context_setRules(Context *self, PyObject *args)
     LIST_CHECK(rulesPython, NULL);
     ASSIGN_PYOBJECT_FIELD(rulesPython);
 
+    PyMem_Free(self->rulesC);
     self->rulesC = (AbstractRule**)_listToDynamicallyAllocatedArray(rulesPython, &self->rulesSize);
+    Context_freeDispatchTable(self);
 
     Py_RETURN_NONE;
 }
 
+/* Append rules to the list. IncludeRules without column and firstNonSpace conditions
+ * are replaced with rules of the included context.
+ * A context included twice is skipped, its rules have already failed
+ */
+static bool
+Context_flattenRules(Context* self, PyObject* flatRules, PyObject* visitedContexts)
+{
+    size_t i;
+    for (i = 0; i < self->rulesSize; i++)
+    {
+        AbstractRule* rule = self->rulesC[i];
+        if (Py_TYPE(rule) == &IncludeRulesType &&
+            rule->abstractRuleParams->column == -1 &&
+            ( ! rule->abstractRuleParams->firstNonSpace))
+        {
+            PyObject* includedContext = (PyObject*)((IncludeRules*)rule)->context;
+            int visited = PySet_Contains(visitedContexts, includedContext);
+            if (visited < 0)
+                return false;
+
+            if (( ! visited) &&
+                (PySet_Add(visitedContexts, includedContext) < 0 ||
+                 ( ! Context_flattenRules((Context*)includedContext, flatRules, visitedContexts))))
+                return false;
+        }
+        else if (PyList_Append(flatRules, (PyObject*)rule) < 0)
+        {
+            return false;
+        }
+    }
+
+    return true;
+}
+
+/* Make lists of rules, which might match text starting with an ASCII character.
+ * flatRulesC is used for other characters
+ */
+static bool
+Context_makeDispatchTable(Context* self)
+{
+    PyObject* visitedContexts = PySet_New(NULL);
+    size_t code;
+    size_t i;
+    size_t dispatchRulesSize = 0;
+
+    if (NULL == visitedContexts)
+        return false;
+
+    self->flatRulesPython = PyList_New(0);
+    if (NULL == self->flatRulesPython ||
+        PySet_Add(visitedContexts, (PyObject*)self) < 0 ||
+        ( ! Context_flattenRules(self, self->flatRulesPython, visitedContexts)))
+    {
+        Py_DECREF(visitedContexts);
+        Py_CLEAR(self->flatRulesPython);
+        return false;
+    }
+    Py_DECREF(visitedContexts);
+
+    self->flatRulesC = (AbstractRule**)_listToDynamicallyAllocatedArray(self->flatRulesPython, &self->flatRulesSize);
+
+    for (code = 0; code < QUTEPART_DISPATCH_TABLE_SIZE; code++)
+    {
+        self->rulesForCharSize[code] = 0;
+        for (i = 0; i < self->flatRulesSize; i++)
+        {
+            AbstractRuleParams* params = self->flatRulesC[i]->abstractRuleParams;
+            if (( ! params->firstCharsKnown) || params->firstChars[code])
+                self->rulesForCharSize[code]++;
+        }
+        dispatchRulesSize += self->rulesForCharSize[code];
+    }
+
+    self->dispatchRules = PyMem_Malloc((sizeof (AbstractRule*)) * (dispatchRulesSize + 1));
+    dispatchRulesSize = 0;
+    for (code = 0; code < QUTEPART_DISPATCH_TABLE_SIZE; code++)
+    {
+        self->rulesForChar[code] = self->dispatchRules + dispatchRulesSize;
+        for (i = 0; i < self->flatRulesSize; i++)
+        {
+            AbstractRuleParams* params = self->flatRulesC[i]->abstractRuleParams;
+            if (( ! params->firstCharsKnown) || params->firstChars[code])
+                self->dispatchRules[dispatchRulesSize++] = self->flatRulesC[i];
+        }
+    }
+
+    QUTEPART_ATOMIC_STORE(&self->dispatchTableMade, 1);
+    return true;
+}
+
+/* Dispatch tables are made on first use. Acquires the GIL, if it is released
+ */
+static void
+Context_ensureDispatchTable(Context* self, PyThreadState* threadState)  // NULL if the GIL is held
+{
+    if (QUTEPART_ATOMIC_LOAD(&self->dispatchTableMade))
+        return;
+
+    _acquireGil(threadState);
+
+    // other thread might be making the table, if it has released the GIL. Then rules are used without the table
+    if (NULL == self->flatRulesPython &&
+        ( ! Context_makeDispatchTable(self)))
+    {
+        PyErr_Print();
+        Context_freeDispatchTable(self);
+    }
+
+    _releaseGil(threadState);
+}
+
 
 static PyMethodDef Context_methods[] = {
     {"setValues", (PyCFunction)Context_setValues, METH_VARARGS,  "Initialize context object with values"},
@@ -2771,76 +4013,382 @@ static PyMethodDef Context_methods[] = {
 
 DECLARE_TYPE_WITH_MEMBERS(Context, Context_methods, "Parsing context");
 
+/* Highlighted segments of a line. Converted to a list of (length, format) tuples, when the line has been parsed.
+ * Formats are borrowed from rules and contexts
+ */
+typedef struct {
+    bool enabled;  /* parseBlock() doesn't make segments */
+    bool failed;  /* not enough memory */
+    size_t count;
+    size_t capacity;
+    size_t* lengths;
+    PyObject** formats;
+    size_t inlineLengths[32];  /* the most of lines have few segments. Not allocated */
+    PyObject* inlineFormats[32];
+} Segments;
+
+static void
+Segments_init(Segments* segments, bool enabled)
+{
+    segments->enabled = enabled;
+    segments->failed = false;
+    segments->count = 0;
+    segments->capacity = sizeof segments->inlineLengths / sizeof segments->inlineLengths[0];
+    segments->lengths = segments->inlineLengths;
+    segments->formats = segments->inlineFormats;
+}
+
 static void
-Context_appendSegment(PyObject* segmentList, size_t count, PyObject* format)
+Segments_free(Segments* segments)
 {
-    if (Py_None != segmentList)
+    if (segments->lengths != segments->inlineLengths)
     {
-        PyObject* segment = Py_BuildValue("iO", count, format);
-        PyList_Append(segmentList, segment);
+        PyMem_RawFree(segments->lengths);
+        PyMem_RawFree(segments->formats);
     }
 }
 
 static void
-Context_appendTextType(size_t fromIndex, size_t count, PyObject* textTypeMap, Py_UNICODE textType)
+Segments_append(Segments* segments, size_t count, PyObject* format)
 {
-    size_t i;
-    for (i = fromIndex; i < fromIndex + count; i++)
-        PyUnicode_WriteChar(textTypeMap, i, textType);
-}
+    if ( ! segments->enabled || segments->failed)
+        return;
+
+    if (segments->count == segments->capacity)
+    {
+        size_t capacity = segments->capacity * 2;
+        size_t* lengths = PyMem_RawMalloc(capacity * sizeof *lengths);
+        PyObject** formats = PyMem_RawMalloc(capacity * sizeof *formats);
+        if (lengths == NULL || formats == NULL)
+        {
+            PyMem_RawFree(lengths);
+            PyMem_RawFree(formats);
+            segments->failed = true;
+            return;
+        }
+        memcpy(lengths, segments->lengths, segments->count * sizeof *lengths);
+        memcpy(formats, segments->formats, segments->count * sizeof *formats);
+        Segments_free(segments);
+        segments->lengths = lengths;
+        segments->formats = formats;
+        segments->capacity = capacity;
+    }
 
+    segments->lengths[segments->count] = count;
+    segments->formats[segments->count] = format;
+    segments->count++;
+}
 
-static size_t
-Context_parseBlock(Context* self,
-                   size_t currentColumnIndex,
-                   PyObject* unicodeText,
-                   PyObject* segmentList,
-                   PyObject* textTypeMap,
-                   ContextStack** pContextStack,
-                   bool* pLineContinue)
+/* Make list of (length, format) tuples or None, if segments are not enabled */
+static PyObject*
+Segments_toList(Segments* segments)
 {
-    size_t startColumnIndex = currentColumnIndex;
-    size_t wholeLineLen;
-    size_t countOfNotMatchedSymbols = 0;
+    PyObject* segmentList;
+    size_t i;
 
-    TextToMatchObject_internal textToMatchObject =
-                    TextToMatchObject_internal_make(currentColumnIndex,
-                                                    unicodeText,
-                                                    ContextStack_currentData(*pContextStack));
+    if ( ! segments->enabled)
+    {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
 
-    wholeLineLen = PyUnicode_GET_SIZE(textToMatchObject.wholeLineUnicodeText);
+    if (segments->failed)
+        return PyErr_NoMemory();
 
-    *pLineContinue = false;
+    segmentList = PyList_New(segments->count);
+    if (segmentList == NULL)
+        return NULL;
 
-    if (wholeLineLen == 0)
+    for (i = 0; i < segments->count; i++)
     {
-        if ((PyObject*)self->lineEmptyContext != Py_None)
+        PyObject* segment = Py_BuildValue("nO", (Py_ssize_t)segments->lengths[i], segments->formats[i]);
+        if (segment == NULL)
         {
-            ContextStack* newContextStack =
-                    ContextSwitcher_getNextContextStack((ContextSwitcher*)self->lineEmptyContext,
-                                                        *pContextStack,
-                                                        NULL);
-            if (newContextStack != *pContextStack)
-            {
-                ASSIGN_VALUE(ContextStack, *pContextStack, newContextStack);
-            }
+            Py_DECREF(segmentList);
+            return NULL;
+        }
+        PyList_SET_ITEM(segmentList, i, segment);
+    }
+
+    return segmentList;
+}
+
+/* Get index of the format in the format table. The format is appended, if not found. -1 for None.
+ * Syntaxes have few formats, linear search is quicker than hashing
+ */
+static int
+_formatIndex(PyObject* formats, PyObject* format)
+{
+    Py_ssize_t size = PyList_GET_SIZE(formats);
+    Py_ssize_t i;
+
+    if (Py_None == format)
+        return -1;
+
+    for (i = 0; i < size; i++)
+    {
+        if (PyList_GET_ITEM(formats, i) == format)
+            return (int)i;
+    }
+
+    if (PyList_Append(formats, format) != 0)
+        return -2;
+
+    return (int)size;
+}
+
+/* Fill the bytearray with (start, length, format index) triples of native ints.
+ * No Python objects are made, except new items of the format table
+ */
+static bool
+Segments_pack(Segments* segments, PyObject* buffer, PyObject* formats)
+{
+    int* packed;
+    size_t start = 0;
+    size_t i;
+    PyObject* prevFormat = NULL;
+    int prevFormatIndex = -1;
+
+    if (segments->failed)
+    {
+        PyErr_NoMemory();
+        return false;
+    }
+
+    if (PyByteArray_Resize(buffer, segments->count * 3 * sizeof(int)) != 0)
+        return false;
+
+    packed = (int*)PyByteArray_AS_STRING(buffer);
+    for (i = 0; i < segments->count; i++)
+    {
+        if (segments->formats[i] != prevFormat)
+        {
+            prevFormat = segments->formats[i];
+            prevFormatIndex = _formatIndex(formats, prevFormat);
+            if (prevFormatIndex == -2)
+                return false;
+        }
+
+        packed[i * 3] = (int)start;
+        packed[i * 3 + 1] = (int)segments->lengths[i];
+        packed[i * 3 + 2] = prevFormatIndex;
+        start += segments->lengths[i];
+    }
+
+    return true;
+}
+
+/* Run-length encoded text type map of a line. Converted to qutepart.syntax.texttypemap.TextTypeMap */
+typedef struct {
+    size_t count;
+    size_t capacity;
+    Py_UCS4* types;
+    unsigned int* ends;  /* exclusive */
+    unsigned int inlineEnds[16];  /* the most of lines have few runs. Not allocated */
+    Py_UCS4 inlineTypes[16];
+    bool failed;  /* not enough memory */
+} TextTypeRuns;
+
+static PyObject* textTypeMapType = NULL;
+static PyObject* singleRunTextTypeMap = NULL;  /* makes shared maps of lines with one run */
+static PyObject* singleRunTextTypeMaps = NULL;  /* the cache of shared maps */
+static PyObject* arrayType = NULL;
+
+static void
+TextTypeRuns_init(TextTypeRuns* runs)
+{
+    runs->count = 0;
+    runs->capacity = sizeof runs->inlineEnds / sizeof runs->inlineEnds[0];
+    runs->types = runs->inlineTypes;
+    runs->ends = runs->inlineEnds;
+    runs->failed = false;
+}
+
+static void
+TextTypeRuns_free(TextTypeRuns* runs)
+{
+    if (runs->ends != runs->inlineEnds)
+    {
+        PyMem_RawFree(runs->ends);
+        PyMem_RawFree(runs->types);
+    }
+}
+
+static bool
+TextTypeRuns_append(TextTypeRuns* runs, size_t count, Py_UCS4 textType)
+{
+    size_t start = runs->count > 0 ? runs->ends[runs->count - 1] : 0;
+
+    if (count == 0 || runs->failed)
+        return ! runs->failed;
+
+    if (runs->count > 0 && runs->types[runs->count - 1] == textType)
+    {
+        runs->ends[runs->count - 1] = start + count;
+        return true;
+    }
+
+    if (runs->count == runs->capacity)
+    {
+        size_t capacity = runs->capacity * 2;
+        unsigned int* ends = PyMem_RawMalloc(capacity * sizeof *ends);
+        Py_UCS4* types = PyMem_RawMalloc(capacity * sizeof *types);
+        if (ends == NULL || types == NULL)
+        {
+            PyMem_RawFree(ends);
+            PyMem_RawFree(types);
+            runs->failed = true;
+            return false;
         }
+        memcpy(ends, runs->ends, runs->count * sizeof *ends);
+        memcpy(types, runs->types, runs->count * sizeof *types);
+        TextTypeRuns_free(runs);
+        runs->ends = ends;
+        runs->types = types;
+        runs->capacity = capacity;
+    }
+
+    runs->types[runs->count] = textType;
+    runs->ends[runs->count] = start + count;
+    runs->count++;
+    return true;
+}
+
+/* Make TextTypeMap of length textLen. Text without a text type is code */
+static PyObject*
+TextTypeRuns_toTextTypeMap(TextTypeRuns* runs, size_t textLen)
+{
+    PyObject* types;
+    PyObject* ends;
+    PyObject* textTypeMap;
+    size_t end = runs->count > 0 ? runs->ends[runs->count - 1] : 0;
+
+    if (end < textLen)
+        TextTypeRuns_append(runs, textLen - end, ' ');
+
+    if (runs->failed)
+        return PyErr_NoMemory();
+
+    types = PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND, runs->types, runs->count);
+    if (types == NULL)
+        return NULL;
+
+    if (runs->count <= 1)
+    {
+        PyObject* key = Py_BuildValue("Nn", types, (Py_ssize_t)textLen);
+        if (key == NULL)
+            return NULL;
+
+        textTypeMap = PyDict_GetItem(singleRunTextTypeMaps, key);  // borrowed
+        if (textTypeMap != NULL)
+            Py_INCREF(textTypeMap);
+        else
+            textTypeMap = PyObject_Call(singleRunTextTypeMap, key, NULL);
+        Py_DECREF(key);
+        return textTypeMap;
+    }
+
+    // the last end is the length
+    ends = PyBytes_FromStringAndSize((const char*)runs->ends,
+                                     (runs->count - 1) * sizeof(unsigned int));
+    if (ends != NULL)
+        ends = PyObject_CallFunction(arrayType, "sN", "I", ends);
+    if (ends == NULL)
+    {
+        Py_DECREF(types);
+        return NULL;
+    }
+
+    textTypeMap = PyObject_CallFunction(textTypeMapType, "NNn", types, ends, (Py_ssize_t)textLen);
+    return textTypeMap;
+}
+
+static void
+Context_appendTextType(size_t fromIndex, size_t count, TextTypeRuns* textTypeMap, Py_UNICODE textType)
+{
+    size_t end = textTypeMap->count > 0 ? textTypeMap->ends[textTypeMap->count - 1] : 0;
+
+    if (fromIndex > end)  // not parsed text is code
+        TextTypeRuns_append(textTypeMap, fromIndex - end, ' ');
+    TextTypeRuns_append(textTypeMap, count, textType);
+}
+
+/* State of parsing of a line. See Parser_parseBlock_internal()
+ */
+typedef struct {
+    TextToMatchObject_internal textToMatchObject;
+    _LineContextStack contextStack;
+    Segments segments;
+    TextTypeRuns textTypeRuns;
+    _LineBudget* budget;  // NULL if not limited
+    PyThreadState* threadState;  // NULL if the GIL is held
+} _LineParser;
+
+
+static size_t
+Context_parseBlock(Context* self,
+                   size_t currentColumnIndex,
+                   _LineParser* line,
+                   bool* pLineContinue)
+{
+    size_t startColumnIndex = currentColumnIndex;
+    TextToMatchObject_internal* textToMatchObject = &line->textToMatchObject;
+    size_t wholeLineLen = textToMatchObject->wholeLineLen;
+    size_t countOfNotMatchedSymbols = 0;
+    bool dispatchTableMade;
+
+    TextToMatchObject_internal_reset(textToMatchObject, _LineContextStack_currentData(&line->contextStack));
+
+    *pLineContinue = false;
+
+    Context_ensureDispatchTable(self, line->threadState);
+    dispatchTableMade = QUTEPART_ATOMIC_LOAD(&self->dispatchTableMade);
+
+    if (wholeLineLen == 0)
+    {
+        if ((PyObject*)self->lineEmptyContext != Py_None)
+            ContextSwitcher_switch((ContextSwitcher*)self->lineEmptyContext, &line->contextStack, NULL);
     }
     else
     {
         while (currentColumnIndex < wholeLineLen)
         {
             size_t i;
+            AbstractRule** rules;
+            size_t rulesSize;
             RuleTryMatchResult_internal result;
 
             Parser* parentParser = (Parser*)self->parser;
-            TextToMatchObject_internal_update(&textToMatchObject, currentColumnIndex, &parentParser->deliminatorSet);
+
+            if (NULL != line->budget && _LineBudget_step(line->budget))
+            {
+                *pLineContinue = false;
+                break;
+            }
+
+            TextToMatchObject_internal_update(textToMatchObject, currentColumnIndex, &parentParser->deliminatorSet);
 
             result.rule = NULL;
 
-            for (i = 0; i < self->rulesSize; i++)
+            if ( ! dispatchTableMade)  // failed to make the dispatch table
+            {
+                rules = self->rulesC;
+                rulesSize = self->rulesSize;
+            }
+            else if (textToMatchObject->unicodeText[0] < QUTEPART_DISPATCH_TABLE_SIZE)
+            {
+                rules = self->rulesForChar[textToMatchObject->unicodeText[0]];
+                rulesSize = self->rulesForCharSize[textToMatchObject->unicodeText[0]];
+            }
+            else
+            {
+                rules = self->flatRulesC;
+                rulesSize = self->flatRulesSize;
+            }
+
+            for (i = 0; i < rulesSize; i++)
             {
-                result = AbstractRule_tryMatch_internal((AbstractRule*)self->rulesC[i], &textToMatchObject);
+                result = AbstractRule_tryMatch_internal(rules[i], textToMatchObject);
 
                 if (NULL != result.rule)
                     break;
@@ -2850,9 +4398,10 @@ Context_parseBlock(Context* self,
             {
                 PyObject* format;
                 Py_UNICODE textType;
+                bool contextStackChanged = false;
                 *pLineContinue = result.lineContinue;
 
-                if (parentParser->debugOutputEnabled)
+                if (parentParser->debugOutputEnabled)  // the GIL is held
                 {
                     fprintf(stderr, "qutepart: \t");
                     PyObject_Print(self->name, stderr, 0);
@@ -2861,49 +4410,43 @@ Context_parseBlock(Context* self,
 
                 if (countOfNotMatchedSymbols > 0)
                 {
-                    Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format);
+                    Segments_append(&line->segments, countOfNotMatchedSymbols, self->format);
                     Context_appendTextType(currentColumnIndex - countOfNotMatchedSymbols, countOfNotMatchedSymbols,
-                                           textTypeMap, self->textType);
+                                           &line->textTypeRuns, self->textType);
                     countOfNotMatchedSymbols = 0;
                 }
 
-                ContextStack* newContextStack = NULL;
                 if (Py_None != (PyObject*)result.rule->abstractRuleParams->context)
                 {
-                    newContextStack =
-                        ContextSwitcher_getNextContextStack(result.rule->abstractRuleParams->context,
-                                                            *pContextStack,
-                                                            result.data);
-                } else
-                {
-                    newContextStack = *pContextStack;
+                    contextStackChanged = ContextSwitcher_switch(result.rule->abstractRuleParams->context,
+                                                                 &line->contextStack,
+                                                                 result.data);
                 }
 
                 if (Py_None != result.rule->abstractRuleParams->attribute)
                     format = result.rule->abstractRuleParams->format;
                 else
-                    format = ContextStack_currentContext(newContextStack)->format;
+                    format = _LineContextStack_currentContext(&line->contextStack)->format;
 
                 if ('\0' != result.rule->abstractRuleParams->textType)
                     textType = result.rule->abstractRuleParams->textType;
                 else
-                    textType = ContextStack_currentContext(newContextStack)->textType;
+                    textType = _LineContextStack_currentContext(&line->contextStack)->textType;
 
-                Context_appendSegment(segmentList,
-                                      result.length,
-                                      format);
+                Segments_append(&line->segments,
+                                result.length,
+                                format);
                 Context_appendTextType(currentColumnIndex, result.length,
-                                       textTypeMap,
+                                       &line->textTypeRuns,
                                        textType);
                 currentColumnIndex += result.length;
 
+                RuleTryMatchResult_internal_free(&result);
+
                 if (Py_None != (PyObject*)result.rule->abstractRuleParams->context)
                 {
-                    RuleTryMatchResult_internal_free(&result);
-
-                    if (newContextStack != *pContextStack)
+                    if (contextStackChanged)
                     {
-                        ASSIGN_VALUE(ContextStack, *pContextStack, newContextStack);
                         break; // while
                     }
                     else if (0 == result.length)
@@ -2918,17 +4461,10 @@ Context_parseBlock(Context* self,
             else // no match
             {
                 *pLineContinue = false;
-                if ((PyObject*)self->fallthroughContext != Py_None)
+                if ((PyObject*)self->fallthroughContext != Py_None &&
+                    ContextSwitcher_switch(self->fallthroughContext, &line->contextStack, NULL))
                 {
-                    ContextStack* newContextStack =
-                            ContextSwitcher_getNextContextStack(self->fallthroughContext,
-                                                                *pContextStack,
-                                                                NULL);
-                    if (newContextStack != *pContextStack)
-                    {
-                        ASSIGN_VALUE(ContextStack, *pContextStack, newContextStack);
-                        break; // while
-                    }
+                    break; // while
                 }
 
                 countOfNotMatchedSymbols++;
@@ -2940,15 +4476,13 @@ Context_parseBlock(Context* self,
 
     if (countOfNotMatchedSymbols > 0)
     {
-        Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format);
+        Segments_append(&line->segments, countOfNotMatchedSymbols, self->format);
         Context_appendTextType(currentColumnIndex - countOfNotMatchedSymbols, countOfNotMatchedSymbols,
-                               textTypeMap, self->textType);
+                               &line->textTypeRuns, self->textType);
 
         countOfNotMatchedSymbols = 0;
     }
 
-    TextToMatchObject_internal_free(&textToMatchObject);
-
     return currentColumnIndex - startColumnIndex;
 }
 
@@ -2963,6 +4497,10 @@ static PyMemberDef Parser_members[] = {
     {"lists", T_OBJECT_EX, offsetof(Parser, lists), READONLY, "Dictionary of lists of keywords"},
     {"deliminatorSet", T_OBJECT_EX, offsetof(Parser, deliminatorSet.setAsUnicodeString), READONLY,
                 "Set of deliminator characters (as string)"},
+    {"keywordsCaseSensitive", T_BOOL, offsetof(Parser, keywordsCaseSensitive), READONLY,
+                "Keywords are case sensitive"},
+    {"packedFormats", T_OBJECT_EX, offsetof(Parser, packedFormats), READONLY,
+                "Formats of segments, returned by highlightBlockPacked(), indexed by format index"},
     {NULL}
 };
 
@@ -2975,6 +4513,7 @@ Parser_dealloc(Parser* self)
     Py_XDECREF(self->contexts);
     Py_XDECREF(self->defaultContext);
     Py_XDECREF(self->defaultContextStack);
+    Py_XDECREF(self->packedFormats);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
@@ -3003,15 +4542,17 @@ Parser_init(Parser *self, PyObject *args, PyObject *kwds)
 
     self->deliminatorSet = _MakeDeliminatorSet(deliminatorSet);
 
+    self->packedFormats = PyList_New(0);
+    if (NULL == self->packedFormats)
+        return -1;
+
     return 0;
 }
 
 static ContextStack*
 _makeDefaultContextStack(Context* defaultContext)
 {
-    _RegExpMatchGroups* data = NULL;
-
-    return ContextStack_new(&defaultContext, &data, 1);
+    return ContextStack_make(NULL, defaultContext, NULL);
 }
 
 
@@ -3038,19 +4579,26 @@ Parser_setConexts(Parser *self, PyObject *args)
 
 
 static bool
-Parser_contextStackEqualToDefault(Context* defaultContext, ContextStack* contextStack)
+Parser_contextStackEqualToDefault(Parser* self, ContextStack* contextStack)
 {
-    return contextStack->_size == 1 &&
-           ContextStack_currentContext(contextStack) == defaultContext &&
-           ContextStack_currentData(contextStack) == NULL;
+    return contextStack == self->defaultContextStack;  // stacks are interned
 }
 
 
+/* The line is parsed with the GIL released, so several lines or documents can be parsed by threads in parallel.
+ * Python objects are touched only before and after the parsing: the texts of TextToMatchObject_internal are made,
+ * and the context stack, segments and text type map are converted to Python objects.
+ * The GIL is held, if profiling or debug output is enabled.
+ *
+ * Returns lineData and list of segments, if returnSegments.
+ * If returnExhausted, a bool is appended, which is True if the budget was exhausted and the line is cut.
+ * If packedBuffer is not NULL, segments are packed to it and only lineData is returned
+ */
 static PyObject*
-Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
+Parser_parseBlock_internal(Parser *self, PyObject* unicodeText, ContextStack* prevContextStack,
+                           unsigned long maxSteps, double maxTime,
+                           bool returnSegments, bool returnExhausted, PyObject* packedBuffer)
 {
-    PyObject* unicodeText = NULL;
-    ContextStack* prevContextStack = NULL;
     Context* currentContext;
     PyObject* segmentList = NULL;
     bool lineContinue = false;
@@ -3058,43 +4606,35 @@ Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
     size_t textLen;
     PyObject* textTypeMap;
     ContextStack* contextStack;
-
-    if (! PyArg_ParseTuple(args, "|OO",
-                           &unicodeText,
-                           &prevContextStack))
-        return NULL;
-
-    UNICODE_CHECK(unicodeText, NULL);
-    if (Py_None != (PyObject*)(prevContextStack))
-        TYPE_CHECK(prevContextStack, ContextStack, NULL);
+    bool profiling = _profilingEnabled;
+    _LineBudget budget;
+    _LineParser line;
 
     if (Py_None != (PyObject*)prevContextStack)
         contextStack = prevContextStack;
     else
         contextStack = self->defaultContextStack;
 
-    Py_INCREF(contextStack);
+    Py_INCREF(contextStack);  // keeps frames of line.contextStack alive
 
-    currentContext = ContextStack_currentContext(contextStack);
+    textLen = PyUnicode_GET_SIZE(unicodeText);
+    line.textToMatchObject = TextToMatchObject_internal_make(0, unicodeText, NULL);
+    line.textToMatchObject.profiling = profiling;
+    _LineContextStack_init(&line.contextStack, contextStack);
+    Segments_init(&line.segments, returnSegments || NULL != packedBuffer);
+    TextTypeRuns_init(&line.textTypeRuns);
+    _LineBudget_init(&budget, maxSteps, maxTime);
+    line.budget = (maxSteps > 0 || maxTime > 0) ? &budget : NULL;
+    line.threadState = NULL;
 
-    segmentList = NULL;
-    if (returnSegments)
-    {
-        segmentList = PyList_New(0);
-    }
-    else
-    {
-        segmentList = Py_None;
-        Py_INCREF(Py_None);
-    }
+    if ( ! profiling && ! self->debugOutputEnabled)
+        line.threadState = PyEval_SaveThread();
 
-    textLen = PyUnicode_GET_SIZE(unicodeText);
-    textTypeMap = PyUnicode_New(textLen, 65535);
-    if (textLen > 0)
-        PyUnicode_Fill(textTypeMap, 0, textLen, ' ');
+    currentContext = _LineContextStack_currentContext(&line.contextStack);
 
     do {
         size_t length;
+        double startTime = 0;
 
         if (self->debugOutputEnabled)
         {
@@ -3103,54 +4643,101 @@ Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
             fprintf(stderr, "\n");
         }
 
-        length = Context_parseBlock( currentContext,
-                                     currentColumnIndex,
-                                     unicodeText,
-                                     segmentList,
-                                     textTypeMap,
-                                     &contextStack,
-                                     &lineContinue);
+        if (profiling)
+            startTime = _monotonicTime();
+
+        length = Context_parseBlock(currentContext,
+                                    currentColumnIndex,
+                                    &line,
+                                    &lineContinue);
+
+        if (profiling)
+            _profileAdd(&_profiledContexts, (PyObject*)currentContext, &currentContext->profile, false, startTime);
+
         currentColumnIndex += length;
-        currentContext = ContextStack_currentContext(contextStack);
+
+        if (budget.exhausted)
+        {
+            // the rest of the line gets the format of the current context
+            if (currentColumnIndex < textLen)
+            {
+                Segments_append(&line.segments, textLen - currentColumnIndex, currentContext->format);
+                Context_appendTextType(currentColumnIndex, textLen - currentColumnIndex,
+                                       &line.textTypeRuns, currentContext->textType);
+            }
+            break;
+        }
+
+        currentContext = _LineContextStack_currentContext(&line.contextStack);
     } while (currentColumnIndex < textLen);
 
     if ( ! lineContinue)
     {
-        while (currentContext->lineEndContext != Py_None)
+        int lineEndSwitches;
+
+        for (lineEndSwitches = 0;
+             currentContext->lineEndContext != Py_None && lineEndSwitches < QUTEPART_MAX_LINE_END_SWITCHES;
+             lineEndSwitches++)
         {
-            ContextStack* newContextStack =
-                           ContextSwitcher_getNextContextStack((ContextSwitcher*)currentContext->lineEndContext,
-                                                               contextStack,
-                                                               NULL);
-            ASSIGN_VALUE(ContextStack, contextStack, newContextStack);
+            ContextSwitcher_switch((ContextSwitcher*)currentContext->lineEndContext,
+                                   &line.contextStack,
+                                   NULL);
 
-            if (currentContext == ContextStack_currentContext(contextStack))
+            if (currentContext == _LineContextStack_currentContext(&line.contextStack))
             {
                 // current context not changed.
-                // probably, ContextSwitcher_getNextContextStack failed to switch context because max context stack depth reached
+                // probably, ContextSwitcher_switch failed to switch context because max context stack depth reached
                 // break for avoid infinite loop
                 break;
             }
-            currentContext = ContextStack_currentContext(contextStack);
+            currentContext = _LineContextStack_currentContext(&line.contextStack);
         }
 
         // this code is not tested, because lineBeginContext is not defined by any xml file
         if (currentContext->lineBeginContext != Py_None)
         {
-            ContextStack* newContextStack =
-                           ContextSwitcher_getNextContextStack((ContextSwitcher*)currentContext->lineBeginContext,
-                                                               contextStack,
-                                                               NULL);
-            ASSIGN_VALUE(ContextStack, contextStack, newContextStack);
+            ContextSwitcher_switch((ContextSwitcher*)currentContext->lineBeginContext,
+                                   &line.contextStack,
+                                   NULL);
 
-            currentContext = ContextStack_currentContext(contextStack);
+            currentContext = _LineContextStack_currentContext(&line.contextStack);
         }
     }
 
-    if (PyErr_Occurred())
+    if (NULL != line.threadState)
+        PyEval_RestoreThread(line.threadState);
+
+    TextToMatchObject_internal_free(&line.textToMatchObject);
+
+    {
+        ContextStack* newContextStack = _LineContextStack_toContextStack(&line.contextStack);
+        _LineContextStack_free(&line.contextStack);
+        Py_DECREF(contextStack);
+        contextStack = newContextStack;
+    }
+
+    if (NULL != packedBuffer)
+    {
+        segmentList = Py_None;
+        Py_INCREF(segmentList);
+        if ( ! Segments_pack(&line.segments, packedBuffer, self->packedFormats))
+            Py_CLEAR(segmentList);
+    }
+    else
+    {
+        segmentList = Segments_toList(&line.segments);
+    }
+    Segments_free(&line.segments);
+
+    textTypeMap = NULL;
+    if (NULL != segmentList && ! PyErr_Occurred())
+        textTypeMap = TextTypeRuns_toTextTypeMap(&line.textTypeRuns, textLen);
+    TextTypeRuns_free(&line.textTypeRuns);
+
+    if (textTypeMap == NULL)
     {
         Py_DECREF(contextStack);
-        Py_DECREF(textTypeMap);
+        Py_XDECREF(segmentList);
         return NULL;
     }
     else
@@ -3158,7 +4745,7 @@ Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
         PyObject* retStack = NULL;
         PyObject* retContextData;
 
-        if ( ! Parser_contextStackEqualToDefault(self->defaultContext, contextStack))
+        if ( ! Parser_contextStackEqualToDefault(self, contextStack))
         {
             retStack = (PyObject*)contextStack;
         }
@@ -3169,33 +4756,211 @@ Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
             Py_DECREF(contextStack);
         }
 
-        retContextData = Py_BuildValue("OO", retStack, textTypeMap);
+        retContextData = Py_BuildValue("NN", retStack, textTypeMap);
 
         if (Py_None != segmentList)
-            return Py_BuildValue("OO", retContextData, segmentList);
+        {
+            if (returnExhausted)
+                return Py_BuildValue("NNO", retContextData, segmentList, budget.exhausted ? Py_True : Py_False);
+            else
+                return Py_BuildValue("NN", retContextData, segmentList);
+        }
         else
+        {
+            Py_DECREF(segmentList);
             return retContextData;
+        }
     }
 }
 
 
+static PyObject*
+Parser_parseBlockArgs(Parser *self, PyObject *args, bool returnSegments, bool returnExhausted)
+{
+    PyObject* unicodeText = NULL;
+    ContextStack* prevContextStack = NULL;
+    unsigned long maxSteps = 0;
+    double maxTime = 0;
+
+    if (! PyArg_ParseTuple(args, "|OOkd",
+                           &unicodeText,
+                           &prevContextStack,
+                           &maxSteps,
+                           &maxTime))
+        return NULL;
+
+    UNICODE_CHECK(unicodeText, NULL);
+    if (Py_None != (PyObject*)(prevContextStack))
+        TYPE_CHECK(prevContextStack, ContextStack, NULL);
+
+    return Parser_parseBlock_internal(self, unicodeText, prevContextStack, maxSteps, maxTime,
+                                      returnSegments, returnExhausted, NULL);
+}
+
 static PyObject*
 Parser_parseBlock(Parser *self, PyObject *args)
 {
-    return Parser_parseBlock_internal(self, args, false);
+    return Parser_parseBlockArgs(self, args, false, false);
 }
 
 static PyObject*
 Parser_highlightBlock(Parser *self, PyObject *args)
 {
-    return Parser_parseBlock_internal(self, args, true);
+    return Parser_parseBlockArgs(self, args, true, false);
+}
+
+static PyObject*
+Parser_highlightBlockLimited(Parser *self, PyObject *args)
+{
+    return Parser_parseBlockArgs(self, args, true, true);
+}
+
+static PyObject*
+Parser_highlightBlockPacked(Parser *self, PyObject *args)
+{
+    PyObject* unicodeText = NULL;
+    ContextStack* prevContextStack = NULL;
+    PyObject* buffer = NULL;
+    unsigned long maxSteps = 0;
+    double maxTime = 0;
+
+    if (! PyArg_ParseTuple(args, "OOO|kd",
+                           &unicodeText,
+                           &prevContextStack,
+                           &buffer,
+                           &maxSteps,
+                           &maxTime))
+        return NULL;
+
+    UNICODE_CHECK(unicodeText, NULL);
+    if (Py_None != (PyObject*)(prevContextStack))
+        TYPE_CHECK(prevContextStack, ContextStack, NULL);
+    if ( ! PyByteArray_Check(buffer))
+    {
+        PyErr_SetString(PyExc_TypeError, "buffer must be a bytearray");
+        return NULL;
+    }
+
+    return Parser_parseBlock_internal(self, unicodeText, prevContextStack, maxSteps, maxTime,
+                                      false, false, buffer);
+}
+
+/* Make match groups from a tuple of strings. Memory layout is the same as _RegExpMatchGroups_fromMatch() output
+ */
+static _RegExpMatchGroups*
+_RegExpMatchGroups_fromTuple(PyObject* tuple)
+{
+    Py_ssize_t size = PyTuple_GET_SIZE(tuple);
+    Py_ssize_t i;
+    size_t bufferSize = size * sizeof(char*);
+    const char** data;
+    char* string;
+
+    for (i = 0; i < size; i++)
+    {
+        PyObject* item = PyTuple_GET_ITEM(tuple, i);
+        if (Py_None != item)
+        {
+            const char* utf8;
+            if ( ! PyUnicode_Check(item))
+            {
+                PyErr_SetString(PyExc_TypeError, "Context data item must be a string or None");
+                return NULL;
+            }
+            utf8 = PyUnicode_AsUTF8(item);
+            if (NULL == utf8)
+                return NULL;
+            bufferSize += strlen(utf8);
+        }
+        bufferSize += 1;
+    }
+
+    data = (const char**)PyMem_RawMalloc(bufferSize);
+    string = (char*)(data + size);
+    for (i = 0; i < size; i++)
+    {
+        PyObject* item = PyTuple_GET_ITEM(tuple, i);
+        const char* utf8 = (Py_None != item) ? PyUnicode_AsUTF8(item) : "";
+        strcpy(string, utf8);
+        data[i] = string;
+        string += strlen(utf8) + 1;
+    }
+
+    return _RegExpMatchGroups_new(size, data);
+}
+
+static PyObject*
+Parser_makeContextStack(Parser *self, PyObject *args)
+{
+    PyObject* frames = NULL;
+    ContextStack* contextStack = NULL;
+    Py_ssize_t i;
+
+    if (! PyArg_ParseTuple(args, "O", &frames))
+        return NULL;
+
+    frames = PySequence_Fast(frames, "frames must be a sequence");
+    if (NULL == frames)
+        return NULL;
+
+    for (i = 0; i < PySequence_Fast_GET_SIZE(frames); i++)
+    {
+        PyObject* context = NULL;
+        PyObject* data = NULL;
+        _RegExpMatchGroups* groups = NULL;
+        ContextStack* newContextStack;
+
+        if (! PyArg_ParseTuple(PySequence_Fast_GET_ITEM(frames, i), "OO", &context, &data) ||
+            ! PyObject_TypeCheck(context, &ContextType) ||
+            (Py_None != data && ! PyTuple_Check(data)))
+        {
+            if ( ! PyErr_Occurred())
+                PyErr_SetString(PyExc_TypeError, "Frame must be a tuple (context, data)");
+            Py_XDECREF(contextStack);
+            Py_DECREF(frames);
+            return NULL;
+        }
+
+        if (Py_None != data)
+        {
+            groups = _RegExpMatchGroups_fromTuple(data);
+            if (NULL == groups)
+            {
+                Py_XDECREF(contextStack);
+                Py_DECREF(frames);
+                return NULL;
+            }
+        }
+
+        newContextStack = ContextStack_make(contextStack, (Context*)context, groups);
+        _RegExpMatchGroups_release(groups);
+        Py_XDECREF(contextStack);
+        contextStack = newContextStack;
+    }
+
+    Py_DECREF(frames);
+
+    if (NULL == contextStack)
+    {
+        PyErr_SetString(PyExc_ValueError, "Context stack must contain at least one frame");
+        return NULL;
+    }
+
+    return (PyObject*)contextStack;
 }
 
 static PyMethodDef Parser_methods[] = {
     {"setContexts", (PyCFunction)Parser_setConexts, METH_VARARGS,  "Set list of parser contexts"},
-    {"parseBlock", (PyCFunction)Parser_parseBlock, METH_VARARGS,  "Parse line of text and return line data"},
+    {"parseBlock", (PyCFunction)Parser_parseBlock, METH_VARARGS,
+            "Parse line of text and return line data. Optional maxSteps and maxTime limit parsing of the line"},
     {"highlightBlock", (PyCFunction)Parser_highlightBlock, METH_VARARGS,
             "Parse line of text and return line data and highlighted segments"},
+    {"highlightBlockLimited", (PyCFunction)Parser_highlightBlockLimited, METH_VARARGS,
+            "Parse line of text and return line data, highlighted segments and True, if maxSteps or maxTime is exhausted"},
+    {"highlightBlockPacked", (PyCFunction)Parser_highlightBlockPacked, METH_VARARGS,
+            "Parse line of text, fill bytearray with (start, length, format index) triples and return line data"},
+    {"makeContextStack", (PyCFunction)Parser_makeContextStack, METH_VARARGS,
+            "Make context stack from frames, as returned by ContextStack.frames()"},
     {NULL}  /* Sentinel */
 };
 
@@ -3207,7 +4972,80 @@ DECLARE_TYPE_WITH_MEMBERS(Parser, Parser_methods, "Parser");
  ********************************************************************************/
 
 
+static PyObject*
+profileInfo(PyObject* self, PyObject* args)
+{
+    Py_ssize_t i;
+    PyObject* contextProfiles = PyList_New(0);
+    PyObject* ruleProfiles = PyList_New(0);
+
+    if (NULL == contextProfiles || NULL == ruleProfiles)
+        goto error;
+
+    for (i = 0; NULL != _profiledContexts && i < PyList_GET_SIZE(_profiledContexts); i++)
+    {
+        Context* context = (Context*)PyList_GET_ITEM(_profiledContexts, i);
+        PyObject* item = Py_BuildValue("(Okd)", context, context->profile.count, context->profile.time);
+        if (NULL == item || 0 != PyList_Append(contextProfiles, item))
+        {
+            Py_XDECREF(item);
+            goto error;
+        }
+        Py_DECREF(item);
+    }
+
+    for (i = 0; NULL != _profiledRules && i < PyList_GET_SIZE(_profiledRules); i++)
+    {
+        AbstractRule* rule = (AbstractRule*)PyList_GET_ITEM(_profiledRules, i);
+        PyObject* item = Py_BuildValue("(OOkkd)", rule, rule->abstractRuleParams->parentContext,
+                                       rule->profile.count, rule->profile.matches, rule->profile.time);
+        if (NULL == item || 0 != PyList_Append(ruleProfiles, item))
+        {
+            Py_XDECREF(item);
+            goto error;
+        }
+        Py_DECREF(item);
+    }
+
+    return Py_BuildValue("(NN)", contextProfiles, ruleProfiles);
+
+error:
+    Py_XDECREF(contextProfiles);
+    Py_XDECREF(ruleProfiles);
+    return NULL;
+}
+
+static PyObject*
+clearProfile(PyObject* self, PyObject* args)
+{
+    Py_ssize_t i;
+
+    for (i = 0; NULL != _profiledContexts && i < PyList_GET_SIZE(_profiledContexts); i++)
+        memset(&((Context*)PyList_GET_ITEM(_profiledContexts, i))->profile, 0, sizeof(_ProfileCounters));
+
+    for (i = 0; NULL != _profiledRules && i < PyList_GET_SIZE(_profiledRules); i++)
+        memset(&((AbstractRule*)PyList_GET_ITEM(_profiledRules, i))->profile, 0, sizeof(_ProfileCounters));
+
+    Py_CLEAR(_profiledContexts);
+    Py_CLEAR(_profiledRules);
+
+    Py_RETURN_NONE;
+}
+
+
 static PyMethodDef cParser_methods[] = {
+    {"dynamicRegExpCacheInfo", (PyCFunction)dynamicRegExpCacheInfo, METH_NOARGS,
+            "Get (hits, misses, size, maximum size) of the cache of compiled patterns of dynamic RegExpr rules"},
+    {"clearDynamicRegExpCache", (PyCFunction)clearDynamicRegExpCache, METH_NOARGS,
+            "Clear the cache of compiled patterns of dynamic RegExpr rules and reset counters"},
+    {"regExpBackend", (PyCFunction)regExpBackend, METH_NOARGS,
+            "Get (library name, version, JIT is supported) of the regular expression library"},
+    {"setProfilingEnabled", (PyCFunction)setProfilingEnabled, METH_O,
+            "Enable or disable counting of trials, matches and time of rules and contexts"},
+    {"profileInfo", (PyCFunction)profileInfo, METH_NOARGS,
+            "Get ([(context, blocks, time)], [(rule, context, trials, matches, time)])"},
+    {"clearProfile", (PyCFunction)clearProfile, METH_NOARGS,
+            "Reset counters of rules and contexts"},
     {NULL}  /* Sentinel */
 };
 
@@ -3233,7 +5071,45 @@ PyInit_cParser(void)
 
     _utf8CharacterLengthTable_init();
 
+    if (NULL == _dynamicRegExpLock)
+    {
+        _dynamicRegExpLock = PyThread_allocate_lock();
+        if (NULL == _dynamicRegExpLock)
+            return PyErr_NoMemory();
+    }
+
     m = PyModule_Create(&moduledef);
+    if (m == NULL)
+        return NULL;
+
+    if (textTypeMapType == NULL)
+    {
+        PyObject* module = PyImport_ImportModule("qutepart.syntax.texttypemap");
+        if (module == NULL)
+            return NULL;
+        textTypeMapType = PyObject_GetAttrString(module, "TextTypeMap");
+        singleRunTextTypeMap = PyObject_GetAttrString(module, "_singleRunMap");
+        singleRunTextTypeMaps = PyObject_GetAttrString(module, "_singleRunMaps");
+        Py_DECREF(module);
+        if (textTypeMapType == NULL || singleRunTextTypeMap == NULL || singleRunTextTypeMaps == NULL)
+            return NULL;
+
+        module = PyImport_ImportModule("array");
+        if (module == NULL)
+            return NULL;
+        arrayType = PyObject_GetAttrString(module, "array");
+        Py_DECREF(module);
+        if (arrayType == NULL)
+            return NULL;
+
+        module = PyImport_ImportModule("qutepart.syntax.parser");
+        if (module == NULL)
+            return NULL;
+        offsetMatchingPattern = PyObject_GetAttrString(module, "_offsetMatchingPattern");
+        Py_DECREF(module);
+        if (offsetMatchingPattern == NULL)
+            return NULL;
+    }
 
     REGISTER_TYPE(AbstractRuleParams)
 
@@ -0,0 +1,219 @@
+"""Export of highlighted text to HTML and to ANSI colored terminal output.
+
+Qt is not used. Text is highlighted with highlightLines() line by line,
+therefore memory usage doesn't depend on the size of the input.
+
+HTML uses a CSS class per default style name, i.e. ``<span class="dsKeyword">``.
+Get the style sheet with htmlStyleSheet(). ANSI output uses 24-bit color escape sequences.
+Colors are taken from ColorTheme.
+"""
+
+import collections
+import html
+
+from qutepart.syntax import SyntaxManager, TextFormat, highlightLines
+from qutepart.syntax.colortheme import ColorTheme
+
+
+_LINES_PER_CHUNK = 1000
+
+_headlessSyntaxManager = None
+
+
+def _headlessSyntax(syntax):
+    """highlightLines() requires a headless syntax. Load it, if syntax has been loaded for Qt
+    """
+    global _headlessSyntaxManager
+    if syntax.manager.headless:
+        return syntax
+
+    if _headlessSyntaxManager is None:
+        _headlessSyntaxManager = SyntaxManager(headless=True)
+    return _headlessSyntaxManager.getSyntax(xmlFileName=syntax.xmlFileName)
+
+
+def _chunks(lines):
+    """Join lines to chunks of _LINES_PER_CHUNK lines to reduce count of write() calls
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == _LINES_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _documentLines(document):
+    block = document.firstBlock()
+    while block.isValid():
+        yield block.text()
+        block = block.next()
+
+
+def linesOf(source):
+    """Get iterable of lines from a QTextDocument or return source as is.
+    Source might be also a file object or any other iterable of strings
+    """
+    if hasattr(source, 'firstBlock'):
+        return _documentLines(source)
+    else:
+        return source
+
+
+def _highlight(lines, syntax):
+    """Generator. Yield (text, spans) for every line. See highlightLines()
+    """
+    texts = collections.deque()  # current line text. highlightLines() takes a line and yields its spans
+
+    def textsIterator():
+        for line in linesOf(lines):
+            text = line.rstrip('\r\n')
+            texts.append(text)
+            yield text
+
+    for spans in highlightLines(textsIterator(), _headlessSyntax(syntax)):
+        yield texts.popleft(), spans
+
+
+################################################################################
+##                               HTML
+################################################################################
+
+def htmlStyleSheet(theme=None, cssClass='qutepart'):
+    """Get CSS for HTML export. Rules are generated from the ColorTheme formats
+    """
+    if theme is None:
+        theme = ColorTheme(TextFormat)
+
+    default = TextFormat()
+    rules = []
+    for defStyleName, format in sorted(theme.format.items()):
+        properties = []
+        if format.color != default.color:
+            properties.append('color: %s' % format.color)
+        if format.background != default.background:
+            properties.append('background-color: %s' % format.background)
+        if format.bold:
+            properties.append('font-weight: bold')
+        if format.italic:
+            properties.append('font-style: italic')
+        if format.underline or format.strikeOut:
+            decorations = []
+            if format.underline:
+                decorations.append('underline')
+            if format.strikeOut:
+                decorations.append('line-through')
+            properties.append('text-decoration: %s' % ' '.join(decorations))
+
+        if properties:
+            rules.append('.%s .%s { %s; }\n' % (cssClass, defStyleName, '; '.join(properties)))
+
+    return ''.join(rules)
+
+
+def htmlLines(lines, syntax):
+    """Generator. Highlight lines and yield HTML code of every line, including line end.
+    Text without a style or with dsNormal style is not wrapped to a <span>
+    """
+    escape = html.escape
+    for text, spans in _highlight(lines, syntax):
+        parts = []
+        for start, length, attributeName, defStyleName, textType in spans:
+            part = escape(text[start:start + length], quote=False)
+            if defStyleName is None or defStyleName == 'dsNormal':
+                parts.append(part)
+            else:
+                parts.append('<span class="%s">%s</span>' % (defStyleName, part))
+        highlightedLength = sum(span[1] for span in spans)
+        parts.append(escape(text[highlightedLength:], quote=False))
+        parts.append('\n')
+        yield ''.join(parts)
+
+
+def exportHtml(lines, syntax, outFile, standalone=True, cssClass='qutepart'):
+    """Highlight lines and write HTML to outFile. Output is written in chunks.
+
+    If standalone is True, a complete HTML document with the style sheet is written,
+    otherwise only a <pre> element
+    """
+    if standalone:
+        outFile.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<style>\n')
+        outFile.write(htmlStyleSheet(cssClass=cssClass))
+        outFile.write('</style>\n</head>\n<body>\n')
+
+    outFile.write('<pre class="%s">' % cssClass)
+    for chunk in _chunks(htmlLines(lines, syntax)):
+        outFile.write(chunk)
+    outFile.write('</pre>\n')
+
+    if standalone:
+        outFile.write('</body>\n</html>\n')
+
+
+################################################################################
+##                               ANSI
+################################################################################
+
+_ANSI_RESET = '\x1b[0m'
+
+
+def _parseColor(color):
+    color = color.lstrip('#')
+    if len(color) == 3:
+        color = ''.join([c * 2 for c in color])
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def _ansiSequence(format):
+    """Get escape sequence for the format. Empty string for the default format
+    """
+    default = TextFormat()
+    codes = []
+    if format.bold:
+        codes.append('1')
+    if format.italic:
+        codes.append('3')
+    if format.underline:
+        codes.append('4')
+    if format.strikeOut:
+        codes.append('9')
+    if format.color != default.color:
+        codes.append('38;2;%d;%d;%d' % _parseColor(format.color))
+    if format.background != default.background:
+        codes.append('48;2;%d;%d;%d' % _parseColor(format.background))
+
+    if codes:
+        return '\x1b[%sm' % ';'.join(codes)
+    else:
+        return ''
+
+
+def ansiLines(lines, syntax, theme=None):
+    """Generator. Highlight lines and yield ANSI colored text of every line, including line end
+    """
+    if theme is None:
+        theme = ColorTheme(TextFormat)
+    sequences = {defStyleName: _ansiSequence(format) \
+                    for defStyleName, format in theme.format.items()}
+
+    for text, spans in _highlight(lines, syntax):
+        parts = []
+        for start, length, attributeName, defStyleName, textType in spans:
+            sequence = sequences.get(defStyleName, '')
+            if sequence:
+                parts.extend((sequence, text[start:start + length], _ANSI_RESET))
+            else:
+                parts.append(text[start:start + length])
+        highlightedLength = sum(span[1] for span in spans)
+        parts.append(text[highlightedLength:])
+        parts.append('\n')
+        yield ''.join(parts)
+
+
+def exportAnsi(lines, syntax, outFile, theme=None):
+    """Highlight lines and write ANSI colored text to outFile. Output is written in chunks
+    """
+    for chunk in _chunks(ansiLines(lines, syntax, theme)):
+        outFile.write(chunk)
@@ -7,13 +7,14 @@ import sys
 import xml.etree.ElementTree
 import re
 import logging
+import hashlib
+import marshal
+import tempfile
 
+import qutepart.version
 from qutepart.syntax.colortheme import ColorTheme
 from qutepart.syntax import TextFormat
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QTextCharFormat, QColor, QFont
-
 
 _logger = logging.getLogger('qutepart')
 
@@ -29,6 +30,12 @@ if os.environ.get('QPART_CPARSER', 'Y') in ('Y', 'y', '1'):
 if binaryParserAvailable == False:
     import qutepart.syntax.parser as _parserModule
 
+# The Python parser matches neighbour rules with one regular expression. See parser.FusedRules
+fuseRules = (not binaryParserAvailable) and os.environ.get('QPART_FUSE_RULES', 'Y') in ('Y', 'y', '1')
+
+# Trivial rules of syntax definitions are rewritten before loading. See optimizeContexts()
+optimizeSyntax = os.environ.get('QPART_OPTIMIZE_SYNTAX', 'Y') in ('Y', 'y', '1')
+
 
 _seqReplacer = re.compile('\\\\.')
 
@@ -56,6 +63,12 @@ def _processEscapeSequences(replaceText):
 
 
 def _convertFormat(format):
+    """Convert TextFormat to QTextCharFormat.
+    PyQt5 is imported here, not on module level. Headless syntaxes do not need it
+    """
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QTextCharFormat, QColor, QFont
+
     if format == TextFormat():
         return None  # Do not apply default format. Performance optimization
 
@@ -132,22 +145,18 @@ def _safeGetRequiredAttribute(xmlElement, name, default):
 
 
 def _getContext(contextName, parser, defaultValue):
+    """Get reference to a context. See _resolveContext()
+    """
     if not contextName:
         return defaultValue
     if contextName in parser.contexts:
-        return parser.contexts[contextName]
-    elif contextName.startswith('##') and \
-         parser.syntax.manager is not None:  # might be None, if loader is used by regenerate-definitions-db.py
-        syntaxName = contextName[2:]
-        parser = parser.syntax.manager.getSyntax(languageName = syntaxName).parser
-        return parser.defaultContext
-    elif (not contextName.startswith('##')) and \
-         '##' in contextName and \
-         contextName.count('##') == 1 and \
-         parser.syntax.manager is not None:  # might be None, if loader is used by regenerate-definitions-db.py
+        return contextName
+    elif contextName.startswith('##'):
+        return (contextName[2:], None)
+    elif '##' in contextName and \
+         contextName.count('##') == 1:
         name, syntaxName = contextName.split('##')
-        parser = parser.syntax.manager.getSyntax(languageName = syntaxName).parser
-        return parser.contexts[name]
+        return (syntaxName, name)
     else:
         _logger.warning('Invalid context name %s', repr(contextName))
         return parser.defaultContext
@@ -171,11 +180,239 @@ def _makeContextSwitcher(contextOperation, parser):
         contextToSwitch = _getContext(rest, parser, None)
 
     if popsCount > 0 or contextToSwitch != None:
-        return _parserModule.ContextSwitcher(popsCount, contextToSwitch, contextOperation)
+        return (popsCount, contextToSwitch, contextOperation)
     else:
         return None
 
 
+################################################################################
+##                               First characters
+################################################################################
+# A rule gets a string of ASCII characters, which text matched by the rule might start with.
+# None, if not known. Contexts try only rules, which might match the current character.
+# The strings must not miss any character, which a rule matches in Python or in C parser
+
+_ASCII_CHARS = [chr(code) for code in range(128)]
+_ASCII_DIGITS = set('0123456789')
+_ASCII_WORD_CHARS = set([char for char in _ASCII_CHARS if char.isalnum() or char == '_'])
+_ASCII_SPACES = set([char for char in _ASCII_CHARS if char.isspace()])
+
+_REG_EXP_ESCAPED_CHARS = {'t': '\t', 'n': '\n', 'r': '\r', 'f': '\f',
+                          'v': '\n\v\f\r'}  # \v is a vertical space class in PCRE
+_REG_EXP_ESCAPED_CLASSES = {'d': _ASCII_DIGITS, 'w': _ASCII_WORD_CHARS, 's': _ASCII_SPACES}
+_REG_EXP_ZERO_WIDTH_ESCAPES = 'bBAZzG'
+_regExpCountedQuantifier = re.compile('\\{(\\d*)(,\\d*)?\\}')
+
+
+class _NotAnalysed(Exception):
+    """Regular expression uses syntax, which is not supported by _regExpFirstChars()
+    """
+    pass
+
+
+def _firstChars(chars, insensitive=False):
+    """Make first characters string from an iterable of characters.
+    If insensitive, ASCII characters which are equal in lower case are added
+    """
+    if insensitive:
+        lowerChars = set([char.lower()[:1] for char in chars])
+        return ''.join([char for char in _ASCII_CHARS if char.lower() in lowerChars])
+    else:
+        chars = set(chars)
+        return ''.join([char for char in _ASCII_CHARS if char in chars])
+
+
+def _regExpEscapeChars(char):
+    """Characters, matched by escape sequence \\char. None if any
+    """
+    if char in _REG_EXP_ESCAPED_CLASSES:
+        return set(_REG_EXP_ESCAPED_CLASSES[char])
+    elif char in _REG_EXP_ESCAPED_CHARS:
+        return set(_REG_EXP_ESCAPED_CHARS[char])
+    elif char.isdigit():  # back references
+        raise _NotAnalysed()
+    elif char.isalnum():  # \D, \x41, etc. A character is consumed
+        return None
+    else:
+        return set(char)
+
+
+def _regExpClassChars(string, index):
+    """Parse [character class] at index.
+    Returns (characters or None if any, index after the class)
+    """
+    index += 1
+    if string.startswith(':', index):  # [:digit:]
+        raise _NotAnalysed()
+
+    negated = string.startswith('^', index)
+    if negated:
+        index += 1
+
+    chars = set()
+    isFirstItem = True
+    while index < len(string):
+        char = string[index]
+        if char == ']' and not isFirstItem:
+            return None if (negated or chars is None) else chars, index + 1
+        isFirstItem = False
+
+        if char == '[':  # [:alnum:] or nested class
+            raise _NotAnalysed()
+        elif char == '\\':
+            escapedChar = string[index + 1:index + 2]
+            if not escapedChar:
+                raise _NotAnalysed()
+            escapedChars = set('\b') if escapedChar == 'b' else _regExpEscapeChars(escapedChar)
+            chars = None if (chars is None or escapedChars is None) else chars | escapedChars
+            index += 2
+            if string.startswith('-', index) and not string.startswith('-]', index):
+                raise _NotAnalysed()  # range from an escaped char
+        elif string.startswith('-', index + 1) and \
+             index + 2 < len(string) and \
+             string[index + 2] != ']':
+            rangeEnd = string[index + 2]
+            if rangeEnd in '\\[' or rangeEnd < char:
+                raise _NotAnalysed()
+            if chars is not None:
+                chars |= set([chr(code) for code in range(ord(char), min(ord(rangeEnd), 127) + 1)])
+                if ord(rangeEnd) > 127:
+                    chars.add(rangeEnd)  # not ASCII characters are not in the result, but are checked for insensitive patterns
+            index += 3
+        else:
+            if chars is not None:
+                chars.add(char)
+            index += 1
+
+    raise _NotAnalysed()  # not closed class
+
+
+def _regExpAlternativesChars(string, index, insensitive):
+    """Parse alternatives till the closing ')' or the end of the pattern.
+    Returns (characters or None if any, True if might be empty, index of the end)
+    """
+    chars = set()
+    nullable = False
+
+    sequenceChars = set()
+    sequenceNullable = True
+    while index < len(string) and string[index] != ')':
+        char = string[index]
+
+        if char == '|':
+            chars = None if (chars is None or sequenceChars is None) else chars | sequenceChars
+            nullable = nullable or sequenceNullable
+            sequenceChars = set()
+            sequenceNullable = True
+            index += 1
+            continue
+
+        if char == '(':
+            if string.startswith(('(?=', '(?!', '(?<=', '(?<!'), index):
+                prefixLength = 3 if string[index + 2] in '=!' else 4
+                atomChars, atomNullable, index = _regExpAlternativesChars(string, index + prefixLength, insensitive)
+                atomChars, atomNullable = set(), True  # zero width
+            else:
+                if string.startswith(('(?:', '(?>'), index):
+                    prefixLength = 3
+                elif string.startswith('(?P<', index) and '>' in string[index:]:
+                    prefixLength = string.index('>', index) + 1 - index
+                elif string.startswith('(?', index):  # flags, back references, conditions, comments
+                    raise _NotAnalysed()
+                else:
+                    prefixLength = 1
+                atomChars, atomNullable, index = _regExpAlternativesChars(string, index + prefixLength, insensitive)
+
+            if not string.startswith(')', index):
+                raise _NotAnalysed()
+            index += 1
+        elif char == '[':
+            atomChars, index = _regExpClassChars(string, index)
+            atomNullable = False
+        elif char == '\\':
+            escapedChar = string[index + 1:index + 2]
+            if not escapedChar:
+                raise _NotAnalysed()
+            if escapedChar in _REG_EXP_ZERO_WIDTH_ESCAPES:
+                atomChars, atomNullable = set(), True
+            else:
+                atomChars, atomNullable = _regExpEscapeChars(escapedChar), False
+            index += 2
+        elif char in '^$':
+            atomChars, atomNullable = set(), True
+            index += 1
+        elif char == '.':
+            atomChars, atomNullable = None, False
+            index += 1
+        elif char in '*+?':
+            raise _NotAnalysed()
+        else:
+            atomChars, atomNullable = set(char), False
+            index += 1
+
+        # quantifier
+        hasQuantifier = True
+        countedQuantifier = _regExpCountedQuantifier.match(string, index)
+        if string.startswith(('*', '?'), index):
+            atomNullable = True
+            index += 1
+        elif string.startswith('+', index):
+            index += 1
+        elif countedQuantifier is not None:
+            if not countedQuantifier.group(1):  # {,n} is a quantifier in Python, but not in PCRE
+                raise _NotAnalysed()
+            if int(countedQuantifier.group(1)) == 0:
+                atomNullable = True
+            index = countedQuantifier.end()
+        else:
+            hasQuantifier = False
+
+        if hasQuantifier and string.startswith(('?', '+'), index):  # lazy or possessive
+            index += 1
+
+        if insensitive and atomChars is not None:
+            if any([ord(atomChar) > 127 for atomChar in atomChars]):
+                atomChars = None  # case folding of not ASCII characters is not checked
+            else:
+                atomChars = atomChars | set([atomChar.swapcase() for atomChar in atomChars])
+
+        if sequenceNullable:
+            sequenceChars = None if (sequenceChars is None or atomChars is None) else sequenceChars | atomChars
+        sequenceNullable = sequenceNullable and atomNullable
+
+    chars = None if (chars is None or sequenceChars is None) else chars | sequenceChars
+    nullable = nullable or sequenceNullable
+    return chars, nullable, index
+
+
+def _regExpMatchesNotEmpty(string):
+    """Check if a regular expression never matches an empty string.
+    False if not known
+    """
+    try:
+        chars, nullable, index = _regExpAlternativesChars(string, 0, False)
+    except _NotAnalysed:
+        return False
+
+    return index == len(string) and not nullable
+
+
+def _regExpFirstChars(string, insensitive):
+    """Get first characters of a regular expression.
+    Only a subset of the syntax is analysed, None for other patterns.
+    Empty matches are not taken into account, parsers reject them
+    """
+    try:
+        chars, nullable, index = _regExpAlternativesChars(string, 0, insensitive)
+    except _NotAnalysed:
+        return None
+
+    if index != len(string) or chars is None:
+        return None
+
+    return _firstChars(chars)
+
+
 ################################################################################
 ##                               Rules
 ################################################################################
@@ -188,18 +425,19 @@ def _loadIncludeRules(parentContext, xmlElement, attributeToFormatMap):
     abstractRuleParams = _loadAbstractRuleParams(parentContext,
                                                  xmlElement,
                                                  attributeToFormatMap)
-    return _parserModule.IncludeRules(abstractRuleParams, context)
+    return ('IncludeRules', abstractRuleParams, (context,))
 
-def _simpleLoader(classObject):
+def _simpleLoader(className, firstChars=None):
     def _load(parentContext, xmlElement, attributeToFormatMap):
         abstractRuleParams = _loadAbstractRuleParams(parentContext,
                                                      xmlElement,
-                                                     attributeToFormatMap)
-        return classObject(abstractRuleParams)
+                                                     attributeToFormatMap,
+                                                     firstChars)
+        return (className, abstractRuleParams, ())
     return _load
 
 def _loadChildRules(context, xmlElement, attributeToFormatMap):
-    """Extract rules from Context or Rule xml element
+    """Extract rule definitions from Context or Rule xml element
     """
     rules = []
     for ruleElement in xmlElement:
@@ -209,16 +447,13 @@ def _loadChildRules(context, xmlElement, attributeToFormatMap):
         rules.append(rule)
     return rules
 
-def _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap):
+def _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, firstChars=None):
     # attribute
     attribute = xmlElement.attrib.get("attribute", None)
     if attribute is not None:
         attribute = attribute.lower()  # not case sensitive
         try:
-            format = attributeToFormatMap[attribute]
-            textType = format.textType if format is not None else ' '
-            if format is not None:
-                format = _convertFormat(format)
+            format, textType = attributeToFormatMap[attribute]
         except KeyError:
             _logger.warning('Unknown rule attribute %s', attribute)
             format = parentContext.format
@@ -244,17 +479,21 @@ def _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap):
     else:
         column = -1
 
-    return _parserModule.AbstractRuleParams(parentContext, format, textType, attribute, context, lookAhead, firstNonSpace, dynamic, column)
+    if dynamic:
+        firstChars = None
 
-def _loadDetectChar(parentContext, xmlElement, attributeToFormatMap):
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
+    return (format, textType, attribute, context, lookAhead, firstNonSpace, dynamic, column, firstChars)
 
+def _loadDetectChar(parentContext, xmlElement, attributeToFormatMap):
     char = _safeGetRequiredAttribute(xmlElement, "char", None)
     if char is not None:
         char = _processEscapeSequences(char)
 
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars((char or '')[:1]))
+
     index = 0
-    if abstractRuleParams.dynamic:
+    if _parseBoolAttribute(xmlElement.attrib.get("dynamic", "false")):
         try:
             index = int(char)
         except ValueError:
@@ -265,7 +504,7 @@ def _loadDetectChar(parentContext, xmlElement, attributeToFormatMap):
             _logger.warning('Too little DetectChar index %d', index)
             index = 0
 
-    return _parserModule.DetectChar(abstractRuleParams, str(char), index)
+    return ('DetectChar', abstractRuleParams, (str(char), index))
 
 def _loadDetect2Chars(parentContext, xmlElement, attributeToFormatMap):
     char = _safeGetRequiredAttribute(xmlElement, 'char', None)
@@ -275,28 +514,31 @@ def _loadDetect2Chars(parentContext, xmlElement, attributeToFormatMap):
     else:
         string = _processEscapeSequences(char) + _processEscapeSequences(char1)
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.Detect2Chars(abstractRuleParams, string)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars((string or '')[:1]))
+    return ('Detect2Chars', abstractRuleParams, (string,))
 
 def _loadAnyChar(parentContext, xmlElement, attributeToFormatMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', '')
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.AnyChar(abstractRuleParams, string)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars(string))
+    return ('AnyChar', abstractRuleParams, (string,))
 
 def _loadStringDetect(parentContext, xmlElement, attributeToFormatMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', None)
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.StringDetect(abstractRuleParams,
-                                      string)
+    firstChars = _firstChars(string[:1]) if string else None  # empty string matches everywhere
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, firstChars)
+    return ('StringDetect', abstractRuleParams, (string,))
 
 def _loadWordDetect(parentContext, xmlElement, attributeToFormatMap):
     word = _safeGetRequiredAttribute(xmlElement, "String", "")
     insensitive = _parseBoolAttribute(xmlElement.attrib.get("insensitive", "false"))
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
+    firstChars = _firstChars(word[:1], insensitive or not parentContext.parser.keywordsCaseSensitive)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, firstChars)
 
-    return _parserModule.WordDetect(abstractRuleParams, word, insensitive)
+    return ('WordDetect', abstractRuleParams, (word, insensitive))
 
 def _loadKeyword(parentContext, xmlElement, attributeToFormatMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', None)
@@ -306,11 +548,14 @@ def _loadKeyword(parentContext, xmlElement, attributeToFormatMap):
         _logger.warning("List '%s' not found", string)
 
         words = list()
+        string = None
 
     insensitive = _parseBoolAttribute(xmlElement.attrib.get("insensitive", "false"))
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.keyword(abstractRuleParams, words, insensitive)
+    firstChars = _firstChars([word[:1] for word in words],
+                             insensitive or not parentContext.parser.keywordsCaseSensitive)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, firstChars)
+    return ('keyword', abstractRuleParams, (string, insensitive))  # the list is shared by name
 
 def _loadRegExpr(parentContext, xmlElement, attributeToFormatMap):
     def _processCraracterCodes(text):
@@ -339,34 +584,35 @@ def _loadRegExpr(parentContext, xmlElement, attributeToFormatMap):
         if len(strippedString) > 1 and strippedString[1] == '|':  # ^|blabla   This condition is not ideal but will cover majority of cases
             wordStart = False
             lineStart = False
+
+        firstChars = _regExpFirstChars(string, insensitive)
     else:
         wordStart = False
         lineStart = False
+        firstChars = None
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.RegExpr(abstractRuleParams,
-                                 string, insensitive, minimal, wordStart, lineStart)
-
-def _loadAbstractNumberRule(rule, parentContext, xmlElement):
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.NumberRule(abstractRuleParams, childRules)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, firstChars)
+    return ('RegExpr', abstractRuleParams, (string, insensitive, minimal, wordStart, lineStart))
 
 def _loadInt(parentContext, xmlElement, attributeToFormatMap):
     childRules = _loadChildRules(parentContext, xmlElement, attributeToFormatMap)
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.Int(abstractRuleParams, childRules)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars(_ASCII_DIGITS))
+    return ('Int', abstractRuleParams, (childRules,))
 
 def _loadFloat(parentContext, xmlElement, attributeToFormatMap):
     childRules = _loadChildRules(parentContext, xmlElement, attributeToFormatMap)
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.Float(abstractRuleParams, childRules)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars(_ASCII_DIGITS | set('.eE')))  # e1 is a float
+    return ('Float', abstractRuleParams, (childRules,))
 
 def _loadRangeDetect(parentContext, xmlElement, attributeToFormatMap):
     char = _safeGetRequiredAttribute(xmlElement, "char", 'char is not set')
     char1 = _safeGetRequiredAttribute(xmlElement, "char1", 'char1 is not set')
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap)
-    return _parserModule.RangeDetect(abstractRuleParams, char, char1)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap,
+                                                 _firstChars(char[:1]) if char else None)
+    return ('RangeDetect', abstractRuleParams, (char, char1))
 
 
 _ruleClassDict = \
@@ -380,15 +626,16 @@ _ruleClassDict = \
     'keyword': _loadKeyword,
     'Int': _loadInt,
     'Float': _loadFloat,
-    'HlCOct': _simpleLoader(_parserModule.HlCOct),
-    'HlCHex': _simpleLoader(_parserModule.HlCHex),
-    'HlCStringChar': _simpleLoader(_parserModule.HlCStringChar),
-    'HlCChar': _simpleLoader(_parserModule.HlCChar),
+    'HlCOct': _simpleLoader('HlCOct', '0'),
+    'HlCHex': _simpleLoader('HlCHex', '0'),
+    'HlCStringChar': _simpleLoader('HlCStringChar', '\\'),
+    'HlCChar': _simpleLoader('HlCChar', "'"),
     'RangeDetect': _loadRangeDetect,
-    'LineContinue': _simpleLoader(_parserModule.LineContinue),
+    'LineContinue': _simpleLoader('LineContinue', '\\'),
     'IncludeRules': _loadIncludeRules,
-    'DetectSpaces': _simpleLoader(_parserModule.DetectSpaces),
-    'DetectIdentifier': _simpleLoader(_parserModule.DetectIdentifier)
+    'DetectSpaces': _simpleLoader('DetectSpaces', _firstChars(_ASCII_SPACES)),
+    'DetectIdentifier': _simpleLoader('DetectIdentifier',
+                                      _firstChars([char for char in _ASCII_CHARS if char.isalpha()]))
 }
 
 ################################################################################
@@ -396,70 +643,381 @@ _ruleClassDict = \
 ################################################################################
 
 
-def _loadContexts(highlightingElement, parser, attributeToFormatMap):
-    contextsElement = highlightingElement.find('contexts')
+class _ParserDefinition:
+    """Data of a syntax definition, which rules refer to while the definition is compiled.
+    Context names are used instead of contexts. See _buildSyntax()
+    """
+    def __init__(self, lists, keywordsCaseSensitive, contextNames):
+        self.lists = lists
+        self.keywordsCaseSensitive = keywordsCaseSensitive
+        self.contexts = set(contextNames)
+        self.defaultContext = contextNames[0]
 
-    xmlElementList = contextsElement.findall('context')
-    contextList = []
-    for xmlElement in xmlElementList:
-        name = _safeGetRequiredAttribute(xmlElement,
-                                         'name',
-                                         'Error: context name is not set!!!')
-        context = _parserModule.Context(parser, name)
-        contextList.append(context)
 
-    defaultContext = contextList[0]
+class _ContextDefinition:
+    """Parent context of rules, which are being compiled
+    """
+    def __init__(self, parser, format, textType):
+        self.parser = parser
+        self.format = format
+        self.textType = textType
+
 
-    contextDict = {}
-    for context in contextList:
-        contextDict[context.name] = context
+def _loadContexts(highlightingElement, lists, keywordsCaseSensitive, attributeToFormatMap):
+    """Get list of context definitions
+    """
+    contextsElement = highlightingElement.find('contexts')
 
-    parser.setContexts(contextDict, defaultContext)
+    xmlElementList = contextsElement.findall('context')
+    names = [_safeGetRequiredAttribute(xmlElement,
+                                       'name',
+                                       'Error: context name is not set!!!') \
+                for xmlElement in xmlElementList]
 
-    # parse contexts stage 2: load contexts
-    for xmlElement, context in zip(xmlElementList, contextList):
-        _loadContext(context, xmlElement, attributeToFormatMap)
+    parser = _ParserDefinition(lists, keywordsCaseSensitive, names)
+    return [_loadContext(name, xmlElement, parser, attributeToFormatMap) \
+                for name, xmlElement in zip(names, xmlElementList)]
 
 
-def _loadContext(context, xmlElement, attributeToFormatMap):
-    """Construct context from XML element
-    Contexts are at first constructed, and only then loaded, because when loading context,
-    _makeContextSwitcher must have references to all defined contexts
+def _loadContext(name, xmlElement, parser, attributeToFormatMap):
+    """Get context definition from XML element.
+    Contexts and context switchers refer to contexts by name. See _resolveContext()
     """
     attribute = _safeGetRequiredAttribute(xmlElement, 'attribute', '<not set>').lower()
     if attribute != '<not set>':  # there are no attributes for internal contexts, used by rules. See perl.xml
         try:
-            format = attributeToFormatMap[attribute]
+            format, textType = attributeToFormatMap[attribute]
         except KeyError:
             _logger.warning('Unknown context attribute %s', attribute)
-            format = TextFormat()
+            format, textType = attributeToFormatMap[None]
     else:
         format = None
-
-    textType = format.textType if format is not None else ' '
-    if format is not None:
-        format = _convertFormat(format)
+        textType = ' '
 
     lineEndContextText = xmlElement.attrib.get('lineEndContext', '#stay')
-    lineEndContext = _makeContextSwitcher(lineEndContextText,  context.parser)
+    lineEndContext = _makeContextSwitcher(lineEndContextText, parser)
     lineBeginContextText = xmlElement.attrib.get('lineBeginContext', '#stay')
-    lineBeginContext = _makeContextSwitcher(lineBeginContextText, context.parser)
+    lineBeginContext = _makeContextSwitcher(lineBeginContextText, parser)
     lineEmptyContextText = xmlElement.attrib.get('lineEmptyContext', '#stay')
-    lineEmptyContext = _makeContextSwitcher(lineEmptyContextText, context.parser)
+    lineEmptyContext = _makeContextSwitcher(lineEmptyContextText, parser)
 
     if _parseBoolAttribute(xmlElement.attrib.get('fallthrough', 'false')):
         fallthroughContextText = _safeGetRequiredAttribute(xmlElement, 'fallthroughContext', '#stay')
-        fallthroughContext = _makeContextSwitcher(fallthroughContextText, context.parser)
+        fallthroughContext = _makeContextSwitcher(fallthroughContextText, parser)
     else:
         fallthroughContext = None
 
     dynamic = _parseBoolAttribute(xmlElement.attrib.get('dynamic', 'false'))
 
-    context.setValues(attribute, format, lineEndContext, lineBeginContext, lineEmptyContext, fallthroughContext, dynamic, textType)
-
     # load rules
-    rules = _loadChildRules(context, xmlElement, attributeToFormatMap)
-    context.setRules(rules)
+    rules = _loadChildRules(_ContextDefinition(parser, format, textType), xmlElement, attributeToFormatMap)
+
+    return (name, attribute, format, textType,
+            lineEndContext, lineBeginContext, lineEmptyContext, fallthroughContext,
+            dynamic, rules)
+
+
+def _fusedPattern(rule):
+    """Get the pattern of a rule for parser.FusedRules. None, if the rule shall be tried separately
+    """
+    if rule.dynamic or rule.column != -1 or rule.firstNonSpace:
+        return None
+
+    if isinstance(rule, _parserModule.keyword):
+        return None  # a set lookup is quick, but the pattern of a big list takes seconds to compile
+
+    pattern = rule.regExpPattern(rule.parentContext.parser.deliminatorSet)
+    if pattern is not None and isinstance(rule, _parserModule.RegExpr):
+        # named groups might conflict with groups of other rules.
+        # Empty match doesn't stop the rule loop, but stops matching of alternatives
+        if '(?P' in rule.string or \
+           not _regExpMatchesNotEmpty(rule.string):
+            return None
+
+    return pattern
+
+################################################################################
+##                               Optimization
+################################################################################
+# Rules are rewritten on XML level before loading, therefore both parsers get the same rules.
+# Highlighting must not change, only the count and the type of rules
+
+_CONTEXT_SWITCH_ATTRIBUTES = ('context', 'lineEndContext', 'lineBeginContext', 'lineEmptyContext', 'fallthroughContext')
+_REG_EXP_SPECIAL_CHARS = '\\.^$|?*+()[]{}'
+
+
+def _contextSwitchTarget(contextOperation):
+    """Get name of the context, which a context operation switches to. None for #stay and #pop
+    """
+    rest = contextOperation
+    while rest.startswith('#pop'):
+        rest = rest[len('#pop'):]
+        if rest.startswith('!'):
+            rest = rest[1:]
+
+    if rest in ('', '#stay'):
+        return None
+    return rest
+
+
+def _regExpLiteralChar(string, index):
+    """Parse a character, which matches only itself.
+    Returns (character, index after it) or (None, index)
+    """
+    char = string[index]
+    if char == '\\':
+        escapedChar = string[index + 1:index + 2]
+        if escapedChar == 't':
+            return '\t', index + 2
+        elif escapedChar and not escapedChar.isalnum():
+            return escapedChar, index + 2
+        else:
+            return None, index
+    elif char in _REG_EXP_SPECIAL_CHARS:
+        return None, index
+    else:
+        return char, index + 1
+
+
+def _regExpLiteral(string):
+    """Get the string, which a regular expression matches, or None, if the pattern is not a literal
+    """
+    chars = []
+    index = 0
+    while index < len(string):
+        char, index = _regExpLiteralChar(string, index)
+        if char is None:
+            return None
+        chars.append(char)
+    return ''.join(chars)
+
+
+def _regExpClass(string):
+    """Get characters of [character class] pattern without ranges, or None
+    """
+    if not (string.startswith('[') and string.endswith(']')) or \
+       string.startswith(('[^', '[]')) or \
+       len(string) < 3:
+        return None
+
+    chars = []
+    index = 1
+    while index < len(string) - 1:
+        if string[index] == '-' and index not in (1, len(string) - 2):
+            return None  # range
+        char, index = _regExpLiteralChar(string, index)
+        if char is None:
+            if string[index] in '.$|?*+(){}':  # not special in a class
+                char, index = string[index], index + 1
+            else:
+                return None
+        chars.append(char)
+
+    return ''.join(sorted(set(chars), key=chars.index))
+
+
+def _caseInsensitive(string):
+    """Check if case insensitive matching doesn't change meaning of the string
+    """
+    return all([ord(char) < 128 and not char.isalpha() for char in string])
+
+
+class _SyntaxOptimizer:
+    """Rewrite rules of <context> elements. Every rewrite is described by a string in self.report
+    """
+    def __init__(self, contextElements, lists):
+        self._contextElements = contextElements
+        self._contexts = {contextElement.attrib.get('name'): contextElement \
+                            for contextElement in contextElements}
+        self._lists = lists
+        self.report = []
+
+    def _log(self, contextElement, message, *args):
+        self.report.append("context '%s': %s" % (contextElement.attrib.get('name'), message % args))
+
+    def _isDynamicTarget(self, ruleElement):
+        """Rule data is saved to the context stack, if the rule switches to a dynamic context.
+        True, if not known
+        """
+        name = _contextSwitchTarget(ruleElement.attrib.get('context', '#stay'))
+        if name is None:
+            return False
+        if name not in self._contexts:
+            return True  # other syntax
+        return _parseBoolAttribute(self._contexts[name].attrib.get('dynamic', 'false'))
+
+    def _neverMatches(self, ruleElement):
+        tag = ruleElement.tag
+        if tag == 'RegExpr':
+            return ruleElement.attrib.get('String') == '' and \
+                   not _parseBoolAttribute(ruleElement.attrib.get('dynamic', 'false'))
+        elif tag == 'AnyChar':
+            return ruleElement.attrib.get('String') == ''
+        elif tag == 'keyword':
+            return ruleElement.attrib.get('String') in self._lists and \
+                   not self._lists[ruleElement.attrib.get('String')]
+        else:
+            return False
+
+    def _simplifiedRegExpr(self, ruleElement):
+        """Get (tag, attributes) of a rule, which matches exactly like RegExpr. None, if not found
+        """
+        attrib = ruleElement.attrib
+        string = attrib.get('String')
+        if not string or \
+           _parseBoolAttribute(attrib.get('dynamic', 'false')) or \
+           self._isDynamicTarget(ruleElement):
+            return None
+
+        insensitive = _parseBoolAttribute(attrib.get('insensitive', 'false'))
+        newAttrib = {name: value for name, value in attrib.items() \
+                        if name not in ('String', 'insensitive', 'minimal')}
+
+        literal = _regExpLiteral(string)
+        if literal is not None and \
+           (not insensitive or _caseInsensitive(literal)):
+            if len(literal) == 1:
+                newAttrib['char'] = literal
+                return 'DetectChar', newAttrib
+            elif len(literal) == 2:
+                newAttrib['char'], newAttrib['char1'] = literal
+                return 'Detect2Chars', newAttrib
+            else:
+                newAttrib['String'] = literal
+                return 'StringDetect', newAttrib
+
+        chars = _regExpClass(string)
+        if chars is not None and \
+           (not insensitive or _caseInsensitive(chars)):
+            newAttrib['String'] = chars
+            return 'AnyChar', newAttrib
+
+        return None
+
+    def _rewriteRules(self, contextElement):
+        for ruleElement in list(contextElement):
+            if self._neverMatches(ruleElement):
+                self._log(contextElement, '%s %r dropped, never matches', ruleElement.tag, ruleElement.attrib.get('String'))
+                contextElement.remove(ruleElement)
+            elif ruleElement.tag == 'RegExpr':
+                simplified = self._simplifiedRegExpr(ruleElement)
+                if simplified is not None:
+                    self._log(contextElement, 'RegExpr %r rewritten to %s', ruleElement.attrib['String'], simplified[0])
+                    ruleElement.tag, ruleElement.attrib = simplified
+
+    def _useCounts(self):
+        """Count of references to every context of the syntax
+        """
+        counts = {}
+        for contextElement in self._contextElements:
+            for element in contextElement.iter():
+                for name in _CONTEXT_SWITCH_ATTRIBUTES:
+                    if name in element.attrib and element.tag != 'IncludeRules':
+                        target = _contextSwitchTarget(element.attrib[name])
+                        counts[target] = counts.get(target, 0) + 1
+                if element.tag == 'IncludeRules':
+                    target = element.attrib.get('context')
+                    counts[target] = counts.get(target, 0) + 1
+        return counts
+
+    def _canInline(self, includeRulesElement, useCounts):
+        name = includeRulesElement.attrib.get('context')
+        if name not in self._contexts or \
+           useCounts.get(name) != 1 or \
+           self._contexts[name] is self._contextElements[0] or \
+           'column' in includeRulesElement.attrib or \
+           _parseBoolAttribute(includeRulesElement.attrib.get('firstNonSpace', 'false')):
+            return False
+
+        # rules with unknown attributes get format of the parent context
+        for ruleElement in list(self._contexts[name].iter())[1:]:
+            if ruleElement.tag == 'IncludeRules' or \
+               ruleElement.attrib.get('attribute', '').lower() not in self._attributes:
+                return False
+        return True
+
+    def _inlineIncludeRules(self, contextElement, useCounts):
+        changed = False
+        for index, ruleElement in reversed(list(enumerate(contextElement))):
+            if ruleElement.tag == 'IncludeRules' and self._canInline(ruleElement, useCounts):
+                name = ruleElement.attrib['context']
+                self._log(contextElement, "IncludeRules '%s' inlined", name)
+                contextElement.remove(ruleElement)
+                for offset, includedElement in enumerate(self._contexts[name]):
+                    contextElement.insert(index + offset, copy.deepcopy(includedElement))
+                useCounts[name] = 0
+                changed = True
+        return changed
+
+    def _mergeDetectChars(self, contextElement):
+        """Replace sequences of DetectChar rules, which differ only by a character, with AnyChar
+        """
+        def key(ruleElement):
+            if ruleElement.tag != 'DetectChar' or \
+               _parseBoolAttribute(ruleElement.attrib.get('dynamic', 'false')) or \
+               len(_processEscapeSequences(ruleElement.attrib.get('char', ''))) != 1:
+                return None
+            return sorted([item for item in ruleElement.attrib.items() if item[0] != 'char'])
+
+        ruleElements = list(contextElement)
+        index = 0
+        while index < len(ruleElements):
+            sequenceKey = key(ruleElements[index])
+            end = index + 1
+            while sequenceKey is not None and \
+                  end < len(ruleElements) and \
+                  key(ruleElements[end]) == sequenceKey:
+                end += 1
+
+            if end - index > 1:
+                chars = ''.join([_processEscapeSequences(ruleElement.attrib['char']) \
+                                    for ruleElement in ruleElements[index:end]])
+                self._log(contextElement, '%d DetectChar merged to AnyChar %r', end - index, chars)
+                ruleElement = ruleElements[index]
+                ruleElement.tag = 'AnyChar'
+                ruleElement.attrib = {name: value for name, value in ruleElement.attrib.items() if name != 'char'}
+                ruleElement.attrib['String'] = chars
+                for removedElement in ruleElements[index + 1:end]:
+                    contextElement.remove(removedElement)
+            index = end
+
+    def optimize(self, attributes):
+        """attributes is a set of lower case itemData names
+        """
+        self._attributes = attributes | set([''])
+
+        for contextElement in self._contextElements:
+            self._rewriteRules(contextElement)
+
+        changed = True
+        while changed:
+            changed = False
+            useCounts = self._useCounts()
+            for contextElement in self._contextElements:
+                changed = self._inlineIncludeRules(contextElement, useCounts) or changed
+
+        for contextElement in self._contextElements:
+            self._mergeDetectChars(contextElement)
+
+
+def _optimizeContexts(highlightingElement, lists):
+    """Rewrite rules of the syntax definition in place. Returns list of rewrite descriptions
+    """
+    contextElements = highlightingElement.find('contexts').findall('context')
+    attributes = set([_safeGetRequiredAttribute(itemData, 'name', '').lower() \
+                        for itemData in highlightingElement.iter('itemData')])
+    optimizer = _SyntaxOptimizer(contextElements, lists)
+    optimizer.optimize(attributes)
+    return optimizer.report
+
+
+def optimizationReport(filePath):
+    """Get list of rewrites of rules of a syntax definition file. See QPART_OPTIMIZE_SYNTAX
+    """
+    root = xml.etree.ElementTree.parse(filePath).getroot()
+    highlightingElement = root.find('highlighting')
+    return _optimizeContexts(highlightingElement, _loadLists(root, highlightingElement))
+
 
 ################################################################################
 ##                               Syntax
@@ -481,10 +1039,12 @@ def _textTypeForDefStyleName(attribute, defStyleName):
     else:
         return ' '
 
-def _makeFormat(defaultTheme, defaultStyleName, textType, item=None):
+def _makeFormat(defaultTheme, defaultStyleName, textType, attributeName, item=None):
     format = copy.copy(defaultTheme.format[defaultStyleName])
 
     format.textType = textType
+    format.attributeName = attributeName
+    format.defStyleName = defaultStyleName
 
     if item is not None:
         caseInsensitiveAttributes = {}
@@ -508,7 +1068,11 @@ def _makeFormat(defaultTheme, defaultStyleName, textType, item=None):
 
     return format
 
-def _loadAttributeToFormatMap(highlightingElement):
+def _loadFormats(highlightingElement):
+    """Load itemDatas. Return (formats, {attribute: (format index, textType)})
+    where formats is a list of dictionaries of TextFormat attributes.
+    Item None is the format for unknown attributes
+    """
     defaultTheme = ColorTheme(TextFormat)
     attributeToFormatMap = {}
 
@@ -525,6 +1089,7 @@ def _loadAttributeToFormatMap(highlightingElement):
             format = _makeFormat(defaultTheme,
                                  defaultStyleName,
                                  _textTypeForDefStyleName(attribute, defaultStyleName),
+                                 item.get('name'),
                                  item)
 
             attributeToFormatMap[attribute] = format
@@ -532,12 +1097,18 @@ def _loadAttributeToFormatMap(highlightingElement):
     # HACK not documented, but 'normal' attribute is used by some parsers without declaration
     if not 'normal' in attributeToFormatMap:
         attributeToFormatMap['normal'] = _makeFormat(defaultTheme, 'dsNormal',
-                                                     _textTypeForDefStyleName('normal', 'dsNormal'))
+                                                     _textTypeForDefStyleName('normal', 'dsNormal'),
+                                                     'Normal')
     if not 'string' in attributeToFormatMap:
         attributeToFormatMap['string'] = _makeFormat(defaultTheme, 'dsString',
-                                                     _textTypeForDefStyleName('string', 'dsString'))
+                                                     _textTypeForDefStyleName('string', 'dsString'),
+                                                     'String')
 
-    return attributeToFormatMap
+    attributeToFormatMap[None] = TextFormat()
+
+    formats = [dict(vars(format)) for format in attributeToFormatMap.values()]
+    return formats, {attribute: (index, format.textType) \
+                        for index, (attribute, format) in enumerate(attributeToFormatMap.items())}
 
 def _loadLists(root, highlightingElement):
     lists = {}  # list name: list
@@ -557,25 +1128,42 @@ def _makeKeywordsLowerCase(listDict):
         for index, keyword in enumerate(keywordList):
             keywordList[index] = keyword.lower()
 
-def _loadSyntaxDescription(root, syntax):
-    syntax.name = _safeGetRequiredAttribute(root, 'name', 'Error: .parser name is not set!!!')
-    syntax.section = _safeGetRequiredAttribute(root, 'section', 'Error: Section is not set!!!')
-    syntax.extensions = [_f for _f in _safeGetRequiredAttribute(root, 'extensions', '').split(';') if _f]
-    syntax.firstLineGlobs = [_f for _f in root.attrib.get('firstLineGlobs', '').split(';') if _f]
-    syntax.mimetype = [_f for _f in root.attrib.get('mimetype', '').split(';') if _f]
-    syntax.version = root.attrib.get('version', None)
-    syntax.kateversion = root.attrib.get('kateversion', None)
-    syntax.priority = int(root.attrib.get('priority', '0'))
-    syntax.author = root.attrib.get('author', None)
-    syntax.license = root.attrib.get('license', None)
-    syntax.hidden = _parseBoolAttribute(root.attrib.get('hidden', 'false'))
+def _loadSyntaxDescription(root):
+    """Get {attribute name: value} of Syntax
+    """
+    description = {}
+    description['name'] = _safeGetRequiredAttribute(root, 'name', 'Error: .parser name is not set!!!')
+    description['section'] = _safeGetRequiredAttribute(root, 'section', 'Error: Section is not set!!!')
+    description['extensions'] = [_f for _f in _safeGetRequiredAttribute(root, 'extensions', '').split(';') if _f]
+    description['firstLineGlobs'] = [_f for _f in root.attrib.get('firstLineGlobs', '').split(';') if _f]
+    description['mimetype'] = [_f for _f in root.attrib.get('mimetype', '').split(';') if _f]
+    description['version'] = root.attrib.get('version', None)
+    description['kateversion'] = root.attrib.get('kateversion', None)
+    description['priority'] = int(root.attrib.get('priority', '0'))
+    description['author'] = root.attrib.get('author', None)
+    description['license'] = root.attrib.get('license', None)
+    description['hidden'] = _parseBoolAttribute(root.attrib.get('hidden', 'false'))
 
     # not documented
-    syntax.indenter = root.attrib.get('indenter', None)
+    description['indenter'] = root.attrib.get('indenter', None)
+    return description
 
 
-def loadSyntax(syntax, filePath = None):
-    _logger.debug("Loading syntax %s", filePath)
+def _setFormatIds(syntax):
+    """Set QTextFormat.UserProperty of every QTextCharFormat to "xmlFileName:index" string.
+    Format copies, which are read back from a QTextLayout, are identified by the string
+    """
+    from PyQt5.QtGui import QTextFormat
+
+    for index, format in enumerate(syntax.formats):
+        format.setProperty(QTextFormat.UserProperty, '%s:%d' % (syntax.xmlFileName, index))
+
+
+def _compileSyntax(filePath):
+    """Compile the XML file to a syntax definition.
+    The definition consists of built-in types only and can be saved with marshal.
+    Formats are referred by index in the list of formats, contexts by name. See _buildSyntax()
+    """
     with open(filePath, 'r', encoding='utf-8') as definitionFile:
         try:
             root = xml.etree.ElementTree.parse(definitionFile).getroot()
@@ -585,13 +1173,18 @@ def loadSyntax(syntax, filePath = None):
 
     highlightingElement = root.find('highlighting')
 
-    _loadSyntaxDescription(root, syntax)
+    xmlFileName = os.path.basename(filePath)
+    description = _loadSyntaxDescription(root)
 
     deliminatorSet = set(_DEFAULT_DELIMINATOR)
 
     # parse lists
     lists = _loadLists(root, highlightingElement)
 
+    if optimizeSyntax:
+        for line in _optimizeContexts(highlightingElement, lists):
+            _logger.debug('%s: %s', xmlFileName, line)
+
     # parse itemData
     keywordsCaseSensitive = True
 
@@ -617,15 +1210,209 @@ def loadSyntax(syntax, filePath = None):
 
         if indentationElement is not None and \
            'mode' in indentationElement.attrib:
-            syntax.indenter = indentationElement.attrib['mode']
+            description['indenter'] = indentationElement.attrib['mode']
+
+    formats, attributeToFormatMap = _loadFormats(highlightingElement)
+
+    # parse contexts
+    contexts = _loadContexts(highlightingElement, lists, keywordsCaseSensitive, attributeToFormatMap)
+
+    return {'description': description,
+            'deliminatorSet': ''.join(list(deliminatorSet)),
+            'lists': lists,
+            'keywordsCaseSensitive': keywordsCaseSensitive,
+            'formats': formats,
+            'contexts': contexts}
+
+
+def _resolveContext(contextRef, parser):
+    """Get context by reference. Reference is a name of a context of the parser,
+    (language name, None) for the default context of other syntax or (language name, context name)
+    """
+    if contextRef is None:
+        return None
+    elif isinstance(contextRef, str):
+        return parser.contexts[contextRef]
+    elif parser.syntax.manager is None:  # might be None, if loader is used by regenerate-definitions-db.py
+        _logger.warning('Invalid context name %s', repr('%s##%s' % (contextRef[1] or '', contextRef[0])))
+        return parser.defaultContext
+    else:
+        syntaxName, name = contextRef
+        parser = parser.syntax.manager.getSyntax(languageName = syntaxName).parser
+        return parser.defaultContext if name is None else parser.contexts[name]
+
+
+def _buildContextSwitcher(switcherDefinition, parser):
+    if switcherDefinition is None:
+        return None
+
+    popsCount, contextRef, contextOperation = switcherDefinition
+    return _parserModule.ContextSwitcher(popsCount, _resolveContext(contextRef, parser), contextOperation)
+
+
+def _buildRule(ruleDefinition, context, formats):
+    className, (format, textType, attribute, contextSwitcher, lookAhead, firstNonSpace, dynamic, column, firstChars), args = \
+        ruleDefinition
+    parser = context.parser
+
+    abstractRuleParams = _parserModule.AbstractRuleParams(context,
+                                                          formats[format] if format is not None else None,
+                                                          textType,
+                                                          attribute,
+                                                          _buildContextSwitcher(contextSwitcher, parser),
+                                                          lookAhead, firstNonSpace, dynamic, column, firstChars)
+
+    if className in ('Int', 'Float'):
+        args = ([_buildRule(childDefinition, context, formats) for childDefinition in args[0]],)
+    elif className == 'keyword':
+        listName, insensitive = args
+        args = (parser.lists[listName] if listName is not None else [], insensitive)
+    elif className == 'IncludeRules':
+        args = (_resolveContext(args[0], parser),)
+
+    return getattr(_parserModule, className)(abstractRuleParams, *args)
+
+
+def _buildContext(context, contextDefinition, formats):
+    name, attribute, format, textType, \
+        lineEndContext, lineBeginContext, lineEmptyContext, fallthroughContext, \
+        dynamic, ruleDefinitions = contextDefinition
+    parser = context.parser
+
+    context.setValues(attribute,
+                      formats[format] if format is not None else None,
+                      _buildContextSwitcher(lineEndContext, parser),
+                      _buildContextSwitcher(lineBeginContext, parser),
+                      _buildContextSwitcher(lineEmptyContext, parser),
+                      _buildContextSwitcher(fallthroughContext, parser),
+                      dynamic,
+                      textType)
+
+    rules = [_buildRule(ruleDefinition, context, formats) for ruleDefinition in ruleDefinitions]
+    if fuseRules:
+        for rule in rules:
+            rule.fusedPattern = _fusedPattern(rule)
+    context.setRules(rules)
+
+
+def _buildSyntax(syntax, definition, headless):
+    """Create the parser of the syntax from a definition. See _compileSyntax()
+    """
+    for name, value in definition['description'].items():
+        setattr(syntax, name, value)
 
-    deliminatorSetAsString = ''.join(list(deliminatorSet))
     debugOutputEnabled = _logger.isEnabledFor(logging.DEBUG)  # for cParser
-    parser = _parserModule.Parser(syntax, deliminatorSetAsString, lists, keywordsCaseSensitive, debugOutputEnabled)
+    parser = _parserModule.Parser(syntax, definition['deliminatorSet'], definition['lists'],
+                                  definition['keywordsCaseSensitive'], debugOutputEnabled)
     syntax._setParser(parser)
-    attributeToFormatMap = _loadAttributeToFormatMap(highlightingElement)
 
-    # parse contexts
-    _loadContexts(highlightingElement, syntax.parser, attributeToFormatMap)
+    # Convert each format once. Rules with the same attribute share the converted format
+    convertFormat = (lambda format: format) if headless else _convertFormat
+    formats = []
+    for fields in definition['formats']:
+        format = TextFormat()
+        vars(format).update(fields)
+        formats.append(convertFormat(format))
+
+    syntax.formats = [format for format in formats if format is not None]
+    if not headless:
+        _setFormatIds(syntax)
+
+    # Contexts are at first constructed, and only then loaded,
+    # because context switchers must have references to all defined contexts
+    contexts = [_parserModule.Context(parser, contextDefinition[0]) \
+                    for contextDefinition in definition['contexts']]
+    parser.setContexts({context.name: context for context in contexts}, contexts[0])
+
+    for context, contextDefinition in zip(contexts, definition['contexts']):
+        _buildContext(context, contextDefinition, formats)
+
+
+################################################################################
+##                               Definition cache
+################################################################################
+# Compiled definitions are saved with marshal. Cache file name is a hash of the XML file path,
+# size and modification time, qutepart version and loader settings, therefore changed XML files are compiled again.
+# Definitions are independent of the parser type
+
+_CACHE_FORMAT_VERSION = 1
+
+
+def _cacheFilePath(cacheDir, filePath):
+    xmlStat = os.stat(filePath)
+    key = hashlib.sha1()
+    key.update(('%s\0%d\0%d\0%s\0%d\0%d\0%d' % (os.path.abspath(filePath),
+                                                   xmlStat.st_size,
+                                                   xmlStat.st_mtime_ns,
+                                                   '.'.join([str(n) for n in qutepart.version.VERSION]),
+                                                   optimizeSyntax,
+                                                   marshal.version,
+                                                   _CACHE_FORMAT_VERSION)).encode('utf-8', 'surrogatepass'))
+    return os.path.join(cacheDir, '%s-%s.qpsyn' % (os.path.basename(filePath), key.hexdigest()))
+
+
+def _loadCachedDefinition(cacheFilePath):
+    """Get definition from the cache. None if not cached
+    """
+    try:
+        with open(cacheFilePath, 'rb') as cacheFile:
+            definition = marshal.loads(cacheFile.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, TypeError) as ex:
+        _logger.warning('Failed to read syntax definition cache %s: %s', cacheFilePath, ex)
+        return None
+
+    if not isinstance(definition, dict) or \
+       definition.get('version') != _CACHE_FORMAT_VERSION:
+        _logger.warning('Invalid syntax definition cache %s', cacheFilePath)
+        return None
+
+    return definition
+
+
+def _saveCachedDefinition(cacheFilePath, definition):
+    """Save definition atomically, concurrent loaders never read a partially written file
+    """
+    tmpFilePath = None
+    try:
+        cacheDir = os.path.dirname(cacheFilePath)
+        os.makedirs(cacheDir, exist_ok=True)
+        fd, tmpFilePath = tempfile.mkstemp(dir=cacheDir)
+        with os.fdopen(fd, 'wb') as cacheFile:
+            cacheFile.write(marshal.dumps(dict(definition, version=_CACHE_FORMAT_VERSION)))
+        os.replace(tmpFilePath, cacheFilePath)
+    except (OSError, ValueError) as ex:
+        _logger.warning('Failed to save syntax definition cache: %s', ex)
+        if tmpFilePath is not None and os.path.exists(tmpFilePath):
+            os.remove(tmpFilePath)
+
+
+def loadSyntax(syntax, filePath = None, headless = False, cacheDir = None):
+    """Load syntax from the XML file.
+    If headless is True, rules get TextFormat instances instead of QTextCharFormat
+    and PyQt5 is not used.
+    If cacheDir is set, the compiled definition is loaded from the directory, if it has been saved
+    there, otherwise it is saved
+    """
+    _logger.debug("Loading syntax %s", filePath)
+
+    definition = None
+    if cacheDir is not None:
+        try:
+            cacheFilePath = _cacheFilePath(cacheDir, filePath)
+        except OSError as ex:
+            _logger.warning('Failed to check syntax definition cache: %s', ex)
+            cacheDir = None
+        else:
+            definition = _loadCachedDefinition(cacheFilePath)
+
+    if definition is None:
+        definition = _compileSyntax(filePath)
+        if cacheDir is not None:
+            _saveCachedDefinition(cacheFilePath, definition)
+
+    syntax.xmlFileName = os.path.basename(filePath)
+    _buildSyntax(syntax, definition, headless)
 
     return syntax
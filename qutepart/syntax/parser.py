@@ -13,48 +13,97 @@ but value from itemDatas section (style name)
 contain not a text value, but ContextSwitcher object
 """
 
+import array
+import collections
 import re
 import logging
+import threading
+import time
+import weakref
+
+from qutepart.syntax.texttypemap import TextTypeMap
 
 _logger = logging.getLogger('qutepart')
 
 _numSeqReplacer = re.compile('%\d+')
+_spacesRegExp = re.compile('\s*')
+
+_MAX_LINE_END_SWITCHES = 128  # lineEndContext of some definitions make a cycle
 
 
 class ContextStack:
-    def __init__(self, contexts, data):
-        """Create default context stack for syntax
-        Contains default context on the top
-        """
-        self._contexts = contexts
+    """Immutable context stack.
+
+    Stack is a linked list of frames. Every stack refers to the stack without its top frame,
+    therefore stacks share tails.
+    Stacks are interned: equal stacks are the same object. It makes them cheap to store for every line
+    and to compare.
+
+    Do not create stacks with the constructor, use ContextStack.make() and append()
+    """
+    __slots__ = ('_parent', '_context', '_data', '_depth', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+    _internedLock = threading.Lock()  # stacks might be created by the background highlighting thread
+
+    def __init__(self, parent, context, data):
+        self._parent = parent
+        self._context = context
         self._data = data
+        self._depth = parent._depth + 1 if parent is not None else 1
+
+    @classmethod
+    def make(cls, parent, context, data):
+        """Get stack, which contains parent stack and new frame.
+        parent is None for a stack with one frame
+        """
+        key = (parent, context, data)
+        with cls._internedLock:
+            contextStack = cls._interned.get(key)
+            if contextStack is None:
+                contextStack = cls(parent, context, data)
+                cls._interned[key] = contextStack
+
+        return contextStack
 
     def pop(self, count):
         """Returns new context stack, which doesn't contain few levels
         """
-        if len(self._contexts) - 1 < count:
-            _logger.error("#pop value is too big %d", len(self._contexts))
-            if len(self._contexts) > 1:
-                return ContextStack(self._contexts[:1], self._data[:1])
-            else:
-                return self
+        contextStack = self
+        if self._depth - 1 < count:
+            _logger.error("#pop value is too big %d", self._depth)
+            while contextStack._parent is not None:
+                contextStack = contextStack._parent
+        else:
+            for _ in range(count):
+                contextStack = contextStack._parent
 
-        return ContextStack(self._contexts[:-count], self._data[:-count])
+        return contextStack
 
     def append(self, context, data):
         """Returns new context, which contains current stack and new frame
         """
-        return ContextStack(self._contexts + [context], self._data + [data])
+        return ContextStack.make(self, context, data)
 
     def currentContext(self):
         """Get current context
         """
-        return self._contexts[-1]
+        return self._context
 
     def currentData(self):
         """Get current data
         """
-        return self._data[-1]
+        return self._data
+
+    def frames(self):
+        """Get tuple of (context, data) frames. The bottom frame is the first
+        """
+        frames = []
+        contextStack = self
+        while contextStack is not None:
+            frames.append((contextStack._context, contextStack._data))
+            contextStack = contextStack._parent
+        return tuple(reversed(frames))
 
 
 class ContextSwitcher:
@@ -85,16 +134,55 @@ class ContextSwitcher:
 
 
 class TextToMatchObject:
-    """Peace of text, which shall be matched.
+    """Position in the text, which shall be matched.
+    Rules match wholeLineText at currentColumnIndex. The text is not sliced, otherwise parsing
+    of long lines takes quadratic time.
     Contains pre-calculated and pre-checked data for performance optimization
+
+    Context.parseBlock() creates one object per call and moves it along the line with moveTo().
+    Rules return the reused result object, see RuleTryMatchResult
+
+    firstNonSpaceIndex is a count of spaces at the line start. It is calculated once per line by
+    Parser.highlightBlock(). Calculated here, if not passed
+
+    isWordStart and word are calculated on first access. Fused rules don't use them
     """
-    def __init__(self, currentColumnIndex, wholeLineText, deliminatorSet, contextData):
-        self.currentColumnIndex = currentColumnIndex
+    __slots__ = ('currentColumnIndex', 'wholeLineText', 'textLen', '_deliminatorSet',
+                 'firstNonSpaceIndex', 'firstNonSpace', 'contextData', 'result',
+                 'isWordStart', 'word', '_wordCalculated')
+
+    def __init__(self, currentColumnIndex, wholeLineText, deliminatorSet, contextData, firstNonSpaceIndex=None):
         self.wholeLineText = wholeLineText
-        self.text = wholeLineText[currentColumnIndex:]
-        self.textLen = len(self.text)
+        self._deliminatorSet = deliminatorSet
 
-        self.firstNonSpace = not bool(wholeLineText[:currentColumnIndex].strip())
+        if firstNonSpaceIndex is None:
+            firstNonSpaceIndex = _spacesRegExp.match(wholeLineText).end()
+        self.firstNonSpaceIndex = firstNonSpaceIndex
+
+        self.contextData = contextData
+        self.result = RuleTryMatchResult()
+        self._wordCalculated = False
+        self.moveTo(currentColumnIndex)
+
+    def moveTo(self, currentColumnIndex):
+        """Move to other position in the same line
+        """
+        self.currentColumnIndex = currentColumnIndex
+        self.textLen = len(self.wholeLineText) - currentColumnIndex
+        self.firstNonSpace = currentColumnIndex <= self.firstNonSpaceIndex
+
+        if self._wordCalculated:
+            del self.isWordStart
+            del self.word
+            self._wordCalculated = False
+
+    def __getattr__(self, name):
+        if name not in ('isWordStart', 'word'):
+            raise AttributeError(name)
+
+        currentColumnIndex = self.currentColumnIndex
+        wholeLineText = self.wholeLineText
+        deliminatorSet = self._deliminatorSet
 
         self.isWordStart = currentColumnIndex == 0 or \
                          wholeLineText[currentColumnIndex - 1].isspace() or \
@@ -102,34 +190,44 @@ class TextToMatchObject:
 
         self.word = None
         if self.isWordStart:
-            wordEndIndex = 0
-            for index, char in enumerate(self.text):
-                if char in deliminatorSet:
+            wordEndIndex = len(wholeLineText)
+            for index in range(currentColumnIndex, len(wholeLineText)):
+                if wholeLineText[index] in deliminatorSet:
                     wordEndIndex = index
                     break
-            else:
-                wordEndIndex = len(wholeLineText)
 
-            if wordEndIndex != 0:
-                self.word = self.text[:wordEndIndex]
+            if wordEndIndex != currentColumnIndex:
+                self.word = wholeLineText[currentColumnIndex:wordEndIndex]
 
-        self.contextData = contextData
+        self._wordCalculated = True
+        return getattr(self, name)
 
 
 class RuleTryMatchResult:
-    def __init__(self, rule, length, data=None):
+    """Matched rule, length of the match and data for a dynamic context.
+
+    Rules don't create results, but fill and return TextToMatchObject.result with set(),
+    therefore a result is valid only until the next rule is tried
+    """
+    __slots__ = ('rule', 'length', 'data')
+
+    def __init__(self, rule=None, length=0, data=None):
         self.rule = rule
         self.length = length
         self.data = data
 
-        if rule.lookAhead:
-            self.length = 0
+    def set(self, rule, length, data=None):
+        self.rule = rule
+        self.length = 0 if rule.lookAhead else length
+        self.data = data
+        return self
 
 
 class AbstractRuleParams:
     """Parameters, passed to the AbstractRule constructor
     """
-    def __init__(self, parentContext, format, textType, attribute, context, lookAhead, firstNonSpace, dynamic, column):
+    def __init__(self, parentContext, format, textType, attribute, context, lookAhead, firstNonSpace, dynamic, column,
+                 firstChars=None):
         self.parentContext = parentContext
         self.format = format
         self.textType = textType
@@ -139,6 +237,7 @@ class AbstractRuleParams:
         self.firstNonSpace = firstNonSpace
         self.dynamic = dynamic
         self.column = column
+        self.firstChars = firstChars
 
 
 class AbstractRule:
@@ -153,8 +252,13 @@ class AbstractRule:
         firstNonSpace
         column          -1 if not set
         dynamic
+        firstChars      ASCII characters, which a match might start with. None if not known
+        fusedPattern    Regular expression, which matches exactly like the rule. Set by the loader,
+                        if the rule shall be fused with neighbour rules. See FusedRules
     """
 
+    fusedPattern = None
+
     _seqReplacer = re.compile('%\d+')
 
     def __init__(self, params):
@@ -167,6 +271,7 @@ class AbstractRule:
         self.firstNonSpace = params.firstNonSpace
         self.dynamic = params.dynamic
         self.column = params.column
+        self.firstChars = params.firstChars
 
     def __str__(self):
         """Serialize.
@@ -183,6 +288,15 @@ class AbstractRule:
         """
         raise NotImplementedError(str(self.__class__))
 
+    def regExpPattern(self, deliminatorSet):
+        """Get regular expression, which matches the same text, as the rule, when matched at an offset
+        in the whole line. None, if the rule can't be converted or is dynamic.
+        Column and firstNonSpace are not checked. RegExpr pattern might match an empty string,
+        but the rule rejects empty matches.
+        deliminatorSet is of the syntax, which is being parsed. It might include the rule
+        """
+        return None
+
     def tryMatch(self, textToMatchObject):
         """Try to find themselves in the text.
         Returns (contextStack, count, matchedRule) or (contextStack, None, None) if doesn't match
@@ -229,10 +343,15 @@ class DetectChar(AbstractRule):
         else:
             string = self.char
 
-        if textToMatchObject.text[0] == string:
-            return RuleTryMatchResult(self, 1)
+        if textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex] == string:
+            return textToMatchObject.result.set(self, 1)
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        if self.dynamic or self.char is None or len(self.char) != 1:
+            return None
+        return re.escape(self.char)
+
 
 class Detect2Chars(AbstractRule):
     """Public attributes
@@ -249,11 +368,16 @@ class Detect2Chars(AbstractRule):
         if self.string is None:
             return None
 
-        if textToMatchObject.text.startswith(self.string):
-            return RuleTryMatchResult(self, len(self.string))
+        if textToMatchObject.wholeLineText.startswith(self.string, textToMatchObject.currentColumnIndex):
+            return textToMatchObject.result.set(self, len(self.string))
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        if not self.string:
+            return None
+        return re.escape(self.string)
+
 
 class AnyChar(AbstractRule):
     """Public attributes:
@@ -267,11 +391,16 @@ class AnyChar(AbstractRule):
         return 'AnyChar(%s)' % self.string
 
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text[0] in self.string:
-            return RuleTryMatchResult(self, 1)
+        if textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex] in self.string:
+            return textToMatchObject.result.set(self, 1)
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        if not self.string:
+            return None
+        return '[%s]' % ''.join([re.escape(char) for char in self.string])
+
 
 class StringDetect(AbstractRule):
     """Public attributes:
@@ -295,11 +424,16 @@ class StringDetect(AbstractRule):
         else:
             string = self.string
 
-        if textToMatchObject.text.startswith(string):
-            return RuleTryMatchResult(self, len(string))
+        if textToMatchObject.wholeLineText.startswith(string, textToMatchObject.currentColumnIndex):
+            return textToMatchObject.result.set(self, len(string))
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        if self.dynamic or not self.string:
+            return None
+        return re.escape(self.string)
+
     @staticmethod
     def _makeDynamicSubsctitutions(string, contextData):
         """For dynamic rules, replace %d patterns with actual strings
@@ -339,10 +473,15 @@ class WordDetect(AbstractRule):
             wordToCheck = textToMatchObject.word
 
         if wordToCheck == self.word:
-            return RuleTryMatchResult(self, len(wordToCheck))
+            return textToMatchObject.result.set(self, len(wordToCheck))
         else:
             return None
 
+    def regExpPattern(self, deliminatorSet):
+        return _wordsPattern([self.word],
+                             self.insensitive or (not self.parentContext.parser.keywordsCaseSensitive),
+                             deliminatorSet)
+
 
 class keyword(AbstractRule):
     """Public attributes:
@@ -368,10 +507,287 @@ class keyword(AbstractRule):
             wordToCheck = textToMatchObject.word
 
         if wordToCheck in self.words:
-            return RuleTryMatchResult(self, len(wordToCheck))
+            return textToMatchObject.result.set(self, len(wordToCheck))
         else:
             return None
 
+    def regExpPattern(self, deliminatorSet):
+        return _wordsPattern(self.words,
+                             self.insensitive or (not self.parentContext.parser.keywordsCaseSensitive),
+                             deliminatorSet)
+
+
+# Characters, which are equal to an ASCII letter after str.lower(), except the letter itself
+_LOWER_CASE_EQUIVALENTS = {'k': '\u212a'}  # Kelvin sign
+
+
+def _wordStartPattern(deliminatorSet):
+    """Assertion, equal to TextToMatchObject.isWordStart
+    """
+    return '(?<![^\\s%s])' % ''.join([re.escape(char) for char in sorted(deliminatorSet)])
+
+
+def _wordsPattern(words, insensitive, deliminatorSet):
+    """Make regular expression, which matches like keyword and WordDetect rules.
+    Rule matches, if a word is equal to TextToMatchObject.word, which is converted to lower case,
+    if insensitive. Words are joined to a tree, i.e. (?:i(?:f|n)|for)
+    """
+    tree = {}
+    for word in words:
+        if insensitive and any([ord(char) > 127 for char in word]):
+            return None  # str.lower() is not analysed for not ASCII characters
+
+        if (not word) or \
+           any([char in deliminatorSet for char in word]) or \
+           (insensitive and word != word.lower()):
+            continue  # can't be equal to a word in the text
+
+        node = tree
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def charPattern(char):
+        if insensitive and char.isalpha():
+            return '[%s%s%s]' % (char, char.upper(), _LOWER_CASE_EQUIVALENTS.get(char, ''))
+        else:
+            return re.escape(char)
+
+    def treePattern(node):
+        alternatives = [charPattern(char) + treePattern(child) \
+                            for char, child in sorted(node.items()) \
+                                if char]
+        if '' in node:
+            alternatives.append('')  # the longest word is tried first
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+        else:
+            return '(?:%s)' % '|'.join(alternatives)
+
+    if not tree:
+        return '(?!)'  # never matches
+
+    deliminatorPattern = ''.join([re.escape(char) for char in sorted(deliminatorSet)])
+    return '%s%s(?![^%s])' % (_wordStartPattern(deliminatorSet), treePattern(tree), deliminatorPattern)
+
+
+# Assertions, which see the text before the match start when the text is matched at an offset.
+# At the start of a sliced text they are equal to these patterns
+_ASSERTIONS_AT_START = {'\\b': '(?=\\w)',
+                        '\\B': '(?!\\w)',
+                        '\\A': '(?:)',
+                        '^': '(?:)'}
+
+
+def _regExpClassEnd(string, index):
+    """Get index after the end of a [character class], which starts at index
+    """
+    index += 1
+    if string.startswith('^', index):
+        index += 1
+    if string.startswith(']', index):
+        index += 1
+    while index < len(string) and string[index] != ']':
+        if string[index] == '\\':
+            index += 1
+        elif string.startswith('[:', index) and ':]' in string[index:]:  # [:alnum:], see _compileRegExp()
+            index = string.index(':]', index) + 1
+        index += 1
+    return index + 1
+
+
+def _regExpGroupEnd(string, index):
+    """Get index after the end of a (group), which starts at index. None, if the group is not closed
+    """
+    depth = 0
+    while index < len(string):
+        char = string[index]
+        if char == '\\':
+            index += 2
+            continue
+        elif char == '[':
+            index = _regExpClassEnd(string, index)
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    return None
+
+
+def _offsetMatchingPattern(string):
+    """Python's regExp.match(text, pos) doesn't slice the text, therefore ^, \\A, \\b, \\B and lookbehind
+    see characters before pos. Make a pattern, which matches at an offset exactly like the original
+    pattern matches a sliced text.
+
+    An assertion is replaced if it is checked only at the start of the match, and is kept if at least
+    one character is always consumed by the pattern before it. Returns None if this can't be proven.
+    A repeated group is not at the start, its next iterations see the text matched by the previous ones
+    """
+    result = []
+    atStart = True  # the current position is the match start
+    consumed = False  # at least one character has been consumed before the current position
+    groups = []  # (atStart, consumed, all alternatives consumed, is lookahead) for open groups
+    index = 0
+    while index < len(string):
+        char = string[index]
+        isConsumingAtom = False
+
+        if char == '\\' or char == '^':
+            if char == '^':
+                token = char
+            elif string[index + 1:index + 2] in ('x', 'u', 'U'):
+                token = string[index:index + {'x': 4, 'u': 6, 'U': 10}[string[index + 1]]]
+            else:
+                token = string[index:index + 2]
+
+            if token in _ASSERTIONS_AT_START:
+                if consumed:
+                    result.append(token)
+                elif atStart:
+                    result.append(_ASSERTIONS_AT_START[token])
+                else:
+                    return None
+                index += len(token)
+                continue
+
+            # backreferences and \\Z might not consume characters
+            isConsumingAtom = not (token[1:2].isdigit() and token[1:2] != '0') and token != '\\Z'
+        elif char == '[':
+            token = string[index:_regExpClassEnd(string, index)]
+            isConsumingAtom = True
+        elif _numSeqReplacer.match(string, index):  # dynamic substitution, might be empty
+            token = _numSeqReplacer.match(string, index).group(0)
+        elif char == '(':
+            if string.startswith(('(?<=', '(?<!', '(?('), index):
+                return None
+
+            if string.startswith(('(?P=', '(?#'), index):
+                token = string[index:string.find(')', index) + 1]
+                if not token:
+                    return None
+            else:
+                if string.startswith('(?P<', index):
+                    token = string[index:string.find('>', index) + 1]
+                elif string.startswith(('(?:', '(?=', '(?!'), index):
+                    token = string[index:index + 3]
+                elif string.startswith('(?', index):
+                    return None  # inline flags
+                else:
+                    token = char
+
+                groupEnd = _regExpGroupEnd(string, index)
+                if groupEnd is None:
+                    return None
+                if string.startswith(('*', '+', '{'), groupEnd):
+                    atStart = False
+                groups.append((atStart, consumed, True, token in ('(?=', '(?!')))
+                result.append(token)
+                index += len(token)
+                continue
+        elif char == '|':
+            if groups:
+                groupAtStart, groupConsumed, allConsumed, isLookahead = groups[-1]
+                groups[-1] = (groupAtStart, groupConsumed, allConsumed and consumed, isLookahead)
+                atStart, consumed = groupAtStart, groupConsumed
+            else:
+                atStart, consumed = True, False
+            result.append(char)
+            index += 1
+            continue
+        elif char == ')':
+            if not groups:
+                return None
+            groupAtStart, groupConsumed, allConsumed, isLookahead = groups.pop()
+            token = char
+            index += 1
+            result.append(token)
+            atStart = False
+            if isLookahead or string.startswith(('?', '*', '{'), index):
+                consumed = groupConsumed
+            else:
+                consumed = allConsumed and consumed
+            continue
+        elif char in '$?*+{}':
+            token = char
+        else:
+            token = char
+            isConsumingAtom = True
+
+        index += len(token)
+        result.append(token)
+        atStart = False
+        if isConsumingAtom and \
+           (not string.startswith(('?', '*', '{'), index)):  # not optional
+            consumed = True
+
+    if groups:
+        return None
+
+    return ''.join(result)
+
+
+class _DynamicRegExpCache:
+    """LRU cache of compiled patterns of dynamic RegExpr rules.
+    Key is (rule, pattern after substitutions)
+    """
+    MAX_SIZE = 256
+
+    def __init__(self):
+        self._regExps = collections.OrderedDict()
+        self._lock = threading.Lock()  # rules might be matched by the background highlighting thread
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rule, string):
+        key = (rule, string)
+        with self._lock:
+            if key in self._regExps:
+                self.hits += 1
+                self._regExps.move_to_end(key)
+                return self._regExps[key]
+
+            self.misses += 1
+            regExp = rule._compileRegExp(string, rule.insensitive, rule.minimal)
+            self._regExps[key] = regExp
+            if len(self._regExps) > self.MAX_SIZE:
+                self._regExps.popitem(last=False)
+            return regExp
+
+    def info(self):
+        return self.hits, self.misses, len(self._regExps), self.MAX_SIZE
+
+    def clear(self):
+        with self._lock:
+            self._regExps.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_dynamicRegExpCache = _DynamicRegExpCache()
+
+# Compiled pattern of a dynamic RegExpr rule for the last context data: rule: (context data, pattern).
+# Substitutions are made and the cache is searched once per context stack frame.
+# Kept per thread, not in the rule, because rules are shared by the GUI and the background highlighting
+# threads and are not modified after loading
+_lastDynamicRegExps = threading.local()
+
+
+def dynamicRegExpCacheInfo():
+    """Get (hits, misses, size, maximum size) of the cache of compiled patterns of dynamic RegExpr rules
+    """
+    return _dynamicRegExpCache.info()
+
+
+def clearDynamicRegExpCache():
+    """Clear the cache of compiled patterns of dynamic RegExpr rules and reset counters
+    """
+    _dynamicRegExpCache.clear()
+
 
 class RegExpr(AbstractRule):
     """ Public attributes:
@@ -388,11 +804,16 @@ class RegExpr(AbstractRule):
         self.wordStart = wordStart
         self.lineStart = lineStart
 
+        # Pattern for matching at an offset in the whole line. None, if the pattern looks at the text
+        # before the match start. Such patterns are matched against the text slice
+        offsetPattern = _offsetMatchingPattern(string)
+        self._matchAtOffset = offsetPattern is not None
+        self._pattern = offsetPattern if self._matchAtOffset else string
+
         if self.dynamic:
             self.regExp = None
         else:
-            self.regExp = self._compileRegExp(string, insensitive, minimal)
-
+            self.regExp = self._compileRegExp(self._pattern, insensitive, minimal)
 
     def shortId(self):
         return 'RegExpr( %s )' % self.string
@@ -412,21 +833,42 @@ class RegExpr(AbstractRule):
             return None
 
         if self.dynamic:
-            string = self._makeDynamicSubsctitutions(self.string, textToMatchObject.contextData)
-            regExp = self._compileRegExp(string, self.insensitive, self.minimal)
+            regExp = self._dynamicRegExp(textToMatchObject.contextData)
         else:
             regExp = self.regExp
 
         if regExp is None:
             return None
 
-        wholeMatch, groups = self._matchPattern(regExp, textToMatchObject.text)
+        if self._matchAtOffset:
+            wholeMatch, groups = self._matchPattern(regExp,
+                                                    textToMatchObject.wholeLineText,
+                                                    textToMatchObject.currentColumnIndex)
+        else:
+            wholeMatch, groups = self._matchPattern(regExp,
+                                                    textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex:])
         if wholeMatch is not None:
             count = len(wholeMatch)
-            return RuleTryMatchResult(self, count, groups)
+            return textToMatchObject.result.set(self, count, groups)
         else:
             return None
 
+    def regExpPattern(self, deliminatorSet):
+        if self.dynamic or self.regExp is None or not self._matchAtOffset:
+            return None
+
+        if self.regExp.flags & re.IGNORECASE:
+            pattern = '(?i:%s)' % self.regExp.pattern
+        else:
+            pattern = '(?:%s)' % self.regExp.pattern
+
+        if self.wordStart:
+            pattern = _wordStartPattern(deliminatorSet) + pattern
+        if self.lineStart:
+            pattern = '(?<![\\s\\S])' + pattern  # column 0
+
+        return pattern
+
     @staticmethod
     def _makeDynamicSubsctitutions(string, contextData):
         """For dynamic rules, replace %d patterns with actual strings
@@ -443,6 +885,24 @@ class RegExpr(AbstractRule):
 
         return _numSeqReplacer.sub(_replaceFunc, string)
 
+    def _dynamicRegExp(self, contextData):
+        """Get compiled pattern of a dynamic rule. See _lastDynamicRegExps
+        """
+        try:
+            lastDynamicRegExps = _lastDynamicRegExps.regExps
+        except AttributeError:  # the first dynamic rule in the thread
+            lastDynamicRegExps = _lastDynamicRegExps.regExps = {}
+
+        lastDynamicRegExp = lastDynamicRegExps.get(self)
+        if lastDynamicRegExp is not None and \
+           lastDynamicRegExp[0] is contextData:
+            return lastDynamicRegExp[1]
+
+        string = self._makeDynamicSubsctitutions(self._pattern, contextData)
+        regExp = _dynamicRegExpCache.get(self, string)
+        lastDynamicRegExps[self] = (contextData, regExp)
+        return regExp
+
     @staticmethod
     def _compileRegExp(string, insensitive, minimal):
         """Compile regular expression.
@@ -465,12 +925,12 @@ class RegExpr(AbstractRule):
             return None
 
     @staticmethod
-    def _matchPattern(regExp, string):
-        """Try to match pattern.
+    def _matchPattern(regExp, string, pos=0):
+        """Try to match pattern at pos.
         Returns tuple (whole match, groups) or (None, None)
         Python function, used by C code
         """
-        match = regExp.match(string)
+        match = regExp.match(string, pos)
         if match is not None and match.group(0):
             return match.group(0), (match.group(0), ) + match.groups()
         else:
@@ -497,41 +957,40 @@ class AbstractNumberRule(AbstractRule):
         if not textToMatchObject.isWordStart:
             return None
 
-        index = self._tryMatchText(textToMatchObject.text)
+        index = self._tryMatchText(textToMatchObject.wholeLineText, textToMatchObject.currentColumnIndex)
         if index is None:
             return None
 
-        if textToMatchObject.currentColumnIndex + index < len(textToMatchObject.wholeLineText):
-            newTextToMatchObject = TextToMatchObject(textToMatchObject.currentColumnIndex + index,
-                                                      textToMatchObject.wholeLineText,
-                                                      self.parentContext.parser.deliminatorSet,
-                                                      textToMatchObject.contextData)
+        currentColumnIndex = textToMatchObject.currentColumnIndex
+        if currentColumnIndex + index < len(textToMatchObject.wholeLineText):
+            textToMatchObject.moveTo(currentColumnIndex + index)
             for rule in self.childRules:
-                ruleTryMatchResult = rule.tryMatch(newTextToMatchObject)
+                ruleTryMatchResult = rule.tryMatch(textToMatchObject)
                 if ruleTryMatchResult is not None:
                     index += ruleTryMatchResult.length
                     break
                 # child rule context and attribute ignored
+            textToMatchObject.moveTo(currentColumnIndex)
 
-        return RuleTryMatchResult(self, index)
+        return textToMatchObject.result.set(self, index)
 
-    def _countDigits(self, text):
-        """Count digits at start of text
+    def _countDigits(self, text, start):
+        """Count digits in text starting from start
         """
-        index = 0
+        index = start
         while index < len(text):
             if not text[index].isdigit():
                 break
             index += 1
-        return index
+        return index - start
 
 
 class Int(AbstractNumberRule):
     def shortId(self):
         return 'Int()'
 
-    def _tryMatchText(self, text):
-        matchedLength = self._countDigits(text)
+    def _tryMatchText(self, text, start):
+        matchedLength = self._countDigits(text, start)
 
         if matchedLength:
             return matchedLength
@@ -543,50 +1002,50 @@ class Float(AbstractNumberRule):
     def shortId(self):
         return 'Float()'
 
-    def _tryMatchText(self, text):
+    def _tryMatchText(self, text, start):
 
         haveDigit = False
         havePoint = False
 
-        matchedLength = 0
+        index = start
 
-        digitCount = self._countDigits(text[matchedLength:])
+        digitCount = self._countDigits(text, index)
         if digitCount:
             haveDigit = True
-            matchedLength += digitCount
+            index += digitCount
 
-        if len(text) > matchedLength and text[matchedLength] == '.':
+        if len(text) > index and text[index] == '.':
             havePoint = True
-            matchedLength += 1
+            index += 1
 
-        digitCount = self._countDigits(text[matchedLength:])
+        digitCount = self._countDigits(text, index)
         if digitCount:
             haveDigit = True
-            matchedLength += digitCount
+            index += digitCount
 
-        if len(text) > matchedLength and text[matchedLength].lower() == 'e':
-            matchedLength += 1
+        if len(text) > index and text[index].lower() == 'e':
+            index += 1
 
-            if len(text) > matchedLength and text[matchedLength] in '+-':
-                matchedLength += 1
+            if len(text) > index and text[index] in '+-':
+                index += 1
 
             haveDigitInExponent = False
 
-            digitCount = self._countDigits(text[matchedLength:])
+            digitCount = self._countDigits(text, index)
             if digitCount:
                 haveDigitInExponent = True
-                matchedLength += digitCount
+                index += digitCount
 
             if not haveDigitInExponent:
                 return None
 
-            return matchedLength
+            return index - start
         else:
             if not havePoint:
                 return None
 
-        if matchedLength and haveDigit:
-            return matchedLength
+        if index > start and haveDigit:
+            return index - start
         else:
             return None
 
@@ -596,20 +1055,22 @@ class HlCOct(AbstractRule):
         return 'HlCOct'
 
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text[0] != '0':
+        text = textToMatchObject.wholeLineText
+        start = textToMatchObject.currentColumnIndex
+        if text[start] != '0':
             return None
 
-        index = 1
-        while index < len(textToMatchObject.text) and textToMatchObject.text[index] in '01234567':
+        index = start + 1
+        while index < len(text) and text[index] in '01234567':
             index += 1
 
-        if index == 1:
+        if index == start + 1:
             return None
 
-        if index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in 'LU':
+        if index < len(text) and text[index].upper() in 'LU':
             index += 1
 
-        return RuleTryMatchResult(self, index)
+        return textToMatchObject.result.set(self, index - start)
 
 
 class HlCHex(AbstractRule):
@@ -617,29 +1078,32 @@ class HlCHex(AbstractRule):
         return 'HlCHex'
 
     def _tryMatch(self, textToMatchObject):
-        if len(textToMatchObject.text) < 3:
+        if textToMatchObject.textLen < 3:
             return None
 
-        if textToMatchObject.text[:2].upper() != '0X':
+        text = textToMatchObject.wholeLineText
+        start = textToMatchObject.currentColumnIndex
+        if text[start:start + 2].upper() != '0X':
             return None
 
-        index = 2
-        while index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in '0123456789ABCDEF':
+        index = start + 2
+        while index < len(text) and text[index].upper() in '0123456789ABCDEF':
             index += 1
 
-        if index == 2:
+        if index == start + 2:
             return None
 
-        if index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in 'LU':
+        if index < len(text) and text[index].upper() in 'LU':
             index += 1
 
-        return RuleTryMatchResult(self, index)
+        return textToMatchObject.result.set(self, index - start)
 
 
-def _checkEscapedChar(text):
-    index = 0
-    if len(text) > 1 and text[0] == '\\':
-        index = 1
+def _checkEscapedChar(text, start):
+    """Get length of an escaped char in text at start or None
+    """
+    if len(text) - start > 1 and text[start] == '\\':
+        index = start + 1
 
         if text[index] in "abefnrtv'\"?\\":
             index += 1
@@ -647,15 +1111,15 @@ def _checkEscapedChar(text):
             index += 1
             while index < len(text) and text[index].upper() in '0123456789ABCDEF':
                 index += 1
-            if index == 2:  # no hex digits
+            if index == start + 2:  # no hex digits
                 return None
         elif text[index] in '01234567':
-            while index < 4 and index < len(text) and text[index] in '01234567':
+            while index < start + 4 and index < len(text) and text[index] in '01234567':
                 index += 1
         else:
             return None
 
-        return index
+        return index - start
 
     return None
 
@@ -665,9 +1129,9 @@ class HlCStringChar(AbstractRule):
         return 'HlCStringChar'
 
     def _tryMatch(self, textToMatchObject):
-        res = _checkEscapedChar(textToMatchObject.text)
+        res = _checkEscapedChar(textToMatchObject.wholeLineText, textToMatchObject.currentColumnIndex)
         if res is not None:
-            return RuleTryMatchResult(self, res)
+            return textToMatchObject.result.set(self, res)
         else:
             return None
 
@@ -677,15 +1141,17 @@ class HlCChar(AbstractRule):
         return 'HlCChar'
 
     def _tryMatch(self, textToMatchObject):
-        if len(textToMatchObject.text) > 2 and textToMatchObject.text[0] == "'" and textToMatchObject.text[1] != "'":
-            result = _checkEscapedChar(textToMatchObject.text[1:])
+        text = textToMatchObject.wholeLineText
+        start = textToMatchObject.currentColumnIndex
+        if textToMatchObject.textLen > 2 and text[start] == "'" and text[start + 1] != "'":
+            result = _checkEscapedChar(text, start + 1)
             if result is not None:
-                index = 1 + result
+                index = start + 1 + result
             else:  # 1 not escaped character
-                index = 1 + 1
+                index = start + 1 + 1
 
-            if index < len(textToMatchObject.text) and textToMatchObject.text[index] == "'":
-                return RuleTryMatchResult(self, index + 1)
+            if index < len(text) and text[index] == "'":
+                return textToMatchObject.result.set(self, index + 1 - start)
 
         return None
 
@@ -704,24 +1170,34 @@ class RangeDetect(AbstractRule):
         return 'RangeDetect(%s, %s)' % (self.char, self.char1)
 
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text.startswith(self.char):
-            end = textToMatchObject.text.find(self.char1, 1)
+        start = textToMatchObject.currentColumnIndex
+        if textToMatchObject.wholeLineText.startswith(self.char, start):
+            end = textToMatchObject.wholeLineText.find(self.char1, start + 1)
             if end > 0:
-                return RuleTryMatchResult(self, end + 1)
+                return textToMatchObject.result.set(self, end - start + 1)
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        if len(self.char) != 1 or len(self.char1) != 1:
+            return None
+        return '%s[^%s]*%s' % (re.escape(self.char), re.escape(self.char1), re.escape(self.char1))
+
 
 class LineContinue(AbstractRule):
     def shortId(self):
         return 'LineContinue'
 
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text == '\\':
-            return RuleTryMatchResult(self, 1)
+        if textToMatchObject.textLen == 1 and \
+           textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex] == '\\':
+            return textToMatchObject.result.set(self, 1)
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        return '\\\\\\Z'
+
 
 class IncludeRules(AbstractRule):
     def __init__(self, abstractRuleParams, context):
@@ -746,11 +1222,12 @@ class IncludeRules(AbstractRule):
         for rule in self.context.rules:
             ruleTryMatchResult = rule.tryMatch(textToMatchObject)
             if ruleTryMatchResult is not None:
-                _logger.debug('\tmatched rule %s at %d in included context %s/%s',
-                              rule.shortId(),
-                              textToMatchObject.currentColumnIndex,
-                              self.context.parser.syntax.name,
-                              self.context.name)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug('\tmatched rule %s at %d in included context %s/%s',
+                                  rule.shortId(),
+                                  textToMatchObject.currentColumnIndex,
+                                  self.context.parser.syntax.name,
+                                  self.context.name)
                 return ruleTryMatchResult
         else:
             return None
@@ -761,12 +1238,16 @@ class DetectSpaces(AbstractRule):
         return 'DetectSpaces()'
 
     def _tryMatch(self, textToMatchObject):
-        spaceLen = len(textToMatchObject.text) - len(textToMatchObject.text.lstrip())
+        spaceLen = _spacesRegExp.match(textToMatchObject.wholeLineText,
+                                       textToMatchObject.currentColumnIndex).end() - textToMatchObject.currentColumnIndex
         if spaceLen:
-            return RuleTryMatchResult(self, spaceLen)
+            return textToMatchObject.result.set(self, spaceLen)
         else:
             return None
 
+    def regExpPattern(self, deliminatorSet):
+        return '\\s+'
+
 
 class DetectIdentifier(AbstractRule):
     _regExp = re.compile('[a-zA-Z][a-zA-Z0-9_]*')
@@ -774,12 +1255,220 @@ class DetectIdentifier(AbstractRule):
         return 'DetectIdentifier()'
 
     def _tryMatch(self, textToMatchObject):
-        match = DetectIdentifier._regExp.match(textToMatchObject.text)
+        match = DetectIdentifier._regExp.match(textToMatchObject.wholeLineText, textToMatchObject.currentColumnIndex)
         if match is not None and match.group(0):
-            return RuleTryMatchResult(self, len(match.group(0)))
+            return textToMatchObject.result.set(self, len(match.group(0)))
 
         return None
 
+    def regExpPattern(self, deliminatorSet):
+        return DetectIdentifier._regExp.pattern
+
+
+# Count of rules, which are fused for a character of a dispatch table. See Context._makeDispatchTable()
+_MAX_DISPATCHED_FUSED_RULES = 32
+
+
+class FusedRules:
+    """Consecutive rules, which are matched with one regular expression.
+    Every rule is an alternative in a group. Alternatives are tried in order,
+    therefore the first matching rule wins, as if the rules were tried one by one.
+    See AbstractRule.fusedPattern
+
+    Public attributes:
+        rules
+        regExp
+    """
+    def __init__(self, rules, deliminatorSet):
+        self.rules = rules
+        self.regExp = re.compile('|'.join(['(?P<_%d>%s)' % (index, _fusedPattern(rule, deliminatorSet)) \
+                                                for index, rule in enumerate(rules)]))
+
+        # rule group index: (rule, index after the last group of the rule if the rule returns groups)
+        self._ruleForGroup = {}
+        groupIndexes = [self.regExp.groupindex['_%d' % index] for index in range(len(rules))]
+        for rule, groupIndex, nextGroupIndex in zip(rules, groupIndexes, groupIndexes[1:] + [self.regExp.groups + 1]):
+            groupsEnd = nextGroupIndex - 1 if isinstance(rule, RegExpr) else None
+            self._ruleForGroup[groupIndex] = (rule, groupsEnd)
+
+    def shortId(self):
+        return 'FusedRules(%s)' % ', '.join([rule.shortId() for rule in self.rules])
+
+    def tryMatch(self, textToMatchObject):
+        match = self.regExp.match(textToMatchObject.wholeLineText, textToMatchObject.currentColumnIndex)
+        if match is None:
+            return None
+
+        return self._matchResult(match, textToMatchObject.result)
+
+    def search(self, textToMatchObject, pos):
+        """Find the first position in the line of textToMatchObject, where a rule matches.
+        Returns (RuleTryMatchResult, position) or (None, None)
+        """
+        match = self.regExp.search(textToMatchObject.wholeLineText, pos)
+        if match is None:
+            return None, None
+
+        return self._matchResult(match, textToMatchObject.result), match.start()
+
+    def _matchResult(self, match, result):
+        # the group of the matched rule is closed after its nested groups
+        rule, groupsEnd = self._ruleForGroup[match.lastindex]
+        if groupsEnd is not None:
+            data = (match.group(0), ) + match.groups()[match.lastindex:groupsEnd]
+        else:
+            data = None
+        return result.set(rule, match.end() - match.start(), data)
+
+
+def _fusedPattern(rule, deliminatorSet):
+    """Get fusedPattern of the rule for the syntax with deliminatorSet.
+    Rules of included syntaxes are matched with deliminators of the current syntax,
+    but fusedPattern is made with deliminators of the rule syntax
+    """
+    if rule.fusedPattern is None or \
+       rule.parentContext.parser.deliminatorSet == deliminatorSet:
+        return rule.fusedPattern
+    else:
+        return rule.regExpPattern(deliminatorSet)
+
+
+def _fuseRules(rules, parser):
+    """Replace sequences of rules, which have fusedPattern, with FusedRules of the parser
+    """
+    result = []
+    sequence = []
+    for rule in rules + (None, ):
+        if rule is not None and _fusedPattern(rule, parser.deliminatorSet) is not None:
+            sequence.append(rule)
+            continue
+
+        if len(sequence) > 1:
+            try:
+                result.append(parser.fusedRules(tuple(sequence)))
+            except re.error as ex:
+                _logger.warning('Failed to fuse rules: %s', ex)
+                result += sequence
+        else:
+            result += sequence
+        sequence = []
+
+        if rule is not None:
+            result.append(rule)
+
+    return tuple(result)
+
+
+class _LineBudget:
+    """Limit of steps and time of parsing of a line. A step is a position, at which rules of a context are tried,
+    or a search of fused rules.
+    Time is checked every _TIME_CHECK_INTERVAL_STEPS steps
+    """
+    __slots__ = ('_stepsLeft', '_endTime', '_stepsToTimeCheck', 'exhausted')
+
+    _TIME_CHECK_INTERVAL_STEPS = 16
+
+    def __init__(self, maxSteps, maxTime):
+        self._stepsLeft = maxSteps if maxSteps else -1
+        self._endTime = time.perf_counter() + maxTime if maxTime else None
+        self._stepsToTimeCheck = self._TIME_CHECK_INTERVAL_STEPS
+        self.exhausted = False
+
+    def step(self):
+        """Count a step. Returns True, if the budget is exhausted
+        """
+        self._stepsLeft -= 1
+        if self._stepsLeft == 0:
+            self.exhausted = True
+
+        if self._endTime is not None:
+            self._stepsToTimeCheck -= 1
+            if self._stepsToTimeCheck == 0:
+                self._stepsToTimeCheck = self._TIME_CHECK_INTERVAL_STEPS
+                if time.perf_counter() >= self._endTime:
+                    self.exhausted = True
+
+        return self.exhausted
+
+
+_profilingEnabled = False
+
+
+class _ProfileCounters:
+    """Trials of a rule or parsed blocks of a context, matches and time in seconds.
+    See setProfilingEnabled()
+    """
+    __slots__ = ('context', 'count', 'matches', 'time')
+
+    def __init__(self, context):
+        self.context = context
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.matches = 0
+        self.time = 0.
+
+    def add(self, matched, startTime):
+        self.count += 1
+        if matched:
+            self.matches += 1
+        self.time += time.perf_counter() - startTime
+
+
+# Counters are kept, when the profile is cleared, because dispatch tables of contexts refer to them
+_ruleProfiles = {}  # rule or FusedRules: _ProfileCounters
+_contextProfiles = {}  # context: _ProfileCounters
+
+
+class _ProfiledRule:
+    """Rule or FusedRules in the dispatch table of a context, while profiling is enabled.
+    Counts trials, matches and time of the rule
+    """
+    __slots__ = ('_rule', '_counters')
+
+    def __init__(self, rule, context):
+        self._rule = rule
+        if rule not in _ruleProfiles:
+            _ruleProfiles[rule] = _ProfileCounters(context if isinstance(rule, FusedRules) else rule.parentContext)
+        self._counters = _ruleProfiles[rule]
+
+    def tryMatch(self, textToMatchObject):
+        startTime = time.perf_counter()
+        ruleTryMatchResult = self._rule.tryMatch(textToMatchObject)
+        self._counters.add(ruleTryMatchResult is not None, startTime)
+        return ruleTryMatchResult
+
+    def search(self, textToMatchObject, pos):
+        startTime = time.perf_counter()
+        ruleTryMatchResult, matchIndex = self._rule.search(textToMatchObject, pos)
+        self._counters.add(ruleTryMatchResult is not None, startTime)
+        return ruleTryMatchResult, matchIndex
+
+
+def setProfilingEnabled(enabled):
+    """Enable or disable counting of trials, matches and time of rules and contexts
+    """
+    global _profilingEnabled
+    _profilingEnabled = bool(enabled)
+
+
+def profileInfo():
+    """Get ([(context, blocks, time)], [(rule, context, trials, matches, time)])
+    """
+    return ([(context, counters.count, counters.time) \
+                for context, counters in list(_contextProfiles.items()) if counters.count],
+            [(rule, counters.context, counters.count, counters.matches, counters.time) \
+                for rule, counters in list(_ruleProfiles.items()) if counters.count])
+
+
+def clearProfile():
+    """Reset counters of rules and contexts
+    """
+    _contextProfiles.clear()
+    for counters in list(_ruleProfiles.values()):
+        counters.reset()
+
 
 class Context:
     """Highlighting context
@@ -793,10 +1482,14 @@ class Context:
         rules
         textType     ' ' : code, 'c' : comment
     """
+    _dispatchTableLock = threading.Lock()  # contexts might be parsed by the background highlighting thread
+
     def __init__(self, parser, name):
         # Will be initialized later, after all context has been created
         self.parser = parser
         self.name = name
+        self.rules = None
+        self._dispatchTable = None
 
     def setValues(self, attribute, format, lineEndContext, lineBeginContext, lineEmptyContext, fallthroughContext, dynamic, textType):
         self.attribute = attribute
@@ -810,6 +1503,106 @@ class Context:
 
     def setRules(self, rules):
         self.rules = rules
+        self._dispatchTable = None
+
+    def _flatRules(self, rules, visitedContexts):
+        """Replace IncludeRules without column and firstNonSpace conditions with rules of the included context.
+        A context included twice is skipped, its rules have already failed
+        """
+        flatRules = []
+        for rule in rules:
+            if isinstance(rule, IncludeRules) and \
+               rule.column == -1 and \
+               not rule.firstNonSpace:
+                if rule.context not in visitedContexts:
+                    visitedContexts.add(rule.context)
+                    flatRules += self._flatRules(rule.context.rules, visitedContexts)
+            else:
+                flatRules.append(rule)
+        return flatRules
+
+    def _getDispatchTable(self):
+        """Get (rules for ASCII character, rules for other characters, search rules, profiled).
+        The table is made once and replaced as a whole, therefore threads never see a partially made table
+        """
+        dispatchTable = self._dispatchTable
+        if dispatchTable is None or dispatchTable[3] != _profilingEnabled:
+            with self._dispatchTableLock:
+                dispatchTable = self._dispatchTable
+                if dispatchTable is None or dispatchTable[3] != _profilingEnabled:
+                    dispatchTable = self._makeDispatchTable()
+                    self._dispatchTable = dispatchTable
+        return dispatchTable
+
+    def _makeDispatchTable(self):
+        """Make map ASCII character: rules, which might match text starting with the character.
+        Rules for other characters are in allRules. Rules with fusedPattern are fused
+        """
+        flatRules = tuple(self._flatRules(self.rules, set([self])))
+        allRules = _fuseRules(flatRules, self.parser)
+
+        # A character gets FusedRules of the rules, which might match text starting with it.
+        # Big sequences aren't fused again for every character, characters use FusedRules of all rules.
+        # Rules, which can't match text starting with the character, don't change the result of FusedRules
+        fusedRulesOfRule = {rule: fusedRules \
+                                for fusedRules in allRules if isinstance(fusedRules, FusedRules) \
+                                    for rule in fusedRules.rules}
+
+        def dispatchedRules(rules):
+            sequences = collections.OrderedDict()  # FusedRules of all rules or a rule: rules of the character
+            for rule in rules:
+                sequences.setdefault(fusedRulesOfRule.get(rule, rule), []).append(rule)
+
+            result = []
+            for fusedRules, sequence in sequences.items():
+                if len(sequence) == 1 or len(sequence) == len(fusedRules.rules):
+                    result.append(sequence[0] if len(sequence) == 1 else fusedRules)
+                elif len(sequence) <= _MAX_DISPATCHED_FUSED_RULES:
+                    result.append(self.parser.fusedRules(tuple(sequence)))
+                else:
+                    result.append(fusedRules)
+            return tuple(result)
+
+        rulesForChar = {}
+        dispatchedRulesCache = {}  # rules: dispatched rules. Many characters have equal rules
+        for code in range(128):
+            char = chr(code)
+            rules = tuple([rule for rule in flatRules \
+                              if rule.firstChars is None or char in rule.firstChars])
+            if rules not in dispatchedRulesCache:
+                dispatchedRulesCache[rules] = dispatchedRules(rules)
+            rulesForChar[char] = dispatchedRulesCache[rules]
+
+        # If all rules are fused and there is no fallthrough context, not matched text is skipped with
+        # one search() call instead of matching at every position
+        searchRules = None
+        if flatRules and \
+           self.fallthroughContext is None and \
+           all([_fusedPattern(rule, self.parser.deliminatorSet) is not None for rule in flatRules]):
+            try:
+                searchRules = self.parser.fusedRules(flatRules)  # equal to allRules[0], if it is FusedRules
+            except re.error as ex:
+                _logger.warning('Failed to fuse rules: %s', ex)
+
+        profiled = _profilingEnabled
+        if profiled:
+            return self._profiledDispatchTable(rulesForChar, allRules, searchRules)
+        return rulesForChar, allRules, searchRules, profiled
+
+    def _profiledDispatchTable(self, rulesForChar, allRules, searchRules):
+        """Replace rules in the dispatch table with _ProfiledRule
+        """
+        profiledRules = {}  # rules: profiled rules
+
+        def profiled(rules):
+            if rules not in profiledRules:
+                profiledRules[rules] = tuple([_ProfiledRule(rule, self) for rule in rules])
+            return profiledRules[rules]
+
+        rulesForChar = {char: profiled(rules) for char, rules in rulesForChar.items()}
+        if searchRules is not None:
+            searchRules = _ProfiledRule(searchRules, self)
+        return rulesForChar, profiled(allRules), searchRules, True
 
     def __str__(self):
         """Serialize.
@@ -828,73 +1621,89 @@ class Context:
             res += str(rule)
         return res
 
-    def parseBlock(self, contextStack, currentColumnIndex, text):
+    def parseBlock(self, contextStack, currentColumnIndex, text, firstNonSpaceIndex,
+                   highlightedSegments, textTypes, budget=None):
         """Parse block
-        Exits, when reached end of the text, or when context is switched
-        Returns (length, newContextStack, highlightedSegments, lineContinue)
+        Exits, when reached end of the text, when context is switched or when the budget is exhausted
+        Appends (length, format) to highlightedSegments and text type of every segment to textTypes
+        budget is a _LineBudget or None
+        Returns (length, newContextStack, lineContinue)
         """
         startColumnIndex = currentColumnIndex
         countOfNotMatchedSymbols = 0
-        highlightedSegments = []
-        textTypeMap = []
         ruleTryMatchResult = None
+        textToMatchObject = TextToMatchObject(currentColumnIndex,
+                                              text,
+                                              self.parser.deliminatorSet,
+                                              contextStack.currentData(),
+                                              firstNonSpaceIndex)
+        rulesForChar, allRules, searchRules, profiled = self._getDispatchTable()
         while currentColumnIndex < len(text):
-            textToMatchObject = TextToMatchObject(currentColumnIndex,
-                                                   text,
-                                                   self.parser.deliminatorSet,
-                                                   contextStack.currentData())
-            for rule in self.rules:
-                ruleTryMatchResult = rule.tryMatch(textToMatchObject)
-                if ruleTryMatchResult is not None:  # if something matched
-                    _logger.debug('\tmatched rule %s at %d',
-                                  rule.shortId(),
-                                  currentColumnIndex)
-                    if countOfNotMatchedSymbols > 0:
-                        highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-                        textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
-                        countOfNotMatchedSymbols = 0
-
-                    if ruleTryMatchResult.rule.context is not None:
-                        newContextStack = ruleTryMatchResult.rule.context.getNextContextStack(contextStack,
-                                                                                              ruleTryMatchResult.data)
-                    else:
-                        newContextStack = contextStack
+            if budget is not None and budget.step():
+                break
 
-                    format = ruleTryMatchResult.rule.format if ruleTryMatchResult.rule.attribute else newContextStack.currentContext().format
-                    textType = ruleTryMatchResult.rule.textType or newContextStack.currentContext().textType
+            if searchRules is not None:  # not matched text is skipped with one search
+                ruleTryMatchResult, matchIndex = searchRules.search(textToMatchObject, currentColumnIndex)
+                if ruleTryMatchResult is None:
+                    countOfNotMatchedSymbols += len(text) - currentColumnIndex
+                    currentColumnIndex = len(text)
+                    break
 
-                    highlightedSegments.append((ruleTryMatchResult.length,
-                                                format))
-                    textTypeMap += textType * ruleTryMatchResult.length
+                countOfNotMatchedSymbols += matchIndex - currentColumnIndex
+                currentColumnIndex = matchIndex
+            else:
+                textToMatchObject.moveTo(currentColumnIndex)
+                for rule in rulesForChar.get(text[currentColumnIndex], allRules):
+                    ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+                    if ruleTryMatchResult is not None:  # if something matched
+                        break
+                else:  # no matched rules
+                    if self.fallthroughContext is not None:
+                        newContextStack = self.fallthroughContext.getNextContextStack(contextStack)
+                        if newContextStack != contextStack:
+                            if countOfNotMatchedSymbols > 0:
+                                highlightedSegments.append((countOfNotMatchedSymbols, self.format))
+                                textTypes.append(self.textType)
+                            return currentColumnIndex - startColumnIndex, newContextStack, False
+
+                    currentColumnIndex += 1
+                    countOfNotMatchedSymbols += 1
+                    continue
+
+            rule = ruleTryMatchResult.rule
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug('\tmatched rule %s at %d', rule.shortId(), currentColumnIndex)
+            if countOfNotMatchedSymbols > 0:
+                highlightedSegments.append((countOfNotMatchedSymbols, self.format))
+                textTypes.append(self.textType)
+                countOfNotMatchedSymbols = 0
+
+            if rule.context is not None:
+                newContextStack = rule.context.getNextContextStack(contextStack, ruleTryMatchResult.data)
+            else:
+                newContextStack = contextStack
 
-                    currentColumnIndex += ruleTryMatchResult.length
+            format = rule.format if rule.attribute else newContextStack.currentContext().format
+            textType = rule.textType or newContextStack.currentContext().textType
 
-                    if newContextStack != contextStack:
-                        lineContinue = isinstance(ruleTryMatchResult.rule, LineContinue)
+            highlightedSegments.append((ruleTryMatchResult.length, format))
+            textTypes.append(textType)
 
-                        return currentColumnIndex - startColumnIndex, newContextStack, highlightedSegments, textTypeMap, lineContinue
+            currentColumnIndex += ruleTryMatchResult.length
 
-                    break  # for loop
-            else:  # no matched rules
-                if self.fallthroughContext is not None:
-                    newContextStack = self.fallthroughContext.getNextContextStack(contextStack)
-                    if newContextStack != contextStack:
-                        if countOfNotMatchedSymbols > 0:
-                            highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-                            textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
-                        return (currentColumnIndex - startColumnIndex, newContextStack, highlightedSegments, textTypeMap, False)
+            if newContextStack != contextStack:
+                lineContinue = isinstance(rule, LineContinue)
 
-                currentColumnIndex += 1
-                countOfNotMatchedSymbols += 1
+                return currentColumnIndex - startColumnIndex, newContextStack, lineContinue
 
         if countOfNotMatchedSymbols > 0:
             highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-            textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
+            textTypes.append(self.textType)
 
         lineContinue = ruleTryMatchResult is not None and \
                        isinstance(ruleTryMatchResult.rule, LineContinue)
 
-        return currentColumnIndex - startColumnIndex, contextStack, highlightedSegments, textTypeMap, lineContinue
+        return currentColumnIndex - startColumnIndex, contextStack, lineContinue
 
 
 class Parser:
@@ -910,18 +1719,32 @@ class Parser:
 
         contexts                Context list as dictionary "context name" : context
         defaultContext          Default context object
+
+        packedFormats           Formats of segments, returned by highlightBlockPacked(), indexed by format index
     """
     def __init__(self, syntax, deliminatorSetAsString, lists, keywordsCaseSensitive, debugOutputEnabled):
         self.syntax = syntax
         self.deliminatorSet = set(deliminatorSetAsString)
         self.lists = lists
         self.keywordsCaseSensitive = keywordsCaseSensitive
+        self.packedFormats = []
+        self._formatIndexes = {}  # id(format): index. Formats are kept alive by self.packedFormats
+        self._formatIndexesLock = threading.Lock()  # lines might be highlighted by several threads
+        self._fusedRules = {}  # rules: FusedRules
         # debugOutputEnabled is used only by cParser
 
     def setContexts(self, contexts, defaultContext):
         self.contexts = contexts
         self.defaultContext = defaultContext
-        self._defaultContextStack = ContextStack([self.defaultContext], [None])
+        self._defaultContextStack = ContextStack.make(None, self.defaultContext, None)
+
+    def fusedRules(self, rules):
+        """Get FusedRules for a tuple of rules. Contexts, which include the same rules, share them.
+        Called while Context._dispatchTableLock is held
+        """
+        if rules not in self._fusedRules:
+            self._fusedRules[rules] = FusedRules(rules, self.deliminatorSet)
+        return self._fusedRules[rules]
 
     def __str__(self):
         """Serialize.
@@ -945,12 +1768,33 @@ class Parser:
 
         return res
 
-    def highlightBlock(self, text, prevContextStack):
+    def makeContextStack(self, frames):
+        """Make context stack from frames, as returned by ContextStack.frames()
+        """
+        if not frames:
+            raise ValueError('Context stack must contain at least one frame')
+
+        contextStack = None
+        for context, data in frames:
+            contextStack = ContextStack.make(contextStack, context, data)
+        return contextStack
+
+    def highlightBlock(self, text, prevContextStack, maxSteps=0, maxTime=0):
         """Parse block and return ParseBlockFullResult
 
         return (lineData, highlightedSegments)
           where lineData is (contextStack, textTypeMap)
-            where textTypeMap is a string of textType characters
+            where textTypeMap is a TextTypeMap
+
+        maxSteps and maxTime (seconds) limit parsing of the line, 0 is no limit.
+        When the limit is reached, the rest of the line gets the format of the current context,
+        and the line ends as if there was no text after the position
+        """
+        return self.highlightBlockLimited(text, prevContextStack, maxSteps, maxTime)[:2]
+
+    def highlightBlockLimited(self, text, prevContextStack, maxSteps=0, maxTime=0):
+        """Parse block and return (lineData, highlightedSegments, exhausted)
+        exhausted is True, if maxSteps or maxTime is reached and the line is cut. See highlightBlock()
         """
         if prevContextStack is not None:
             contextStack = prevContextStack
@@ -958,24 +1802,45 @@ class Parser:
             contextStack = self._defaultContextStack
 
         highlightedSegments = []
+        textTypes = []  # of highlighted segments
         lineContinue = False
         currentColumnIndex = 0
-        textTypeMap = []
+        exhausted = False
 
         if len(text) > 0:
+            firstNonSpaceIndex = _spacesRegExp.match(text).end()
+            profiling = _profilingEnabled
+            budget = _LineBudget(maxSteps, maxTime) if maxSteps or maxTime else None
             while currentColumnIndex < len(text):
-                _logger.debug('In context %s', contextStack.currentContext().name)
+                context = contextStack.currentContext()
+                _logger.debug('In context %s', context.name)
 
-                length, newContextStack, segments, textTypeMapPart, lineContinue = \
-                    contextStack.currentContext().parseBlock(contextStack, currentColumnIndex, text)
+                if profiling:
+                    startTime = time.perf_counter()
+
+                length, contextStack, lineContinue = \
+                    context.parseBlock(contextStack, currentColumnIndex, text, firstNonSpaceIndex,
+                                       highlightedSegments, textTypes, budget)
+
+                if profiling:
+                    if context not in _contextProfiles:
+                        _contextProfiles[context] = _ProfileCounters(context)
+                    _contextProfiles[context].add(False, startTime)
 
-                highlightedSegments += segments
-                contextStack = newContextStack
-                textTypeMap += textTypeMapPart
                 currentColumnIndex += length
 
+                if budget is not None and budget.exhausted:
+                    exhausted = True
+                    if currentColumnIndex < len(text):
+                        highlightedSegments.append((len(text) - currentColumnIndex, context.format))
+                        textTypes.append(context.textType)
+                    lineContinue = False
+                    break
+
             if not lineContinue:
-                while contextStack.currentContext().lineEndContext is not None:
+                for lineEndSwitches in range(_MAX_LINE_END_SWITCHES):
+                    if contextStack.currentContext().lineEndContext is None:
+                        break
                     oldStack = contextStack
                     contextStack = contextStack.currentContext().lineEndContext.getNextContextStack(contextStack)
                     if oldStack == contextStack:  # avoid infinite while loop if nothing to switch
@@ -987,8 +1852,43 @@ class Parser:
         elif contextStack.currentContext().lineEmptyContext is not None:
             contextStack = contextStack.currentContext().lineEmptyContext.getNextContextStack(contextStack)
 
-        lineData = (contextStack, textTypeMap)
-        return lineData, highlightedSegments
+        lineData = (contextStack, TextTypeMap.fromSegments(highlightedSegments, textTypes))
+        return lineData, highlightedSegments, exhausted
+
+    def parseBlock(self, text, prevContextStack, maxSteps=0, maxTime=0):
+        return self.highlightBlock(text, prevContextStack, maxSteps, maxTime)[0]
+
+    def _formatIndex(self, format):
+        if format is None:
+            return -1
+
+        index = self._formatIndexes.get(id(format))
+        if index is None:
+            with self._formatIndexesLock:
+                index = self._formatIndexes.get(id(format))
+                if index is None:
+                    index = len(self.packedFormats)
+                    self.packedFormats.append(format)
+                    self._formatIndexes[id(format)] = index
+        return index
+
+    def highlightBlockPacked(self, text, prevContextStack, buffer, maxSteps=0, maxTime=0):
+        """Parse block, fill buffer with highlighted segments and return lineData
+
+        buffer is a bytearray. It is resized and filled with (start, length, format index) triples
+        of native ints, one per segment. Format index is an index in self.packedFormats,
+        or -1 for a segment without format
+        """
+        if not isinstance(buffer, bytearray):
+            raise TypeError('buffer must be a bytearray')
+
+        lineData, highlightedSegments = self.highlightBlock(text, prevContextStack, maxSteps, maxTime)
+
+        packed = array.array('i')
+        start = 0
+        for length, format in highlightedSegments:
+            packed.extend((start, length, self._formatIndex(format)))
+            start += length
 
-    def parseBlock(self, text, prevContextStack):
-        return self.highlightBlock(text, prevContextStack)[0]
+        buffer[:] = packed.tobytes()
+        return lineData
@@ -0,0 +1,170 @@
+"""Run-length encoded text type map of a line.
+
+Text type is a letter, which is set by the parser for every character of a line:
+    ' ' code
+    'c' comment
+    'b' block comment
+    'h' here document
+    's' string
+See Syntax.isCode() and friends.
+
+Lines usually consist of few runs of characters with the same text type, therefore the map stores
+only runs. Memory usage doesn't depend on the line length
+"""
+
+import array
+import bisect
+import operator
+
+
+_NO_ENDS = array.array('I')  # shared by all single run maps. Never modified
+
+_singleRunMaps = {}  # (textType, length): TextTypeMap. The most of lines consist of one run
+
+
+def _singleRunMap(textType, length):
+    """Get shared map of a line, which consists of one run. textType is '' for an empty line
+    """
+    key = (textType, length)
+    textTypeMap = _singleRunMaps.get(key)
+    if textTypeMap is None:
+        textTypeMap = _singleRunMaps.setdefault(key, TextTypeMap(textType, _NO_ENDS, length))
+    return textTypeMap
+
+
+class TextTypeMap:
+    """Immutable run-length encoded sequence of text type letters.
+
+    Behaves like a string of text types: supports len(), indexing by column, iteration,
+    and is equal to the string. Lookup by column is O(log runs).
+
+    Public attributes:
+        types   String. Text type of every run. Adjacent runs always differ
+        ends    array('I'). End column (exclusive) of every run except the last one
+        length  Length of the line
+
+    Use fromRuns() and fromString() to create a map. Maps of lines with one run are shared
+    """
+    __slots__ = ('types', 'ends', 'length')
+
+    def __init__(self, types, ends, length):
+        self.types = types
+        self.ends = ends if ends else _NO_ENDS
+        self.length = length
+
+    @classmethod
+    def fromRuns(cls, runs):
+        """Make map from iterable of (length, textType). Empty runs are skipped, equal adjacent runs are joined
+        """
+        types = []
+        ends = array.array('I')
+        end = 0
+        for length, textType in runs:
+            if length == 0:
+                continue
+            if types and types[-1] == textType:
+                ends[-1] += length
+            else:
+                types.append(textType)
+                ends.append(end + length)
+            end += length
+
+        if len(types) <= 1:
+            return _singleRunMap(''.join(types), end)
+
+        ends.pop()  # the last end is the length
+        return cls(''.join(types), ends, end)
+
+    @classmethod
+    def fromSegments(cls, highlightedSegments, textTypes):
+        """Make map from highlighted segments (length, format) and text type of every segment
+        """
+        return cls.fromRuns(zip(map(operator.itemgetter(0), highlightedSegments), textTypes))
+
+    @classmethod
+    def fromString(cls, string):
+        """Make map from a string of text types
+        """
+        return cls.fromRuns([(1, textType) for textType in string])
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, column):
+        if column < 0:
+            column += self.length
+        if not 0 <= column < self.length:
+            raise IndexError('column out of range')
+
+        return self.types[bisect.bisect_right(self.ends, column)]
+
+    def __iter__(self):
+        for start, length, textType in self.runs():
+            for i in range(length):
+                yield textType
+
+    def __str__(self):
+        return ''.join([textType * length for start, length, textType in self.runs()])
+
+    def __repr__(self):
+        return 'TextTypeMap(%r)' % str(self)
+
+    def __eq__(self, other):
+        if isinstance(other, TextTypeMap):
+            return self.length == other.length and \
+                   self.types == other.types and \
+                   self.ends == other.ends
+        elif isinstance(other, str):
+            return str(self) == other
+        else:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(str(self))  # equal to the string
+
+    def __reduce__(self):
+        return (TextTypeMap, (self.types, self.ends, self.length))
+
+    def runs(self):
+        """Generator. Yield (start, length, textType) for every run
+        """
+        start = 0
+        for textType, end in zip(self.types, self.ends):
+            yield start, end - start, textType
+            start = end
+
+        if self.length > 0:
+            yield start, self.length - start, self.types[-1]
+
+    def ranges(self, textTypes):
+        """Get list of (start, end) ranges of text with one of textTypes. End is exclusive.
+        ranges(' ') returns all code ranges of the line
+        """
+        result = []
+        for start, length, textType in self.runs():
+            if textType in textTypes:
+                if result and result[-1][1] == start:  # runs of different types from textTypes
+                    result[-1] = (result[-1][0], start + length)
+                else:
+                    result.append((start, start + length))
+        return result
+
+    def nextBoundary(self, column, textTypes):
+        """Get the first column after column, where text enters or leaves text with one of textTypes.
+        nextBoundary(column, 'cbh') returns the next comment boundary.
+        Returns length of the line if text type doesn't change until the line end
+        """
+        if column >= self.length:
+            return self.length
+
+        runIndex = bisect.bisect_right(self.ends, max(column, 0))
+        inside = self.types[runIndex] in textTypes
+        for textType, end in zip(self.types[runIndex + 1:], self.ends[runIndex:]):
+            if (textType in textTypes) != inside:
+                return end
+
+        return self.length
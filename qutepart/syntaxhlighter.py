@@ -2,13 +2,29 @@
 Uses syntax module for doing the job
 """
 
+import bisect
+import collections
+import functools
+import queue
+import threading
 import time
 
-from PyQt5.QtCore import QObject, QTimer, pyqtSlot
+from PyQt5.QtCore import QObject, QPoint, QTimer, pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import QApplication
-from PyQt5.QtGui import QTextBlockUserData, QTextLayout
+from PyQt5.QtGui import QTextBlockUserData, QTextFormat, QTextLayout
 
 import qutepart.syntax
+from qutepart.highlightcache import HighlightCache
+
+
+"""Parsing of a line is limited, otherwise long lines of minified files or pathological syntax definitions
+freeze the GUI. The rest of the line gets the format of the current context, the context stack
+is carried to the next line.
+A line might be cut only because the main loop or the machine was busy. Cut lines are parsed again with
+a bigger limit, when highlighting of the document is finished
+"""
+_MAX_LINE_PARSING_TIME_SEC = 0.02
+_MAX_IDLE_LINE_PARSING_TIME_SEC = 0.2
 
 
 def _cmpFormatRanges(a, b):
@@ -41,33 +57,211 @@ class _TextBlockUserData(QTextBlockUserData):
         self.data = data
 
 
-class GlobalTimer:
+class _ContextStackCheckpoints:
+    """Context stacks at the beginning of blocks. Checkpoint is stored for every N-th block.
+
+    Block numbers are shifted when blocks are inserted or removed.
+    Checkpoints after a changed block are marked as invalid until highlighting
+    reaches them or converges before them.
+    Block 0 is an implicit checkpoint with the default context stack (None)
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._blockNumbers = []  # sorted
+        self._checkpoints = {}  # block number: [context stack, is valid]
+
+    def clear(self):
+        self._blockNumbers = []
+        self._checkpoints = {}
+
+    def blockParsed(self, blockNumber, contextStack):
+        """Block is being parsed with the context stack.
+        Update the checkpoint or create a new one, if the previous is too far
+        """
+        if blockNumber in self._checkpoints:
+            self._checkpoints[blockNumber] = [contextStack, True]
+            return
+
+        index = bisect.bisect_left(self._blockNumbers, blockNumber)
+        prevBlockNumber = self._blockNumbers[index - 1] if index > 0 else 0
+        if blockNumber - prevBlockNumber >= self._interval:
+            self._blockNumbers.insert(index, blockNumber)
+            self._checkpoints[blockNumber] = [contextStack, True]
+
+    def blocksChanged(self, firstBlockNumber, oldLastBlockNumber, delta):
+        """Blocks firstBlockNumber..oldLastBlockNumber have been changed.
+        delta blocks have been inserted (or removed, if negative).
+        Checkpoints inside the changed range are removed, checkpoints after it are shifted
+        and marked as invalid
+        """
+        newBlockNumbers = []
+        newCheckpoints = {}
+        for blockNumber in self._blockNumbers:
+            checkpoint = self._checkpoints[blockNumber]
+            if blockNumber <= firstBlockNumber:
+                newBlockNumbers.append(blockNumber)
+                newCheckpoints[blockNumber] = checkpoint
+            elif blockNumber > oldLastBlockNumber:
+                checkpoint[1] = False
+                newBlockNumbers.append(blockNumber + delta)
+                newCheckpoints[blockNumber + delta] = checkpoint
+
+        self._blockNumbers = newBlockNumbers
+        self._checkpoints = newCheckpoints
+
+    def validateAfter(self, blockNumber, untilBlockNumber=None):
+        """Highlighting converged on the block. Checkpoints after it are valid.
+        If untilBlockNumber is not None, blocks after it are not highlighted yet,
+        checkpoints after it are still invalid
+        """
+        index = bisect.bisect_right(self._blockNumbers, blockNumber)
+        for checkpointBlockNumber in self._blockNumbers[index:]:
+            if untilBlockNumber is not None and \
+               checkpointBlockNumber > untilBlockNumber:
+                break
+            self._checkpoints[checkpointBlockNumber][1] = True
+
+    def find(self, blockNumber):
+        """Find the nearest valid checkpoint before or at the block.
+        Returns (checkpoint block number, context stack)
+        """
+        index = bisect.bisect_right(self._blockNumbers, blockNumber)
+        while index > 0:
+            index -= 1
+            checkpointBlockNumber = self._blockNumbers[index]
+            contextStack, isValid = self._checkpoints[checkpointBlockNumber]
+            if isValid:
+                return checkpointBlockNumber, contextStack
+
+        return 0, None
+
+
+class _DirtyIntervals:
+    """Sorted list of disjoint intervals of blocks, which shall be highlighted.
+
+    Interval is ``(first block number, at least until block number)``.
+    Blocks ``first .. atLeastUntil - 1`` shall be highlighted.
+    Next blocks shall be highlighted while highlighting result changes.
+    """
+
+    def __init__(self):
+        self._intervals = []  # [[first, atLeastUntil], ...]
+
+    def isEmpty(self):
+        return not self._intervals
+
+    def clear(self):
+        self._intervals = []
+
+    def firstBlockNumber(self):
+        """First dirty block number or None
+        """
+        return self._intervals[0][0] if self._intervals else None
+
+    def add(self, first, atLeastUntil):
+        """Add interval. It is merged with overlapping intervals
+        """
+        first, atLeastUntil = self.takeOverlapping(first, atLeastUntil)
+        bisect.insort(self._intervals, [first, atLeastUntil])
+
+    def pop(self):
+        """Remove and return the first interval, or None
+        """
+        if self._intervals:
+            return tuple(self._intervals.pop(0))
+        else:
+            return None
+
+    def takeOverlapping(self, first, atLeastUntil):
+        """Remove intervals, which overlap with the interval.
+        Return union of the interval and removed intervals
+        """
+        remaining = []
+        for interval in self._intervals:
+            if interval[0] <= atLeastUntil and interval[1] >= first:
+                first = min(first, interval[0])
+                atLeastUntil = max(atLeastUntil, interval[1])
+            else:
+                remaining.append(interval)
+
+        self._intervals = remaining
+        return first, atLeastUntil
+
+    def blocksChanged(self, firstBlockNumber, oldLastBlockNumber, delta):
+        """Blocks firstBlockNumber..oldLastBlockNumber have been changed.
+        delta blocks have been inserted (or removed, if negative).
+        Intervals after the changed blocks are shifted, intervals inside are cut to the changed blocks
+        """
+        newLastBlockNumber = oldLastBlockNumber + delta
+        for interval in self._intervals:
+            first, atLeastUntil = interval
+            if first > oldLastBlockNumber:
+                first += delta
+            elif first > firstBlockNumber:
+                first = firstBlockNumber
+
+            if atLeastUntil > oldLastBlockNumber:
+                atLeastUntil += delta
+            elif atLeastUntil > firstBlockNumber:
+                atLeastUntil = newLastBlockNumber
+
+            interval[:] = [first, atLeastUntil]
+
+
+class Scheduler:
     """All parsing and highlighting is done in main loop thread.
     If parsing is being done for long time, main loop gets blocked.
     Therefore SyntaxHighlighter controls, how long parsign is going, and, if too long,
-    schedules timer and releases main loop.
-    One global timer is used by all Qutepart instances, because main loop time usage
-    must not depend on opened files count
+    schedules a callback and releases main loop.
+
+    One scheduler is used by all Qutepart instances, because main loop time usage
+    must not depend on opened files count.
+    Scheduled callbacks are called with a timeout. Callbacks of all documents share
+    ``frameBudgetSec`` per main loop iteration.
+    Callback of the focused document is called first, then visible documents, then hidden.
+    Documents with equal priority are processed in round-robin order.
+    If ``pauseHidden`` is True, hidden documents are not highlighted until they are shown.
     """
+    PRIORITY_FOCUSED = 0
+    PRIORITY_VISIBLE = 1
+    PRIORITY_HIDDEN = 2
+
+    # how often priorities are checked, when only paused callbacks are scheduled
+    _PAUSED_CHECK_INTERVAL_MS = 200
 
     def __init__(self):
         self._timer = QTimer(QApplication.instance())
         self._timer.setSingleShot(True)
         self._timer.timeout.connect(self._onTimer)
 
-        self._scheduledCallbacks = []
+        self.frameBudgetSec = 0.02
+        self._pauseHidden = False
+
+        self._scheduledCallbacks = collections.OrderedDict()  # callback: priority getter
 
     def isActive(self):
         return self._timer.isActive()
 
-    def scheduleCallback(self, callback):
+    def pauseHidden(self):
+        return self._pauseHidden
+
+    def setPauseHidden(self, pause):
+        self._pauseHidden = pause
+        if self._scheduledCallbacks:
+            self._timer.start(0)
+
+    def scheduleCallback(self, callback, priority):
+        """Schedule callback(timeout).
+        priority() returns one of PRIORITY_* constants. It is called every time the scheduler selects a callback
+        """
         if not callback in self._scheduledCallbacks:
-            self._scheduledCallbacks.append(callback)
-            self._timer.start()
+            self._scheduledCallbacks[callback] = priority
+            self._timer.start(0)
 
     def unScheduleCallback(self, callback):
         if callback in self._scheduledCallbacks:
-            self._scheduledCallbacks.remove(callback)
+            del self._scheduledCallbacks[callback]
 
         if not self._scheduledCallbacks:
             self._timer.stop()
@@ -75,12 +269,138 @@ class GlobalTimer:
     def isCallbackScheduled(self, callback):
         return callback in self._scheduledCallbacks
 
+    def _takeNextCallback(self):
+        """Remove from the queue and return the first callback with the highest priority.
+        Callback is appended to the end of the queue when rescheduled, this is how round-robin works
+        """
+        bestCallback = None
+        bestPriority = None
+        for callback, priority in self._scheduledCallbacks.items():
+            priorityValue = priority()
+            if self._pauseHidden and priorityValue == self.PRIORITY_HIDDEN:
+                continue
+            if bestPriority is None or priorityValue < bestPriority:
+                bestCallback = callback
+                bestPriority = priorityValue
+                if priorityValue == self.PRIORITY_FOCUSED:
+                    break
+
+        if bestCallback is not None:
+            del self._scheduledCallbacks[bestCallback]
+        return bestCallback
+
     def _onTimer(self):
+        endTime = time.time() + self.frameBudgetSec
+        while True:
+            timeout = endTime - time.time()
+            if timeout <= 0:
+                break
+
+            callback = self._takeNextCallback()
+            if callback is None:
+                break
+            callback(timeout)
+
         if self._scheduledCallbacks:
-            callback = self._scheduledCallbacks.pop()
-            callback()
-        if self._scheduledCallbacks:
-            self._timer.start()
+            if any(priority() != self.PRIORITY_HIDDEN or not self._pauseHidden
+                   for priority in self._scheduledCallbacks.values()):
+                self._timer.start(0)
+            else:
+                self._timer.start(self._PAUSED_CHECK_INTERVAL_MS)
+
+
+class _BackgroundParser(QObject):
+    """Parses a snapshot of block texts in a worker thread.
+
+    The worker never touches the QTextDocument. It gets texts of a range of blocks,
+    parses them and posts ``(blockNumber, lineData, highlightedSegments, exhausted)`` batches
+    back to the main thread with ``batchReady`` signal. The main thread only applies the results.
+
+    A job is cancelled, when a new job is started, or when ``cancel()`` is called.
+    Batches of cancelled jobs are never delivered, because job id is checked in the main thread.
+
+    The worker shares the syntax with the main thread. Contexts and rules of both parsers are not
+    modified after loading, caches, which are filled while parsing, are locked.
+    """
+    # job id, [(blockNumber, lineData, segments, exhausted), ...], job finished, highlighting converged
+    batchReady = pyqtSignal(int, object, bool, bool)
+
+    # how often parsed lines are posted to the main thread
+    _BATCH_TIME_SEC = 0.02
+
+    def __init__(self, syntax, parent):
+        QObject.__init__(self, parent)
+        self._syntax = syntax
+        self._currentJobId = 0
+        self._jobs = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name='qutepart highlighter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def terminate(self):
+        """Cancel current job and stop the thread
+        """
+        self.cancel()
+        self._jobs.put(None)
+
+    def startJob(self, firstBlockNumber, contextStack, texts, oldLineDatas, atLeastUntilIndex):
+        """Start parsing texts. Previous job is cancelled.
+        oldLineDatas is used to stop parsing as soon as result converges with existing data.
+        Returns job id
+        """
+        self._currentJobId += 1
+        self._jobs.put((self._currentJobId, firstBlockNumber, contextStack, texts, oldLineDatas, atLeastUntilIndex))
+        return self._currentJobId
+
+    def cancel(self):
+        self._currentJobId += 1
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            jobId, firstBlockNumber, contextStack, texts, oldLineDatas, atLeastUntilIndex = job
+            batch = []
+            batchEndTime = time.time() + self._BATCH_TIME_SEC
+
+            for index, text in enumerate(texts):
+                if jobId != self._currentJobId:  # cancelled
+                    break
+
+                lineData, highlightedSegments, exhausted = \
+                    self._syntax.highlightBlockLimited(text, contextStack, maxTime=_MAX_LINE_PARSING_TIME_SEC)
+                contextStack = lineData[0] if lineData is not None else None
+
+                batch.append((firstBlockNumber + index, lineData, highlightedSegments, exhausted))
+
+                if index >= atLeastUntilIndex and \
+                   oldLineDatas[index] == lineData:
+                    self.batchReady.emit(jobId, batch, True, True)
+                    break
+
+                if time.time() >= batchEndTime:
+                    self.batchReady.emit(jobId, batch, False, False)
+                    batch = []
+                    batchEndTime = time.time() + self._BATCH_TIME_SEC
+            else:
+                self.batchReady.emit(jobId, batch, True, False)
+
+
+def _measureTime(method):
+    """SyntaxHighlighter method decorator. Adds execution time to the document highlighting time
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        startTime = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._highlightingTime += time.time() - startTime
+
+    return wrapper
 
 
 """Global var, because main loop time usage shall not depend on Qutepart instances count
@@ -97,11 +417,26 @@ class SyntaxHighlighter(QObject):
     # when user is typing text - response shall be quick
     _MAX_PARSING_TIME_SMALL_CHANGE_SEC = 0.02
 
-    _globalTimer = GlobalTimer()
+    # count of blocks, which are copied and passed to the background thread at once
+    _BACKGROUND_JOB_SIZE_BLOCKS = 5000
+
+    # context stack is remembered for every N-th block. See contextStackAtLine()
+    _CHECKPOINT_INTERVAL_BLOCKS = 256
 
-    def __init__(self, syntax, textEdit):
+    scheduler = Scheduler()
+
+    def __init__(self, syntax, textEdit, background=False, viewportFirst=False, cacheDir=None):
+        """If background is True, long highlighting tasks are done in a worker thread.
+        Main thread only applies the results
+
+        If viewportFirst is True, visible blocks are highlighted before the blocks above them.
+
+        If cacheDir is set, results of the initial highlighting are saved to the directory.
+        Highlighting of the same text is restored from it instead of parsing.
+        """
         QObject.__init__(self, textEdit.document())
 
+        self._highlightingTime = 0.
         self._syntax = syntax
         self._textEdit = textEdit
         self._document = textEdit.document()
@@ -110,25 +445,73 @@ class SyntaxHighlighter(QObject):
         self._pendingBlockNumber = None
         self._pendingAtLeastUntilBlockNumber = None
 
+        # other blocks to highlight, when _pendingBlockNumber.._pendingAtLeastUntilBlockNumber is done
+        self._dirtyIntervals = _DirtyIntervals()
+
+        self._checkpoints = _ContextStackCheckpoints(self._CHECKPOINT_INTERVAL_BLOCKS)
+        self._blockCount = self._document.blockCount()
+
+        # numbers of blocks, which parsing has been cut by _MAX_LINE_PARSING_TIME_SEC
+        self._cutBlockNumbers = set()
+
+        self._backgroundParser = None
+        self._backgroundJobId = None
+        if background:
+            self._backgroundParser = _BackgroundParser(syntax, self)
+            self._backgroundParser.batchReady.connect(self._onBackgroundBatchReady)
+
+        self._viewportFirst = viewportFirst
+        self._viewportPending = False
+        # (blockNumber, lineData) of the last block, which was parsed but not highlighted by _highlightViewport()
+        self._parsedOnlyLineData = None
+        if viewportFirst:
+            self._textEdit.verticalScrollBar().valueChanged.connect(self._onScrolled)
+
+        self._cache = None
+        self._cacheSavePending = False
+        if cacheDir is not None:
+            self._cache = HighlightCache(cacheDir)
+
         self._document.contentsChange.connect(self._onContentsChange)
 
+        if self._cache is not None and self._restoreFromCache():
+            return
+
+        self._cacheSavePending = self._cache is not None
         charsAdded = self._document.lastBlock().position() + self._document.lastBlock().length()
         self._onContentsChange(0, 0, charsAdded, zeroTimeout=self._wasChangedJustBefore())
 
     def terminate(self):
+        self._cacheSavePending = False  # highlighting is removed, not finished
+
         try:
             self._document.contentsChange.disconnect(self._onContentsChange)
         except TypeError:
             pass
 
-        self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        if self._viewportFirst:
+            try:
+                self._textEdit.verticalScrollBar().valueChanged.disconnect(self._onScrolled)
+            except TypeError:
+                pass
+
+        self.scheduler.unScheduleCallback(self._onContinueHighlighting)
+        self.scheduler.unScheduleCallback(self._onReparseCutBlocks)
+        if self._backgroundParser is not None:
+            self._backgroundParser.terminate()
+            self._backgroundParser = None
+            self._backgroundJobId = None
+        self._dirtyIntervals.clear()
+        self._checkpoints.clear()
+        self._cutBlockNumbers.clear()
+
         block = self._document.firstBlock()
         while block.isValid():
             block.layout().setAdditionalFormats([])
             block.setUserData(None)
             self._document.markContentsDirty(block.position(), block.length())
             block = block.next()
-        self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        self.scheduler.unScheduleCallback(self._onContinueHighlighting)
 
     def syntax(self):
         """Return own syntax
@@ -138,7 +521,30 @@ class SyntaxHighlighter(QObject):
     def isInProgress(self):
         """Highlighting is in progress
         """
-        return self._globalTimer.isCallbackScheduled(self._onContinueHighlighting)
+        return self.scheduler.isCallbackScheduled(self._onContinueHighlighting) or \
+               self._backgroundJobId is not None
+
+    def contextStackAtLine(self, lineNumber):
+        """Get context stack at the beginning of the line.
+        The stack is restored from the nearest checkpoint, at most ``_CHECKPOINT_INTERVAL_BLOCKS`` lines are parsed
+        if the text above the line has been highlighted.
+
+        Returned value shall be passed to ``Syntax.highlightBlock()`` or ``Syntax.parseBlock()``.
+        ``None`` means the default context stack
+        """
+        checkpointBlockNumber, contextStack = self._checkpoints.find(lineNumber)
+        block = self._document.findBlockByNumber(checkpointBlockNumber)
+        while block.blockNumber() < lineNumber:
+            lineData = self._syntax.parseBlock(block.text(), contextStack, maxTime=_MAX_LINE_PARSING_TIME_SEC)
+            contextStack = lineData[0] if lineData is not None else None
+            block = block.next()
+
+        return contextStack
+
+    def highlightingTime(self):
+        """Time in seconds, which main loop thread has spent highlighting this document
+        """
+        return self._highlightingTime
 
     def isCode(self, block, column):
         """Check if character at column is a a code
@@ -181,22 +587,37 @@ class SyntaxHighlighter(QObject):
         return time.time() <= _gLastChangeTime + 1
 
     @pyqtSlot(int, int, int)
+    @_measureTime
     def _onContentsChange(self, from_, charsRemoved, charsAdded, zeroTimeout=False):
         global _gLastChangeTime
+        self._parsedOnlyLineData = None
+        self._viewportPending = False
         firstBlock = self._document.findBlock(from_)
         untilBlock = self._document.findBlock(from_ + charsAdded)
 
-        if self._globalTimer.isCallbackScheduled(self._onContinueHighlighting):  # have not finished task.
-            """ Intersect ranges. Might produce a lot of extra highlighting work
-            More complicated algorithm might be invented later
-            """
-            if self._pendingBlockNumber < firstBlock.blockNumber():
-                firstBlock = self._document.findBlockByNumber(self._pendingBlockNumber)
-            if self._pendingAtLeastUntilBlockNumber > untilBlock.blockNumber():
-                untilBlockNumber = min(self._pendingAtLeastUntilBlockNumber,
-                                       self._document.blockCount() - 1)
-                untilBlock = self._document.findBlockByNumber(untilBlockNumber)
-            self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        if self.isInProgress():  # have not finished task. Remember it as a dirty interval
+            self._dirtyIntervals.add(self._pendingBlockNumber, self._pendingAtLeastUntilBlockNumber)
+            self.scheduler.unScheduleCallback(self._onContinueHighlighting)
+            self._cancelBackgroundJob()
+
+        blockCountDelta = self._document.blockCount() - self._blockCount
+        self._blockCount = self._document.blockCount()
+        oldUntilBlockNumber = untilBlock.blockNumber() - blockCountDelta
+        self._checkpoints.blocksChanged(firstBlock.blockNumber(), oldUntilBlockNumber, blockCountDelta)
+        self._dirtyIntervals.blocksChanged(firstBlock.blockNumber(), oldUntilBlockNumber, blockCountDelta)
+        # changed blocks are parsed again
+        self._cutBlockNumbers = {number + blockCountDelta if number > oldUntilBlockNumber else number
+                                 for number in self._cutBlockNumbers
+                                 if not firstBlock.blockNumber() <= number <= oldUntilBlockNumber}
+
+        """Changed blocks are highlighted first. Dirty intervals, which overlap with them, are merged.
+        Other intervals are highlighted later, each one until its highlighting converges
+        """
+        firstBlockNumber, untilBlockNumber = \
+            self._dirtyIntervals.takeOverlapping(firstBlock.blockNumber(), untilBlock.blockNumber())
+        untilBlockNumber = min(untilBlockNumber, self._document.blockCount() - 1)
+        firstBlock = self._document.findBlockByNumber(firstBlockNumber)
+        untilBlock = self._document.findBlockByNumber(untilBlockNumber)
 
         if zeroTimeout:
             timeout = 0  # no parsing, only schedule
@@ -209,12 +630,97 @@ class SyntaxHighlighter(QObject):
 
         _gLastChangeTime = time.time()
 
-        self._highlighBlocks(firstBlock, untilBlock, timeout)
+        if self._viewportFirst and \
+           self._textEdit.firstVisibleBlock().blockNumber() > firstBlock.blockNumber():
+            """Changed blocks are not visible. Highlight visible blocks first, changed blocks later
+            """
+            self._highlighBlocks(firstBlock, untilBlock, 0)
+            self._viewportPending = True
+            self._continueViewportHighlighting(timeout)
+        else:
+            self._highlighBlocks(firstBlock, untilBlock, timeout)
+
+    @_measureTime
+    def _onScrolled(self, value):
+        if self.isInProgress():
+            self._viewportPending = True
+            self._continueViewportHighlighting(self._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
+
+    @_measureTime
+    def _onContinueHighlighting(self, timeout):
+        if self._viewportPending:
+            self._continueViewportHighlighting(timeout)
+            if self._backgroundParser is None:
+                self.scheduler.scheduleCallback(self._onContinueHighlighting, self._priority)
+            return
 
-    def _onContinueHighlighting(self):
         self._highlighBlocks(self._document.findBlockByNumber(self._pendingBlockNumber),
                              self._document.findBlockByNumber(self._pendingAtLeastUntilBlockNumber),
-                             self._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
+                             timeout)
+
+    def _priority(self):
+        if self._textEdit.hasFocus():
+            return Scheduler.PRIORITY_FOCUSED
+        elif self._textEdit.isVisible():
+            return Scheduler.PRIORITY_VISIBLE
+        else:
+            return Scheduler.PRIORITY_HIDDEN
+
+    def _continueViewportHighlighting(self, timeout):
+        if self._highlightViewport(timeout):
+            self._viewportPending = False
+        else:
+            self.scheduler.scheduleCallback(self._onContinueHighlighting, self._priority)
+
+    def _highlightViewport(self, timeout):
+        """Highlight visible blocks, if they are not highlighted yet.
+        Blocks between the pending block and the viewport are only parsed to get context stack.
+        They are highlighted later, when the main loop is idle.
+
+        Returns False, if time is over before visible blocks have been highlighted
+        """
+        endTime = time.time() + timeout
+
+        firstVisibleBlock = self._textEdit.firstVisibleBlock()
+        viewportBottom = QPoint(0, self._textEdit.viewport().height() - 1)
+        lastVisibleBlockNumber = self._textEdit.cursorForPosition(viewportBottom).blockNumber()
+
+        firstDirtyBlockNumber = self._pendingBlockNumber
+        if not self._dirtyIntervals.isEmpty():
+            firstDirtyBlockNumber = min(firstDirtyBlockNumber, self._dirtyIntervals.firstBlockNumber())
+        if lastVisibleBlockNumber < firstDirtyBlockNumber:
+            return True  # already highlighted
+
+        block = self._document.findBlockByNumber(firstDirtyBlockNumber)
+        lineData = self._lineData(block.previous())
+        if self._parsedOnlyLineData is not None:
+            parsedBlockNumber, parsedLineData = self._parsedOnlyLineData
+            if block.blockNumber() <= parsedBlockNumber < firstVisibleBlock.blockNumber():
+                block = self._document.findBlockByNumber(parsedBlockNumber + 1)
+                lineData = parsedLineData
+
+        while block.blockNumber() < firstVisibleBlock.blockNumber():
+            if time.time() >= endTime:
+                return False
+
+            contextStack = lineData[0] if lineData is not None else None
+            self._checkpoints.blockParsed(block.blockNumber(), contextStack)
+            lineData = self._syntax.parseBlock(block.text(), contextStack, maxTime=_MAX_LINE_PARSING_TIME_SEC)
+            self._parsedOnlyLineData = (block.blockNumber(), lineData)
+            block = block.next()
+
+        while block.isValid() and block.blockNumber() <= lastVisibleBlockNumber:
+            contextStack = lineData[0] if lineData is not None else None
+            self._checkpoints.blockParsed(block.blockNumber(), contextStack)
+            lineData = self._highlightBlock(block, contextStack, _MAX_LINE_PARSING_TIME_SEC)
+            block = block.next()
+
+        """Blocks after the viewport were highlighted with old context stack.
+        Pending highlighting might stop on the visible blocks, because their data is not changed anymore
+        """
+        if block.isValid():
+            self._dirtyIntervals.add(block.blockNumber(), block.blockNumber())
+        return True
 
     def _highlighBlocks(self, fromBlock, atLeastUntilBlock, timeout):
         endTime = time.time() + timeout
@@ -224,52 +730,107 @@ class SyntaxHighlighter(QObject):
 
         while block.isValid() and block != atLeastUntilBlock:
             if time.time() >= endTime:  # time is over, schedule parsing later and release event loop
-                self._pendingBlockNumber = block.blockNumber()
-                self._pendingAtLeastUntilBlockNumber = atLeastUntilBlock.blockNumber()
-                self._globalTimer.scheduleCallback(self._onContinueHighlighting)
+                self._scheduleHighlighting(block, atLeastUntilBlock)
                 return
 
             contextStack = lineData[0] if lineData is not None else None
-            if block.length() < 4096:
-                lineData, highlightedSegments = self._syntax.highlightBlock(block.text(), contextStack)
-            else:
-                """Parser freezes for a long time, if line is too long
-                invalid parsing results are still better, than freeze
-                """
-                lineData, highlightedSegments = None, []
-            if lineData is not None:
-                block.setUserData(_TextBlockUserData(lineData))
-            else:
-                block.setUserData(None)
-
-            self._applyHighlightedSegments(block, highlightedSegments)
+            self._checkpoints.blockParsed(block.blockNumber(), contextStack)
+            lineData = self._highlightBlock(block, contextStack, _MAX_LINE_PARSING_TIME_SEC)
             block = block.next()
 
         # reached atLeastUntilBlock, now parse next only while data changed
         prevLineData = self._lineData(block)
         while block.isValid():
             if time.time() >= endTime:  # time is over, schedule parsing later and release event loop
-                self._pendingBlockNumber = block.blockNumber()
-                self._pendingAtLeastUntilBlockNumber = atLeastUntilBlock.blockNumber()
-                self._globalTimer.scheduleCallback(self._onContinueHighlighting)
+                self._scheduleHighlighting(block, atLeastUntilBlock)
                 return
             contextStack = lineData[0] if lineData is not None else None
-            lineData, highlightedSegments = self._syntax.highlightBlock(block.text(), contextStack)
-            if lineData is not None:
-                block.setUserData(_TextBlockUserData(lineData))
-            else:
-                block.setUserData(None)
-
-            self._applyHighlightedSegments(block, highlightedSegments)
+            self._checkpoints.blockParsed(block.blockNumber(), contextStack)
+            lineData = self._highlightBlock(block, contextStack, _MAX_LINE_PARSING_TIME_SEC)
             if prevLineData == lineData:
+                self._checkpoints.validateAfter(block.blockNumber(), self._dirtyIntervals.firstBlockNumber())
                 break
 
             block = block.next()
             prevLineData = self._lineData(block)
 
+        self._onHighlightingFinished()
+
+    def _highlightBlock(self, block, contextStack, maxTime):
+        """Highlight the block, remember if parsing is cut. Returns lineData
+        """
+        lineData, highlightedSegments, exhausted = \
+            self._syntax.highlightBlockLimited(block.text(), contextStack, maxTime=maxTime)
+        self._setBlockHighlighting(block, lineData, highlightedSegments, exhausted)
+        return lineData
+
+    def _setBlockHighlighting(self, block, lineData, highlightedSegments, exhausted):
+        if lineData is not None:
+            block.setUserData(_TextBlockUserData(lineData))
+        else:
+            block.setUserData(None)
+
+        if exhausted:
+            self._cutBlockNumbers.add(block.blockNumber())
+        else:
+            self._cutBlockNumbers.discard(block.blockNumber())
+
+        self._applyHighlightedSegments(block, highlightedSegments)
+
+    @_measureTime
+    def _onReparseCutBlocks(self, timeout):
+        """Parse again blocks, which parsing has been cut, with a bigger time limit.
+        A block, which is cut again, is not retried until it is parsed again for other reasons,
+        and the document is not saved to the highlighting cache.
+        If line data of a block changes, the next blocks are highlighted as a dirty interval
+        """
+        if self.isInProgress():
+            return  # scheduled again, when highlighting is finished
+
+        endTime = time.time() + timeout
+        while self._cutBlockNumbers and time.time() < endTime:
+            blockNumber = min(self._cutBlockNumbers)
+            self._cutBlockNumbers.remove(blockNumber)
+            block = self._document.findBlockByNumber(blockNumber)
+            if not block.isValid():
+                continue
+
+            oldLineData = self._lineData(block)
+            contextStack = self._lineData(block.previous())
+            contextStack = contextStack[0] if contextStack is not None else None
+            lineData = self._highlightBlock(block, contextStack, _MAX_IDLE_LINE_PARSING_TIME_SEC)
+            if blockNumber in self._cutBlockNumbers:
+                self._cutBlockNumbers.remove(blockNumber)
+                self._cacheSavePending = False
+            if lineData != oldLineData and block.next().isValid():
+                self._dirtyIntervals.add(blockNumber + 1, blockNumber + 1)
+
+        # highlights the dirty intervals, then continues reparsing or saves to the cache
+        self._onHighlightingFinished()
+
+    def _onHighlightingFinished(self):
+        nextInterval = self._dirtyIntervals.pop()
+        if nextInterval is not None:
+            self._pendingBlockNumber, self._pendingAtLeastUntilBlockNumber = nextInterval
+            if self._backgroundParser is not None:
+                self._startBackgroundJob()
+            else:
+                self.scheduler.scheduleCallback(self._onContinueHighlighting, self._priority)
+            return
+
         # sucessfully finished, reset pending tasks
         self._pendingBlockNumber = None
         self._pendingAtLeastUntilBlockNumber = None
+        self._viewportPending = False
+        self._parsedOnlyLineData = None
+        self.scheduler.unScheduleCallback(self._onContinueHighlighting)
+
+        if self._cutBlockNumbers:
+            # the cache is saved when the cut blocks are parsed. See _onReparseCutBlocks()
+            self.scheduler.scheduleCallback(self._onReparseCutBlocks, self._priority)
+        elif self._cacheSavePending:
+            self._cacheSavePending = False
+            self._saveToCache()
 
         """Emit sizeChanged when highlighting finished, because document size might change.
         See andreikop/enki issue #191
@@ -277,6 +838,122 @@ class SyntaxHighlighter(QObject):
         documentLayout = self._textEdit.document().documentLayout()
         documentLayout.documentSizeChanged.emit(documentLayout.documentSize())
 
+    def _scheduleHighlighting(self, block, atLeastUntilBlock):
+        """Time is over. Continue highlighting later or in the background thread
+        """
+        self._pendingBlockNumber = block.blockNumber()
+        self._pendingAtLeastUntilBlockNumber = atLeastUntilBlock.blockNumber()
+
+        if self._backgroundParser is not None:
+            self._startBackgroundJob()
+        else:
+            self.scheduler.scheduleCallback(self._onContinueHighlighting, self._priority)
+
+    def _startBackgroundJob(self):
+        """Copy texts of the next portion of pending blocks and pass it to the background parser.
+        Only a portion is copied, because the copy is done in the main thread
+        """
+        block = self._document.findBlockByNumber(self._pendingBlockNumber)
+        contextStack = self._lineData(block.previous())
+        contextStack = contextStack[0] if contextStack is not None else None
+
+        texts = []
+        oldLineDatas = []
+        while block.isValid() and len(texts) < self._BACKGROUND_JOB_SIZE_BLOCKS:
+            texts.append(block.text())
+            oldLineDatas.append(self._lineData(block))
+            block = block.next()
+
+        atLeastUntilIndex = self._pendingAtLeastUntilBlockNumber - self._pendingBlockNumber
+        self._backgroundJobId = self._backgroundParser.startJob(self._pendingBlockNumber,
+                                                                contextStack,
+                                                                texts,
+                                                                oldLineDatas,
+                                                                atLeastUntilIndex)
+
+    def _cancelBackgroundJob(self):
+        if self._backgroundJobId is not None:
+            self._backgroundParser.cancel()
+            self._backgroundJobId = None
+
+    @_measureTime
+    def _onBackgroundBatchReady(self, jobId, batch, jobFinished, converged):
+        """Apply results of the background parser.
+        Results of cancelled jobs are ignored. Document has been modified after the job has been started.
+        """
+        if jobId != self._backgroundJobId:
+            return
+
+        if batch:
+            block = self._document.findBlockByNumber(batch[0][0])
+            contextStack = self._lineData(block.previous())
+            contextStack = contextStack[0] if contextStack is not None else None
+            for blockNumber, lineData, highlightedSegments, exhausted in batch:
+                self._checkpoints.blockParsed(blockNumber, contextStack)
+                contextStack = lineData[0] if lineData is not None else None
+                self._setBlockHighlighting(block, lineData, highlightedSegments, exhausted)
+                block = block.next()
+
+            self._pendingBlockNumber = batch[-1][0] + 1
+
+        if jobFinished:
+            self._backgroundJobId = None
+            """Job finishes when highlighting converged or when the copied portion of blocks has been parsed.
+            In the last case continue with the next portion
+            """
+            if converged or \
+               self._pendingBlockNumber >= self._document.blockCount():
+                if converged:
+                    self._checkpoints.validateAfter(self._pendingBlockNumber - 1,
+                                                    self._dirtyIntervals.firstBlockNumber())
+                self._onHighlightingFinished()
+            else:
+                self._startBackgroundJob()
+
+    @_measureTime
+    def _restoreFromCache(self):
+        """Apply highlighting from the cache. Returns False, if the text is not cached
+        """
+        def makeRange(start, length, format):
+            range = QTextLayout.FormatRange()
+            range.format = format
+            range.start = start
+            range.length = length
+            return range
+
+        lines = self._cache.load(self._document.toRawText(), self._syntax, makeRange)
+        if lines is None or len(lines) != self._document.blockCount():
+            return False
+
+        block = self._document.firstBlock()
+        contextStack = None
+        for lineData, lineRanges in lines:
+            self._checkpoints.blockParsed(block.blockNumber(), contextStack)
+            contextStack = lineData[0] if lineData is not None else None
+            if lineData is not None:
+                block.setUserData(_TextBlockUserData(lineData))
+            else:
+                block.setUserData(None)
+            block.layout().setAdditionalFormats(lineRanges)
+            block = block.next()
+
+        self._document.markContentsDirty(0, self._document.characterCount())
+        return True
+
+    @_measureTime
+    def _saveToCache(self):
+        """Save highlighting of the whole document. Formats are identified by QTextFormat.UserProperty
+        """
+        def lines():
+            block = self._document.firstBlock()
+            while block.isValid():
+                lineRanges = [(range.start, range.length, range.format.property(QTextFormat.UserProperty)) \
+                                for range in block.layout().additionalFormats()]
+                yield self._lineData(block), lineRanges
+                block = block.next()
+
+        self._cache.save(self._document.toRawText(), self._syntax, lines())
+
     def _applyHighlightedSegments(self, block, highlightedSegments):
         ranges = []
         currentPos = 0
@@ -3,10 +3,14 @@
 import sys
 import os
 import platform
+import shutil
+import tempfile
 
 from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 
 import distutils.ccompiler
+import distutils.errors
 import distutils.sysconfig
 
 sys.path.insert(0, 'qutepart')
@@ -69,13 +73,16 @@ def _checkBuildDependencies():
         print("--lib-dir= and --include-dir= may be used multiple times")
         return False
 
+    if _usePcre2():
+        return True
+
     if not compiler.has_function('pcre_version',
                                  includes=['pcre.h'],
                                  libraries=['pcre'],
                                  include_dirs=include_dirs,
                                  library_dirs=library_dirs):
         print("Failed to find pcre library.")
-        print("Try to install libpcre{version}-dev package, or go to http://pcre.org")
+        print("Try to install libpcre2-dev or libpcre{version}-dev package, or go to http://pcre.org")
         print("If not standard directories are used, pass parameters:")
         print("\tpython setup.py install --lib-dir=c://github/pcre-8.37/build/Release --include-dir=c://github/pcre-8.37/build")
         print("\tpython setup.py install --lib-dir=/my/local/lib --include-dir=/my/local/include")
@@ -85,6 +92,57 @@ def _checkBuildDependencies():
     return True
 
 
+def _hasPcre2():
+    """Check if PCRE2 library for 8-bit strings is installed.
+    compiler.has_function() is not used, because pcre2.h requires PCRE2_CODE_UNIT_WIDTH to be defined
+    """
+    compiler = distutils.ccompiler.new_compiler()
+    tmpDir = tempfile.mkdtemp()
+    try:
+        sourcePath = os.path.join(tmpDir, 'pcre2check.c')
+        with open(sourcePath, 'w') as sourceFile:
+            sourceFile.write('#define PCRE2_CODE_UNIT_WIDTH 8\n'
+                             '#include <pcre2.h>\n'
+                             'int main(void) { return pcre2_config(PCRE2_CONFIG_JIT, NULL); }\n')
+        objects = compiler.compile([sourcePath], output_dir=tmpDir, include_dirs=include_dirs)
+        compiler.link_executable(objects, os.path.join(tmpDir, 'pcre2check'),
+                                 libraries=['pcre2-8'], library_dirs=library_dirs)
+    except (distutils.errors.CompileError, distutils.errors.LinkError):
+        return False
+    finally:
+        shutil.rmtree(tmpDir)
+
+    return True
+
+
+_usePcre2Result = None
+
+def _usePcre2():
+    """PCRE2 with JIT compiler is used, if installed. Legacy PCRE is used on Windows,
+    if PCRE2 is not found, or if --without-pcre2 is passed.
+    PCRE2 is detected once and only when the extension is built, because a test program is compiled
+    """
+    global _usePcre2Result
+    if _usePcre2Result is None:
+        _usePcre2Result = (not withoutPcre2) and (not onWindows()) and _hasPcre2()
+    return _usePcre2Result
+
+
+class BuildExt(build_ext):
+    """Set PCRE library and macros of the extension, when it is built
+    """
+    def build_extensions(self):
+        for ext in self.extensions:
+            if _usePcre2():
+                ext.define_macros.append(('QUTEPART_PCRE2', None))
+                ext.libraries = ['pcre2-8']
+            else:
+                if platform.system() == 'Windows':
+                    ext.define_macros.append(('HAVE_PCRE_CONFIG_H', None))
+                ext.libraries = ['pcre']
+        build_ext.build_extensions(self)
+
+
 if onWindows() and (not runningOnPip()) and 'install' in sys.argv:
   print(howToInstallMsg)
   sys.exit(0)
@@ -105,16 +163,22 @@ library_dirs = parse_arg_list('--lib-dir=')
 if not library_dirs:
     library_dirs = ['/usr/lib', '/usr/local/lib', '/opt/local/lib']
 
-macros = []
-if platform.system() == 'Windows':
-    macros.append(('HAVE_PCRE_CONFIG_H', None))
+skipExtension = False
+if '--skip-extension' in sys.argv:
+    skipExtension = True
+    sys.argv.remove('--skip-extension')
+
+# See _usePcre2()
+withoutPcre2 = False
+if '--without-pcre2' in sys.argv:
+    withoutPcre2 = True
+    sys.argv.remove('--without-pcre2')
 
+# PCRE library and macros are set by BuildExt
 extension = Extension('qutepart.syntax.cParser',
                       sources=['qutepart/syntax/cParser.c'],
-                      libraries=['pcre'],
                       include_dirs=include_dirs,
-                      library_dirs=library_dirs,
-                      define_macros=macros)
+                      library_dirs=library_dirs)
 
 
 """ A hack to set compiler version for distutils on Windows.
@@ -129,12 +193,6 @@ else:
         os.remove(cfgPath)
 
 
-skipExtension = False
-if '--skip-extension' in sys.argv:
-    skipExtension = True
-    sys.argv.remove('--skip-extension')
-
-
 # Check build dependencies
 if (('build' in sys.argv or
     'build_ext' in sys.argv) and
@@ -171,6 +229,7 @@ setup(name='qutepart',
     packages=packages,
     package_data=package_data,
     ext_modules=ext_modules,
+    cmdclass={'build_ext': BuildExt},
     python_requires = '>=3.5',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -2,7 +2,9 @@
 
 import os
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
 import base
 
@@ -10,8 +12,11 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtTest import QTest
 
 from qutepart import Qutepart
+from qutepart.syntaxhlighter import SyntaxHighlighter
 
 import qutepart.completer
+import qutepart.highlightcache
+import qutepart.syntaxhlighter
 qutepart.completer._GlobalUpdateWordSetTimer._IDLE_TIMEOUT_MS = 0
 
 class _BaseTest(unittest.TestCase):
@@ -165,6 +170,266 @@ class IsCodeOrComment(_BaseTest):
         self.assertTrue(self.qpart.isComment(1, 2))
 
 
+class BackgroundHighlighting(_BaseTest):
+    def _wait_highlighting_finished(self):
+        while self.qpart.isHighlightingInProgress():
+            self.app.processEvents()
+
+    def test_1(self):
+        self.qpart.backgroundHighlighting = True
+        self.qpart.text = '\n'.join(['a = b  # comment'] * 3000 + ['"""', 'text'])
+        self.qpart.detectSyntax(language = 'Python')
+        self._wait_highlighting_finished()
+
+        self.assertTrue(self.qpart.isCode(2999, 1))
+        self.assertTrue(self.qpart.isComment(2999, 10))
+        self.assertTrue(self.qpart.isComment(3001, 2))
+
+    def test_edit_while_highlighting(self):
+        self.qpart.backgroundHighlighting = True
+        self.qpart.text = '\n'.join(['a = b  # comment'] * 3000)
+        self.qpart.detectSyntax(language = 'Python')
+        self.qpart.lines[0] = '"""'
+        self._wait_highlighting_finished()
+
+        self.assertTrue(self.qpart.isComment(2999, 1))
+
+        self.qpart.lines[0] = 'a = b'
+        self._wait_highlighting_finished()
+
+        self.assertTrue(self.qpart.isCode(2999, 1))
+
+
+class ViewportFirstHighlighting(_BaseTest):
+    def test_1(self):
+        self.qpart.show()
+        self.qpart.viewportFirstHighlighting = True
+        self.qpart.text = '\n'.join(['"""'] + ['a = b  # comment'] * 20000)
+        self.qpart.cursorPosition = (19990, 0)
+        self.qpart.detectSyntax(language = 'Python')
+
+        # visible lines are highlighted first, the lines above them later
+        while not self.qpart.isComment(19990, 1):
+            self.app.processEvents()
+        self.assertTrue(self.qpart.isHighlightingInProgress())
+        self.assertIsNone(self.qpart.document().findBlockByNumber(10000).userData())
+
+        while self.qpart.isHighlightingInProgress():
+            self.app.processEvents()
+
+        self.assertTrue(self.qpart.isComment(10000, 1))
+        self.assertTrue(self.qpart.isComment(20000, 1))
+
+
+class ContextStackAtLine(_BaseTest):
+    def _wait_highlighting_finished(self):
+        while self.qpart.isHighlightingInProgress():
+            self.app.processEvents()
+
+    def _check(self, lineNumber):
+        highlighter = self.qpart._highlighter
+        block = self.qpart.document().findBlockByNumber(lineNumber)
+        contextStack = highlighter.contextStackAtLine(lineNumber)
+        lineData = highlighter.syntax().parseBlock(block.text(), contextStack)
+        self.assertEqual(lineData[1], block.userData().data[1])
+
+    def _checkAll(self):
+        for lineNumber in (0, 1, 255, 256, 257, 700, 1000, len(self.qpart.lines) - 1):
+            self._check(lineNumber)
+
+    def test_1(self):
+        self.qpart.text = '\n'.join(['a = b  # comment', '"""', 'docstring', '"""', 'x = 1'] * 400)
+        self.qpart.detectSyntax(language = 'Python')
+        self._wait_highlighting_finished()
+        self._checkAll()
+
+        self.qpart.lines.insert(0, 'x = 1')
+        self._wait_highlighting_finished()
+        self._checkAll()
+
+        self.qpart.lines.insert(0, '"""')
+        self._wait_highlighting_finished()
+        self._checkAll()
+
+        del self.qpart.lines[0:3]
+        self._wait_highlighting_finished()
+        self._checkAll()
+
+
+class DirtyIntervals(_BaseTest):
+    def setUp(self):
+        _BaseTest.setUp(self)
+        self._timeout = SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC
+        SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC = 0  # only schedule highlighting on edit
+
+    def tearDown(self):
+        SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC = self._timeout
+        _BaseTest.tearDown(self)
+
+    def _wait_highlighting_finished(self):
+        while self.qpart.isHighlightingInProgress():
+            self.app.processEvents()
+
+    def test_independent_intervals(self):
+        self.qpart.text = '\n'.join(['x = 1'] * 5000)
+        self.qpart.detectSyntax(language = 'Python')
+        self._wait_highlighting_finished()
+
+        syntax = self.qpart._highlighter.syntax()
+        with mock.patch.object(syntax, 'highlightBlockLimited', wraps=syntax.highlightBlockLimited) as highlightBlock:
+            self.qpart.lines[0] = 'y = 2'
+            self.qpart.lines[4990] = 'y = 2'
+            self._wait_highlighting_finished()
+
+        self.assertLess(highlightBlock.call_count, 100)
+
+    def test_propagation(self):
+        self.qpart.text = '\n'.join(['x = 1'] * 3000)
+        self.qpart.detectSyntax(language = 'Python')
+        self._wait_highlighting_finished()
+
+        self.qpart.lines[2000] = '"""'
+        self.qpart.lines[1000] = '"""'
+        self.qpart.lines[10] = 'y = 2'
+        self._wait_highlighting_finished()
+
+        self.assertTrue(self.qpart.isCode(999, 1))
+        self.assertTrue(self.qpart.isComment(1500, 1))
+        self.assertTrue(self.qpart.isCode(2500, 1))
+
+        del self.qpart.lines[1000]
+        self.qpart.lines.insert(0, 'z = 3')
+        self._wait_highlighting_finished()
+
+        self.assertTrue(self.qpart.isCode(1500, 1))
+        self.assertTrue(self.qpart.isComment(2500, 1))
+
+
+class CutLines(_BaseTest):
+    """Lines, which parsing has been cut by the time limit, are parsed again, when highlighting is finished
+    """
+    def _wait_reparsing_finished(self):
+        highlighter = self.qpart._highlighter
+        while self.qpart.isHighlightingInProgress() or \
+              highlighter.scheduler.isCallbackScheduled(highlighter._onReparseCutBlocks):
+            self.app.processEvents()
+
+    def test_reparse(self):
+        with mock.patch.object(qutepart.syntaxhlighter, '_MAX_LINE_PARSING_TIME_SEC', 1e-9):
+            self.qpart.text = '\n'.join(['x = 1; ' * 100 + '"""', 'text', '"""', 'y = 2'])
+            self.qpart.detectSyntax(language = 'Python')
+            self._wait_reparsing_finished()
+
+        self.assertTrue(self.qpart.isCode(0, 1))
+        self.assertFalse(self.qpart.isCode(1, 1))
+        self.assertTrue(self.qpart.isCode(3, 1))
+        self.assertEqual(self.qpart._highlighter._cutBlockNumbers, set())
+
+
+class HighlightCache(_BaseTest):
+    _TEXT = '\n'.join(['x = 1', '"""doc', 'string', '"""', 'y = 2  # comment'] * 100)
+
+    def setUp(self):
+        _BaseTest.setUp(self)
+        self._cacheDir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        _BaseTest.tearDown(self)
+        self._cacheDir.cleanup()
+
+    def _highlight(self, text):
+        qpart = Qutepart()
+        qpart.highlightCacheDir = self._cacheDir.name
+        qpart.text = text
+        qpart.detectSyntax(language = 'Python')
+        highlighter = qpart._highlighter
+        while qpart.isHighlightingInProgress() or \
+              highlighter.scheduler.isCallbackScheduled(highlighter._onReparseCutBlocks):
+            self.app.processEvents()
+        return qpart
+
+    def _formats(self, qpart):
+        return [[(range.start, range.length, range.format) \
+                    for range in qpart.document().findBlockByNumber(i).layout().additionalFormats()] \
+                        for i in range(qpart.document().blockCount())]
+
+    def test_restore(self):
+        parsed = self._highlight(self._TEXT)
+        self.assertEqual(len(os.listdir(self._cacheDir.name)), 1)
+
+        syntax = parsed._highlighter.syntax()
+        with mock.patch.object(syntax, 'highlightBlockLimited', wraps=syntax.highlightBlockLimited) as highlightBlock:
+            restored = self._highlight(self._TEXT)
+        self.assertEqual(highlightBlock.call_count, 0)
+
+        self.assertEqual(self._formats(restored), self._formats(parsed))
+        self.assertTrue(restored.isComment(2, 1))
+        self.assertTrue(restored.isCode(4, 1))
+        self.assertTrue(restored.isComment(4, 10))
+
+        restored.lines[0] = '"""'
+        while restored.isHighlightingInProgress():
+            self.app.processEvents()
+        self.assertTrue(restored.isComment(0, 1))
+        self.assertTrue(restored.isCode(2, 1))
+
+        parsed.terminate()
+        restored.terminate()
+
+    def test_changed_text(self):
+        self._highlight(self._TEXT).terminate()
+        self._highlight(self._TEXT + '\nz = 3').terminate()
+        self.assertEqual(len(os.listdir(self._cacheDir.name)), 2)
+
+    def test_max_size(self):
+        """The least recently used files are removed, when total size of the files is over the limit
+        """
+        syntax = self.qpart._globalSyntaxManager.getSyntax(languageName='Python')
+        cache = qutepart.highlightcache.HighlightCache(self._cacheDir.name)
+        cache.save('a', syntax, [])
+        fileSize = os.path.getsize(cache._filePath('a', syntax))
+
+        cache = qutepart.highlightcache.HighlightCache(self._cacheDir.name, maxSize=int(fileSize * 2.5))
+        cache.save('b', syntax, [])
+        os.utime(cache._filePath('a', syntax), (1000, 1000))
+        os.utime(cache._filePath('b', syntax), (2000, 2000))
+        self.assertEqual(cache.load('a', syntax), [])  # 'a' is used recently
+
+        cache.save('c', syntax, [])
+        self.assertEqual(len(os.listdir(self._cacheDir.name)), 2)
+        self.assertIsNone(cache.load('b', syntax))
+        self.assertEqual(cache.load('a', syntax), [])
+        self.assertEqual(cache.load('c', syntax), [])
+
+    def test_cut_line(self):
+        """A line, which parsing has been cut by the time limit, is saved when it is parsed again
+        """
+        text = '\n'.join(['a = b + c * 7; ' * 100 + '"""', 'text', '"""', 'y = 2'])  # not in the line cache of the syntax
+        with mock.patch.object(qutepart.syntaxhlighter, '_MAX_LINE_PARSING_TIME_SEC', 1e-9):
+            parsed = self._highlight(text)
+            self.assertEqual(len(os.listdir(self._cacheDir.name)), 1)
+
+            syntax = parsed._highlighter.syntax()
+            with mock.patch.object(syntax, 'highlightBlockLimited', wraps=syntax.highlightBlockLimited) as highlightBlock:
+                restored = self._highlight(text)
+            self.assertEqual(highlightBlock.call_count, 0)
+
+        for qpart in (parsed, restored):
+            self.assertTrue(qpart.isCode(0, 1))
+            self.assertFalse(qpart.isCode(1, 1))
+            self.assertTrue(qpart.isCode(3, 1))
+            qpart.terminate()
+
+    def test_cut_line_not_saved(self):
+        """A line, which is cut again when it is parsed with the bigger time limit, is not saved
+        """
+        text = '\n'.join(['z = 3; ' * 100 + '"""', 'text', '"""', 'y = 2'])  # not in the line cache of the syntax
+        with mock.patch.object(qutepart.syntaxhlighter, '_MAX_LINE_PARSING_TIME_SEC', 1e-9), \
+             mock.patch.object(qutepart.syntaxhlighter, '_MAX_IDLE_LINE_PARSING_TIME_SEC', 1e-9):
+            self._highlight(text).terminate()
+        self.assertEqual(os.listdir(self._cacheDir.name), [])
+
+
 class DetectSyntax(_BaseTest):
     def test_1(self):
         self.qpart.detectSyntax(xmlFileName='ada.xml')
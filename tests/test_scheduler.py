@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from qutepart.syntaxhlighter import Scheduler
+
+
+class _Document:
+    """Callback, which needs `steps` calls to finish the job
+    """
+    def __init__(self, scheduler, name, priority, steps, log):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+        self.steps = steps
+        self.log = log
+
+    def getPriority(self):
+        return self.priority
+
+    def schedule(self):
+        self.scheduler.scheduleCallback(self.onContinue, self.getPriority)
+
+    def onContinue(self, timeout):
+        self.log.append(self.name)
+        self.steps -= 1
+        if self.steps:
+            self.schedule()
+
+
+class Test(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.frameBudgetSec = 1  # all scheduled jobs are done on one timer event
+        self.log = []
+
+    def _document(self, name, priority, steps):
+        document = _Document(self.scheduler, name, priority, steps, self.log)
+        document.schedule()
+        return document
+
+    def _wait(self):
+        while self.scheduler.isActive():
+            self.app.processEvents()
+
+    def test_priorities(self):
+        self._document('hidden', Scheduler.PRIORITY_HIDDEN, 1)
+        self._document('visible', Scheduler.PRIORITY_VISIBLE, 1)
+        self._document('focused', Scheduler.PRIORITY_FOCUSED, 1)
+        self._wait()
+
+        self.assertEqual(self.log, ['focused', 'visible', 'hidden'])
+
+    def test_round_robin(self):
+        self._document('a', Scheduler.PRIORITY_VISIBLE, 3)
+        self._document('b', Scheduler.PRIORITY_VISIBLE, 2)
+        self._document('c', Scheduler.PRIORITY_VISIBLE, 1)
+        self._wait()
+
+        self.assertEqual(self.log, ['a', 'b', 'c', 'a', 'b', 'a'])
+
+    def test_pause_hidden(self):
+        hidden = self._document('hidden', Scheduler.PRIORITY_HIDDEN, 1)
+        self._document('visible', Scheduler.PRIORITY_VISIBLE, 1)
+        self.scheduler.setPauseHidden(True)
+        base._processPendingEvents(self.app)
+
+        self.assertEqual(self.log, ['visible'])
+        self.assertTrue(self.scheduler.isCallbackScheduled(hidden.onContinue))
+
+        hidden.priority = Scheduler.PRIORITY_VISIBLE
+        self._wait()
+        self.assertEqual(self.log, ['visible', 'hidden'])
+
+
+if __name__ == '__main__':
+    unittest.main()
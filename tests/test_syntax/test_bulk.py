@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import json
+import os.path
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+import qutepart.syntax
+import qutepart.syntax.bulk
+from qutepart.syntax import SyntaxManager, highlightLines
+from qutepart.syntax.bulk import highlightFiles, highlightFilesAsJsonLines, highlightTexts
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.TemporaryDirectory()
+        self.dirPath = self._tmpDir.name
+        os.mkdir(os.path.join(self.dirPath, 'sub'))
+        self._write('a.py', 'x = 1\n"""doc\n"""\n')
+        self._write(os.path.join('sub', 'b.c'), 'int main() {}')
+        self._write('c.unknownextension', 'text\n')
+
+    def tearDown(self):
+        self._tmpDir.cleanup()
+
+    def _write(self, name, text):
+        with open(os.path.join(self.dirPath, name), 'w') as f:
+            f.write(text)
+
+    def _path(self, name):
+        return os.path.join(self.dirPath, name)
+
+    def test_files(self):
+        notExisting = self._path('not_existing.py')
+        results = list(highlightFiles([self.dirPath, notExisting], jobs=2))
+
+        self.assertEqual([result['path'] for result in results],
+                         [self._path('a.py'),
+                          self._path('c.unknownextension'),
+                          self._path(os.path.join('sub', 'b.c')),
+                          notExisting])
+
+        python = SyntaxManager(headless=True).getSyntax(languageName='Python')
+        self.assertEqual(results[0]['syntax'], 'Python')
+        self.assertEqual(results[0]['lines'],
+                         list(highlightLines(['x = 1', '"""doc', '"""'], python)))
+        self.assertIsNone(results[1]['syntax'])
+        self.assertEqual(results[2]['syntax'], 'C')
+        self.assertEqual(len(results[2]['lines']), 1)
+        self.assertIn('error', results[3])
+
+    def test_exception(self):
+        """An exception is reported as an error of the file, next files are highlighted
+        """
+        qutepart.syntax.bulk._initWorker()
+        with unittest.mock.patch.object(qutepart.syntax.bulk, 'highlightLines', side_effect=RuntimeError('broken')):
+            results = qutepart.syntax.bulk._highlightFiles(0, 0, [self._path('a.py'),
+                                                                  self._path('c.unknownextension')])
+        self.assertEqual(results, [{'path': self._path('a.py'), 'error': 'RuntimeError: broken'},
+                                   {'path': self._path('c.unknownextension'), 'syntax': None}])
+
+    def test_budget(self):
+        self._write('long.c', 'x = 1;' * 1000)
+        result, = highlightFiles([self._path('long.c')], jobs=1, maxSteps=10)
+        fullResult, = highlightFiles([self._path('long.c')], jobs=1)
+        self.assertLess(len(result['lines'][0]), len(fullResult['lines'][0]))
+
+    def test_json_lines(self):
+        results = list(highlightFiles([self.dirPath], jobs=1))
+        jsonLines = list(highlightFilesAsJsonLines([self.dirPath], jobs=1))
+        # tuples are converted to lists
+        self.assertEqual([json.loads(line) for line in jsonLines],
+                         json.loads(json.dumps(results)))
+
+
+class Threads(unittest.TestCase):
+    """Texts, highlighted by parallel threads, are highlighted as by one thread
+    """
+    def setUp(self):
+        qutepart.syntax.setLineCacheSize(0)  # lines are parsed by the threads
+
+    def tearDown(self):
+        qutepart.syntax.setLineCacheSize(qutepart.syntax._LINE_CACHE_DEFAULT_SIZE)
+
+    def _readSample(self, name):
+        with open(os.path.join(os.path.dirname(__file__), 'files', name), encoding='utf-8') as f:
+            return f.read()
+
+    def test_texts(self):
+        manager = SyntaxManager(headless=True)
+        for name, languageName in (('highlight.pl', 'Perl'), ('highlight.rb', 'Ruby')):
+            syntax = manager.getSyntax(languageName=languageName)
+            lines = self._readSample(name).rstrip('\n').split('\n')
+            # chunks of different length make threads parse different lines at the same time
+            texts = ['\n'.join(lines[i:]) for i in range(0, len(lines), 7)]
+
+            expected = [list(highlightLines(text.split('\n'), syntax)) for text in texts]
+            results = list(highlightTexts(texts * 3, syntax, jobs=4))
+            self.assertEqual(results, expected * 3)
+
+    def test_not_headless(self):
+        syntax = SyntaxManager(headless=False).getSyntax(languageName='Python')
+        with self.assertRaises(ValueError):
+            list(highlightTexts(['x = 1'], syntax))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+
+
+class Test(unittest.TestCase):
+    """Context stacks are interned. Equal stacks are the same object
+    """
+    def _contextStacks(self, language, lines):
+        syntax = SyntaxManager().getSyntax(languageName=language)
+        contextStacks = []
+        contextStack = None
+        for line in lines:
+            contextStack = syntax.parseBlock(line, contextStack)[0]
+            contextStacks.append(contextStack)
+        return contextStacks
+
+    def test_equal_stacks_are_identical(self):
+        stacks = self._contextStacks('Python', ['"""', 'text', '"""', 'x = 1', '"""', 'text'])
+        self.assertIs(stacks[0], stacks[1])
+        self.assertIs(stacks[0], stacks[4])
+        self.assertIs(stacks[0], stacks[5])
+        self.assertIs(stacks[2], stacks[3])
+        self.assertIsNot(stacks[0], stacks[2])
+
+    def test_dynamic_data(self):
+        stacks = self._contextStacks('Perl', ['print <<EOF;', 'text', 'EOF',
+                                              'print <<EOF;', 'text', 'EOF',
+                                              'print <<END;', 'text', 'END'])
+        self.assertIs(stacks[0], stacks[3])
+        self.assertIs(stacks[1], stacks[4])
+        self.assertIsNot(stacks[0], stacks[6])
+        self.assertIs(stacks[2], stacks[5])
+        self.assertIs(stacks[2], stacks[8])
+
+    def test_frames(self):
+        stacks = self._contextStacks('Perl', ['print <<EOF;', 'text'])
+        for stack in stacks:
+            frames = stack.frames()
+            parser = frames[0][0].parser
+            self.assertIs(frames[0][0], parser.defaultContext)
+            self.assertIs(parser.makeContextStack(frames), stack)
+
+
+if __name__ == '__main__':
+    unittest.main()
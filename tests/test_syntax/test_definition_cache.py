@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import unittest
+import unittest.mock
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager, Syntax, highlightLines
+import qutepart.syntax.loader
+
+
+_FILES_PATH = os.path.join(os.path.dirname(__file__), 'files')
+_XML_DIR_PATH = os.path.join(os.path.dirname(qutepart.syntax.loader.__file__), 'data', 'xml')
+
+
+class DefinitionCache(unittest.TestCase):
+    """Compiled syntax definitions are saved to SyntaxManager cacheDir
+    """
+    def setUp(self):
+        self._cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._cacheDir)
+
+    def _highlight(self, manager, fileName):
+        with open(os.path.join(_FILES_PATH, fileName), encoding='utf-8') as sourceFile:
+            lines = sourceFile.read().splitlines()
+        syntax = manager.getSyntax(sourceFilePath=fileName, firstLine=lines[0])
+        return list(highlightLines(lines, syntax))
+
+    def test_highlighting(self):
+        """Syntaxes, which are loaded from the cache, highlight like syntaxes loaded from XML.
+        Ruby refers to contexts of other syntaxes
+        """
+        for fileName in ('highlight.rb', 'highlight.pl'):
+            expected = self._highlight(SyntaxManager(headless=True), fileName)
+            self.assertEqual(self._highlight(SyntaxManager(headless=True, cacheDir=self._cacheDir), fileName),
+                             expected)
+            self.assertEqual(self._highlight(SyntaxManager(headless=True, cacheDir=self._cacheDir), fileName),
+                             expected)
+
+    def test_xml_not_parsed(self):
+        SyntaxManager(headless=True, cacheDir=self._cacheDir).getSyntax(xmlFileName='html-php.xml')
+        self.assertTrue(any([fileName.startswith('html-php.xml') for fileName in os.listdir(self._cacheDir)]))
+
+        with unittest.mock.patch.object(qutepart.syntax.loader, '_compileSyntax', side_effect=AssertionError):
+            syntax = SyntaxManager(headless=True, cacheDir=self._cacheDir).getSyntax(xmlFileName='html-php.xml')
+        self.assertEqual(syntax.name, 'PHP (HTML)')
+        self.assertEqual(syntax.xmlFileName, 'html-php.xml')
+        self.assertIn('*.php', syntax.extensions)
+
+    def _load(self, xmlFilePath):
+        return qutepart.syntax.loader.loadSyntax(Syntax(None), xmlFilePath, True, self._cacheDir)
+
+    def test_changed_xml(self):
+        xmlFilePath = os.path.join(self._cacheDir, 'ini.xml')
+        shutil.copy(os.path.join(_XML_DIR_PATH, 'ini.xml'), xmlFilePath)
+        self.assertEqual(self._load(xmlFilePath).name, 'INI Files')
+
+        with open(xmlFilePath, encoding='utf-8') as xmlFile:
+            text = xmlFile.read()
+        with open(xmlFilePath, 'w', encoding='utf-8') as xmlFile:
+            xmlFile.write(text.replace('name="INI Files"', 'name="Changed INI Files"'))
+        os.utime(xmlFilePath, ns=(0, os.stat(xmlFilePath).st_mtime_ns + 10 ** 9))
+
+        self.assertEqual(self._load(xmlFilePath).name, 'Changed INI Files')
+
+    def test_broken_cache(self):
+        xmlFilePath = os.path.join(_XML_DIR_PATH, 'ini.xml')
+        self._load(xmlFilePath)
+        cacheFilePath = qutepart.syntax.loader._cacheFilePath(self._cacheDir, xmlFilePath)
+        for content in (b'broken', b''):
+            with open(cacheFilePath, 'wb') as cacheFile:
+                cacheFile.write(content)
+
+            with self.assertLogs('qutepart', 'WARNING'):
+                syntax = self._load(xmlFilePath)
+            self.assertEqual(syntax.name, 'INI Files')
+            self.assertEqual(qutepart.syntax.loader._loadCachedDefinition(cacheFilePath)['version'],
+                             qutepart.syntax.loader._CACHE_FORMAT_VERSION)
+
+
+if __name__ == '__main__':
+    unittest.main()
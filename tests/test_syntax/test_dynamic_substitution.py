@@ -3,12 +3,16 @@
 import unittest
 import sys
 import os.path
+import threading
 
 topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, topLevelPath)
 sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
 sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
 
+import qutepart.syntax
+import qutepart.syntax.loader
+from qutepart.syntax import SyntaxManager, highlightLines, dynamicRegExpCacheInfo, clearDynamicRegExpCache
 from qutepart.syntax.parser import StringDetect, RegExpr
 
 class TestCase(unittest.TestCase):
@@ -21,5 +25,70 @@ class TestCase(unittest.TestCase):
                          'a\|c%3')
 
 
+class DynamicRegExpCache(unittest.TestCase):
+    """Patterns of dynamic rules are compiled once per substituted pattern
+    """
+    def test_heredoc(self):
+        syntax = SyntaxManager(headless=True).getSyntax(languageName='Bash')
+        lines = ['cat <<END'] + ['echo text $x line'] * 50 + ['END',
+                 'cat <<STOP', 'a b c', 'STOP',
+                 'cat <<END', 'x', 'END',
+                 'echo done']
+
+        clearDynamicRegExpCache()
+        spans = list(highlightLines(lines, syntax))
+        hits, misses, size, maxSize = dynamicRegExpCacheInfo()
+
+        self.assertEqual(spans[-1][0][2:], ('Builtin', 'dsBuiltIn', ' '))
+        self.assertEqual(misses, size)
+        self.assertEqual(size, 4)  # 2 rules, END and STOP
+        self.assertEqual(hits, 2)  # the second END
+
+        clearDynamicRegExpCache()
+        self.assertEqual(dynamicRegExpCacheInfo(), (0, 0, 0, maxSize))
+
+
+class Threads(unittest.TestCase):
+    """Dynamic rules are shared by threads, which highlight texts with different context data
+    """
+    def setUp(self):
+        qutepart.syntax.setLineCacheSize(0)  # lines are parsed by the threads
+        self._switchInterval = sys.getswitchinterval()
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='Bash')
+
+    def tearDown(self):
+        sys.setswitchinterval(self._switchInterval)
+        qutepart.syntax.setLineCacheSize(qutepart.syntax._LINE_CACHE_DEFAULT_SIZE)
+
+    def _lines(self, delimiter):
+        return ['cat <<%s' % delimiter] + ['echo text $x END STOP'] * 100 + [delimiter, 'echo done']
+
+    @unittest.skipIf(qutepart.syntax.loader.binaryParserAvailable, 'Rules of the Python parser')
+    def test_rules_not_modified(self):
+        rules = [rule for context in self._syntax.parser.contexts.values() for rule in context.rules
+                 if isinstance(rule, RegExpr) and rule.dynamic]
+        attributes = [dict(vars(rule)) for rule in rules]
+        list(highlightLines(self._lines('END'), self._syntax))
+        self.assertEqual([vars(rule) for rule in rules], attributes)
+
+    def test_threads(self):
+        delimiters = ['END', 'STOP', 'EOF', 'DONE']
+        expected = [list(highlightLines(self._lines(delimiter), self._syntax)) for delimiter in delimiters]
+
+        sys.setswitchinterval(1e-6)
+        results = {}
+
+        def highlight(delimiter):
+            results[delimiter] = list(highlightLines(self._lines(delimiter), self._syntax))
+
+        for attempt in range(5):
+            threads = [threading.Thread(target=highlight, args=(delimiter,)) for delimiter in delimiters]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([results[delimiter] for delimiter in delimiters], expected)
+
+
 if __name__ == '__main__':
     unittest.main()
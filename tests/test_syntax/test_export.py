@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import io
+import os.path
+import sys
+import tempfile
+import unittest
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+from qutepart.syntax import export
+from qutepart.syntax.bulk import exportFiles
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.syntax = SyntaxManager(headless=True).getSyntax(languageName='Python')
+
+    def test_html(self):
+        lines = list(export.htmlLines(['x = 1 # <a & b>\n', 'pass'], self.syntax))
+        self.assertEqual(lines,
+                         ['x <span class="dsOperator">=</span> <span class="dsDecVal">1</span> '
+                          '<span class="dsComment"># &lt;a &amp; b&gt;</span>\n',
+                          '<span class="dsControlFlow">pass</span>\n'])
+
+    def test_style_sheet(self):
+        css = export.htmlStyleSheet()
+        self.assertIn('.qutepart .dsComment { color: #888786; }', css)
+        self.assertIn('.qutepart .dsKeyword { font-weight: bold; }', css)
+        self.assertNotIn('dsNormal', css)
+
+    def test_html_document(self):
+        out = io.StringIO()
+        export.exportHtml(['pass'], self.syntax, out)
+        self.assertIn('<style>', out.getvalue())
+        self.assertIn('<pre class="qutepart"><span class="dsControlFlow">pass</span>\n</pre>', out.getvalue())
+
+    def test_ansi(self):
+        lines = list(export.ansiLines(['pass # c'], self.syntax))
+        self.assertEqual(lines, ['\x1b[1mpass\x1b[0m \x1b[38;2;136;135;134m# c\x1b[0m\n'])
+
+    def test_qt_syntax(self):
+        syntax = SyntaxManager().getSyntax(languageName='Python')
+        self.assertEqual(list(export.ansiLines(['pass'], syntax)),
+                         list(export.ansiLines(['pass'], self.syntax)))
+
+    def test_export_files(self):
+        with tempfile.TemporaryDirectory() as dirPath:
+            sourcePath = os.path.join(dirPath, 'src', 'a.py')
+            os.mkdir(os.path.dirname(sourcePath))
+            with open(sourcePath, 'w') as sourceFile:
+                sourceFile.write('pass\n')
+
+            outDirPath = os.path.join(dirPath, 'out')
+            results = list(exportFiles([os.path.dirname(sourcePath)], outDirPath, 'html', jobs=1))
+            outPath = os.path.join(outDirPath, 'a.py.html')
+            self.assertEqual(results, [{'path': sourcePath, 'syntax': 'Python', 'output': outPath}])
+            with open(outPath) as outFile:
+                self.assertIn('<span class="dsControlFlow">pass</span>', outFile.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+from qutepart.syntax.loader import _regExpFirstChars
+
+
+class RegExp(unittest.TestCase):
+    """Characters, which a regular expression match might start with
+    """
+    def _check(self, pattern, expected, insensitive=False):
+        self.assertEqual(_regExpFirstChars(pattern, insensitive), expected)
+
+    def test_literal(self):
+        self._check('abc', 'a')
+        self._check('#\\s*if', '#')
+        self._check('\\.\\d', '.')
+
+    def test_alternatives(self):
+        self._check('\\b(if|else|while)\\b', 'eiw')
+        self._check('(?:<<|>>)=?', '<>')
+
+    def test_nullable(self):
+        self._check('a?b*c', 'abc')
+        self._check('(\\+|-)?\\d', '+-0123456789')
+        self._check('x{0,2}y', 'xy')
+
+    def test_class(self):
+        self._check('[a-c_]+', '_abc')
+        self._check('[]x]', ']x')
+        self._check('[\\-+]', '+-')
+
+    def test_insensitive(self):
+        self._check('if', 'Ii', insensitive=True)
+        self._check('[a-b]', 'ABab', insensitive=True)
+        self._check('\u212a', None, insensitive=True)  # Kelvin sign matches k
+
+    def test_zero_width(self):
+        self._check('^\\s*#', '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f #')
+        self._check('(?=x)\\w', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz')
+
+    def test_not_analysed(self):
+        for pattern in ('.', 'a|.', '[^a]', '\\D', '[[:digit:]]', '(?i)a', '\\1', '(a', 'x{,2}y'):
+            self._check(pattern, None)
+
+
+class Dispatch(unittest.TestCase):
+    """Rules of included contexts are tried in the order of inclusion
+    """
+    def test_included_rules(self):
+        syntax = SyntaxManager().getSyntax(languageName='C++')
+        text = 'int main() { return 0x1F; } // comment'
+        lineData, highlightedSegments = syntax.parser.highlightBlock(text, None)
+        self.assertEqual(sum([length for length, format in highlightedSegments]), len(text))
+        self.assertEqual(''.join(lineData[1]), ' ' * 28 + 'c' * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
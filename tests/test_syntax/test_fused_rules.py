@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+import threading
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+import qutepart.syntax.parser
+
+
+@unittest.skipIf(qutepart.syntax.loader.binaryParserAvailable, 'Rules are fused by the Python parser only')
+class FusedRules(unittest.TestCase):
+    """Fused rules highlight exactly as rules tried one by one
+    """
+    def setUp(self):
+        self._fuseRules = qutepart.syntax.loader.fuseRules
+
+    def tearDown(self):
+        qutepart.syntax.loader.fuseRules = self._fuseRules
+
+    def _highlight(self, languageName, lines, fuseRules):
+        qutepart.syntax.loader.fuseRules = fuseRules
+        syntax = SyntaxManager(headless=True).getSyntax(languageName=languageName)
+        result = []
+        contextStack = None
+        for text in lines:
+            lineData, highlightedSegments = syntax.parser.highlightBlock(text, contextStack)
+            contextStack = lineData[0]
+            result.append(([length for length, format in highlightedSegments], ''.join(lineData[1])))
+        return result
+
+    def _check(self, languageName, lines):
+        self.assertEqual(self._highlight(languageName, lines, True),
+                         self._highlight(languageName, lines, False))
+
+    def test_cpp(self):
+        self._check('C++', ['#include <stdio.h>',
+                            'int main() { return 0x1F + 1.5e3; } // TODO comment',
+                            '/* block',
+                            '   comment */ char c = \'\\n\';'])
+
+    def test_included_syntax_deliminators(self):
+        """Modelines syntax is matched with C++ deliminators, ':' is not a part of a word
+        """
+        self._check('C++', ['// kate: hl Clipper;'])
+
+    def test_python(self):
+        self._check('Python', ['def f(x, *args):',
+                               '    return u"%s" % x if x else r\'\\d\'  # comment'])
+
+    def test_cmake(self):
+        """Big sequences of rules are not fused for every character
+        """
+        with open(os.path.join(os.path.dirname(__file__), 'files', 'highlight.cmake')) as sourceFile:
+            self._check('CMake', sourceFile.read().splitlines())
+
+
+@unittest.skipIf(qutepart.syntax.loader.binaryParserAvailable, 'Dispatch tables of the Python parser')
+class DispatchTable(unittest.TestCase):
+    def setUp(self):
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='PHP (HTML)')
+        self._contexts = set([rule.parentContext for context in self._syntax.parser.contexts.values() \
+                                    for rule in context.rules])
+
+    def test_made_lazily(self):
+        """Tables are made on first parsing of a context, not for every context on load
+        """
+        for context in self._contexts:
+            self.assertIsNone(context._dispatchTable)
+
+        self._syntax.parseBlock('<p>text</p>', None)
+        self.assertIsNotNone(self._syntax.parser.defaultContext._dispatchTable)
+
+    def test_keywords_not_fused(self):
+        """Patterns of big keyword lists compile for seconds
+        """
+        for context in self._contexts:
+            rulesForChar, allRules, searchRules, profiled = context._getDispatchTable()
+            for rules in list(rulesForChar.values()) + [allRules]:
+                for rule in rules:
+                    if isinstance(rule, qutepart.syntax.parser.FusedRules):
+                        self.assertFalse(any([isinstance(fusedRule, qutepart.syntax.parser.keyword) \
+                                                for fusedRule in rule.rules]))
+
+    def test_threads(self):
+        """Threads, which parse a context at once, see either no table or a complete one
+        """
+        lines = ['<?php $x = array(1, "str"); // comment', '/* block */ echo $x; ?>', '<p class="x">text</p>']
+
+        def highlight():
+            contextStack = None
+            result = []
+            for text in lines:
+                lineData, highlightedSegments = self._syntax.parser.highlightBlock(text, contextStack)
+                contextStack = lineData[0]
+                result.append([length for length, format in highlightedSegments])
+            return result
+
+        expected = highlight()
+        results = []
+        errors = []
+
+        def run():
+            try:
+                results.append(highlight())
+            except Exception as ex:
+                errors.append(ex)
+
+        switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for attempt in range(5):
+                for context in self._contexts:
+                    context._dispatchTable = None
+                threads = [threading.Thread(target=run) for i in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            sys.setswitchinterval(switchInterval)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [expected] * 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import unittest
+import subprocess
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager, highlightLines
+
+
+class Test(unittest.TestCase):
+    """highlightLines() works without QApplication
+    """
+    def setUp(self):
+        self.syntax = SyntaxManager(headless=True).getSyntax(languageName='Python')
+
+    def test_spans(self):
+        lines = list(highlightLines(['x = 1  # comment\n'], self.syntax))
+        self.assertEqual(lines,
+                         [[(0, 2, 'Normal Text', 'dsNormal', ' '),
+                           (2, 1, 'Operator', 'dsOperator', ' '),
+                           (3, 1, 'Normal Text', 'dsNormal', ' '),
+                           (4, 1, 'Int', 'dsDecVal', ' '),
+                           (5, 2, 'Normal Text', 'dsNormal', ' '),
+                           (7, 9, 'Comment', 'dsComment', 'c')]])
+
+    def test_context_is_kept(self):
+        lines = list(highlightLines(['s = """text\n', 'text\r\n', '"""', ''], self.syntax))
+        self.assertEqual(lines[1], [(0, 4, 'String', 'dsString', 's')])
+        self.assertEqual(lines[2], [(0, 3, 'String', 'dsString', 's')])
+        self.assertEqual(lines[3], [])
+
+    def test_generator(self):
+        def infiniteLines():
+            while True:
+                yield 'a = 1'
+
+        spans = highlightLines(infiniteLines(), self.syntax)
+        for i in range(1000):
+            self.assertEqual(next(spans)[0], (0, 2, 'Normal Text', 'dsNormal', ' '))
+
+    def test_requires_headless_syntax(self):
+        syntax = SyntaxManager().getSyntax(languageName='Python')
+        with self.assertRaises(ValueError):
+            next(highlightLines(['a'], syntax))
+
+
+class Import(unittest.TestCase):
+    def test_no_pyqt(self):
+        """qutepart.syntax doesn't import PyQt5, the widget is imported on first use
+        """
+        code = 'import sys, qutepart.syntax; ' \
+               'assert not [name for name in sys.modules if name.startswith("PyQt5")]; ' \
+               'from qutepart import Qutepart; ' \
+               'assert "PyQt5.QtWidgets" in sys.modules'
+        subprocess.check_call([sys.executable, '-c', code], cwd=topLevelPath)
+
+    def test_star_import(self):
+        """Names of the widget are imported by "from qutepart import *"
+        """
+        code = 'from qutepart import *; ' \
+               'import qutepart; ' \
+               'names = dir(); ' \
+               'assert all([name in names for name in qutepart.__all__]); ' \
+               'assert Qutepart.__module__ == "qutepart.widget"'
+        subprocess.check_call([sys.executable, '-c', code], cwd=topLevelPath)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+
+
+class LineBudget(unittest.TestCase):
+    """Parsing of a line is limited by count of steps and time
+    """
+    def setUp(self):
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='C++')
+        self._parser = self._syntax.parser
+
+    def _checkSegments(self, text, segments):
+        self.assertEqual(sum([length for length, format in segments]), len(text))
+
+    def test_not_exhausted(self):
+        text = 'int x = 1; /* comment */ y = "str";'
+        self.assertEqual(self._parser.highlightBlock(text, None, 1000, 10.),
+                         self._parser.highlightBlock(text, None))
+
+    def test_steps(self):
+        text = 'int x; /* comment' + ' x' * 1000
+        lineData, segments = self._parser.highlightBlock(text, None, 10)
+        fullLineData, fullSegments = self._parser.highlightBlock(text, None)
+        self._checkSegments(text, segments)
+        self.assertLess(len(segments), len(fullSegments))
+        self.assertEqual(segments[:3], fullSegments[:3])
+
+        # the rest of the line gets the format of the comment context, the next line is in the comment
+        self.assertEqual(segments[-1], (len(text) - sum([length for length, format in segments[:-1]]),
+                                        fullSegments[-1][1]))
+        self.assertTrue(self._syntax.isComment(lineData, len(text) - 1))
+        self.assertEqual(lineData[0], fullLineData[0])
+
+        self.assertEqual(self._parser.parseBlock(text, None, 10), lineData)
+
+    def test_line_end(self):
+        """Line end context switches are applied, when the budget is exhausted
+        """
+        text = 'x = 1; // comment' + ' y' * 1000
+        lineData, segments = self._parser.highlightBlock(text, None, 20)
+        self._checkSegments(text, segments)
+        self.assertTrue(self._syntax.isComment(lineData, len(text) - 1))
+        self.assertEqual(lineData[0], self._parser.highlightBlock('x = 1;', None)[0][0])
+
+    def test_time(self):
+        text = 'int x = 1;' * 1000
+        lineData, segments = self._parser.highlightBlock(text, None, 0, 1e-9)
+        self._checkSegments(text, segments)
+        self.assertLess(len(segments), 100)
+
+    def test_exhausted(self):
+        text = 'int x; /* comment' + ' x' * 1000
+        lineData, segments, exhausted = self._parser.highlightBlockLimited(text, None, 10)
+        self.assertTrue(exhausted)
+        self.assertEqual((lineData, segments), self._parser.highlightBlock(text, None, 10))
+
+        self.assertFalse(self._parser.highlightBlockLimited(text, None, 0, 10.)[2])
+        self.assertFalse(self._parser.highlightBlockLimited(text, None)[2])
+
+    def test_syntax(self):
+        text = 'int x; /* comment' + ' x' * 1000
+        lineData, segments = self._syntax.highlightBlock(text, None, maxSteps=10)
+        self.assertEqual(len(segments), len(self._parser.highlightBlock(text, None, 10)[1]))
+        self.assertGreater(len(self._syntax.highlightBlock(text, None)[1]), len(segments))
+
+
+class LineEndCycle(unittest.TestCase):
+    """lineEndContext of the WML section context pushes the error context, which pops back to the section.
+    Count of line end context switches is limited
+    """
+    def test_wml(self):
+        syntax = SyntaxManager(headless=True).getSyntax(xmlFileName='wml.xml')
+        lineData, segments = syntax.highlightBlock('[unit', None)
+        context, data = lineData[0].frames()[-1]
+        self.assertEqual(context.name, 'section')
+
+
+if __name__ == '__main__':
+    unittest.main()
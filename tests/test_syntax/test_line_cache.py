@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+
+
+class LineCache(unittest.TestCase):
+    """Highlighting results of lines are cached
+    """
+    def setUp(self):
+        self._maxSize = qutepart.syntax.lineCacheInfo()[3]
+        qutepart.syntax.clearLineCache()
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='C++')
+
+    def tearDown(self):
+        qutepart.syntax.setLineCacheSize(self._maxSize)
+
+    def _highlight(self, lines):
+        result = []
+        contextStack = None
+        for text in lines:
+            lineData, highlightedSegments = self._syntax.highlightBlock(text, contextStack)
+            contextStack = lineData[0]
+            result.append((lineData, highlightedSegments))
+        return result
+
+    def test_repeated_lines(self):
+        lines = ['int x; /* start', 'int x; /* start', 'end */ int x; /* start'] * 2
+        result = self._highlight(lines)
+        hits, misses, size, maxSize = qutepart.syntax.lineCacheInfo()
+        self.assertEqual((hits, misses, size), (3, 3, 3))  # the 1st line is parsed in other context
+        self.assertIs(result[1][0], result[3][0])
+
+        qutepart.syntax.setLineCacheSize(0)
+        self.assertEqual(result, self._highlight(lines))
+
+    def test_size(self):
+        qutepart.syntax.setLineCacheSize(2)
+        self._highlight(['a;', 'b;', 'c;', 'a;'])
+        self.assertEqual(qutepart.syntax.lineCacheInfo(), (0, 4, 2, 2))
+
+        qutepart.syntax.setLineCacheSize(0)
+        self._highlight(['a;', 'a;'])
+        self.assertEqual(qutepart.syntax.lineCacheInfo(), (0, 2, 0, 0))
+
+    def test_chars(self):
+        qutepart.syntax.setLineCacheSize(100, 10)
+        self._highlight(['a = 1;', 'b = 2;', 'a = 1;'])
+        self.assertEqual(qutepart.syntax.lineCacheInfo(), (0, 3, 1, 100))
+
+        self._highlight(['x' * 11, 'x' * 11])
+        self.assertEqual(qutepart.syntax.lineCacheInfo(), (0, 5, 1, 100))
+
+    def test_exhausted_not_cached(self):
+        """A line, which is cut by the budget, is parsed again. The complete result is used with any budget
+        """
+        text = 'int x; /* comment' + ' x' * 1000
+        lineData, segments, exhausted = self._syntax.highlightBlockLimited(text, None, maxSteps=10)
+        self.assertTrue(exhausted)
+        self.assertEqual(qutepart.syntax.lineCacheInfo()[2], 0)
+
+        lineData, fullSegments, exhausted = self._syntax.highlightBlockLimited(text, None)
+        self.assertFalse(exhausted)
+        self.assertGreater(len(fullSegments), len(segments))
+        self.assertEqual(self._syntax.highlightBlockLimited(text, None, maxSteps=10), (lineData, fullSegments, False))
+        self.assertEqual(qutepart.syntax.lineCacheInfo()[:3], (1, 2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+import xml.etree.ElementTree
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager, highlightLines
+import qutepart.syntax.loader
+from qutepart.syntax.loader import _optimizeContexts
+
+
+class Rewrite(unittest.TestCase):
+    """Rules are rewritten on XML level
+    """
+    def _optimize(self, contexts, lists={}):
+        highlightingElement = xml.etree.ElementTree.fromstring(
+            '<highlighting><contexts>%s</contexts>'
+            '<itemDatas><itemData name="Normal" defStyleNum="dsNormal"/></itemDatas>'
+            '</highlighting>' % contexts)
+        report = _optimizeContexts(highlightingElement, lists)
+        contextElements = highlightingElement.find('contexts').findall('context')
+        return report, [[(ruleElement.tag, ruleElement.attrib) for ruleElement in contextElement] \
+                            for contextElement in contextElements]
+
+    def test_reg_expr(self):
+        report, contexts = self._optimize('<context name="Normal">'
+                                          '<RegExpr String="\\." attribute="Normal"/>'
+                                          '<RegExpr String="//"/>'
+                                          '<RegExpr String="\\*\\*=" minimal="true"/>'
+                                          '<RegExpr String="[+\\-]"/>'
+                                          '<RegExpr String="if" insensitive="true"/>'
+                                          '<RegExpr String="a+"/>'
+                                          '</context>')
+        self.assertEqual(contexts[0], [('DetectChar', {'char': '.', 'attribute': 'Normal'}),
+                                       ('Detect2Chars', {'char': '/', 'char1': '/'}),
+                                       ('StringDetect', {'String': '**='}),
+                                       ('AnyChar', {'String': '+-'}),
+                                       ('RegExpr', {'String': 'if', 'insensitive': 'true'}),
+                                       ('RegExpr', {'String': 'a+'})])
+        self.assertEqual(len(report), 4)
+
+    def test_dynamic_target(self):
+        """Matched text is saved for a dynamic context
+        """
+        report, contexts = self._optimize('<context name="Normal">'
+                                          '<RegExpr String="x" context="String"/>'
+                                          '</context>'
+                                          '<context name="String" dynamic="true"/>')
+        self.assertEqual(report, [])
+
+    def test_merge_detect_char(self):
+        report, contexts = self._optimize('<context name="Normal">'
+                                          '<DetectChar char="(" attribute="Normal"/>'
+                                          '<RegExpr String="\\)" attribute="Normal"/>'
+                                          '<DetectChar char="\\t" attribute="Normal"/>'
+                                          '<DetectChar char="[" context="#pop"/>'
+                                          '</context>')
+        self.assertEqual(contexts[0], [('AnyChar', {'String': '()\t', 'attribute': 'Normal'}),
+                                       ('DetectChar', {'char': '[', 'context': '#pop'})])
+
+    def test_never_matches(self):
+        report, contexts = self._optimize('<context name="Normal">'
+                                          '<keyword String="empty"/>'
+                                          '<AnyChar String=""/>'
+                                          '<keyword String="words"/>'
+                                          '</context>',
+                                          {'empty': [], 'words': ['if']})
+        self.assertEqual(contexts[0], [('keyword', {'String': 'words'})])
+
+    def test_inline_include_rules(self):
+        report, contexts = self._optimize('<context name="Normal">'
+                                          '<IncludeRules context="Once"/>'
+                                          '<IncludeRules context="Twice"/>'
+                                          '<DetectChar char="x" context="Twice"/>'
+                                          '</context>'
+                                          '<context name="Once"><StringDetect String="once"/></context>'
+                                          '<context name="Twice"><StringDetect String="twice"/></context>')
+        self.assertEqual(contexts[0], [('StringDetect', {'String': 'once'}),
+                                       ('IncludeRules', {'context': 'Twice'}),
+                                       ('DetectChar', {'char': 'x', 'context': 'Twice'})])
+        self.assertEqual(report, ["context 'Normal': IncludeRules 'Once' inlined"])
+
+
+class Highlighting(unittest.TestCase):
+    """Highlighting is equal with and without the optimizer
+    """
+    def setUp(self):
+        self._optimizeSyntax = qutepart.syntax.loader.optimizeSyntax
+
+    def tearDown(self):
+        qutepart.syntax.loader.optimizeSyntax = self._optimizeSyntax
+
+    def _highlight(self, xmlFileName, lines, optimize):
+        qutepart.syntax.loader.optimizeSyntax = optimize
+        syntax = SyntaxManager(headless=True).getSyntax(xmlFileName=xmlFileName)
+        return list(highlightLines(lines, syntax))
+
+    def _check(self, xmlFileName, path):
+        with open(path, encoding='utf-8') as sourceFile:
+            lines = sourceFile.read().split('\n')
+        self.assertEqual(self._highlight(xmlFileName, lines, True),
+                         self._highlight(xmlFileName, lines, False))
+
+    def test_cpp(self):
+        self._check('cpp.xml', os.path.join(topLevelPath, 'qutepart', 'syntax', 'cParser.c'))
+
+    def test_python(self):
+        self._check('python.xml', qutepart.syntax.loader.__file__)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+
+
+def _unpack(buffer):
+    values = memoryview(buffer).cast('i').tolist()
+    return [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+
+
+class HighlightBlockPacked(unittest.TestCase):
+    """Segments are packed to a bytearray as (start, length, format index) triples
+    """
+    def setUp(self):
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='C++')
+
+    def _check(self, text, contextStack=None):
+        buffer = bytearray()
+        lineData = self._syntax.highlightBlockPacked(text, contextStack, buffer)
+        expectedLineData, segments = self._syntax.highlightBlock(text, contextStack)
+        self.assertEqual(lineData, expectedLineData)
+
+        formats = self._syntax.parser.packedFormats
+        packed = _unpack(buffer)
+        self.assertEqual([(length, formats[index] if index >= 0 else None) for start, length, index in packed],
+                         list(segments))
+        self.assertEqual([start for start, length, index in packed],
+                         [sum([length for length, format in segments[:i]]) for i in range(len(segments))])
+        return lineData, buffer
+
+    def test_segments(self):
+        lineData, buffer = self._check('int x = 1; /* comment')
+        self._check('still comment */ "str"; // comment', lineData[0])
+
+    def test_empty(self):
+        lineData, buffer = self._check('')
+        self.assertEqual(buffer, bytearray())
+
+    def test_reuse(self):
+        """Buffer is resized, equal lines give equal buffers, format indexes are stable
+        """
+        buffer = bytearray()
+        self._syntax.highlightBlockPacked('int x = 1; // long comment', None, buffer)
+        first = bytes(buffer)
+        formatCount = len(self._syntax.parser.packedFormats)
+
+        self._syntax.highlightBlockPacked('x', None, buffer)
+        self.assertEqual(len(_unpack(buffer)), 1)
+
+        self._syntax.highlightBlockPacked('int x = 1; // long comment', None, buffer)
+        self.assertEqual(bytes(buffer), first)
+        self.assertEqual(len(self._syntax.parser.packedFormats), formatCount)
+
+    def test_budget(self):
+        text = 'int x; /* comment' + ' x' * 1000
+        buffer = bytearray()
+        self._syntax.highlightBlockPacked(text, None, buffer, 10)
+        packed = _unpack(buffer)
+        self.assertEqual(len(packed), len(self._syntax.highlightBlock(text, None, maxSteps=10)[1]))
+        self.assertEqual(packed[-1][0] + packed[-1][1], len(text))
+
+    def test_not_bytearray(self):
+        with self.assertRaises(TypeError):
+            self._syntax.highlightBlockPacked('int x;', None, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
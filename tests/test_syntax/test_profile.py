@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+import qutepart.syntax
+from qutepart.syntax import SyntaxManager
+
+
+class Profile(unittest.TestCase):
+    """Trials, matches and time of rules and contexts are counted, if profiling is enabled
+    """
+    def setUp(self):
+        self._syntax = SyntaxManager(headless=True).getSyntax(languageName='Python')
+        qutepart.syntax.clearProfile()
+
+    def tearDown(self):
+        qutepart.syntax.setProfilingEnabled(False)
+        qutepart.syntax.clearProfile()
+
+    def _highlight(self, lines):
+        contextStack = None
+        for text in lines:
+            lineData, highlightedSegments = self._syntax.parser.highlightBlock(text, contextStack)
+            contextStack = lineData[0]
+
+    def test_disabled(self):
+        self._highlight(['x = 1  # comment'])
+        self.assertEqual(qutepart.syntax.profileInfo(), ([], []))
+
+    def test_profile(self):
+        qutepart.syntax.setProfilingEnabled(True)
+        self._highlight(['x = 1  # comment', 'y = "string"'])
+        contextProfiles, ruleProfiles = qutepart.syntax.profileInfo()
+
+        contexts = {(xmlFileName, contextName): blocks \
+                        for xmlFileName, contextName, blocks, time in contextProfiles}
+        self.assertEqual(contexts[('python.xml', 'Hash comment')], 1)
+        self.assertEqual(contexts[('python.xml', 'Normal')], 2)
+
+        for xmlFileName, contextName, ruleId, trials, matches, time in ruleProfiles:
+            self.assertIsInstance(ruleId, str)
+            self.assertGreater(trials, 0)
+            self.assertLessEqual(matches, trials)
+            self.assertGreaterEqual(time, 0)
+
+        rules = {(xmlFileName, contextName, ruleId): (trials, matches) \
+                    for xmlFileName, contextName, ruleId, trials, matches, time in ruleProfiles}
+        self.assertEqual(rules[('python.xml', 'Normal', 'DetectChar(#, 0)')], (1, 1))
+        self.assertEqual(rules[('python.xml', 'Normal', 'Int()')], (1, 1))
+
+        times = [profile[-1] for profile in ruleProfiles]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_clear(self):
+        qutepart.syntax.setProfilingEnabled(True)
+        self._highlight(['x = 1'])
+        qutepart.syntax.clearProfile()
+        self.assertEqual(qutepart.syntax.profileInfo(), ([], []))
+
+        self._highlight(['x = 1'])
+        contextProfiles, ruleProfiles = qutepart.syntax.profileInfo()
+        self.assertEqual([profile[:3] for profile in contextProfiles], [('python.xml', 'Normal', 1)])
+
+    def test_short_id(self):
+        """Rules of both parsers have shortId()
+        """
+        for context in self._syntax.parser.contexts.values():
+            for rule in context.rules:
+                self.assertIsInstance(rule.shortId(), str)
+
+        hashComment = self._syntax.parser.contexts['Hash comment']
+        self.assertIn('IncludeRules(Normal Text)', [rule.shortId() for rule in hashComment.rules])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,6 +15,7 @@ import qutepart
 from qutepart.syntax import SyntaxManager
 
 import qutepart.syntax.loader
+from qutepart.syntax.parser import _offsetMatchingPattern
 
 parser = qutepart.syntax.loader._parserModule
 
@@ -162,6 +163,19 @@ class Test(unittest.TestCase):
         if hasattr(rule, 'regExp'):  # only on Python version
             self.assertEqual(rule.regExp.pattern, "[A-Z][A-Za-z\xc0-\xd6\xd8-\xf6\xf8-\xff0-9_']*")
 
+    def test_RegExpr_manyGroups(self):
+        """Pattern matches, even if it has more groups, than are saved
+        """
+        rule = self._getRule('selinux-cil.xml', '_common', 5)  # IPv6 address, 19 groups
+        self.assertEqual(tryMatch(rule, 0, '1:2:3:4:5:6:7:8 x'), len('1:2:3:4:5:6:7:8'))
+
+    def test_RegExpr_notAscii(self):
+        """Text after not ASCII characters is matched
+        """
+        rule = self._getRule('debiancontrol.xml', 'Field', 0)  # <.*@.*>
+        self.assertEqual(tryMatch(rule, 0, '<адрес@пример.рф>'), len('<адрес@пример.рф>'))
+        self.assertEqual(tryMatch(rule, 6, 'Автор <адрес@пример.рф>'), len('<адрес@пример.рф>'))
+
     def test_RegExpr_slashB(self):
         rule = self._getRule('fortran.xml', 'find_numbers', 3)
         self.assertEqual(tryMatch(rule, 5, 'point3d'), None)
@@ -173,6 +187,14 @@ class Test(unittest.TestCase):
         self.assertEqual(tryMatch(rule, 1, ' real'), None)
         self.assertEqual(tryMatch(rule, 0, 'real'), 4)
 
+    def test_RegExpr_caretInGroup(self):
+        """Text before the column is not visible for the pattern
+        """
+        rule = self._getRule('selinux-fc.xml', '_normal', 1)  # (\s|^)\-[bcdpls\-](?=(\s|$))
+        self.assertEqual(tryMatch(rule, 5, '/foo -d x'), 2)
+        self.assertEqual(tryMatch(rule, 4, '/foo -d x'), 3)
+        self.assertEqual(tryMatch(rule, 5, '/foo -x x'), None)
+
     @unittest.skip('Fails after update to XML files -- is this test out of date?')
     def test_Int(self):
         rule = self._getRule('apache.xml', 'Integer Directives', 1)
@@ -310,5 +332,51 @@ class Test(unittest.TestCase):
         self.assertEqual(count, len(text))
 
 
+@unittest.skipIf(qutepart.syntax.loader.binaryParserAvailable, 'Python parser reuses objects')
+class Reuse(unittest.TestCase):
+    """One TextToMatchObject is moved along the line, rules return its result object
+    """
+    _getRule = Test._getRule
+
+    def _intRule(self):
+        self._getRule('c.xml', 'Normal', 0)
+        return [rule for rule in _currentSyntax.parser.contexts['Normal'].rules if rule.shortId() == 'Int()'][0]
+
+    def test_move_to(self):
+        rule = self._intRule()
+        textToMatchObject = parser.TextToMatchObject(1, '(756LUL 12', _currentSyntax.parser.deliminatorSet, None)
+        self.assertEqual(textToMatchObject.word, '756LUL')
+
+        textToMatchObject.moveTo(8)
+        self.assertIs(rule.tryMatch(textToMatchObject), textToMatchObject.result)
+        self.assertEqual(textToMatchObject.result.length, 2)
+        self.assertEqual(textToMatchObject.word, '12')
+
+    def test_child_rule(self):
+        """Number rule moves the object to match a child rule and moves it back
+        """
+        rule = self._intRule()
+        textToMatchObject = parser.TextToMatchObject(1, '(756LUL', _currentSyntax.parser.deliminatorSet, None)
+        ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+        self.assertEqual((ruleTryMatchResult.rule, ruleTryMatchResult.length), (rule, 6))
+        self.assertEqual(textToMatchObject.currentColumnIndex, 1)
+
+
+class OffsetMatchingPattern(unittest.TestCase):
+    """Patterns of the Python parser, which match at an offset in the whole line like the original pattern
+    matches the sliced line
+    """
+    def test_assertions_at_start(self):
+        self.assertEqual(_offsetMatchingPattern(r'\bfoo'), r'(?=\w)foo')
+        self.assertEqual(_offsetMatchingPattern(r'(\bx)?y'), r'((?=\w)x)?y')
+        self.assertEqual(_offsetMatchingPattern(r'a(\bb)+'), r'a(\bb)+')
+
+    def test_repeated_group(self):
+        """Next iterations of a repeated group see the text, which is matched by the previous ones
+        """
+        for pattern in (r'(\bx)+', r'(?:\bx|y)*z', r'(\bx){2}', r'((\bx)y)+'):
+            self.assertIsNone(_offsetMatchingPattern(pattern), pattern)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import unittest
+import pickle
+import sys
+import os.path
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+from qutepart.syntax import SyntaxManager
+from qutepart.syntax.texttypemap import TextTypeMap
+
+
+class Map(unittest.TestCase):
+    """Run-length encoded map behaves like a string of text types
+    """
+    def test_runs(self):
+        textTypeMap = TextTypeMap.fromRuns([(2, ' '), (0, 'c'), (3, ' '), (4, 'c'), (1, 'b')])
+        self.assertEqual(textTypeMap.types, ' cb')
+        self.assertEqual(list(textTypeMap.ends), [5, 9])
+        self.assertEqual(list(textTypeMap.runs()), [(0, 5, ' '), (5, 4, 'c'), (9, 1, 'b')])
+
+    def test_string(self):
+        string = '  ccc  hh'
+        textTypeMap = TextTypeMap.fromString(string)
+        self.assertEqual(len(textTypeMap), len(string))
+        self.assertEqual([textTypeMap[column] for column in range(len(string))], list(string))
+        self.assertEqual(textTypeMap[-1], 'h')
+        self.assertEqual(''.join(textTypeMap), string)
+        self.assertEqual(str(textTypeMap), string)
+        self.assertEqual(textTypeMap, string)
+        self.assertEqual(hash(textTypeMap), hash(string))
+        self.assertEqual(pickle.loads(pickle.dumps(textTypeMap)), textTypeMap)
+        self.assertNotEqual(textTypeMap, TextTypeMap.fromString(' ' + string[1:-1]))
+
+        with self.assertRaises(IndexError):
+            textTypeMap[len(string)]
+
+    def test_single_run_shared(self):
+        self.assertIs(TextTypeMap.fromString('cccc'), TextTypeMap.fromRuns([(1, 'c'), (3, 'c')]))
+        self.assertIs(TextTypeMap.fromString(''), TextTypeMap.fromRuns([]))
+        self.assertEqual(list(TextTypeMap.fromString('').runs()), [])
+
+    def test_ranges(self):
+        textTypeMap = TextTypeMap.fromString('  cc  bbcc  ')
+        self.assertEqual(textTypeMap.ranges(' '), [(0, 2), (4, 6), (10, 12)])
+        self.assertEqual(textTypeMap.ranges('cbh'), [(2, 4), (6, 10)])
+        self.assertEqual(textTypeMap.ranges('s'), [])
+
+    def test_next_boundary(self):
+        textTypeMap = TextTypeMap.fromString('  cc  bbcc  ')
+        self.assertEqual(textTypeMap.nextBoundary(0, 'cbh'), 2)
+        self.assertEqual(textTypeMap.nextBoundary(2, 'cbh'), 4)
+        self.assertEqual(textTypeMap.nextBoundary(6, 'cbh'), 10)
+        self.assertEqual(textTypeMap.nextBoundary(10, 'cbh'), 12)
+        self.assertEqual(textTypeMap.nextBoundary(12, 'cbh'), 12)
+
+
+class Parser(unittest.TestCase):
+    """Parsers make run-length encoded maps
+    """
+    def test_line_data(self):
+        syntax = SyntaxManager(headless=True).getSyntax(languageName='C++')
+        text = 'x = 1; /* comment */ y = "str"; // end'
+        lineData, highlightedSegments = syntax.highlightBlock(text, None)
+        textTypeMap = lineData[1]
+        self.assertIsInstance(textTypeMap, TextTypeMap)
+        self.assertEqual(textTypeMap, '       ccccccccccccc     sssss  cccccc')
+        self.assertEqual(textTypeMap.ranges(' '), [(0, 7), (20, 25), (30, 32)])
+        self.assertEqual(textTypeMap.nextBoundary(0, 'cbh'), 7)
+        self.assertTrue(syntax.isCode(lineData, 0))
+        self.assertTrue(syntax.isComment(lineData, 10))
+        self.assertFalse(syntax.isCode(lineData, 26))
+
+    def test_empty_line(self):
+        syntax = SyntaxManager(headless=True).getSyntax(languageName='C++')
+        lineData = syntax.parseBlock('', None)
+        self.assertEqual(len(lineData[1]), 0)
+        self.assertTrue(syntax.isCode(lineData, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,125 @@ sys.path.insert(0, '..')
 
 from qutepart.syntax import SyntaxManager
 
+
+def _usage():
+    print('Usage:\n'
+          '\t%s SYNTAX_FILE_NAME\n'
+          '\t\tPrint syntax definition\n'
+          '\t%s --tokenize [--jobs N] PATH...\n'
+          '\t\tHighlight files and directories in parallel, print a JSON line per file\n'
+          '\t%s --export html|ansi [--jobs N] OUT_DIR PATH...\n'
+          '\t\tExport files and directories to HTML or ANSI colored text in parallel\n'
+          '\t%s --optimizer-report [SYNTAX_FILE_NAME...]\n'
+          '\t\tList rules, which are rewritten by the syntax optimizer. All syntaxes by default\n'
+          '\t%s --optimizer-check PATH...\n'
+          '\t\tCheck that files and directories are highlighted equally with and without the syntax optimizer' % \
+                (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0]))
+
+
+def _parseJobs(args):
+    if args[:1] == ['--jobs']:
+        return int(args[1]), args[2:]
+    else:
+        return None, args
+
+
+def _tokenize(args):
+    jobs, args = _parseJobs(args)
+
+    if not args:
+        _usage()
+        return
+
+    from qutepart.syntax.bulk import highlightFilesAsJsonLines
+
+    for jsonLine in highlightFilesAsJsonLines(args, jobs):
+        sys.stdout.write(jsonLine)
+        sys.stdout.write('\n')
+
+
+
+def _export(args):
+    if not args or args[0] not in ('html', 'ansi'):
+        _usage()
+        return
+    outFormat = args[0]
+    jobs, args = _parseJobs(args[1:])
+
+    if len(args) < 2:
+        _usage()
+        return
+
+    from qutepart.syntax.bulk import exportFiles
+
+    for result in exportFiles(args[1:], args[0], outFormat, jobs):
+        if 'error' in result:
+            print('%s: %s' % (result['path'], result['error']), file=sys.stderr)
+        elif result['syntax'] is None:
+            print('%s: syntax not detected' % result['path'], file=sys.stderr)
+
+
+def _optimizerReport(args):
+    import os.path
+    import qutepart.syntax.loader
+
+    xmlDirPath = os.path.join(os.path.dirname(qutepart.syntax.loader.__file__), 'data', 'xml')
+    xmlFileNames = args or sorted([fileName for fileName in os.listdir(xmlDirPath) if fileName.endswith('.xml')])
+
+    total = 0
+    for xmlFileName in xmlFileNames:
+        report = qutepart.syntax.loader.optimizationReport(os.path.join(xmlDirPath, xmlFileName))
+        print('%s: %d rewrites' % (xmlFileName, len(report)))
+        for line in report:
+            print('\t' + line)
+        total += len(report)
+    print('Total: %d rewrites in %d files' % (total, len(xmlFileNames)))
+
+
+def _highlightWithOptimizer(lines, xmlFileName, optimize):
+    import qutepart.syntax.loader
+    from qutepart.syntax import highlightLines
+
+    qutepart.syntax.loader.optimizeSyntax = optimize
+    syntax = SyntaxManager(headless=True).getSyntax(xmlFileName=xmlFileName)
+    return list(highlightLines(lines, syntax))
+
+
+def _optimizerCheck(args):
+    if not args:
+        _usage()
+        return
+
+    from qutepart.syntax.bulk import iterFiles
+
+    manager = SyntaxManager(headless=True)
+    failed = 0
+    for path in iterFiles(args):
+        with open(path, encoding='utf-8', errors='replace') as sourceFile:
+            lines = sourceFile.read().split('\n')
+        syntax = manager.getSyntax(sourceFilePath=path, firstLine=lines[0])
+        if syntax is None:
+            continue
+
+        if _highlightWithOptimizer(lines, syntax.xmlFileName, True) != \
+           _highlightWithOptimizer(lines, syntax.xmlFileName, False):
+            print('%s: highlighting differs' % path)
+            failed += 1
+
+    sys.exit(1 if failed else 0)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage:\n\t%s SYNTAX_FILE_NAME' % sys.argv[0])
+    if len(sys.argv) >= 2 and sys.argv[1] == '--tokenize':
+        _tokenize(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == '--export':
+        _export(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == '--optimizer-report':
+        _optimizerReport(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == '--optimizer-check':
+        _optimizerCheck(sys.argv[2:])
+    elif len(sys.argv) != 2:
+        _usage()
     else:
         syntax = SyntaxManager().getSyntax(xmlFileName=sys.argv[1])
         print(str(syntax))